@@ -0,0 +1,116 @@
+"""
+Terrarium Benchmarks
+
+A load test of the aio module against local stub backends. Every Earth Engine round
+trip and Maps lookup sleeps for a fixed latency to stand in for the network, and the
+throughput of sequential blocking calls is compared with the same calls gathered on
+the bounded pools. A quota limited stub that rejects calls above a concurrency bound
+shows the pool backing off and retrying instead of failing the batch.
+
+Run with 'python benchmarks/bench_aio.py' with the package installed.
+"""
+import time
+import asyncio
+import tempfile
+import threading
+
+import ee
+
+import fakeee
+from terrarium import aio
+from terrarium import export
+from terrarium import spatial
+from terrarium import temporal
+from terrarium import geocoding
+
+# The simulated latency of a round trip in seconds
+LATENCY = 0.02
+
+def timed(function) -> float:
+    """ A function that returns the wall time of a call in seconds. """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def report(label: str, count: int, sync: float, concurrent: float):
+    """ A function that prints the throughput of the sync and async paths of a case. """
+    print(f"  {label:24} sync {count / sync:8.1f}/s  aio {count / concurrent:8.1f}/s  {sync / concurrent:5.1f}x")
+
+def bench_earthengine(count: int = 200):
+    """ A benchmark of datelist and task status round trips through the Earth Engine pool. """
+    def respond(expression: dict):
+        time.sleep(LATENCY)
+        return [1609459200000 + day * 86400000 for day in range(30)]
+
+    with fakeee.FakeEarthEngine(responder=respond) as fake:
+        collections = [ee.ImageCollection("COPERNICUS/S2_SR").filterBounds(ee.Geometry.Point(index * 0.01, 0)) for index in range(count)]
+        sync = timed(lambda: [temporal.generate_earthenginecollection_datelist(collection) for collection in collections])
+        concurrent = timed(lambda: asyncio.run(aio.gather_datelists(collections)))
+        report("datelist getInfo", count, sync, concurrent)
+
+        # Slow down the operations lookups of the stand-in
+        getoperation = ee.data.getOperation
+        ee.data.getOperation = lambda name: (time.sleep(LATENCY), getoperation(name))[1]
+        names = [f"projects/{fake.project}/operations/TASK{index}" for index in range(count)]
+        sync = timed(lambda: [export.get_taskstatus(name) for name in names])
+        concurrent = timed(lambda: asyncio.run(aio.gather("earthengine", export.get_taskstatus, [(name,) for name in names])))
+        report("task status", count, sync, concurrent)
+
+def bench_maps(count: int = 200):
+    """ A benchmark of reverse geocoding lookups through the rate limited Maps pool. """
+    stub = geocoding.StubBackend(lambda longitude, latitude: (time.sleep(LATENCY), f"{longitude:.3f},{latitude:.3f}")[1])
+    points = [(index * 0.1, 10 + index * 0.1) for index in range(count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Use a fresh cache for either path so every point is a miss
+        geocoding.set_geocoder(geocoding.Geocoder(stub, geocoding.GeocodeCache(f"{directory}/sync.sqlite")))
+        sync = timed(lambda: [spatial.generate_location(*point) for point in points])
+        geocoding.set_geocoder(geocoding.Geocoder(stub, geocoding.GeocodeCache(f"{directory}/aio.sqlite")))
+        concurrent = timed(lambda: asyncio.run(aio.generate_locations(points)))
+        geocoding.set_geocoder(None)
+
+    report(f"geocode ({aio.get_pool('maps').rate:.0f}/s rate)", count, sync, concurrent)
+    aio.set_pool("maps", aio.BackendPool("maps", concurrency=8))
+    with tempfile.TemporaryDirectory() as directory:
+        geocoding.set_geocoder(geocoding.Geocoder(stub, geocoding.GeocodeCache(f"{directory}/aio.sqlite")))
+        concurrent = timed(lambda: asyncio.run(aio.generate_locations(points)))
+        geocoding.set_geocoder(None)
+
+    report("geocode (no rate)", count, sync, concurrent)
+    aio.set_pool("maps", None)
+
+def bench_quota(count: int = 200, quota: int = 4):
+    """ A benchmark of a backend that rejects calls beyond 'quota' concurrent calls with a quota error. """
+    lock = threading.Lock()
+    state = {"active": 0, "rejected": 0}
+
+    def lookup(index: int) -> int:
+        with lock:
+            state["active"] += 1
+            active = state["active"]
+        try:
+            if active > quota:
+                state["rejected"] += 1
+                raise RuntimeError("429 Too Many Requests")
+            time.sleep(LATENCY)
+            return index
+        finally:
+            with lock:
+                state["active"] -= 1
+
+    pool = aio.BackendPool("quota", concurrency=16, retries=8, cooldown=0.05, maxcooldown=0.5)
+    results = []
+    concurrent = timed(lambda: results.extend(asyncio.run(pool.gather(lookup, [(index,) for index in range(count)]))))
+    sync = count * LATENCY
+    metrics = pool.metrics()
+    pool.close()
+
+    report(f"quota ({quota} concurrent)", count, sync, concurrent)
+    print(f"  {'':24} rejected {state['rejected']}  throttled {metrics['throttled']}  retried {metrics['retried']}"
+          f"  failed {metrics['failed']}  limit {metrics['limit']}  correct {results == list(range(count))}")
+
+if __name__ == "__main__":
+    print(f"simulated latency {LATENCY * 1e3:.0f}ms")
+    bench_earthengine()
+    bench_maps()
+    bench_quota()
@@ -0,0 +1,66 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the cold start of the package that report the import time of every
+module in a fresh interpreter along with the heavy dependencies it loaded. The
+'--check' flag turns the benchmark into a regression guard that exits with a
+non-zero status if importing a module loads a heavy dependency or, with '--budget',
+takes longer than the given number of milliseconds.
+
+Run with 'python benchmarks/bench_imports.py [--check] [--budget MS]' with the package installed.
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# The dependencies that must only be imported on first use
+HEAVY = ("ee", "numpy", "shapely", "pyproj", "area", "googlemaps", "google.api_core", "rasterio", "httplib2")
+
+# The modules whose import time is measured
+MODULES = (
+    "terrarium", "terrarium.temporal", "terrarium.spatial", "terrarium.spectral", "terrarium.export",
+    "terrarium.geocoding", "terrarium.ingestion", "terrarium.catalog", "terrarium.scheduler", "terrarium.monitor",
+    "terrarium.dateindex", "terrarium.cloudcover", "terrarium.raster", "terrarium.postprocess", "terrarium.tiles", "terrarium.instrumentation",
+    "terrarium.session", "terrarium.tiledexport", "terrarium.serialization", "terrarium.aio", "terrarium.manifest",
+)
+
+# The script run in a fresh interpreter that imports a module and reports the time and the heavy dependencies loaded
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def probe(module: str) -> dict:
+    """ A function that imports a module in a fresh interpreter and returns the import time and the heavy dependencies loaded. """
+    output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+def bench_imports(repeat: int = 5, budget: float = None) -> int:
+    """ A benchmark of the import time of every module that returns the number of modules that fail the guard. """
+    failures = 0
+    print(f"{'module':30} {'median':>10} {'min':>10}  heavy dependencies")
+    for module in MODULES:
+        results = [probe(module) for _ in range(repeat)]
+        times = [result["seconds"] * 1000 for result in results]
+        heavy = results[0]["heavy"]
+
+        failed = bool(heavy) or (budget is not None and statistics.median(times) > budget)
+        failures += failed
+        print(f"{module:30} {statistics.median(times):8.1f}ms {min(times):8.1f}ms  {', '.join(heavy) or '-'}{'  FAIL' if failed else ''}")
+
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the Terrarium modules.")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of fresh interpreters per module")
+    parser.add_argument("--budget", type=float, help="the median import time in milliseconds that a module must not exceed")
+    parser.add_argument("--check", action="store_true", help="exit with a non-zero status if a module fails the guard")
+    options = parser.parse_args()
+
+    failures = bench_imports(options.repeat, options.budget)
+    sys.exit(1 if options.check and failures else 0)
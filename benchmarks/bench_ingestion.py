@@ -0,0 +1,67 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the ingestion module that measure the throughput and peak memory
+of streaming a large synthetic FeatureCollection against loading it whole.
+
+Run with 'python benchmarks/bench_ingestion.py' with the package installed.
+"""
+import os
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+
+import shapely.geometry as shapes
+
+from terrarium import ingestion
+
+def generate_featurecollection(path: str, count: int, seed: int = 0):
+    """ A function that writes a FeatureCollection of parcel shaped polygons to a file. """
+    rand = random.Random(seed)
+    with open(path, "w") as file:
+        file.write('{"type": "FeatureCollection", "features": [')
+        for index in range(count):
+            lon, lat = rand.uniform(-170, 170), rand.uniform(-60, 60)
+            size = rand.uniform(0.0005, 0.005)
+            ring = [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+            feature = {"type": "Feature", "properties": {"parcel": index}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+            file.write(("," if index else "") + json.dumps(feature))
+        file.write("]}")
+
+def measure(function) -> tuple:
+    """ A function that returns the result, wall time and peak traced memory of a function from two separate calls. """
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def bench_stream(count: int = 100000):
+    """ A benchmark of streaming shapes from a large FeatureCollection. """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "parcels.geojson")
+        generate_featurecollection(path, count)
+        size = os.path.getsize(path) / 1e6
+
+        def loadwhole():
+            with open(path) as file:
+                return len([shapes.shape(f["geometry"]) for f in json.load(file)["features"]])
+
+        def loadstream():
+            return sum(len(batch.geometries) for batch in ingestion.stream_shapes_fromgeojson(path, batchsize=5000))
+
+        wholecount, wholetime, wholepeak = measure(loadwhole)
+        streamcount, streamtime, streampeak = measure(loadstream)
+
+    print(f"geojson ingestion x{count} features ({size:.1f} MB)")
+    print(f"  json.load     {wholetime:8.3f}s  {wholecount / wholetime:10.0f} features/s  peak {wholepeak / 1e6:8.1f} MB")
+    print(f"  streaming     {streamtime:8.3f}s  {streamcount / streamtime:10.0f} features/s  peak {streampeak / 1e6:8.1f} MB")
+
+if __name__ == "__main__":
+    bench_stream()
@@ -0,0 +1,53 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the instrumentation module that report the wall time per call of
+instrumented functions when instrumentation is disabled and its overhead when
+it is enabled and tracing. Disabled functions are the original functions.
+
+Run with 'python benchmarks/bench_instrumentation.py' with the package installed.
+"""
+import time
+import datetime
+
+import shapely.geometry as shapes
+
+from terrarium import spatial
+from terrarium import temporal
+from terrarium import instrumentation
+
+def timed(function, *args, count: int = 20000) -> float:
+    """ A function that returns the mean wall time of a call in nanoseconds over 'count' calls. """
+    start = time.perf_counter()
+    for _ in range(count):
+        function(*args)
+    return (time.perf_counter() - start) / count * 1e9
+
+def bench_overhead():
+    """ A benchmark of the overhead of instrumenting a small spatial and a small temporal function. """
+    polygon = shapes.Point(10, 10).buffer(0.01, 8)
+    date = datetime.datetime(2021, 6, 1)
+    cases = (
+        ("spatial.generate_centroid", lambda: (spatial.generate_centroid, polygon)),
+        ("temporal.shift_date", lambda: (temporal.shift_date, date, 5)),
+    )
+
+    print("instrumentation overhead per call")
+    for name, resolve in cases:
+        # Resolve the function from its module after every change, as the modules hold the swapped function
+        instrumentation.disable()
+        function, *args = resolve()
+        disabled = timed(function, *args)
+        print(f"  {name:28} disabled {disabled:8.0f}ns", end="")
+
+        for label, tracing in (("enabled", False), ("tracing", True)):
+            instrumentation.enable(tracing=tracing)
+            function, *args = resolve()
+            print(f"  {label} {timed(function, *args) - disabled:+8.0f}ns", end="")
+        print()
+
+    instrumentation.disable()
+    instrumentation.reset()
+
+if __name__ == "__main__":
+    bench_overhead()
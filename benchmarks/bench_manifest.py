@@ -0,0 +1,59 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the manifest module that replay a stream of export requests with
+repeats, as produced by retries and repeated user requests, against the local task
+backend of the scheduler. The number of tasks started with and without deduplication
+and the overhead of hashing and checking the manifest per request are reported.
+
+Run with 'python benchmarks/bench_manifest.py' with the package installed.
+"""
+import time
+import random
+import datetime
+import tempfile
+
+import ee
+
+import fakeee
+from terrarium import manifest
+from terrarium import scheduler
+from terrarium import spectral
+
+def generate_requests(count: int, unique: int, seed: int = 0) -> list:
+    """ A function that returns 'count' export requests drawn from 'unique' distinct image graphs with a different name for every request. """
+    rng = random.Random(seed)
+    geometry = ee.Geometry.Polygon([[[-121.9, 37.3], [-121.8, 37.3], [-121.8, 37.4], [-121.9, 37.4]]])
+    dates = [datetime.datetime(2021, 1, 1) + datetime.timedelta(days=index) for index in range(unique)]
+    graphs = [spectral.generate_spectral_graph(date, geometry, "NDVI").serialized for date in dates]
+
+    return [(graphs[rng.randrange(unique)], f"exports/request-{index}") for index in range(count)]
+
+def bench_dedupe(count: int = 500, unique: int = 50):
+    """ A benchmark of a stream of export requests with and without deduplication. """
+    requests = generate_requests(count, unique)
+
+    naive = scheduler.LocalBackend(polls=10**9)
+    start = time.perf_counter()
+    for payload, name in requests:
+        naive.start(scheduler.ExportJob(0, name, "terrascope-assets", payload))
+    naivetime = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        backend = scheduler.LocalBackend(polls=10**9)
+        deduplicator = manifest.ExportDeduplicator(backend, manifest.ExportManifest(f"{directory}/manifest.sqlite"))
+        start = time.perf_counter()
+        for payload, name in requests:
+            deduplicator.submit(payload, "terrascope-assets", name, {"scale": 10})
+        dedupetime = time.perf_counter() - start
+        metrics = deduplicator.metrics()
+
+    size = sum(len(payload) for payload, _ in requests) / count
+    print(f"{count} requests of {unique} unique graphs, {size / 1024:.1f}KiB per graph")
+    print(f"  {'naive':10} tasks started {len(naive.started):5}  {naivetime / count * 1e6:8.1f}us per request")
+    print(f"  {'dedupe':10} tasks started {len(backend.started):5}  {dedupetime / count * 1e6:8.1f}us per request"
+          f"  joined {metrics['joined']}  skipped {metrics['skipped']}")
+
+if __name__ == "__main__":
+    with fakeee.FakeEarthEngine():
+        bench_dedupe()
@@ -0,0 +1,64 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the raster module that report the throughput of the local
+spectral engine in megapixels per second of output and compare the histogram
+focal median against a generic sort-per-window median.
+
+Run with 'python benchmarks/bench_raster.py' with the package installed.
+"""
+import os
+import time
+import tempfile
+
+import numpy
+
+from terrarium import raster
+
+def timed(function, *args, **kwargs) -> float:
+    """ A function that returns the wall time of a single call in seconds. """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def bench_focal_median(size: int = 400, radius: int = 5):
+    """ A benchmark of the histogram focal median against sorting every window. """
+    rand = numpy.random.default_rng(0)
+    values = rand.integers(-10, 11, (size, size)).astype(numpy.float32)
+
+    def sortmedian():
+        windows = numpy.lib.stride_tricks.sliding_window_view(numpy.pad(values, radius, mode="edge"), (2 * radius + 1,) * 2)
+        return numpy.median(windows, axis=(2, 3))
+
+    histogram = timed(raster.focal_median, values, radius, -10, 10)
+    generic = timed(sortmedian)
+    megapixels = size * size / 1e6
+
+    print(f"focal median {size}x{size} radius {radius}")
+    print(f"  sort per window   {generic:8.3f}s  {megapixels / generic:8.2f} MP/s")
+    print(f"  histogram         {histogram:8.3f}s  {megapixels / histogram:8.2f} MP/s  {generic / histogram:6.1f}x")
+
+def bench_spectral(size: int = 512, workers: int = None):
+    """ A benchmark of the NDVI and true color engines on memory-mapped bands. """
+    rand = numpy.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for band in ("B8", "B4", "TCI_R", "TCI_G", "TCI_B"):
+            path = os.path.join(directory, f"{band}.npy")
+            dtype = numpy.uint16 if band.startswith("B") else numpy.uint8
+            numpy.save(path, rand.integers(0, 255 if dtype == numpy.uint8 else 5000, (size, size)).astype(dtype))
+            paths.append(path)
+
+        output = os.path.join(directory, "output.npy")
+        megapixels = (size * 10) ** 2 / 1e6
+
+        print(f"spectral engine {size}x{size} input, {megapixels:.0f} MP output")
+        for index, bands in (("NDVI", paths[:2]), ("TCI", paths[2:])):
+            serial = timed(raster.generate_spectral_array, index, bands, output=output, workers=1)
+            parallel = timed(raster.generate_spectral_array, index, bands, output=output, workers=workers)
+            print(f"  {index:4} serial     {serial:8.3f}s  {megapixels / serial:8.2f} MP/s")
+            print(f"  {index:4} parallel   {parallel:8.3f}s  {megapixels / parallel:8.2f} MP/s")
+
+if __name__ == "__main__":
+    bench_focal_median()
+    bench_spectral()
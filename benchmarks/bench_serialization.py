@@ -0,0 +1,77 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the serialization module that compare the GeoJSON writer, the
+binary columnar encoding and the WKB collection encoding against the current
+path of 'spatial.generate_geojson_fromshape' and 'spatial.generate_shape_fromgeojson'
+for collections of AOI shaped polygons and densely digitized parcels.
+
+Run with 'python benchmarks/bench_serialization.py' with the package installed.
+"""
+import json
+import time
+
+import shapely.geometry as shapes
+
+from terrarium import spatial
+from terrarium import serialization
+from bench_spatial import generate_polygons, generate_parcels
+
+def timed(function, repeat: int = 5) -> float:
+    """ A function that returns the best wall time of 'repeat' calls in seconds. """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_collection(label: str, shapelist: list):
+    """ A benchmark of the encoding and decoding of a collection of geometries with every path. """
+    properties = [{"id": index} for index in range(len(shapelist))]
+    columns = serialization.generate_geometrycolumns(shapelist, properties)
+
+    # The current path writes and parses one single feature collection per shape
+    documents = [spatial.generate_geojson_fromshape(shape) for shape in shapelist]
+    collection = json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": props, "geometry": shapes.mapping(shape)} for shape, props in zip(shapelist, properties)
+    ]})
+    geojson = serialization.generate_geojson_fromcolumns(columns)
+    geojsonfixed = serialization.generate_geojson_fromcolumns(columns, 7)
+    binary = serialization.encode_columns(columns)
+    wkb = serialization.encode_wkbcollection(columns)
+
+    cases = [
+        ("geojson per shape", lambda: [spatial.generate_geojson_fromshape(shape) for shape in shapelist],
+         lambda: [spatial.generate_shape_fromgeojson(document) for document in documents], sum(len(d) for d in documents)),
+        ("geojson mapping", lambda: json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": props, "geometry": shapes.mapping(shape)} for shape, props in zip(shapelist, properties)]}),
+         lambda: [shapes.shape(feature["geometry"]) for feature in json.loads(collection)["features"]], len(collection)),
+        ("geojson columns", lambda: serialization.generate_geojson_fromshapes(shapelist, properties),
+         lambda: serialization.generate_shapes_fromgeojson(geojson), len(geojson)),
+        ("geojson columns 7dp", lambda: serialization.generate_geojson_fromshapes(shapelist, properties, 7),
+         lambda: serialization.generate_shapes_fromgeojson(geojsonfixed), len(geojsonfixed)),
+        ("wkb collection", lambda: serialization.encode_wkbcollection(shapelist),
+         lambda: serialization.generate_shapes_fromwkbcollection(wkb), len(wkb)),
+        ("binary columns", lambda: serialization.encode_columns(serialization.generate_geometrycolumns(shapelist, properties)),
+         lambda: serialization.generate_shapes_fromcolumns(serialization.decode_columns(binary)), len(binary)),
+    ]
+
+    print(f"{label}: {len(shapelist)} geometries, {len(columns.coordinates)} vertices")
+    baseline = None
+    for name, encode, decode, size in cases:
+        encoded, decoded = timed(encode), timed(decode)
+        baseline = baseline or encoded + decoded
+        print(f"  {name:20} encode {encoded * 1e3:8.2f}ms  decode {decoded * 1e3:8.2f}ms  {size / 1024:9.1f}KiB"
+              f"  {baseline / (encoded + decoded):5.1f}x")
+
+    # The coordinate arrays are decoded without constructing any geometries
+    geojsoncolumns, writecolumns = timed(lambda: serialization.generate_columns_fromgeojson(geojson)), timed(lambda: serialization.generate_geojson_fromcolumns(columns))
+    writefixed = timed(lambda: serialization.generate_geojson_fromcolumns(columns, 7))
+    encodecolumns, decodecolumns = timed(lambda: serialization.encode_columns(columns)), timed(lambda: serialization.decode_columns(binary))
+    print(f"  {'columns only':20} geojson write {writecolumns * 1e3:7.2f}ms  7dp write {writefixed * 1e3:7.2f}ms  parse {geojsoncolumns * 1e3:7.2f}ms"
+          f"  binary encode {encodecolumns * 1e3:6.3f}ms  decode {decodecolumns * 1e6:6.1f}us")
+
+if __name__ == "__main__":
+    bench_collection("aoi polygons", generate_polygons(2000))
+    bench_collection("parcels", generate_parcels(50))
@@ -0,0 +1,69 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the session module that report the cost per request of sending
+requests to a local HTTP server on a new httplib2 client for every request and
+on the pooled transport, along with the time spent waiting for a pooled client
+and opening connections as reported by the timing hooks.
+
+Run with 'python benchmarks/bench_session.py' with the package installed.
+"""
+import time
+import threading
+import collections
+import http.server
+import concurrent.futures
+
+import httplib2
+
+from terrarium import session
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ A class of the request handler of the local server that responds to every request with a small JSON body. """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"result": 1}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def timed(request, url: str, count: int, workers: int) -> float:
+    """ A function that returns the mean wall time of a request in microseconds over 'count' requests sent by 'workers' threads. """
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: request(url, "POST", body=b"{}"), range(count)))
+    return (time.perf_counter() - start) / count * 1e6
+
+def bench_transport(count: int = 2000, workers: int = 8):
+    """ A benchmark of the cost per request of a new client per request against the pooled transport. """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/projects/bench/value:compute"
+
+    print(f"requests to a local server, {count} requests on {workers} threads")
+    cold = timed(lambda *args, **kwargs: httplib2.Http(timeout=60).request(*args, **kwargs), url, count, workers)
+    print(f"  client per request   {cold:8.1f}us/request")
+
+    manager = session.SessionManager(poolsize=workers)
+    timings = collections.defaultdict(list)
+    manager.add_timinghook(lambda timing: timings[timing.phase].append(timing.seconds))
+    pooled = timed(manager.transport.request, url, count, workers)
+    print(f"  pooled transport     {pooled:8.1f}us/request  ({cold / pooled:.1f}x)")
+
+    for phase in ("wait", "connect", "request"):
+        values = timings[phase]
+        print(f"    {phase:8} {len(values):6} timings  mean {sum(values) / len(values) * 1e6:8.1f}us  total {sum(values) * 1e3:8.1f}ms")
+
+    manager.transport.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    bench_transport()
@@ -0,0 +1,129 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the spatial module that compare the
+batch functions against the per-shape functions and report
+the savings and cost of the geometry preparation.
+
+Run with 'python benchmarks/bench_spatial.py' with the package installed.
+"""
+import json
+import math
+import time
+import random
+
+import shapely.ops as shapeops
+import shapely.geometry as shapes
+
+from terrarium import spatial
+
+def generate_polygons(count: int, seed: int = 0) -> list:
+    """ A function that returns a list of randomly placed AOI shaped polygons. """
+    rand = random.Random(seed)
+    polygons = []
+    for _ in range(count):
+        center = shapes.Point(rand.uniform(-170, 170), rand.uniform(-60, 60))
+        polygons.append(center.buffer(rand.uniform(0.001, 0.05), 8))
+
+    return polygons
+
+def generate_parcels(count: int, vertices: int = 3000, seed: int = 0) -> list:
+    """
+    A function that returns a list of parcel shaped polygons with 5 to 12 corners whose edges are densely digitized
+    with 'vertices' vertices in total and a perpendicular noise of 30cm, as traced outlines of real parcels are.
+    """
+    rand = random.Random(seed)
+    parcels = []
+    for _ in range(count):
+        longitude, latitude = rand.uniform(-120, 120), rand.uniform(-55, 60)
+        angles = sorted(rand.uniform(0, 2 * math.pi) for _ in range(rand.randint(5, 12)))
+        radius = rand.uniform(80, 600)
+        corners = [(math.cos(a) * radius * rand.uniform(0.6, 1), math.sin(a) * radius * rand.uniform(0.6, 1)) for a in angles]
+
+        points = []
+        steps = vertices // len(corners)
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+            length = math.hypot(x1 - x0, y1 - y0)
+            for step in range(steps):
+                # Offset every digitized vertex from the edge along its normal, tapering the offset towards the corners
+                t = step / steps
+                offset = rand.gauss(0, 0.3) * min(1.0, 20 * t, 20 * (1 - t))
+                points.append((x0 + (x1 - x0) * t - (y1 - y0) / length * offset, y0 + (y1 - y0) * t + (x1 - x0) / length * offset))
+
+        # Convert the meters around the center into longitudes and latitudes
+        meters = 1 / 111320
+        parcels.append(shapes.Polygon([(longitude + x * meters / math.cos(math.radians(latitude)), latitude + y * meters) for x, y in points]))
+
+    return parcels
+
+def timed(function, *args) -> float:
+    """ A function that returns the wall time of a single call in seconds. """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def bench_area_centroid(count: int = 20000):
+    """ A benchmark of the batch area and centroid functions against the per-shape loop. """
+    polygons = generate_polygons(count)
+
+    loop = timed(lambda: [(spatial.generate_area(p), spatial.generate_centroid(p)) for p in polygons])
+    batch = timed(lambda: (spatial.generate_areas(polygons), spatial.generate_centroids(polygons)))
+    buffers = spatial.generate_coordinatebuffers(polygons)
+    arrays = timed(lambda: (spatial.generate_areas_fromarrays(*buffers), spatial.generate_centroids_fromarrays(*buffers)))
+
+    print(f"area+centroid x{count}")
+    print(f"  per-shape loop    {loop:8.3f}s")
+    print(f"  batch (shapes)    {batch:8.3f}s  {loop / batch:6.1f}x")
+    print(f"  batch (buffers)   {arrays:8.3f}s  {loop / arrays:6.1f}x")
+
+def bench_reshape(count: int = 2000):
+    """ A benchmark of the bulk reshape functions against the per-shape loop. """
+    rand = random.Random(1)
+    points = [shapes.Point(rand.uniform(-170, 170), rand.uniform(-60, 60)) for _ in range(count)]
+    polygons = generate_polygons(count)
+    lons, lats = [p.x for p in points], [p.y for p in points]
+
+    pointloop = timed(lambda: [spatial.reshape_point(p) for p in points])
+    pointbulk = timed(spatial.reshape_points, lons, lats)
+    polygonloop = timed(lambda: [spatial.reshape_polygon(p) for p in polygons])
+    polygonbulk = timed(spatial.reshape_polygons, polygons)
+
+    print(f"reshape x{count}")
+    print(f"  reshape_point loop    {pointloop:8.3f}s")
+    print(f"  reshape_points        {pointbulk:8.3f}s  {pointloop / pointbulk:6.1f}x")
+    print(f"  reshape_polygon loop  {polygonloop:8.3f}s")
+    print(f"  reshape_polygons      {polygonbulk:8.3f}s  {polygonloop / polygonbulk:6.1f}x")
+
+def bench_prepare(count: int = 50):
+    """ A benchmark of the vertices and payload bytes saved by the geometry preparation and its cost with and without the cache. """
+    parcels = generate_parcels(count)
+
+    print(f"prepare_geometry x{count} parcels")
+    for tolerance in (0.5, 1.0, 5.0):
+        spatial.geometrycache.clear()
+        cold = timed(lambda: [spatial.prepare_geometry(p, tolerance) for p in parcels])
+        cached = timed(lambda: [spatial.prepare_geometry(p, tolerance) for p in parcels])
+        prepared = [spatial.prepare_geometry(p, tolerance) for p in parcels]
+        report = spatial.generate_savingsreport(prepared)
+
+        # Measure the largest deviation of the prepared outlines in meters
+        deviation = 0.0
+        for parcel, geometry in zip(parcels, prepared):
+            transform = spatial.get_transformer("EPSG:4326", spatial.generate_utmcrs(parcel.centroid.x, parcel.centroid.y)).transform
+            deviation = max(deviation, shapeops.transform(transform, parcel).hausdorff_distance(shapeops.transform(transform, geometry.shape)))
+
+        print(f"  tolerance {tolerance:4.1f}m  vertices {report['vertices']:7} -> {report['preparedvertices']:6}"
+              f"  bytes {report['bytes']:8} -> {report['preparedbytes']:7} ({report['bytes'] / report['preparedbytes']:5.1f}x)"
+              f"  deviation {deviation:5.2f}m  cold {cold / count * 1e3:6.2f}ms  cached {cached / count * 1e3:6.3f}ms")
+
+    # Measure the serialization of the request payloads that the prepared geometries shrink
+    geojsons = [json.dumps(shapes.mapping(p)) for p in parcels]
+    full = timed(lambda: [json.loads(geojson) for geojson in geojsons])
+    geojsons = [json.dumps(shapes.mapping(g.shape)) for g in prepared]
+    reduced = timed(lambda: [json.loads(geojson) for geojson in geojsons])
+    print(f"  payload parsing  full {full / count * 1e3:6.3f}ms  prepared {reduced / count * 1e3:6.3f}ms  {full / reduced:6.1f}x")
+
+if __name__ == "__main__":
+    bench_area_centroid()
+    bench_reshape()
+    bench_prepare()
@@ -0,0 +1,281 @@
+"""
+Terrarium Benchmarks
+
+A benchmark suite for the public functions of the spatial, temporal, spectral,
+dateindex, cloudcover and export modules. Earth Engine is replaced by the offline stand-in of
+the fakeee module, which records the number of nodes and the serialized size of
+every graph and the round trips that would be made to the servers.
+
+Results are written as JSON so that the wall time and round trips of two versions
+can be compared, and the comparison exits with a non-zero status on regressions.
+
+Run with 'python benchmarks/bench_suite.py --output results.json' with the package installed
+and compare with 'python benchmarks/bench_suite.py --compare baseline.json'.
+"""
+import sys
+import json
+import time
+import random
+import typing
+import argparse
+import datetime
+import platform
+import statistics
+
+import ee
+import shapely.geometry as shapes
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+import fakeee
+from bench_spatial import generate_parcels
+
+from terrarium import spatial
+from terrarium import temporal
+from terrarium import spectral
+from terrarium import export
+from terrarium import geocoding
+from terrarium import dateindex
+from terrarium import cloudcover
+
+class Case(typing.NamedTuple):
+    """ A class that represents a benchmark case with the function it calls and an optional setup run before every call. """
+    name: str
+    call: typing.Callable[[], typing.Any]
+    setup: typing.Optional[typing.Callable[[], None]] = None
+    repeat: int = 20
+
+# The registered benchmark cases in the order they are run
+CASES: typing.List[Case] = []
+
+def register(name: str, call: typing.Callable[[], typing.Any], setup: typing.Callable[[], None] = None, repeat: int = 20):
+    """ A function that registers a benchmark case. """
+    CASES.append(Case(name, call, setup, repeat))
+
+def generate_polygons(count: int, seed: int = 0) -> list:
+    """ A function that returns a list of randomly placed AOI shaped polygons. """
+    rand = random.Random(seed)
+    return [shapes.Point(rand.uniform(-170, 170), rand.uniform(-60, 60)).buffer(rand.uniform(0.001, 0.05), 8) for _ in range(count)]
+
+def respond(expression: dict) -> list:
+    """ A function that answers the 'getInfo' calls of the temporal module with a year of acquisitions. """
+    start = datetime.datetime(2021, 1, 1)
+    function = expression["values"][expression["result"]].get("functionInvocationValue", {}).get("functionName")
+
+    # The day lists are sorted on the server and the date lists are raw timestamps
+    if function == "List.sort":
+        return [(start + datetime.timedelta(days=day)).strftime("%Y-%m-%d") for day in range(0, 365, 5)]
+    return [int((start + datetime.timedelta(days=day)).timestamp() * 1000) for day in range(0, 365, 5)]
+
+def register_cases(fake: fakeee.FakeEarthEngine):
+    """ A function that registers the benchmark cases of every module. """
+    polygon = generate_polygons(1)[0]
+    polygons = generate_polygons(1000)
+    points = [shapes.Point(p.centroid.x, p.centroid.y) for p in polygons]
+    lines = [shapes.LineString(p.exterior.coords[:4]) for p in polygons]
+    bounds = spatial._generate_bounds(polygons)
+    geojson = spatial.generate_geojson_fromshape(polygon)
+    geometry = spatial.generate_earthenginegeometry_fromgeojson(geojson)
+    parcel = generate_parcels(1)[0]
+    parceljson = spatial.generate_geojson_fromshape(parcel)
+    date = datetime.datetime(2021, 6, 1)
+
+    # Spatial cases
+    register("spatial.generate_earthenginegeometry_fromgeojson", lambda: spatial.generate_earthenginegeometry_fromgeojson(geojson))
+    register("spatial.generate_earthenginegeometry_frombounds", lambda: spatial.generate_earthenginegeometry_frombounds(*polygon.bounds))
+    register("spatial.generate_shape_fromgeojson", lambda: spatial.generate_shape_fromgeojson(geojson))
+    register("spatial.generate_geojson_fromshape", lambda: spatial.generate_geojson_fromshape(polygon))
+    register("spatial.generate_geometryhash[shape]", lambda: spatial.generate_geometryhash(polygon))
+    register("spatial.generate_geometryhash[ee]", lambda: spatial.generate_geometryhash(geometry))
+    register("spatial.generate_area", lambda: spatial.generate_area(polygon))
+    register("spatial.generate_centroid", lambda: spatial.generate_centroid(polygon))
+    register("spatial.generate_areas[1000]", lambda: spatial.generate_areas(polygons))
+    register("spatial.generate_centroids[1000]", lambda: spatial.generate_centroids(polygons))
+    register("spatial.reshape_point", lambda: spatial.reshape_point(points[0]))
+    register("spatial.reshape_polygon", lambda: spatial.reshape_polygon(polygon))
+    register("spatial.reshape_linestring", lambda: spatial.reshape_linestring(lines[0]))
+    register("spatial.reshape_points[1000]", lambda: spatial.reshape_points([p.x for p in points], [p.y for p in points]))
+    register("spatial.reshape_polygons[1000]", lambda: spatial.reshape_polygons(polygons))
+    register("spatial.reshape_linestrings[1000]", lambda: spatial.reshape_linestrings(lines))
+    register("spatial.reshape_bounds[1000]", lambda: spatial.reshape_bounds(*bounds))
+    register("spatial.prepare_geometry[cold]", lambda: spatial.prepare_geometry(parcel, 1.0), setup=spatial.geometrycache.clear)
+    register("spatial.prepare_geometry[cached]", lambda: spatial.prepare_geometry(parcel, 1.0))
+    register("spatial.generate_earthenginegeometry_fromgeojson[parcel]", lambda: spatial.generate_earthenginegeometry_fromgeojson(parceljson))
+    register("spatial.generate_earthenginegeometry_fromgeojson[parcel,1m]", lambda: spatial.generate_earthenginegeometry_fromgeojson(parceljson, 1.0))
+    register("spatial.generate_location", lambda: spatial.generate_location(points[0].x, points[0].y))
+    register("spatial.generate_locations[1000]", lambda: spatial.generate_locations([(p.x, p.y) for p in points]))
+
+    # Temporal cases over a thousand values
+    stamps = [1609459200000 + day * 86400000 for day in range(1000)]
+    dates = [temporal.datetime_fromtimestamp(stamp) for stamp in stamps]
+    googledates = [DatetimeWithNanoseconds.fromisoformat(date.isoformat()) for date in dates]
+    collection = ee.ImageCollection("COPERNICUS/S2_SR").filterBounds(geometry)
+
+    register("temporal.datetime_fromtimestamp[1000]", lambda: [temporal.datetime_fromtimestamp(stamp) for stamp in stamps])
+    register("temporal.datetime_fromgoogledate[1000]", lambda: [temporal.datetime_fromgoogledate(date) for date in googledates])
+    register("temporal.googledate_fromdatetime[1000]", lambda: [temporal.googledate_fromdatetime(date) for date in dates])
+    register("temporal.googledate_fromtimestamp[1000]", lambda: [temporal.googledate_fromtimestamp(stamp) for stamp in stamps])
+    register("temporal.shift_date[1000]", lambda: [temporal.shift_date(date, 5) for date in dates])
+    register("temporal.generate_daterange[1000]", lambda: [temporal.generate_daterange(date, 10, True) for date in dates])
+    register("temporal.datetimes_fromtimestamps[1000]", lambda: temporal.datetimes_fromtimestamps(stamps))
+    register("temporal.googledates_fromtimestamps[1000]", lambda: temporal.googledates_fromtimestamps(stamps))
+    register("temporal.shift_dates[1000]", lambda: temporal.shift_dates(dates, 5))
+    register("temporal.generate_dateranges[1000]", lambda: temporal.generate_dateranges(dates, 10, True))
+    register("temporal.plan_dateranges[1000]", lambda: temporal.plan_dateranges(dates, 10, True))
+    register("temporal.generate_earthenginecollection_datelist", lambda: temporal.generate_earthenginecollection_datelist(collection))
+    register("temporal.generate_earthenginecollection_daylist", lambda: temporal.generate_earthenginecollection_daylist(collection))
+    register("dateindex.fetch_acquisitiondays", lambda: dateindex.fetch_acquisitiondays(geometry, date))
+
+    # Spectral cases with the graph cache cleared before every call and kept warm
+    image = ee.Image("COPERNICUS/S2_SR/20210601T100031_20210601T100027_T33TWE")
+    register("spectral.truecolor_algorithm", lambda: spectral.truecolor_algorithm(image))
+    register("spectral.ndvi_algorithm", lambda: spectral.ndvi_algorithm(image))
+    for index in spectral.SPECTRALINDICES:
+        register(f"spectral.generate_spectral_graph[{index}]", lambda index=index: spectral.generate_spectral_graph(date, geometry, index), spectral.graphcache.clear)
+        register(f"spectral.generate_native_spectral_graph[{index}]", lambda index=index: spectral.generate_native_spectral_graph(date, geometry, index), spectral.graphcache.clear)
+
+    indices = list(spectral.SPECTRALINDICES)
+    register("spectral.generate_spectral_graph[warm]", lambda: spectral.generate_spectral_graph(date, geometry, "NDVI"))
+    register(f"spectral.generate_fused_spectral_graph[{len(indices)}]", lambda: spectral.generate_fused_spectral_graph(date, geometry, indices), spectral.graphcache.clear)
+    register("spectral.generate_fused_spectral_image[select]", lambda: spectral.select_spectral_index(spectral.generate_fused_spectral_image(date, geometry, indices), "NDVI"))
+    seriesdates = [date + datetime.timedelta(days=5 * day) for day in range(50)]
+    register("spectral.generate_spectral_graph[50 dates]", lambda: [spectral.generate_spectral_graph(day, geometry, "NDVI") for day in seriesdates], spectral.graphcache.clear, repeat=5)
+    register("spectral.generate_spectral_timeseries_graph[50 dates]", lambda: spectral.generate_spectral_timeseries_graph(seriesdates, geometry, "NDVI"), spectral.graphcache.clear)
+    register("spectral.generate_spectral_stack_graph[50 dates]", lambda: spectral.generate_spectral_stack_graph(seriesdates, geometry, "NDVI"), spectral.graphcache.clear)
+
+    # Cloud cover cases with a local cloud screen that is warm after the first call
+    screen = cloudcover.CloudScreen(":memory:", fetcher=lambda geometry, dates, probability, scale: [0.5] * len(dates))
+    register("cloudcover.fetch_cloudfractions[50 dates]", lambda: cloudcover.fetch_cloudfractions(geometry, seriesdates))
+    register("cloudcover.CloudScreen.rank[50 dates]", lambda: screen.rank(geometry, seriesdates))
+
+    # Export cases
+    graph = spectral.generate_spectral_graph(date, geometry, "NDVI")
+    register("export.export_image", lambda: export.export_image(graph.image, "bucket", "name", expression=graph.expression))
+    register("export.export_native_image", lambda: export.export_native_image(graph.image, "bucket", "name"))
+    register("export.get_taskstatus", lambda: export.get_taskstatus(operationid="projects/terrarium-benchmarks/operations/A"))
+    operationids = [f"projects/terrarium-benchmarks/operations/{number}" for number in range(50)]
+    fake.operations.update({operationid: {"name": operationid, "metadata": {"state": "RUNNING"}, "done": False} for operationid in operationids})
+    register("export.get_taskstatuses[50]", lambda: export.get_taskstatuses(operationids=operationids))
+
+def measure(value: typing.Any) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    """ 
+    A function that returns the graph nodes and bytes of a result if it is an Earth Engine object, a spectral graph or an
+    export task, or their totals if it is a list of them.
+    """
+    if isinstance(value, list) and value and isinstance(value[0], (spectral.SpectralGraph, ee.ComputedObject)):
+        sizes = [measure(item) for item in value]
+        return sum(nodes for nodes, _ in sizes), sum(size for _, size in sizes)
+
+    if isinstance(value, spectral.SpectralGraph):
+        value = value.expression
+    elif isinstance(value, ee.batch.Task):
+        value = value.config["expression"]
+
+    if isinstance(value, ee.ComputedObject):
+        return fakeee.measure_graph(value)
+    if isinstance(value, dict) and "values" in value:
+        return fakeee.count_nodes(value), len(json.dumps(value))
+
+    return None, None
+
+def run_case(case: Case, fake: fakeee.FakeEarthEngine, stub: geocoding.StubBackend, repeat: int = None) -> dict:
+    """ A function that runs a benchmark case and returns its wall times, round trips and graph measurements. """
+    times, roundtrips, payloads, result = [], {}, 0, None
+    for iteration in range(repeat or case.repeat):
+        if case.setup is not None:
+            case.setup()
+
+        fake.reset()
+        lookups = stub.calls
+        start = time.perf_counter()
+        result = case.call()
+        times.append(time.perf_counter() - start)
+
+        # Record the round trips of the first call, later calls may be answered from caches
+        if iteration == 0:
+            roundtrips = dict(fake.calls)
+            if stub.calls > lookups:
+                roundtrips["reverseGeocode"] = stub.calls - lookups
+            payloads = sum(fake.payloads)
+
+    nodes, size = measure(result)
+    return {
+        "name": case.name,
+        "repeat": len(times),
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "roundtrips": roundtrips,
+        "roundtrips_total": sum(roundtrips.values()),
+        "payload_bytes": payloads,
+        "graph_nodes": nodes,
+        "graph_bytes": size,
+    }
+
+def compare(baseline: dict, current: dict, tolerance: float) -> int:
+    """
+    A function that prints the cases of two result sets side by side and returns the number of regressions.
+    A case regresses if its median wall time grows by more than 'tolerance' or if it makes more round trips or larger graphs.
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = 0
+
+    print(f"{'case':58} {'baseline':>10} {'current':>10} {'change':>8}  round trips  nodes")
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+
+        change = result["median_s"] / before["median_s"] - 1 if before["median_s"] else 0.0
+        issues = []
+        if change > tolerance:
+            issues.append("slower")
+        if result["roundtrips_total"] > before["roundtrips_total"]:
+            issues.append("round trips")
+        if (result["graph_nodes"] or 0) > (before["graph_nodes"] or 0):
+            issues.append("graph")
+
+        regressions += bool(issues)
+        print(
+            f"{result['name']:58} {before['median_s'] * 1e3:8.3f}ms {result['median_s'] * 1e3:8.3f}ms {change:+8.1%}"
+            f"  {before['roundtrips_total']:>4} -> {result['roundtrips_total']:<4} {before['graph_nodes'] or '-'!s:>4} -> {result['graph_nodes'] or '-'!s:<4}"
+            f"  {', '.join(issues)}"
+        )
+
+    return regressions
+
+def main(arguments: typing.Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the Terrarium benchmark suite against an offline Earth Engine.")
+    parser.add_argument("--output", help="the path of the JSON file to write the results to")
+    parser.add_argument("--compare", help="the path of a JSON results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="the relative slowdown that is reported as a regression")
+    parser.add_argument("--filter", default="", help="only run the cases with names that contain this string")
+    parser.add_argument("--repeat", type=int, help="the number of calls of every case")
+    options = parser.parse_args(arguments)
+
+    stub = geocoding.StubBackend(lambda longitude, latitude: "Somewhere, Earth")
+    geocoding.set_geocoder(geocoding.Geocoder(stub))
+
+    with fakeee.FakeEarthEngine(responder=respond) as fake:
+        register_cases(fake)
+        results = [run_case(case, fake, stub, options.repeat) for case in CASES if options.filter in case.name]
+
+    current = {
+        "created": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "earthengine": ee.__version__,
+        "results": results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(current, file, indent=2)
+
+    if options.compare:
+        with open(options.compare) as file:
+            return 1 if compare(json.load(file), current, options.tolerance) else 0
+
+    for result in results:
+        print(f"{result['name']:58} {result['median_s'] * 1e3:10.3f}ms  round trips {result['roundtrips_total']:>3}  nodes {result['graph_nodes'] or '-'!s:>4}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Terrarium Benchmarks
+
+Benchmarks for the tiles module that report the latency of rendering XYZ tiles
+of a 1m NDVI raster when they are cold, warm on disk and warm in memory.
+
+Run with 'python benchmarks/bench_tiles.py' with the package installed.
+"""
+import os
+import time
+import tempfile
+
+import numpy
+
+from terrarium import tiles
+from terrarium import palette
+
+def timed(function, *args, **kwargs) -> float:
+    """ A function that returns the wall time of a single call in seconds. """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def report(label: str, latencies: list):
+    """ A function that prints the median and 95th percentile of a list of latencies in milliseconds. """
+    latencies = numpy.array(latencies) * 1000
+    print(f"  {label:14} {len(latencies):5} tiles  p50 {numpy.percentile(latencies, 50):8.3f}ms  p95 {numpy.percentile(latencies, 95):8.3f}ms")
+
+def bench_tiles(size: int = 4000, minzoom: int = 12, maxzoom: int = 17):
+    """ A benchmark of cold, disk warm and memory warm tile latencies over the zoom pyramid of a raster. """
+    rand = numpy.random.default_rng(0)
+    # Build a smooth focalized NDVI raster in UTM at 1m resolution
+    coarse = rand.uniform(0, 10, (size // 100 + 1, size // 100 + 1)).astype(numpy.float32)
+    array = numpy.trunc(numpy.kron(coarse, numpy.ones((100, 100), dtype=numpy.float32))[:size, :size])
+    source = tiles.ArraySource(array, (1.0, 0.0, 500000.0, 0.0, -1.0, 4500000.0), "EPSG:32633", key="bench")
+    pyramid = tiles.generate_pyramid(tuple(source.bounds), minzoom, maxzoom)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tiles.sqlite")
+        print(f"tile rendering {size}x{size} raster, zoom {minzoom}-{maxzoom}")
+
+        renderer = tiles.TileRenderer(source, palette.NDVIFOCAL, cache=tiles.TileCache(path))
+        report("cold", [timed(renderer.render_tile, *tile) for tile in pyramid])
+        report("memory warm", [timed(renderer.render_tile, *tile) for tile in pyramid])
+
+        renderer = tiles.TileRenderer(source, palette.NDVIFOCAL, cache=tiles.TileCache(path))
+        report("disk warm", [timed(renderer.render_tile, *tile) for tile in pyramid])
+
+        renderer = tiles.TileRenderer(source, palette.NDVIFOCAL, cache=tiles.TileCache(disk=False))
+        print(f"  prewarm        {timed(renderer.prewarm, minzoom=minzoom, maxzoom=maxzoom):8.3f}s")
+
+if __name__ == "__main__":
+    bench_tiles()
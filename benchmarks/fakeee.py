@@ -0,0 +1,110 @@
+"""
+Terrarium Benchmarks
+
+The fakeee module contains an offline stand-in for Earth Engine. The real client
+library is initialized against the static algorithm table that is bundled with it
+and every call that would go to the servers is answered locally and recorded, so
+graphs are constructed and serialized exactly as they are in production.
+"""
+import json
+import uuid
+import typing
+import collections
+
+import ee
+import ee.apitestcase
+
+# The ee.data functions that make a round trip to the servers
+ROUNDTRIPS = ("computeValue", "getOperation", "listOperations", "cancelOperation", "exportImage", "startProcessing", "getAsset", "getList")
+
+def count_nodes(expression: dict) -> int:
+    """ A function that returns the number of function invocations in a Cloud API encoded expression. """
+    count = 0
+    stack = [expression]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            count += "functionInvocationValue" in value
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+    return count
+
+def measure_graph(value: typing.Any) -> typing.Tuple[int, int]:
+    """ A function that returns the number of nodes and the size in bytes of the serialized graph of an Earth Engine object. """
+    expression = ee.serializer.encode(value, for_cloud_api=True)
+    return count_nodes(expression), len(json.dumps(expression))
+
+
+class FakeEarthEngine:
+    """
+    A class that installs the offline stand-in for Earth Engine.
+
+    'responder' is called with the Cloud API encoded expression of every 'getInfo' and returns its
+    value. 'operations' maps operation names to the statuses returned by 'getOperation' and
+    'listOperations'. The number of round trips by function is tracked in 'calls' and the
+    serialized size of every computed expression in 'payloads'.
+    """
+    def __init__(self, responder: typing.Callable[[dict], typing.Any] = None, operations: typing.Dict[str, dict] = None, project: str = "terrarium-benchmarks"):
+        self.responder = responder or (lambda expression: None)
+        self.operations = operations if operations is not None else {}
+        self.project = project
+        self.calls = collections.Counter()
+        self.payloads = []
+        self._originals = {}
+
+    def install(self):
+        """ A method that initializes the Earth Engine client offline and patches its server calls. """
+        names = ROUNDTRIPS + ("getAlgorithms", "_install_cloud_api_resource")
+        self._originals = {name: getattr(ee.data, name) for name in names if hasattr(ee.data, name)}
+
+        ee.Reset()
+        ee.data._install_cloud_api_resource = lambda: None
+        ee.data.getAlgorithms = ee.apitestcase.GetAlgorithms
+
+        ee.data.computeValue = self._compute_value
+        ee.data.getOperation = self._get_operation
+        ee.data.listOperations = self._list_operations
+        ee.data.exportImage = self._start_export
+        ee.data.startProcessing = self._start_export
+
+        ee.Initialize(None, "", project=self.project)
+        return self
+
+    def uninstall(self):
+        """ A method that restores the patched functions and resets the Earth Engine client. """
+        for name, function in self._originals.items():
+            setattr(ee.data, name, function)
+        ee.Reset()
+
+    def reset(self):
+        """ A method that clears the recorded round trips and payloads. """
+        self.calls.clear()
+        self.payloads.clear()
+
+    def _compute_value(self, value: typing.Any) -> typing.Any:
+        self.calls["computeValue"] += 1
+        expression = ee.serializer.encode(value, for_cloud_api=True)
+        self.payloads.append(len(json.dumps(expression)))
+        return self.responder(expression)
+
+    def _get_operation(self, name: str) -> dict:
+        self.calls["getOperation"] += 1
+        return self.operations.get(name, {"name": name, "metadata": {"state": "PENDING"}, "done": False})
+
+    def _list_operations(self, project: str = None) -> typing.List[dict]:
+        self.calls["listOperations"] += 1
+        return list(self.operations.values())
+
+    def _start_export(self, *args, **kwargs) -> dict:
+        self.calls["exportImage"] += 1
+        name = f"projects/{self.project}/operations/{uuid.uuid4().hex.upper()}"
+        self.operations[name] = {"name": name, "metadata": {"state": "PENDING"}, "done": False}
+        return {"name": name, "started": "OK"}
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
@@ -29,19 +29,25 @@ setup(
         'Topic :: Software Development :: Build Tools',
 
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.11',
         'Operating System :: OS Independent',
     ],
     keywords='geosentry, terrarium, earthengine, GIS',
 
     packages=find_packages(),
-    python_requires='>=3.8, <4',
+    python_requires='>=3.11, <4',
     install_requires=[
-        'earthengine-api==0.1.271',
-        'googlemaps==4.4.5',
-        'google-api-core==1.30.0',
-        'Shapely==1.7.1',
-        'pyproj==3.1.0',
-        'area==1.1.1'
-    ],   
+        'earthengine-api>=1.7.48',
+        'googlemaps>=4.10.0',
+        'google-api-core>=2.42.0',
+        'httplib2>=0.32.0',
+        'Shapely>=2.2.0',
+        'pyproj>=3.7.2',
+        'area>=1.1.1',
+        'numpy>=2.4.6'
+    ],
+    extras_require={
+        'raster': ['rasterio>=1.4.4'],
+        'storage': ['google-cloud-storage>=3.17.0'],
+    },
 )
\ No newline at end of file
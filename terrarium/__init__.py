@@ -1,31 +1,48 @@
 """
 Terrarium Package
 """
-import os
-import ee
+from __future__ import annotations
+
+import importlib
+
+from . import lazyload
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+session = lazyload.lazy_import("terrarium.session")
+
+# The submodules of the package that are imported on first access as attributes of the package
+SUBMODULES = (
+    "aio", "caching", "catalog", "cloudcover", "dateindex", "export", "geocoding", "ingestion", "manifest", "monitor", "palette",
+    "postprocess", "raster", "scheduler", "serialization", "session", "spatial", "spectral", "temporal", "tiledexport", "tiles",
+)
+
+def __getattr__(name: str):
+    if name in SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES))
 
 def initialize(project: str):
     """
     A function that initializes an Earth Engine session with the credentials 
     of a Service Account Agent. The Service Account must be authenticated to use 
-    the Earth Engine API and the credentials must be provided as bytes string.
-    """
-    # Check if Earth Engine is already intialized
-    if ee.data._initialized:
-        return
-
-    try:
-        # Retrieve the location of the credentials file from the environment variable
-        keyfile = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
-        # Construct the Service Account Credentials from the credentials bytes string
-        eecredentials = ee.ServiceAccountCredentials(email=None, key_file=keyfile)
+    the Earth Engine API and the location of its key file must be set in the
+    'GOOGLE_APPLICATION_CREDENTIALS' environment variable.
 
-        # Use the Service Account Credentials and the project ID
-        # to authenticate with Earth Engine and initialize the session
-        ee.Initialize(credentials=eecredentials, project=project)
-
-    except KeyError as e:
-        raise RuntimeError(f"could not initalize earth engine. cannot find credentials")
+    The session is added to the default 'session.SessionManager' and Earth Engine is
+    only initialized once per process, even when called concurrently from many threads.
+    """
+    # Retrieve the default session manager
+    manager = session.get_manager()
+    # Add a session for the project if it does not already have one or another thread added it
+    if project not in manager.sessions:
+        try:
+            manager.add_session(project, project)
+        except RuntimeError:
+            pass
 
-    except Exception as e:
-        raise RuntimeError(f"could not initialize earth engine. error: {e}")
+    # Initialize Earth Engine with the sessions of the manager
+    manager.initialize()
@@ -0,0 +1,331 @@
+"""
+Terrarium Package
+
+The aio module contains the asyncio facade for the blocking network calls of the
+Earth Engine and Maps backends. Calls run on a bounded thread pool for every backend
+with per-call timeouts and cancellation, callers beyond the bound of a pool wait for
+a free slot and pools back off on their own when a backend reports quota errors.
+"""
+from __future__ import annotations
+
+import typing
+import datetime
+import threading
+import contextvars
+import collections
+import concurrent.futures
+
+from . import lazyload
+from . import export
+from . import spatial
+from . import temporal
+from . import instrumentation
+
+asyncio = lazyload.lazy_import("asyncio")
+ee = lazyload.lazy_import("ee")
+
+# The markers in the messages of errors that are raised when the quota of a backend is exhausted
+QUOTAMARKERS = ("429", "too many requests", "resource_exhausted", "quota", "over_query_limit", "rate limit")
+
+# The settings of the default pools of the backends
+POOLSETTINGS = {
+    "earthengine": {"concurrency": 16},
+    "maps": {"concurrency": 8, "rate": 50.0},
+}
+
+def is_quotaerror(error: BaseException) -> bool:
+    """ A function that returns whether an error, or any error it was raised from, reports an exhausted quota. """
+    while error is not None:
+        message = f"{type(error).__name__} {error}".lower()
+        if any(marker in message for marker in QUOTAMARKERS):
+            return True
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+class BackendPool:
+    """
+    A class that runs the blocking calls of a backend on a bounded thread pool for asyncio callers.
+
+    At most 'concurrency' calls run at once and the callers beyond it wait for a free slot in order of arrival, which
+    applies backpressure to the callers instead of queueing work without bound. If 'rate' is given, calls are started
+    at most 'rate' times per second. A call that fails with a quota error, as detected by 'quotaerror', halves the
+    concurrency limit, pauses new calls for 'cooldown' seconds, doubling with consecutive quota errors up to
+    'maxcooldown' seconds, and is retried up to 'retries' times. The limit grows back by one slot every time as many
+    calls as the limit have succeeded.
+
+    The 'timeout' in seconds applies to a whole call including the wait for a slot and its retries. Cancelled and
+    timed out calls that have not started are dropped, while calls that are already running in a thread run to
+    completion and keep their slot until they return, as blocking calls cannot be interrupted.
+    """
+    def __init__(self, name: str, concurrency: int = 8, rate: float = None, timeout: float = None, retries: int = 3,
+                 cooldown: float = 1.0, maxcooldown: float = 60.0, quotaerror: typing.Callable[[BaseException], bool] = is_quotaerror):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.retries = retries
+        self.cooldown = cooldown
+        self.maxcooldown = maxcooldown
+        self.quotaerror = quotaerror
+
+        self.limit = concurrency
+        self.inflight = 0
+        self.counters = {"calls": 0, "completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0, "throttled": 0, "retried": 0}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"terrarium-{name}")
+
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._resume = 0.0
+        self._nextstart = 0.0
+        self._strikes = 0
+        self._epoch = 0
+        self._credit = 0
+
+    def _wakeup(self):
+        """ A method that wakes the first caller that is waiting for a slot. Safe to call from any thread. """
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    return
+                waiter = self._waiters.popleft()
+
+            try:
+                # Resolve the waiter on the event loop it belongs to
+                waiter.get_loop().call_soon_threadsafe(self._notify, waiter)
+                return
+            except RuntimeError:
+                # The event loop of the waiter was closed, so wake the next caller instead
+                continue
+
+    def _notify(self, waiter: asyncio.Future):
+        """ A method that resolves a waiter on its event loop or passes the wakeup on if its caller is gone. """
+        if waiter.done():
+            self._wakeup()
+        else:
+            waiter.set_result(None)
+
+    def _release(self):
+        """ A method that frees the slot of a finished call. Called from the thread of the call when it returns. """
+        with self._lock:
+            self.inflight -= 1
+        self._wakeup()
+
+    async def _acquire(self):
+        """ A method that waits for a free slot while respecting the concurrency limit, the rate and any quota pause. """
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait out the quota pause and the interval between calls of the rate
+            delay = max(self._resume, self._nextstart) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            with self._lock:
+                if self.inflight < self.limit:
+                    self.inflight += 1
+                    if self.rate:
+                        self._nextstart = max(loop.time(), self._nextstart) + 1 / self.rate
+                    return
+
+                # Wait in line for a slot to be freed
+                waiter = loop.create_future()
+                self._waiters.append(waiter)
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass a wakeup that arrived with the cancellation on to the next caller
+                if waiter.done() and not waiter.cancelled():
+                    self._wakeup()
+                raise
+
+    def _throttle(self, loop: asyncio.AbstractEventLoop, epoch: int):
+        """
+        A method that halves the concurrency limit and pauses new calls after a quota error. Calls that were started
+        before the last throttle fail together, so only the first of their errors throttles the pool again.
+        """
+        if epoch != self._epoch:
+            return
+
+        self.counters["throttled"] += 1
+        self._epoch += 1
+        self._strikes += 1
+        self.limit = max(1, self.limit // 2)
+        self._credit = 0
+        self._resume = loop.time() + min(self.cooldown * 2 ** (self._strikes - 1), self.maxcooldown)
+
+    def _recover(self):
+        """ A method that grows the concurrency limit by a slot after as many calls as the limit have succeeded. """
+        self._strikes = 0
+        if self.limit < self.concurrency:
+            self._credit += 1
+            if self._credit >= self.limit:
+                self._credit = 0
+                self.limit += 1
+                self._wakeup()
+
+    async def _call(self, function: typing.Callable, args: tuple, kwargs: dict) -> typing.Any:
+        """ A method that runs a call in a slot of the pool and retries it after quota errors. """
+        loop = asyncio.get_running_loop()
+        attempts = 0
+        while True:
+            await self._acquire()
+            epoch = self._epoch
+
+            # Run the call in the context of the caller, so the current session is kept
+            context = contextvars.copy_context()
+            try:
+                future = self.executor.submit(context.run, function, *args, **kwargs)
+            except Exception:
+                self._release()
+                raise
+
+            # Free the slot when the thread returns, even if the caller has stopped waiting for it
+            future.add_done_callback(lambda _: self._release())
+
+            try:
+                result = await asyncio.wrap_future(future)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempts < self.retries and self.quotaerror(e):
+                    attempts += 1
+                    self.counters["retried"] += 1
+                    self._throttle(loop, epoch)
+                    continue
+                raise
+
+            self._recover()
+            return result
+
+    async def run(self, function: typing.Callable, *args, timeout: float = None, **kwargs) -> typing.Any:
+        """
+        A method that runs a blocking function with the given arguments on the pool and returns its result.
+        The 'timeout' defaults to the timeout of the pool and a RuntimeError is raised when it is exceeded.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        self.counters["calls"] += 1
+        try:
+            result = await asyncio.wait_for(self._call(function, args, kwargs), timeout)
+
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise RuntimeError(f"could not complete {self.name} call. timed out after {timeout}s.")
+        except asyncio.CancelledError:
+            self.counters["cancelled"] += 1
+            raise
+        except Exception:
+            self.counters["failed"] += 1
+            raise
+
+        self.counters["completed"] += 1
+        return result
+
+    async def gather(self, function: typing.Callable, arguments: typing.Iterable[typing.Sequence], timeout: float = None,
+                     return_exceptions: bool = False) -> typing.List[typing.Any]:
+        """
+        A method that runs a blocking function once for every sequence of positional arguments on the pool and returns
+        the results in order. The calls share the slots of the pool, so a large batch does not overload the backend.
+        If 'return_exceptions' is False the first error is raised and the calls that have not started are cancelled.
+        """
+        tasks = [asyncio.ensure_future(self.run(function, *args, timeout=timeout)) for args in arguments]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        """ A method that returns a mapping of the counters of the pool with its current concurrency limit and calls in flight. """
+        return {**self.counters, "limit": self.limit, "inflight": self.inflight, "waiting": sum(1 for waiter in self._waiters if not waiter.done())}
+
+    def close(self):
+        """ A method that shuts the thread pool down without waiting for running calls. """
+        self.executor.shutdown(wait=False)
+
+
+# The default pools of the backends
+_pools = {}
+_poolslock = threading.Lock()
+
+def get_pool(backend: str) -> BackendPool:
+    """
+    A function that returns the default BackendPool of a backend, such as 'earthengine' or 'maps'. Pools are created on
+    first use with the settings in 'POOLSETTINGS' unless one was set with 'set_pool'.
+    """
+    with _poolslock:
+        if backend not in _pools:
+            _pools[backend] = BackendPool(backend, **POOLSETTINGS.get(backend, {}))
+
+        return _pools[backend]
+
+def set_pool(backend: str, pool: typing.Optional[BackendPool]):
+    """ A function that replaces the default BackendPool of a backend. Passing None resets it to be recreated on next use. """
+    with _poolslock:
+        previous = _pools.pop(backend, None)
+        if pool is not None:
+            _pools[backend] = pool
+
+    if previous is not None and previous is not pool:
+        previous.close()
+
+async def call(backend: str, function: typing.Callable, *args, timeout: float = None, **kwargs) -> typing.Any:
+    """ A function that runs a blocking function on the default pool of a backend and returns its result. """
+    return await get_pool(backend).run(function, *args, timeout=timeout, **kwargs)
+
+async def gather(backend: str, function: typing.Callable, arguments: typing.Iterable[typing.Sequence], timeout: float = None,
+                 return_exceptions: bool = False) -> typing.List[typing.Any]:
+    """ A function that runs a blocking function for every sequence of arguments on the default pool of a backend. Refer to 'BackendPool.gather'. """
+    return await get_pool(backend).gather(function, arguments, timeout, return_exceptions)
+
+async def generate_earthenginecollection_datelist(collection: ee.ImageCollection, timeout: float = None) -> typing.List[datetime.datetime]:
+    """ A function that returns the dates of an Earth Engine ImageCollection. Refer to 'temporal.generate_earthenginecollection_datelist'. """
+    return await call("earthengine", temporal.generate_earthenginecollection_datelist, collection, timeout=timeout)
+
+async def generate_earthenginecollection_daylist(collection: ee.ImageCollection, timeout: float = None) -> typing.List[datetime.datetime]:
+    """ A function that returns the acquisition days of an Earth Engine ImageCollection. Refer to 'temporal.generate_earthenginecollection_daylist'. """
+    return await call("earthengine", temporal.generate_earthenginecollection_daylist, collection, timeout=timeout)
+
+async def gather_datelists(collections: typing.Sequence[ee.ImageCollection], timeout: float = None,
+                           return_exceptions: bool = False) -> typing.List[typing.List[datetime.datetime]]:
+    """ A function that returns the dates of every Earth Engine ImageCollection with the calls spread over the Earth Engine pool. """
+    return await gather("earthengine", temporal.generate_earthenginecollection_datelist, [(collection,) for collection in collections], timeout, return_exceptions)
+
+async def get_taskstatus(operationid: str = None, taskid: str = None, project: str = None, timeout: float = None) -> dict:
+    """ A function that returns the status of an Earth Engine export task. Refer to 'export.get_taskstatus'. """
+    return await call("earthengine", export.get_taskstatus, operationid, taskid, project, timeout=timeout)
+
+async def get_taskstatuses(operationids: typing.Sequence[str] = None, taskids: typing.Sequence[str] = None, project: str = None,
+                           timeout: float = None) -> typing.Dict[str, dict]:
+    """ A function that returns the statuses of many Earth Engine export tasks with a bounded operation listing. Refer to 'export.get_taskstatuses'. """
+    return await call("earthengine", export.get_taskstatuses, operationids, taskids, project, timeout=timeout)
+
+def _start_task(task: ee.batch.Task) -> str:
+    """ A function that starts an Earth Engine task and returns its ID. """
+    with instrumentation.roundtrip("earthengine", "startExport"):
+        task.start()
+    return task.id
+
+async def start_task(task: ee.batch.Task, timeout: float = None) -> str:
+    """ A function that starts an Earth Engine export task, such as one from 'export.export_image', and returns its task ID. """
+    return await call("earthengine", _start_task, task, timeout=timeout)
+
+async def gather_tasks(tasks: typing.Sequence[ee.batch.Task], timeout: float = None, return_exceptions: bool = False) -> typing.List[str]:
+    """ A function that starts every Earth Engine export task with the calls spread over the Earth Engine pool and returns their task IDs. """
+    return await gather("earthengine", _start_task, [(task,) for task in tasks], timeout, return_exceptions)
+
+async def generate_location(longitude: float, latitude: float, timeout: float = None) -> str:
+    """ A function that returns the location address for a set of coordinates. Refer to 'spatial.generate_location'. """
+    return await call("maps", spatial.generate_location, longitude, latitude, timeout=timeout)
+
+async def generate_locations(points: typing.Sequence[typing.Tuple[float, float]], timeout: float = None,
+                             return_exceptions: bool = False) -> typing.List[str]:
+    """
+    A function that returns the location addresses for a sequence of (longitude, latitude) points with a lookup for
+    every point on the Maps pool, so the lookups are bounded by the concurrency and rate of the pool. Lookups of points
+    in the same geohash cell are deduplicated by the default Geocoder.
+    """
+    return await gather("maps", spatial.generate_location, points, timeout, return_exceptions)
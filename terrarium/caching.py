@@ -0,0 +1,94 @@
+"""
+Terrarium Package
+
+The caching module contains the shared cache helpers used by
+the subsystems that keep state in memory or on the local disk.
+"""
+import os
+import typing
+import threading
+import collections
+
+def generate_cachepath(name: str) -> str:
+    """
+    A function that returns the path to a named file in the Terrarium cache directory.
+
+    The cache directory is read from the 'TERRARIUM_CACHE_DIR' environment variable
+    and defaults to '~/.cache/terrarium'. The directory is created if it does not exist.
+    """
+    try:
+        # Retrieve the cache directory from the environment or use the default
+        directory = os.environ.get("TERRARIUM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "terrarium"))
+        # Create the cache directory if it does not exist
+        os.makedirs(directory, exist_ok=True)
+        # Return the path to the named file in the cache directory
+        return os.path.join(directory, name)
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate cache path. error: {e}")
+
+
+class LRUCache:
+    """
+    A class that implements a thread-safe in-memory cache that evicts the least recently
+    used entries beyond 'capacity' entries. Lookups are counted as hits and misses.
+
+    If 'maxweight' is given, entries are also evicted while the total weight of the cached
+    values is beyond it. The weight of a value is returned by 'weigher' and defaults to its length.
+    """
+    def __init__(self, capacity: int = 256, maxweight: int = None, weigher: typing.Callable[[typing.Any], int] = len):
+        self.capacity = capacity
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """ A method that returns the cached value for a key or the default if it is not cached. """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def put(self, key: typing.Hashable, value: typing.Any):
+        """ A method that caches the value for a key and evicts the least recently used entries. """
+        with self._lock:
+            if self.maxweight is not None:
+                if key in self._entries:
+                    self.weight -= self.weigher(self._entries[key])
+                self.weight += self.weigher(value)
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity or (self.maxweight is not None and self.weight > self.maxweight and len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                if self.maxweight is not None:
+                    self.weight -= self.weigher(evicted)
+
+    def clear(self):
+        """ A method that removes every entry from the cache and resets the counters. """
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """ A method that returns a mapping of the hit and miss counters, the size, the weight and the capacity of the cache. """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "weight": self.weight, "capacity": self.capacity}
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
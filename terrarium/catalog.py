@@ -0,0 +1,248 @@
+"""
+Terrarium Package
+
+The catalog module contains the array backed AOI catalog that stores
+a large collection of geometries in contiguous buffers with a spatial index.
+"""
+from __future__ import annotations
+
+import os
+import json
+import typing
+
+from . import lazyload
+from . import instrumentation
+
+numpy = lazyload.lazy_import("numpy")
+shapes = lazyload.lazy_import("shapely.geometry")
+
+# The geometry type codes stored by the catalog
+POINT, LINESTRING, POLYGON = 0, 1, 2
+# The number of children of every node in the spatial index
+NODESIZE = 16
+
+def _pack_index(bounds: numpy.ndarray, nodesize: int) -> typing.Tuple[numpy.ndarray, typing.List[numpy.ndarray]]:
+    """
+    A function that builds a Sort-Tile-Recursive packed R-tree over an array of bounds.
+
+    Returns the permutation of the items in index order and the list of node bounds for every
+    level from the items upwards. The children of node 'i' on a level are the nodes from
+    'i * nodesize' to '(i + 1) * nodesize' on the level below it.
+    """
+    count = len(bounds)
+    if count == 0:
+        return numpy.empty(0, dtype=numpy.int64), [numpy.empty((0, 4), dtype=numpy.float64)]
+
+    # Calculate the number of vertical slices for the leaf nodes
+    leaves = -(-count // nodesize)
+    slices = int(numpy.ceil(numpy.sqrt(leaves)))
+    slicesize = slices * nodesize
+
+    # Sort the items by their center into vertical slices and then each slice by its center
+    centerx = (bounds[:, 0] + bounds[:, 2]) / 2
+    centery = (bounds[:, 1] + bounds[:, 3]) / 2
+    order = numpy.argsort(centerx, kind="stable")
+    slicenumber = numpy.arange(count) // slicesize
+    order = order[numpy.lexsort((centery[order], slicenumber))]
+
+    # Group every level into the nodes of the level above it
+    levels = [bounds[order]]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        starts = numpy.arange(0, len(below), nodesize)
+        levels.append(numpy.stack([
+            numpy.minimum.reduceat(below[:, 0], starts),
+            numpy.minimum.reduceat(below[:, 1], starts),
+            numpy.maximum.reduceat(below[:, 2], starts),
+            numpy.maximum.reduceat(below[:, 3], starts),
+        ], axis=1))
+
+    return order, levels
+
+
+class AOICatalog:
+    """
+    A class that stores a catalog of AOI geometries in contiguous NumPy buffers.
+
+    Coordinates are stored as a (N, 2) array of longitude and latitude values with an array of
+    ring offsets into the coordinates and an array of part offsets from each geometry into its rings.
+    Points and LineStrings have a single ring and the first ring of a Polygon is its exterior.
+    The bounds of every geometry are precomputed and indexed with a packed STR-tree.
+
+    Catalogs are created with 'from_shapes' or 'from_rings' and can be saved to a directory with
+    'save'. Catalogs opened with 'load' are memory-mapped so that they can be shared between processes.
+    """
+    def __init__(self, coordinates: numpy.ndarray, ringoffsets: numpy.ndarray, partoffsets: numpy.ndarray,
+                 types: numpy.ndarray, bounds: numpy.ndarray = None, nodesize: int = NODESIZE):
+        self.coordinates = coordinates
+        self.ringoffsets = ringoffsets
+        self.partoffsets = partoffsets
+        self.types = types
+        self.nodesize = nodesize
+
+        # Calculate the bounds of every geometry if they are not given
+        self.bounds = bounds if bounds is not None else self._generate_bounds()
+        # Build the spatial index over the bounds
+        self.order, self.levels = _pack_index(numpy.asarray(self.bounds), nodesize)
+
+    def _generate_bounds(self) -> numpy.ndarray:
+        """ A method that returns the (N, 4) array of west, south, east and north bounds of every geometry. """
+        if len(self.types) == 0:
+            return numpy.empty((0, 4), dtype=numpy.float64)
+
+        # Every geometry starts at the first coordinate of its first ring
+        starts = self.ringoffsets[self.partoffsets[:-1]]
+        return numpy.stack([
+            numpy.minimum.reduceat(self.coordinates[:, 0], starts),
+            numpy.minimum.reduceat(self.coordinates[:, 1], starts),
+            numpy.maximum.reduceat(self.coordinates[:, 0], starts),
+            numpy.maximum.reduceat(self.coordinates[:, 1], starts),
+        ], axis=1)
+
+    @classmethod
+    def from_shapes(cls, shapelist: typing.Sequence[typing.Union[shapes.Point, shapes.LineString, shapes.Polygon]]) -> "AOICatalog":
+        """ A method that creates a catalog from a sequence of Shapely Points, LineStrings and Polygons. """
+        coordinates, ringsizes, partsizes, types = [], [], [], []
+
+        for shape in shapelist:
+            if isinstance(shape, shapes.Polygon):
+                rings, code = [shape.exterior, *shape.interiors], POLYGON
+            elif isinstance(shape, shapes.LineString):
+                rings, code = [shape], LINESTRING
+            elif isinstance(shape, shapes.Point):
+                rings, code = [shape], POINT
+            else:
+                raise RuntimeError("could not create catalog. not a shapely point, linestring or polygon")
+
+            for ring in rings:
+                ringcoords = numpy.asarray(ring.coords, dtype=numpy.float64)[:, :2]
+                coordinates.append(ringcoords)
+                ringsizes.append(len(ringcoords))
+
+            partsizes.append(len(rings))
+            types.append(code)
+
+        try:
+            return cls(
+                numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2), dtype=numpy.float64),
+                numpy.concatenate([[0], numpy.cumsum(ringsizes, dtype=numpy.int64)]).astype(numpy.int64),
+                numpy.concatenate([[0], numpy.cumsum(partsizes, dtype=numpy.int64)]).astype(numpy.int64),
+                numpy.asarray(types, dtype=numpy.uint8),
+            )
+
+        except Exception as e:
+            raise RuntimeError(f"could not create catalog. error: {e}")
+
+    @classmethod
+    def from_rings(cls, rings: numpy.ndarray) -> "AOICatalog":
+        """ A method that creates a catalog of Polygons from a (N, V, 2) array of exterior rings such as those returned by the reshape functions. """
+        rings = numpy.asarray(rings, dtype=numpy.float64)
+        if rings.ndim != 3 or rings.shape[2] != 2:
+            raise RuntimeError("could not create catalog. rings must be an array of shape (N, V, 2)")
+
+        count, vertices, _ = rings.shape
+        return cls(
+            numpy.ascontiguousarray(rings.reshape(-1, 2)),
+            numpy.arange(count + 1, dtype=numpy.int64) * vertices,
+            numpy.arange(count + 1, dtype=numpy.int64),
+            numpy.full(count, POLYGON, dtype=numpy.uint8),
+        )
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def get_shape(self, index: int) -> typing.Union[shapes.Point, shapes.LineString, shapes.Polygon]:
+        """ A method that returns the Shapely Geometry at the given position in the catalog. """
+        rings = [
+            numpy.asarray(self.coordinates[self.ringoffsets[ring]:self.ringoffsets[ring + 1]])
+            for ring in range(self.partoffsets[index], self.partoffsets[index + 1])
+        ]
+
+        code = self.types[index]
+        if code == POINT:
+            return shapes.Point(rings[0][0])
+        if code == LINESTRING:
+            return shapes.LineString(rings[0])
+        return shapes.Polygon(rings[0], rings[1:])
+
+    @instrumentation.instrumented
+    def query_bounds(self, west: float, south: float, east: float, north: float) -> numpy.ndarray:
+        """ A method that returns the sorted positions of the geometries whose bounds intersect the given bounds. """
+        if len(self) == 0:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        # Start from every node on the top level of the index
+        candidates = numpy.arange(len(self.levels[-1]))
+        children = numpy.arange(self.nodesize)
+
+        for depth in range(len(self.levels) - 1, -1, -1):
+            # Retain the candidates whose bounds intersect the query bounds
+            level = self.levels[depth]
+            nodes = level[candidates]
+            candidates = candidates[(nodes[:, 0] <= east) & (nodes[:, 2] >= west) & (nodes[:, 1] <= north) & (nodes[:, 3] >= south)]
+
+            # Expand the candidates into their children on the level below
+            if depth:
+                candidates = (candidates[:, None] * self.nodesize + children).ravel()
+                candidates = candidates[candidates < len(self.levels[depth - 1])]
+
+        # Map the candidates from index order back to catalog positions
+        return numpy.sort(self.order[candidates])
+
+    @instrumentation.instrumented
+    def query_intersects(self, geometry: shapes.base.BaseGeometry) -> numpy.ndarray:
+        """ A method that returns the sorted positions of the geometries that intersect the given Shapely Geometry. """
+        candidates = self.query_bounds(*geometry.bounds)
+
+        try:
+            # Test the candidates against the exact geometry
+            return numpy.array([index for index in candidates if self.get_shape(index).intersects(geometry)], dtype=numpy.int64)
+
+        except Exception as e:
+            raise RuntimeError(f"could not query catalog. error: {e}")
+
+    def save(self, directory: str):
+        """ A method that saves the catalog buffers as NumPy files in the given directory. """
+        try:
+            os.makedirs(directory, exist_ok=True)
+            arrays = {
+                "coordinates": self.coordinates, "ringoffsets": self.ringoffsets, "partoffsets": self.partoffsets,
+                "types": self.types, "bounds": self.bounds, "order": self.order,
+                "index": numpy.concatenate(self.levels),
+            }
+            for name, array in arrays.items():
+                numpy.save(os.path.join(directory, f"{name}.npy"), numpy.asarray(array))
+
+            # Write the metadata required to split the index into levels
+            with open(os.path.join(directory, "catalog.json"), "w") as file:
+                json.dump({"nodesize": self.nodesize, "levels": [len(level) for level in self.levels]}, file)
+
+        except Exception as e:
+            raise RuntimeError(f"could not save catalog. error: {e}")
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "AOICatalog":
+        """ A method that loads a catalog saved with 'save'. The buffers are memory-mapped read-only unless 'mmap' is False. """
+        try:
+            with open(os.path.join(directory, "catalog.json")) as file:
+                metadata = json.load(file)
+
+            mode = "r" if mmap else None
+            arrays = {
+                name: numpy.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+                for name in ("coordinates", "ringoffsets", "partoffsets", "types", "bounds", "order", "index")
+            }
+
+        except Exception as e:
+            raise RuntimeError(f"could not load catalog. error: {e}")
+
+        # Restore the catalog without rebuilding the index
+        catalog = cls.__new__(cls)
+        catalog.coordinates, catalog.ringoffsets = arrays["coordinates"], arrays["ringoffsets"]
+        catalog.partoffsets, catalog.types = arrays["partoffsets"], arrays["types"]
+        catalog.bounds, catalog.order = arrays["bounds"], arrays["order"]
+        catalog.nodesize = metadata["nodesize"]
+
+        splits = numpy.cumsum(metadata["levels"])[:-1]
+        catalog.levels = numpy.split(arrays["index"], splits)
+        return catalog
@@ -0,0 +1,215 @@
+"""
+Terrarium Package
+
+The cloudcover module contains the cloud pre-screening stage that computes the
+cloud fraction of an AOI on many dates from the Sentinel-2 Cloud Probability
+dataset in a single reduction, caches them locally and screens or ranks dates
+before any spectral graph is built for them.
+"""
+from __future__ import annotations
+
+import time
+import typing
+import sqlite3
+import datetime
+import threading
+
+from . import lazyload
+from . import caching
+from . import spatial
+from . import temporal
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+# The Earth Engine collection of the Sentinel-2 Cloud Probability dataset
+CLOUDCOLLECTION = "COPERNICUS/S2_CLOUD_PROBABILITY"
+# The number of dates whose fractions are reduced and retrieved in a single round trip
+CLOUDCHUNKSIZE = 100
+
+@instrumentation.instrumented
+def fetch_cloudfractions(geometry: ee.Geometry, dates: typing.Sequence[datetime.datetime], probability: int = 50, scale: float = 20,
+                         chunksize: int = CLOUDCHUNKSIZE) -> typing.List[typing.Optional[float]]:
+    """
+    A function that returns the cloud fraction of the given geometry on every date, as the share of its pixels with a
+    cloud probability above 'probability' percent at a resolution of 'scale' meters. The cloud probability images are
+    mosaiced for the same buffer around every date as the spectral images and the fractions are reduced on the server
+    and retrieved in one round trip per 'chunksize' dates, which keeps every reduction within the limits of a single
+    request. The fraction is None for dates without acquisitions.
+    """
+    dates = list(dates)
+    if chunksize < 1:
+        raise RuntimeError("could not fetch cloud fractions. chunksize must be positive.")
+
+    fractions = []
+    for start in range(0, len(dates), chunksize):
+        fractions.extend(_fetch_cloudfractions(geometry, dates[start:start + chunksize], probability, scale))
+
+    return fractions
+
+def _fetch_cloudfractions(geometry: ee.Geometry, dates: typing.List[datetime.datetime], probability: int, scale: float) -> typing.List[typing.Optional[float]]:
+    """ A function that returns the cloud fraction of the given geometry on every date from a single reduction. """
+    try:
+        # Filter the cloud probability collection for the geometry and the buffers of every date
+        collection = ee.ImageCollection(CLOUDCOLLECTION).filterBounds(geometry)
+        collection, buffers = temporal.generate_earthenginecollection_series(collection, dates, 0.5)
+
+        def fraction(buffer: ee.List) -> ee.Number:
+            # Mosaic the cloud probabilities of the date and mark the cloudy pixels
+            buffer = ee.List(buffer)
+            window = collection.filterDate(buffer.get(0), buffer.get(1))
+            cloudy = window.mosaic().select("probability").gt(probability)
+            # Reduce the cloudy pixels over the geometry into the fraction of cloudy pixels
+            stats = cloudy.reduceRegion(reducer=ee.Reducer.mean(), geometry=geometry, scale=scale, maxPixels=1e9, bestEffort=True)
+            # Mark the dates without acquisitions with a negative fraction
+            return ee.Algorithms.If(window.size().gt(0), stats.get("probability"), -1)
+
+        fractions = buffers.map(fraction)
+
+    except RuntimeError as e:
+        raise RuntimeError(f"could not create cloud probability collection. {e}")
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create cloud fraction reduction. {e}")
+
+    try:
+        # Retrieve the fractions of every date
+        with instrumentation.roundtrip("earthengine", "getInfo"):
+            fractions = fractions.getInfo()
+
+    except Exception as e:
+        raise RuntimeError(f"could not fetch cloud fractions. error: {e}")
+
+    return [None if fraction is None or fraction < 0 else float(fraction) for fraction in fractions]
+
+
+class CloudScreen:
+    """
+    A class that screens the dates of an AOI by their cloud fraction before any spectral work is done for them.
+
+    Cloud fractions are stored in an SQLite database keyed by the canonical hash of the geometry, the date and the
+    probability threshold and scale of the reduction, so every date of an AOI is only reduced once. The fractions of
+    the dates that are not stored yet are fetched together with 'fetcher', which is called with the geometry, the dates,
+    the probability and the scale and defaults to 'fetch_cloudfractions'. Dates without acquisitions are stored with a
+    fraction of None. Fractions of the dates within the last 'settle' days are never stored, with or without
+    acquisitions, as more of their images may still be ingested and change the mosaic, so they are fetched again
+    until they have settled.
+    The path defaults to 'clouds.sqlite' in the Terrarium cache directory.
+    """
+    def __init__(self, path: str = None, probability: int = 50, scale: float = 20, settle: float = 5,
+                 fetcher: typing.Callable[..., typing.List[typing.Optional[float]]] = fetch_cloudfractions):
+        self.path = path or caching.generate_cachepath("clouds.sqlite")
+        self.probability = probability
+        self.scale = scale
+        self.settle = settle
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+
+        try:
+            # Open the database and create the cloud fractions table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS clouds "
+                "(aoi TEXT, date TEXT, probability INTEGER, scale REAL, fraction REAL, created REAL, "
+                "PRIMARY KEY (aoi, date, probability, scale))"
+            )
+            self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open cloud screen. error: {e}")
+
+    @instrumentation.instrumented
+    def fractions(self, geometry: ee.Geometry, dates: typing.Sequence[datetime.datetime]) -> typing.Dict[datetime.datetime, typing.Optional[float]]:
+        """ A method that returns the cloud fraction of the geometry on every date, or None for dates without acquisitions. """
+        aoi = spatial.generate_geometryhash(geometry)
+        dates = list(dict.fromkeys(dates))
+
+        try:
+            rows = []
+            with self._lock:
+                # Retrieve the stored fractions of the dates in chunks below the variable limit of SQLite
+                for start in range(0, len(dates), 500):
+                    chunk = [date.isoformat() for date in dates[start:start + 500]]
+                    rows.extend(self._connection.execute(
+                        f"SELECT date, fraction FROM clouds WHERE aoi = ? AND probability = ? AND scale = ? AND date IN ({','.join('?' * len(chunk))})",
+                        (aoi, self.probability, self.scale, *chunk)
+                    ).fetchall())
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not read cloud screen. error: {e}")
+
+        fractions = {datetime.datetime.fromisoformat(date): fraction for date, fraction in rows}
+        missing = [date for date in dates if date not in fractions]
+        if not missing:
+            return {date: fractions[date] for date in dates}
+
+        # Fetch the fractions of the missing dates together
+        fetched = self.fetcher(geometry, missing, self.probability, self.scale)
+        fractions.update(zip(missing, fetched))
+
+        # Store the fetched fractions except for the recent dates that have not settled
+        now = time.time()
+        settled = datetime.datetime.utcnow() - datetime.timedelta(days=self.settle)
+        rows = [
+            (aoi, date.isoformat(), self.probability, self.scale, fraction, now)
+            for date, fraction in zip(missing, fetched) if date < settled
+        ]
+        if not rows:
+            return {date: fractions[date] for date in dates}
+
+        try:
+            with self._lock:
+                self._connection.executemany("INSERT OR REPLACE INTO clouds VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not update cloud screen. error: {e}")
+
+        return {date: fractions[date] for date in dates}
+
+    @instrumentation.instrumented
+    def screen(self, geometry: ee.Geometry, dates: typing.Sequence[datetime.datetime], maxcloud: float) -> typing.List[datetime.datetime]:
+        """
+        A method that returns the dates with a cloud fraction of at most 'maxcloud' in their given order.
+        Dates without acquisitions are dropped.
+        """
+        fractions = self.fractions(geometry, dates)
+        return [date for date in dates if fractions[date] is not None and fractions[date] <= maxcloud]
+
+    @instrumentation.instrumented
+    def rank(self, geometry: ee.Geometry, dates: typing.Sequence[datetime.datetime], maxcloud: float = 1.0) -> typing.List[datetime.datetime]:
+        """
+        A method that returns the dates with a cloud fraction of at most 'maxcloud' ordered from the clearest to the
+        cloudiest. Dates with the same fraction keep their given order and dates without acquisitions are dropped.
+        """
+        fractions = self.fractions(geometry, dates)
+        dates = [date for date in dates if fractions[date] is not None and fractions[date] <= maxcloud]
+        return sorted(dates, key=lambda date: fractions[date])
+
+    @instrumentation.instrumented
+    def check(self, geometry: ee.Geometry, date: datetime.datetime, maxcloud: float):
+        """ A method that raises a RuntimeError if the geometry has no acquisitions or a cloud fraction above 'maxcloud' on the date. """
+        fraction = self.fractions(geometry, [date])[date]
+        if fraction is None:
+            raise RuntimeError(f"could not screen date. there are no acquisitions on {date.isoformat()}.")
+        if fraction > maxcloud:
+            raise RuntimeError(f"could not screen date. cloud fraction of {fraction:.2f} on {date.isoformat()} exceeds {maxcloud:.2f}.")
+
+
+# The default cloud screen used by the spectral module
+_cloudscreen = None
+_cloudscreenlock = threading.Lock()
+
+def get_cloudscreen() -> CloudScreen:
+    """ A function that returns the default CloudScreen. It is created on first use with the default on-disk database unless one was set with 'set_cloudscreen'. """
+    global _cloudscreen
+    with _cloudscreenlock:
+        if _cloudscreen is None:
+            _cloudscreen = CloudScreen()
+
+        return _cloudscreen
+
+def set_cloudscreen(cloudscreen: typing.Optional[CloudScreen]):
+    """ A function that replaces the default CloudScreen. Passing None resets it to be recreated on next use. """
+    global _cloudscreen
+    with _cloudscreenlock:
+        _cloudscreen = cloudscreen
@@ -0,0 +1,122 @@
+"""
+Terrarium Package
+
+The dateindex module contains the acquisition date index that persists
+the known acquisition days of every AOI and refreshes them incrementally.
+"""
+from __future__ import annotations
+
+import typing
+import sqlite3
+import datetime
+import threading
+
+from . import lazyload
+from . import caching
+from . import spatial
+from . import temporal
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+@instrumentation.instrumented
+def fetch_acquisitiondays(geometry: ee.Geometry, since: typing.Optional[datetime.datetime], collection: str = "COPERNICUS/S2_SR") -> typing.List[datetime.datetime]:
+    """
+    A function that returns the unique acquisition days of the images in an Earth Engine collection
+    that intersect the given geometry. Only images acquired on or after 'since' are considered if it is given.
+    """
+    try:
+        # Filter the collection for the geometry
+        images = ee.ImageCollection(collection).filterBounds(geometry)
+        # Filter the collection for the images acquired since the given day
+        if since is not None:
+            millis = int(since.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+            images = images.filter(ee.Filter.gte("system:time_start", millis))
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create filtered collection. {e}")
+
+    # Retrieve the unique days deduplicated on the server
+    return temporal.generate_earthenginecollection_daylist(images)
+
+
+class AcquisitionIndex:
+    """
+    A class that stores the known acquisition days of every AOI in an SQLite database.
+
+    AOIs are keyed by the canonical hash of their geometry, so the same geometry is only fetched once
+    however it is referred to. 'refresh' only fetches the days after the last known day of an AOI, re-checking the last 'lookback'
+    days to pick up images that were ingested late, and 'query' answers date range queries from the
+    local index without any Earth Engine round trip. The days are fetched with 'fetcher', which is 
+    called with the geometry and the first day to fetch and defaults to 'fetch_acquisitiondays'.
+    The path defaults to 'acquisitions.sqlite' in the Terrarium cache directory.
+    """
+    def __init__(self, path: str = None, lookback: int = 2,
+                 fetcher: typing.Callable[[typing.Any, typing.Optional[datetime.datetime]], typing.List[datetime.datetime]] = fetch_acquisitiondays):
+        self.path = path or caching.generate_cachepath("acquisitions.sqlite")
+        self.lookback = lookback
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+
+        try:
+            # Open the database and create the acquisitions table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS acquisitions (aoi TEXT, day TEXT, PRIMARY KEY (aoi, day))")
+            self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open acquisition index. error: {e}")
+
+    def _get_lastdate(self, aoi: str) -> typing.Optional[datetime.datetime]:
+        """ A method that returns the last known acquisition day of the AOI with the given geometry hash or None if it has none. """
+        with self._lock:
+            row = self._connection.execute("SELECT MAX(day) FROM acquisitions WHERE aoi = ?", (aoi,)).fetchone()
+
+        return datetime.datetime.fromisoformat(row[0]) if row[0] else None
+
+    def get_lastdate(self, geometry: ee.Geometry) -> typing.Optional[datetime.datetime]:
+        """ A method that returns the last known acquisition day of the AOI of a geometry or None if it has none. """
+        return self._get_lastdate(spatial.generate_geometryhash(geometry))
+
+    @instrumentation.instrumented
+    def refresh(self, geometry: ee.Geometry) -> typing.List[datetime.datetime]:
+        """ A method that fetches the acquisition days of the AOI of a geometry after its last known day and returns the days that were new. """
+        aoi = spatial.generate_geometryhash(geometry)
+
+        # Start from the last known day with the lookback
+        lastdate = self._get_lastdate(aoi)
+        since = temporal.shift_date(lastdate, -self.lookback) if lastdate is not None else None
+
+        # Fetch the acquisition days
+        days = self.fetcher(geometry, since)
+
+        try:
+            with self._lock:
+                # Determine which of the days are not known yet
+                known = {row[0] for row in self._connection.execute(
+                    "SELECT day FROM acquisitions WHERE aoi = ? AND day >= ?", (aoi, since.date().isoformat() if since else "")
+                )}
+                new = sorted({day.date().isoformat() for day in days} - known)
+
+                # Store the new days
+                self._connection.executemany("INSERT OR IGNORE INTO acquisitions VALUES (?, ?)", [(aoi, day) for day in new])
+                self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not update acquisition index. error: {e}")
+
+        return [datetime.datetime.fromisoformat(day) for day in new]
+
+    @instrumentation.instrumented
+    def query(self, geometry: ee.Geometry, start: datetime.datetime = None, end: datetime.datetime = None) -> typing.List[datetime.datetime]:
+        """ A method that returns the known acquisition days of the AOI of a geometry between 'start' and 'end', both inclusive, in chronological order. """
+        aoi = spatial.generate_geometryhash(geometry)
+        startday = start.date().isoformat() if start is not None else ""
+        endday = end.date().isoformat() if end is not None else "9999-12-31"
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT day FROM acquisitions WHERE aoi = ? AND day >= ? AND day <= ? ORDER BY day", (aoi, startday, endday)
+            ).fetchall()
+
+        return [datetime.datetime.fromisoformat(row[0]) for row in rows]
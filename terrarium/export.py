@@ -3,13 +3,38 @@ Terrarium Package
 
 The export module contains functions for exporting acquisition assets
 """
-import ee
+from __future__ import annotations
 
-def export_image(image: ee.Image, bucket: str, name: str) -> ee.batch.Task:
+import re
+import typing
+
+from . import lazyload
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+def generate_taskdescription(name: str) -> str:
+    """
+    A function that returns a valid Earth Engine task description for a name. Characters that are not allowed
+    in descriptions, such as the slashes of an object path, are replaced and the description is cut to 100 characters.
+    """
+    return re.sub(r"[^A-Za-z0-9 .,:;_-]", "_", name)[:100] or "export"
+
+@instrumentation.instrumented
+def export_image(image: ee.Image, bucket: str, name: str, expression: dict = None, scale: float = 1, maxpixels: float = 1e10,
+                 region: ee.Geometry = None, crs: str = None, crstransform: typing.Sequence[float] = None,
+                 description: str = None) -> ee.batch.Task:
     """ 
     A function that creates an export task for the given Earth Engine Image.
     The image is exported to the 'terrascope-assets' bucket as a GeoTIFF with the given 
     name and cropped to the given Geometry at a 1m spatial resolution and a CRS of EPSG:4326.
+
+    A Cloud API encoded 'expression' of the image, such as the one held by a 'spectral.SpectralGraph',
+    can be given to be used by the task instead of serializing the image again when it is started.
+    The spatial resolution and the pixel limit of the export can be changed with 'scale' and 'maxpixels'.
+    The exported 'region' and 'crs' default to the geometry and projection of the image. An affine
+    'crstransform' pins the pixel grid of the export and replaces the 'scale', as for the chunks of 'tiledexport'.
+    The task 'description' defaults to the name, so tasks can be told apart in the task list.
     """
     # Define the export configuration
     exportconfig = {
@@ -17,32 +42,52 @@ def export_image(image: ee.Image, bucket: str, name: str) -> ee.batch.Task:
         "image": image,
 
         # Export Tranforms and Bounds
-        "scale": 1,
-        "region": image.geometry(),
-        "crs": image.projection().crs(),
+        "scale": scale,
+        "region": region if region is not None else image.geometry(),
+        "crs": crs if crs is not None else image.projection().crs(),
         
         # Destination Filename and Bucket
         "bucket": bucket,
         "fileNamePrefix": name,
 
         # Export Description
-        "description": f"export"[0:100],
+        "description": generate_taskdescription(description if description is not None else name),
         
         # Export Constraints
-        "maxPixels": 1e10,
+        "maxPixels": maxpixels,
         "skipEmptyTiles": True,
         "fileFormat": "GeoTIFF"
     }
 
+    # Pin the pixel grid of the export with the affine transform if one is given
+    if crstransform is not None:
+        del exportconfig["scale"]
+        exportconfig["crsTransform"] = list(crstransform)
+
     try:
         # Create an export task with the export configuration
         task = ee.batch.Export.image.toCloudStorage(**exportconfig)
+        # Use the pre-encoded image expression if one is given
+        if expression is not None:
+            task.config["expression"] = expression
+
         # Return the task
         return task
 
     except Exception as e:
         raise RuntimeError(f"could not create image export task. {e}.")
 
+@instrumentation.instrumented
+def export_native_image(image: ee.Image, bucket: str, name: str, expression: dict = None) -> ee.batch.Task:
+    """
+    A function that creates an export task for the given Earth Engine Image at the native 10m spatial
+    resolution of the Sentinel-2 bands, such as an image from 'spectral.generate_native_spectral_image'.
+    The export has a hundredth of the pixels of a 1m export and is intended to be upsampled locally 
+    with 'postprocess.postprocess_geotiff' after it is downloaded.
+    """
+    return export_image(image, bucket, name, expression, scale=10, maxpixels=1e8)
+
+@instrumentation.instrumented
 def get_taskstatus(operationid: str = None, taskid: str = None, project: str = None) -> dict:
     """
     A function that returns the status of an Earh Engine export task.
@@ -63,9 +108,121 @@ def get_taskstatus(operationid: str = None, taskid: str = None, project: str = N
 
     try:
         # Retrieve the task status from Earth Engine
-        status = ee.data.getOperation(operationid)
+        with instrumentation.roundtrip("earthengine", "getOperation"):
+            status = ee.data.getOperation(operationid)
         # Return the task status
         return status
 
     except Exception as e:
         raise RuntimeError(f"could not check task status. {e}.")
+
+# The number of operations per page of an operation listing
+LISTPAGESIZE = 100
+# The maximum number of pages of an operation listing that are read per project
+MAXLISTPAGES = 5
+# The number of operations up to which the statuses are retrieved individually instead of with a listing
+MAXLOOKUPS = 4
+
+def _generate_operationpages(projectpath: str) -> typing.Iterator[typing.List[dict]]:
+    """
+    A generator that yields the pages of the operation listing of a project, newest operations first, so the listing
+    can be stopped early. Falls back on the complete listing of 'ee.data.listOperations' as a single page if the
+    paged operations resource of the client is not available, such as in clients that do not expose it.
+    """
+    try:
+        operations = ee.data._get_cloud_projects().operations()
+        request = operations.list(pageSize=LISTPAGESIZE, name=projectpath)
+        execute = ee.data._execute_cloud_call
+    except Exception:
+        with instrumentation.roundtrip("earthengine", "listOperations"):
+            page = ee.data.listOperations(projectpath)
+        yield page
+        return
+
+    while request is not None:
+        with instrumentation.roundtrip("earthengine", "listOperations"):
+            response = execute(request)
+        yield response.get("operations", [])
+        request = operations.list_next(request, response)
+
+@instrumentation.instrumented
+def get_taskstatuses(operationids: typing.Sequence[str] = None, taskids: typing.Sequence[str] = None, project: str = None) -> typing.Dict[str, dict]:
+    """
+    A function that returns the statuses of many Earth Engine export tasks as a mapping of operation IDs to statuses.
+    Accepts the full operation IDs or accepts the task IDs and the project ID, the same as 'get_taskstatus'.
+
+    The statuses are retrieved from the operation listing of every project, which is read a page of 'LISTPAGESIZE'
+    operations at a time until every wanted operation is found or 'MAXLISTPAGES' pages have been read. Operations
+    that are missing from the listings and projects with at most 'MAXLOOKUPS' wanted operations are retrieved individually.
+    """
+    # Check if operation IDs are given
+    if not operationids:
+        # Check if task IDs and project ID are given
+        if not taskids or not project:
+            raise RuntimeError("could not check task statuses. task IDs and project ID must be specified if operation IDs are not.")
+
+        # Construct the operations identifiers from the project ID and task IDs
+        operationids = [f"projects/{project}/operations/{taskid}" for taskid in taskids]
+
+    # Group the operation IDs by their project path
+    projects = {}
+    for operationid in operationids:
+        projects.setdefault(operationid.split("/operations/")[0], set()).add(operationid)
+
+    try:
+        statuses = {}
+        # Read the listing of operations for every project with enough wanted operations
+        for projectpath, wanted in projects.items():
+            if len(wanted) <= MAXLOOKUPS:
+                continue
+
+            remaining = set(wanted)
+            for pagenumber, page in enumerate(_generate_operationpages(projectpath), 1):
+                for operation in page:
+                    if operation.get("name") in remaining:
+                        statuses[operation["name"]] = operation
+                        remaining.discard(operation["name"])
+
+                # Stop once every wanted operation is found or the page limit is reached
+                if not remaining or pagenumber >= MAXLISTPAGES:
+                    break
+
+        # Retrieve the operations missing from the listings
+        for operationid in operationids:
+            if operationid not in statuses:
+                with instrumentation.roundtrip("earthengine", "getOperation"):
+                    statuses[operationid] = ee.data.getOperation(operationid)
+
+        # Return the task statuses
+        return statuses
+
+    except Exception as e:
+        raise RuntimeError(f"could not check task statuses. {e}.")
+
+# A mapping of Earth Engine operation and task states to the normalized task states
+TASKSTATES = {
+    "PENDING": "PENDING", "READY": "PENDING", "UNSUBMITTED": "PENDING",
+    "RUNNING": "RUNNING", "CANCELLING": "RUNNING", "CANCEL_REQUESTED": "RUNNING",
+    "SUCCEEDED": "COMPLETED", "COMPLETED": "COMPLETED",
+    "FAILED": "FAILED",
+    "CANCELLED": "CANCELLED",
+}
+
+def generate_taskstate(status: dict) -> str:
+    """
+    A function that returns the normalized state of a task from its operation status as returned by 'get_taskstatus'.
+    The normalized states are 'PENDING', 'RUNNING', 'COMPLETED', 'FAILED' and 'CANCELLED'.
+    """
+    try:
+        # Retrieve the state from the operation metadata
+        state = status.get("metadata", {}).get("state")
+        # Fall back on the error and done flags of the operation
+        if state is None:
+            state = ("FAILED" if "error" in status else "SUCCEEDED") if status.get("done") else "PENDING"
+
+        return TASKSTATES[state]
+
+    except KeyError:
+        raise RuntimeError(f"could not check task state. unknown state: {state}.")
+    except Exception as e:
+        raise RuntimeError(f"could not check task state. {e}.")
@@ -0,0 +1,285 @@
+"""
+Terrarium Package
+
+The geocoding module contains the reverse geocoding subsystem used for
+resolving location addresses from coordinates. Lookups are cached on disk
+by geohash cell, deduplicated while in flight and dispatched to a pluggable backend.
+"""
+from __future__ import annotations
+
+import os
+import time
+import typing
+import sqlite3
+import threading
+import concurrent.futures
+
+from . import lazyload
+from . import caching
+from . import instrumentation
+
+googlemaps = lazyload.lazy_import("googlemaps")
+
+# The base32 alphabet used for geohash encoding
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def generate_geohash(longitude: float, latitude: float, precision: int = 5) -> str:
+    """
+    A function that returns the geohash cell of the given precision for a set of coordinates.
+    A precision of 5 corresponds to a cell of roughly 4.9km by 4.9km at the equator.
+    """
+    lonrange, latrange = [-180.0, 180.0], [-90.0, 90.0]
+    geohash, bits, bit, even = [], 0, 0, True
+
+    while len(geohash) < precision:
+        # Alternate between bisecting the longitude and latitude ranges
+        value, bounds = (longitude, lonrange) if even else (latitude, latrange)
+        middle = (bounds[0] + bounds[1]) / 2
+
+        if value >= middle:
+            bits = (bits << 1) | 1
+            bounds[0] = middle
+        else:
+            bits = bits << 1
+            bounds[1] = middle
+
+        even = not even
+        bit += 1
+
+        # Emit a character for every 5 bits accumulated
+        if bit == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit = 0, 0
+
+    return "".join(geohash)
+
+
+class GeocodingBackend:
+    """
+    A class that defines the interface for reverse geocoding backends.
+    Backends must implement 'reverse_geocode' and return the formatted address
+    for the coordinates or None if the coordinates could not be resolved.
+    """
+    def reverse_geocode(self, longitude: float, latitude: float) -> typing.Optional[str]:
+        raise NotImplementedError
+
+
+class GoogleMapsBackend(GeocodingBackend):
+    """
+    A class that resolves addresses with the Google Maps Geocoding API.
+    The Maps client is created once and reused for every lookup. The API key is
+    read from the 'MAPS_APIKEY' environment variable if it is not given.
+    """
+    def __init__(self, apikey: str = None):
+        try:
+            # Retrieve the Google Maps Geocoding API Key
+            apikey = apikey or os.environ['MAPS_APIKEY']
+            # Create the Google Maps Client
+            self.client = googlemaps.Client(key=apikey)
+
+        except KeyError:
+            raise RuntimeError(f"could not setup maps client. geocoding API key is not set in environment variables.")
+        except Exception as e:
+            raise RuntimeError(f"could not setup maps client. error: {e}")
+
+    def reverse_geocode(self, longitude: float, latitude: float) -> typing.Optional[str]:
+        # Perform a reverse geocode lookup for the coordinates
+        with instrumentation.roundtrip("maps", "reverseGeocode"):
+            result = self.client.reverse_geocode((latitude, longitude), language="English", location_type="APPROXIMATE", result_type=f"administrative_area_level_2")
+        # Retrieve the formatted address from the result
+        return result[0]["formatted_address"] if result else None
+
+
+class StubBackend(GeocodingBackend):
+    """
+    A class that resolves addresses locally with a callable that accepts the longitude
+    and latitude values. Intended to stand in for the Maps backend during tests.
+    The number of lookups performed is tracked in the 'calls' attribute.
+    """
+    def __init__(self, resolver: typing.Callable[[float, float], typing.Optional[str]]):
+        self.resolver = resolver
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reverse_geocode(self, longitude: float, latitude: float) -> typing.Optional[str]:
+        with self._lock:
+            self.calls += 1
+
+        return self.resolver(longitude, latitude)
+
+
+class GeocodeCache:
+    """
+    A class that persists resolved addresses in an SQLite database keyed by geohash cell.
+
+    Entries older than 'ttl' seconds are treated as misses and the least recently
+    used entries are evicted when the cache grows beyond 'capacity' entries.
+    The path defaults to 'geocoding.sqlite' in the Terrarium cache directory.
+    """
+    def __init__(self, path: str = None, capacity: int = 100000, ttl: float = 30 * 86400):
+        self.path = path or caching.generate_cachepath("geocoding.sqlite")
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        try:
+            # Open the database and create the cache table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes "
+                "(cell TEXT PRIMARY KEY, address TEXT, created REAL, accessed REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS geocodes_accessed ON geocodes (accessed)")
+            self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open geocode cache. error: {e}")
+
+    def get(self, cell: str) -> typing.Tuple[bool, typing.Optional[str]]:
+        """ A method that returns a tuple of a hit flag and the cached address for a geohash cell. """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT address, created FROM geocodes WHERE cell = ?", (cell,)).fetchone()
+            if row is None:
+                return False, None
+
+            # Drop the entry if it has outlived the TTL
+            if now - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM geocodes WHERE cell = ?", (cell,))
+                self._connection.commit()
+                return False, None
+
+            # Refresh the access time of the entry
+            self._connection.execute("UPDATE geocodes SET accessed = ? WHERE cell = ?", (now, cell))
+            self._connection.commit()
+            return True, row[0]
+
+    def put(self, cell: str, address: typing.Optional[str]):
+        """ A method that stores the address for a geohash cell and evicts the least recently used entries. """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)", (cell, address, now, now))
+
+            # Evict the least recently used entries beyond the capacity
+            count = self._connection.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+            if count > self.capacity:
+                self._connection.execute(
+                    "DELETE FROM geocodes WHERE cell IN (SELECT cell FROM geocodes ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.capacity,)
+                )
+
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+
+class Geocoder:
+    """
+    A class that resolves location addresses for coordinates with caching and deduplication.
+
+    Coordinates are quantized to a geohash cell of the given precision and every cell is
+    resolved at most once. Concurrent lookups for the same cell share a single backend call
+    and batch lookups only send cache misses to the backend on at most 'workers' threads.
+    """
+    def __init__(self, backend: GeocodingBackend, cache: GeocodeCache = None, precision: int = 5, workers: int = 8):
+        self.backend = backend
+        self.cache = cache
+        self.precision = precision
+        self.workers = workers
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @instrumentation.instrumented
+    def locate(self, longitude: float, latitude: float) -> str:
+        """ A method that returns the location address for a set of coordinates. """
+        cell = generate_geohash(longitude, latitude, self.precision)
+
+        # Check the cache for the geohash cell
+        if self.cache is not None:
+            hit, address = self.cache.get(cell)
+            if hit:
+                return address or "limbo"
+
+        with self._lock:
+            # Join the lookup for the cell if one is already in flight
+            future = self._inflight.get(cell)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[cell] = future
+
+        if not owner:
+            return future.result() or "limbo"
+
+        try:
+            # Resolve the address with the backend and cache it
+            address = self.backend.reverse_geocode(longitude, latitude)
+            if self.cache is not None:
+                self.cache.put(cell, address)
+
+            future.set_result(address)
+
+        except Exception as e:
+            future.set_exception(e)
+            raise
+
+        finally:
+            with self._lock:
+                self._inflight.pop(cell, None)
+
+        return address or "limbo"
+
+    @instrumentation.instrumented
+    def locate_many(self, points: typing.Sequence[typing.Tuple[float, float]]) -> typing.List[str]:
+        """ A method that returns the location addresses for a sequence of (longitude, latitude) points. """
+        # Group the points by their geohash cell
+        cells = [generate_geohash(lon, lat, self.precision) for lon, lat in points]
+        representatives = {}
+        for cell, point in zip(cells, points):
+            representatives.setdefault(cell, point)
+
+        addresses = {}
+        misses = []
+
+        # Resolve the cells that are already cached
+        for cell, point in representatives.items():
+            hit, address = self.cache.get(cell) if self.cache is not None else (False, None)
+            if hit:
+                addresses[cell] = address or "limbo"
+            else:
+                misses.append((cell, point))
+
+        # Resolve the cache misses concurrently
+        if misses:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, len(misses))) as executor:
+                futures = {cell: executor.submit(self.locate, *point) for cell, point in misses}
+                for cell, future in futures.items():
+                    addresses[cell] = future.result()
+
+        return [addresses[cell] for cell in cells]
+
+
+# The default geocoder used by the spatial module
+_geocoder = None
+_geocoderlock = threading.Lock()
+
+def get_geocoder() -> Geocoder:
+    """
+    A function that returns the default Geocoder. It is created on first use with the
+    Google Maps backend and the default on-disk cache unless one was set with 'set_geocoder'.
+    """
+    global _geocoder
+    with _geocoderlock:
+        if _geocoder is None:
+            _geocoder = Geocoder(GoogleMapsBackend(), GeocodeCache())
+
+        return _geocoder
+
+def set_geocoder(geocoder: typing.Optional[Geocoder]):
+    """ A function that replaces the default Geocoder. Passing None resets it to be recreated on next use. """
+    global _geocoder
+    with _geocoderlock:
+        _geocoder = geocoder
@@ -0,0 +1,209 @@
+"""
+Terrarium Package
+
+The ingestion module contains functions for streaming the features
+of large GeoJSON FeatureCollections with bounded memory.
+"""
+from __future__ import annotations
+
+import io
+import os
+import re
+import json
+import codecs
+import typing
+
+from . import lazyload
+
+ee = lazyload.lazy_import("ee")
+shapes = lazyload.lazy_import("shapely.geometry")
+
+# The pattern for JSON insignificant whitespace
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# The default number of bytes read from the source at a time
+CHUNKSIZE = 1 << 16
+
+class FeatureBatch(typing.NamedTuple):
+    """
+    A batch of geometries read from a GeoJSON FeatureCollection.
+
+    'geometries' contains the geometries that were constructed successfully and 'indices'
+    contains the position of each of them in the FeatureCollection. 'errors' contains a
+    tuple of the position and the error message for every feature that could not be read.
+    """
+    geometries: list
+    indices: typing.List[int]
+    errors: typing.List[typing.Tuple[int, str]]
+
+
+class _StreamBuffer:
+    """
+    A class that incrementally decodes JSON values from a stream. Only the unconsumed
+    part of the stream is held in memory and it is read in chunks as values are decoded.
+    """
+    def __init__(self, stream: typing.IO, chunksize: int):
+        self.stream = stream
+        self.chunksize = chunksize
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.jsondecoder = json.JSONDecoder()
+
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self, size: int = None) -> bool:
+        """ A method that reads the next chunk from the stream. Returns False if the stream is exhausted. """
+        if self.eof:
+            return False
+
+        data = self.stream.read(size or self.chunksize)
+        # Decode the data if the stream is binary
+        text = data if isinstance(data, str) else self.decoder.decode(data, final=not data)
+        if not data:
+            self.eof = True
+
+        # Discard the consumed part of the buffer and append the new data
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        """ A method that skips whitespace and returns the next character or an empty string at the end of the stream. """
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, characters: str) -> str:
+        """ A method that consumes the next character if it is one of the given characters. """
+        character = self.peek()
+        if not character or character not in characters:
+            raise RuntimeError(f"could not parse geojson. expected one of '{characters}' at '{character}'.")
+
+        self.position += 1
+        return character
+
+    def decode(self) -> typing.Any:
+        """ A method that decodes the next JSON value, reading more of the stream until it is complete. """
+        self.peek()
+        size = self.chunksize
+
+        while True:
+            try:
+                value, end = self.jsondecoder.raw_decode(self.buffer, self.position)
+                # Scalars that end with the buffer could continue in the next chunk
+                if end < len(self.buffer) or self.eof or isinstance(value, (dict, list, str)):
+                    self.position = end
+                    return value
+
+                self.fill(size)
+
+            except json.JSONDecodeError as e:
+                if not self.fill(size):
+                    raise RuntimeError(f"could not parse geojson. {e}.")
+
+                # Grow the reads with the value to keep retries linear
+                size = max(size, len(self.buffer))
+
+
+def _open_source(source: typing.Union[str, os.PathLike, bytes, typing.IO]) -> typing.Tuple[typing.IO, bool]:
+    """ A function that returns a readable stream for a source and whether it must be closed after reading. """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return open(source, "rb"), True
+        except OSError as e:
+            raise RuntimeError(f"could not open geojson file. {e}.")
+
+    if hasattr(source, "read"):
+        return source, False
+
+    raise RuntimeError("could not open geojson. source must be a file path, a file object or bytes.")
+
+def iterate_geojson_features(source: typing.Union[str, os.PathLike, bytes, typing.IO], chunksize: int = CHUNKSIZE) -> typing.Iterator[typing.Tuple[int, dict]]:
+    """
+    A function that yields the position and the mapping of every feature in a GeoJSON FeatureCollection.
+
+    The source can be a file path, a binary or text file object or a bytes string. It is read in chunks
+    of 'chunksize' bytes and only the feature being decoded is held in memory. Malformed JSON cannot be
+    recovered from and raises a RuntimeError after the features preceding it have been yielded.
+    """
+    stream, close = _open_source(source)
+
+    try:
+        reader = _StreamBuffer(stream, chunksize)
+        reader.expect("{")
+        if reader.peek() == "}":
+            raise RuntimeError("corrupt geojson. missing key: 'features'.")
+
+        while True:
+            # Decode the next top level key
+            key = reader.decode()
+            reader.expect(":")
+
+            if key != "features":
+                # Skip the values of other top level keys
+                reader.decode()
+                if reader.expect(",}") == "}":
+                    raise RuntimeError("corrupt geojson. missing key: 'features'.")
+                continue
+
+            reader.expect("[")
+            if reader.peek() == "]":
+                return
+
+            index = 0
+            while True:
+                # Decode and yield the next feature
+                yield index, reader.decode()
+                index += 1
+
+                if reader.expect(",]") == "]":
+                    return
+
+    finally:
+        if close:
+            stream.close()
+
+def _stream_geometries(source, constructor: typing.Callable[[dict], typing.Any], batchsize: int, chunksize: int) -> typing.Iterator[FeatureBatch]:
+    """ A function that yields batches of geometries constructed from the features of a GeoJSON FeatureCollection. """
+    batch = FeatureBatch([], [], [])
+
+    for index, feature in iterate_geojson_features(source, chunksize):
+        try:
+            geometry = constructor(feature["geometry"])
+            batch.geometries.append(geometry)
+            batch.indices.append(index)
+
+        except KeyError as e:
+            batch.errors.append((index, f"corrupt geojson feature. missing key: {e}."))
+        except TypeError:
+            batch.errors.append((index, "corrupt geojson feature. feature is not a mapping."))
+        except Exception as e:
+            batch.errors.append((index, f"could not construct geometry. {e}"))
+
+        # Yield the batch once it is full
+        if len(batch.geometries) + len(batch.errors) >= batchsize:
+            yield batch
+            batch = FeatureBatch([], [], [])
+
+    if batch.geometries or batch.errors:
+        yield batch
+
+def stream_shapes_fromgeojson(source: typing.Union[str, os.PathLike, bytes, typing.IO], batchsize: int = 1000, chunksize: int = CHUNKSIZE) -> typing.Iterator[FeatureBatch]:
+    """
+    A function that yields batches of Shapely Geometries for every feature in a GeoJSON FeatureCollection.
+    Each batch holds up to 'batchsize' features and reports the features that could not be read
+    in its 'errors' instead of aborting the load.
+    """
+    return _stream_geometries(source, shapes.shape, batchsize, chunksize)
+
+def stream_earthenginegeometries_fromgeojson(source: typing.Union[str, os.PathLike, bytes, typing.IO], batchsize: int = 1000, chunksize: int = CHUNKSIZE) -> typing.Iterator[FeatureBatch]:
+    """
+    A function that yields batches of Earth Engine Geometries for every feature in a GeoJSON FeatureCollection.
+    Each batch holds up to 'batchsize' features and reports the features that could not be read
+    in its 'errors' instead of aborting the load. The full GeoJSON geometry of every feature is used.
+    """
+    return _stream_geometries(source, ee.Geometry, batchsize, chunksize)
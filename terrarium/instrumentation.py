@@ -0,0 +1,320 @@
+"""
+Terrarium Package
+
+The instrumentation module contains the metrics and tracing layer of the package.
+Instrumented functions record their call counts, errors and latency histograms and
+external calls record round trips by backend and operation. Calls can be traced as
+spans with attributes such as the AOI and the spectral index.
+
+Instrumentation is disabled by default and can be enabled with 'enable' or with the
+'TERRARIUM_INSTRUMENTATION' environment variable set to '1', or to 'trace' to also
+record spans. While it is disabled the modules hold the original functions, so there
+is no overhead. References to functions taken before 'enable' is called are not swapped.
+"""
+import os
+import sys
+import time
+import bisect
+import typing
+import functools
+import itertools
+import threading
+import contextvars
+import collections
+
+# The upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+_enabled = os.environ.get("TERRARIUM_INSTRUMENTATION", "") in ("1", "trace")
+_tracing = os.environ.get("TERRARIUM_INSTRUMENTATION", "") == "trace"
+
+# The instrumented functions as tuples of their module, qualified name, original function and wrapper
+_functions = []
+
+def _swap(instrumented: bool):
+    """ A function that sets every instrumented function in its module or class to its wrapper or to the original function. """
+    for module, qualname, function, wrapper in _functions:
+        owner = sys.modules[module]
+        *parents, attribute = qualname.split(".")
+        for parent in parents:
+            owner = getattr(owner, parent)
+
+        setattr(owner, attribute, wrapper if instrumented else function)
+
+def enable(tracing: bool = False):
+    """ A function that enables the recording of metrics and, if 'tracing' is set, of spans. """
+    global _enabled, _tracing
+    _enabled, _tracing = True, tracing
+    _swap(True)
+
+def disable():
+    """ A function that disables the recording of metrics and spans. Recorded metrics are kept. """
+    global _enabled, _tracing
+    _enabled, _tracing = False, False
+    _swap(False)
+
+def is_enabled() -> bool:
+    """ A function that returns whether metrics are being recorded. """
+    return _enabled
+
+
+class Histogram:
+    """ A class that counts observed latencies into the buckets of 'BUCKETS' along with their count and sum. """
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """ A method that records an observed latency in seconds. """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> typing.List[typing.Tuple[float, int]]:
+        """ A method that returns the cumulative counts of every bucket as (upper bound, count) tuples. """
+        return list(zip(BUCKETS, itertools.accumulate(self.counts)))
+
+
+class Span(typing.NamedTuple):
+    """ A class that represents a finished span with its parent, attributes, start time, duration and error flag. """
+    name: str
+    spanid: int
+    parentid: typing.Optional[int]
+    attributes: dict
+    start: float
+    duration: float
+    error: bool
+
+
+class Registry:
+    """
+    A class that holds the recorded metrics and the most recent 'spancapacity' spans.
+    Every finished span is also passed to the hooks added with 'add_spanhook'.
+    """
+    def __init__(self, spancapacity: int = 1000):
+        self.calls = {}
+        self.roundtrips = {}
+        self.spans = collections.deque(maxlen=spancapacity)
+        self.spanhooks = []
+        self._lock = threading.Lock()
+
+    def _record(self, metrics: dict, key: typing.Hashable, duration: float, error: bool):
+        with self._lock:
+            entry = metrics.get(key)
+            if entry is None:
+                entry = metrics[key] = [0, Histogram()]
+
+            entry[0] += error
+            entry[1].observe(duration)
+
+    def record_call(self, name: str, duration: float, error: bool):
+        """ A method that records a call of an instrumented function. """
+        self._record(self.calls, name, duration, error)
+
+    def record_roundtrip(self, backend: str, operation: str, duration: float, error: bool):
+        """ A method that records a round trip to an external backend. """
+        self._record(self.roundtrips, (backend, operation), duration, error)
+
+    def record_span(self, span: Span):
+        """ A method that stores a finished span and passes it to the span hooks. """
+        self.spans.append(span)
+        for hook in self.spanhooks:
+            hook(span)
+
+    def add_spanhook(self, hook: typing.Callable[[Span], None]):
+        """ A method that adds a callable that is called with every finished span, such as an exporter to a tracing backend. """
+        self.spanhooks.append(hook)
+
+    def reset(self):
+        """ A method that clears every recorded metric and span. """
+        with self._lock:
+            self.calls.clear()
+            self.roundtrips.clear()
+            self.spans.clear()
+
+# The registry of the process
+registry = Registry()
+
+# The identifier of the span that is active in the current context
+_currentspan = contextvars.ContextVar("terrarium_span", default=None)
+_spanids = itertools.count(1)
+
+
+class _Noop:
+    """ A class of the shared context manager returned when instrumentation is disabled. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def set(self, key: str, value: typing.Any):
+        pass
+
+_NOOP = _Noop()
+
+
+class _ActiveSpan:
+    """ A class of the context manager that times a span and records it when it exits. """
+    __slots__ = ("name", "attributes", "spanid", "parentid", "start", "_started", "_token")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.spanid = next(_spanids)
+        self.parentid = _currentspan.get()
+        self._token = _currentspan.set(self.spanid)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exctype, *exc) -> bool:
+        duration = time.perf_counter() - self._started
+        _currentspan.reset(self._token)
+        registry.record_span(Span(self.name, self.spanid, self.parentid, self.attributes, self.start, duration, exctype is not None))
+        return False
+
+    def set(self, key: str, value: typing.Any):
+        """ A method that sets an attribute of the span. """
+        self.attributes[key] = value
+
+
+class _RoundTrip:
+    """ A class of the context manager that times a round trip to an external backend. """
+    __slots__ = ("backend", "operation", "span", "_started")
+
+    def __init__(self, backend: str, operation: str):
+        self.backend = backend
+        self.operation = operation
+        self.span = _ActiveSpan(f"{backend}.{operation}", {"backend": backend}) if _tracing else None
+
+    def __enter__(self):
+        if self.span is not None:
+            self.span.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exctype, *exc) -> bool:
+        registry.record_roundtrip(self.backend, self.operation, time.perf_counter() - self._started, exctype is not None)
+        if self.span is not None:
+            self.span.__exit__(exctype, *exc)
+        return False
+
+    def set(self, key: str, value: typing.Any):
+        if self.span is not None:
+            self.span.set(key, value)
+
+def span(name: str, **attributes) -> typing.ContextManager:
+    """
+    A function that returns a context manager that records a span with the given attributes when tracing is enabled.
+    Attributes can be added while the span is active with its 'set' method. Spans opened inside it are its children.
+    """
+    return _ActiveSpan(name, attributes) if _tracing else _NOOP
+
+def roundtrip(backend: str, operation: str) -> typing.ContextManager:
+    """ A function that returns a context manager that records a round trip to an external backend such as 'earthengine' or 'maps'. """
+    return _RoundTrip(backend, operation) if _enabled else _NOOP
+
+def instrumented(function: typing.Callable = None, *, name: str = None) -> typing.Callable:
+    """
+    A function that decorates a function to record its calls, errors and latencies while instrumentation is
+    enabled, and a span for every call while tracing is enabled. The metric name defaults to the name of the
+    module and the qualified name of the function, such as 'spatial.reshape_point'.
+
+    The decorator returns the original function while instrumentation is disabled and the wrapper is
+    swapped in by 'enable'. Only module level functions and methods of module level classes can be swapped.
+    """
+    def decorator(function: typing.Callable) -> typing.Callable:
+        label = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            active = _ActiveSpan(label, {}) if _tracing else _NOOP
+            started, error = time.perf_counter(), True
+            with active:
+                try:
+                    result = function(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    registry.record_call(label, time.perf_counter() - started, error)
+
+        _functions.append((function.__module__, function.__qualname__, function, wrapper))
+        return wrapper if _enabled else function
+
+    return decorator(function) if function is not None else decorator
+
+def _generate_histogram(histogram: Histogram) -> dict:
+    """ A function that returns the count, sum and cumulative buckets of a histogram as a mapping. """
+    return {
+        "count": histogram.count,
+        "sum": histogram.sum,
+        "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for bound, count in histogram.cumulative()},
+    }
+
+def snapshot() -> dict:
+    """
+    A function that returns a copy of the recorded metrics and spans.
+
+    'calls' maps the name of every instrumented function and 'roundtrips' maps every 'backend.operation'
+    to its count, errors, total seconds and cumulative latency buckets. 'spans' lists the recent spans.
+    """
+    with registry._lock:
+        calls = {name: dict(errors=entry[0], **_generate_histogram(entry[1])) for name, entry in registry.calls.items()}
+        roundtrips = {
+            f"{backend}.{operation}": dict(backend=backend, operation=operation, errors=entry[0], **_generate_histogram(entry[1]))
+            for (backend, operation), entry in registry.roundtrips.items()
+        }
+        spans = [span._asdict() for span in registry.spans]
+
+    return {"enabled": _enabled, "tracing": _tracing, "calls": calls, "roundtrips": roundtrips, "spans": spans}
+
+def reset():
+    """ A function that clears every recorded metric and span. """
+    registry.reset()
+
+def _escape(value: str) -> str:
+    """ A function that escapes a Prometheus label value. """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def export_prometheus(prefix: str = "terrarium") -> str:
+    """ A function that returns the recorded metrics in the Prometheus text exposition format. """
+    metrics = snapshot()
+    lines = []
+
+    def family(name: str, kind: str, description: str, entries: typing.List[typing.Tuple[str, dict]], field: str = None):
+        lines.append(f"# HELP {prefix}_{name} {description}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, entry in entries:
+            if kind == "histogram":
+                for bound, count in entry["buckets"].items():
+                    lines.append(f"{prefix}_{name}_bucket{{{labels},le=\"{bound}\"}} {count}")
+                lines.append(f"{prefix}_{name}_sum{{{labels}}} {entry['sum']}")
+                lines.append(f"{prefix}_{name}_count{{{labels}}} {entry['count']}")
+            else:
+                lines.append(f"{prefix}_{name}{{{labels}}} {entry[field]}")
+
+    calls = [(f"function=\"{_escape(name)}\"", entry) for name, entry in sorted(metrics["calls"].items())]
+    roundtrips = [
+        (f"backend=\"{_escape(entry['backend'])}\",operation=\"{_escape(entry['operation'])}\"", entry)
+        for _, entry in sorted(metrics["roundtrips"].items())
+    ]
+
+    family("calls_total", "counter", "The number of calls of every instrumented function.", calls, "count")
+    family("call_errors_total", "counter", "The number of calls of every instrumented function that raised.", calls, "errors")
+    family("call_duration_seconds", "histogram", "The latency of every instrumented function.", calls)
+    family("roundtrips_total", "counter", "The number of round trips to every external backend.", roundtrips, "count")
+    family("roundtrip_errors_total", "counter", "The number of round trips to every external backend that failed.", roundtrips, "errors")
+    family("roundtrip_duration_seconds", "histogram", "The latency of the round trips to every external backend.", roundtrips)
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+"""
+Terrarium Package
+
+The lazyload module contains the helper used by the other modules to defer
+importing their heavy dependencies, such as the Earth Engine API, NumPy,
+Shapely and PyProj, until they are first used.
+"""
+import sys
+import types
+import importlib
+import threading
+
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    A class of the placeholder for a module that is imported on the first access of one of its attributes.
+
+    When the module is imported, the placeholder replaces itself with the module in the namespace
+    that it was created in, so later accesses go directly to the module without any overhead.
+    """
+    def __init__(self, name: str, namespace: dict):
+        super().__init__(name)
+        self.__dict__["_namespace"] = namespace
+
+    def _load(self) -> types.ModuleType:
+        """ A method that imports the module and replaces the placeholder with it in its namespace. """
+        module = importlib.import_module(self.__name__)
+        with _lock:
+            namespace = self.__dict__["_namespace"]
+            for key, value in list(namespace.items()):
+                if value is self:
+                    namespace[key] = module
+
+        return module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    A function that returns a placeholder for the module with the given name that imports it on first use.
+    The module is returned directly if it is already imported. The placeholder must be assigned to a global
+    of the calling module, such as "ee = lazyload.lazy_import('ee')" in place of "import ee".
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name, sys._getframe(1).f_globals)
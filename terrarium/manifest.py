@@ -0,0 +1,305 @@
+"""
+Terrarium Package
+
+The manifest module contains the content addressed export manifest that deduplicates
+image exports. Exports are keyed by a hash of their serialized image graph and export
+parameters, and an export that matches a finished or running one is skipped or joined.
+"""
+from __future__ import annotations
+
+import json
+import time
+import typing
+import hashlib
+import sqlite3
+import threading
+
+from . import lazyload
+from . import caching
+from . import scheduler
+from . import tiledexport
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+# The states of an export that is still in progress
+ACTIVESTATES = ("PENDING", "RUNNING")
+
+def generate_exportkey(payload: str, bucket: str, options: dict = None) -> str:
+    """
+    A function that returns the content hash of an export as a hexadecimal SHA-256 digest. The hash covers the
+    Cloud API serialized graph of the image, the bucket and the export 'options' as accepted by 'export.export_image',
+    but not the name of the export. The graph and the options are hashed in a canonical form with sorted keys.
+    """
+    try:
+        document = {"payload": json.loads(payload), "bucket": bucket, "options": options or {}}
+        canonical = json.dumps(document, sort_keys=True, separators=(",", ":"))
+
+    except (TypeError, ValueError) as e:
+        raise RuntimeError(f"could not generate export key. error: {e}")
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ManifestEntry(typing.NamedTuple):
+    """
+    A class that represents an export in the manifest. The 'path' is the Cloud Storage path of the exported GeoTIFF,
+    whose name is the prefix of the files of an export that Earth Engine split into several files. 'state' is one of
+    'PENDING', 'RUNNING', 'COMPLETED', 'FAILED' or 'CANCELLED' and the 'taskid' is None until the task is started.
+    """
+    key: str
+    bucket: str
+    name: str
+    path: str
+    taskid: typing.Optional[str]
+    state: str
+    created: float
+    updated: float
+
+
+class ExportManifest:
+    """
+    A class that persists the exports by content hash in an SQLite database.
+    The path defaults to 'manifest.sqlite' in the Terrarium cache directory.
+
+    Entries are changed with 'replace', which only applies when the entry of the key is still the one that the
+    change was based on, so processes that share the manifest cannot both claim the same export.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or caching.generate_cachepath("manifest.sqlite")
+        self._lock = threading.Lock()
+
+        try:
+            # Open the database and create the exports table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS exports "
+                "(key TEXT PRIMARY KEY, bucket TEXT, name TEXT, path TEXT, taskid TEXT, state TEXT, created REAL, updated REAL)"
+            )
+            self._connection.commit()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open export manifest. error: {e}")
+
+    def get(self, key: str) -> typing.Optional[ManifestEntry]:
+        """ A method that returns the entry of an export key or None if it is not in the manifest. """
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM exports WHERE key = ?", (key,)).fetchone()
+            return ManifestEntry(*row) if row else None
+
+    def replace(self, entry: ManifestEntry, previous: ManifestEntry = None) -> bool:
+        """
+        A method that stores an entry if the current entry of its key is 'previous', or if the key is not in the
+        manifest when 'previous' is None. Returns whether the entry was stored.
+        """
+        with self._lock:
+            try:
+                if previous is None:
+                    cursor = self._connection.execute("INSERT OR IGNORE INTO exports VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entry)
+                else:
+                    cursor = self._connection.execute(
+                        "UPDATE exports SET bucket = ?, name = ?, path = ?, taskid = ?, state = ?, created = ?, updated = ? "
+                        "WHERE key = ? AND state = ? AND taskid IS ? AND created = ? AND updated = ?",
+                        (*entry[1:], entry.key, previous.state, previous.taskid, previous.created, previous.updated)
+                    )
+                self._connection.commit()
+
+            except sqlite3.Error as e:
+                raise RuntimeError(f"could not update export manifest. error: {e}")
+
+            return cursor.rowcount == 1
+
+    def remove(self, entry: ManifestEntry) -> bool:
+        """ A method that removes an entry if it is still the current entry of its key. Returns whether it was removed. """
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM exports WHERE key = ? AND state = ? AND taskid IS ? AND created = ? AND updated = ?",
+                (entry.key, entry.state, entry.taskid, entry.created, entry.updated)
+            )
+            self._connection.commit()
+            return cursor.rowcount == 1
+
+    def entries(self, states: typing.Sequence[str] = None) -> typing.List[ManifestEntry]:
+        """ A method that returns the entries of the manifest in order of creation, optionally only those in the given states. """
+        with self._lock:
+            if states:
+                rows = self._connection.execute(
+                    f"SELECT * FROM exports WHERE state IN ({', '.join('?' * len(states))}) ORDER BY created", tuple(states)
+                ).fetchall()
+            else:
+                rows = self._connection.execute("SELECT * FROM exports ORDER BY created").fetchall()
+
+            return [ManifestEntry(*row) for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM exports").fetchone()[0]
+
+
+class ExportOutcome(typing.NamedTuple):
+    """
+    A class that represents the outcome of a deduplicated export. 'action' is 'STARTED' if a new task was started,
+    'JOINED' if a matching export is still in progress and 'SKIPPED' if a matching export has already finished. The
+    'path' is that of the matching export, which may have been submitted under another name.
+    """
+    key: str
+    path: str
+    taskid: typing.Optional[str]
+    state: str
+    action: str
+
+
+class ExportDeduplicator:
+    """
+    A class that starts image exports on a task backend unless a matching export is already in the manifest.
+
+    The 'backend' is a 'scheduler.ExportBackend', such as 'scheduler.EarthEngineBackend' or 'scheduler.LocalBackend'
+    as a stand-in. If a 'storage' backend from 'tiledexport' is given, the files of completed exports are checked
+    for and exports whose files were deleted are started again. Failed and cancelled exports are started again
+    and an export that was claimed but never started is considered abandoned after 'staletimeout' seconds.
+
+    Started tasks are described with their export key, so duplicates can also be told apart in the task list.
+    """
+    def __init__(self, backend: scheduler.ExportBackend, manifest: ExportManifest = None, storage: tiledexport.StorageBackend = None,
+                 staletimeout: float = 3600.0, clock: typing.Callable[[], float] = time.time):
+        self.backend = backend
+        self.manifest = manifest if manifest is not None else ExportManifest()
+        self.storage = storage
+        self.staletimeout = staletimeout
+        self.clock = clock
+
+        self.counters = {"started": 0, "joined": 0, "skipped": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str):
+        """ A method that increments one of the counters of the deduplicator. """
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _refresh(self, entry: ManifestEntry) -> ManifestEntry:
+        """ A method that updates an entry in progress with the state of its task and returns the current entry. """
+        if entry.state not in ACTIVESTATES:
+            return entry
+
+        if entry.taskid is None:
+            # Give up on claims whose task was never started
+            if self.clock() - entry.updated <= self.staletimeout:
+                return entry
+            state = "FAILED"
+        else:
+            try:
+                state = self.backend.status(entry.taskid)
+            except Exception:
+                # Keep the entry as is if the backend cannot be reached
+                return entry
+
+        if state == entry.state:
+            return entry
+
+        updated = entry._replace(state=state, updated=self.clock())
+        if self.manifest.replace(updated, entry):
+            return updated
+        # Another process changed the entry in the meantime
+        return self.manifest.get(entry.key) or updated
+
+    def _exists(self, entry: ManifestEntry) -> bool:
+        """ A method that returns whether the files of a completed export are still in storage. Always True without a storage backend. """
+        if self.storage is None:
+            return True
+
+        try:
+            return bool(tiledexport.get_exportfiles(self.storage, entry.bucket, entry.name))
+        except Exception:
+            # Trust the manifest if the storage cannot be reached
+            return True
+
+    @instrumentation.instrumented
+    def submit(self, payload: str, bucket: str, name: str, options: dict = None) -> ExportOutcome:
+        """
+        A method that exports a serialized image graph, such as 'spectral.SpectralGraph.serialized', to a bucket with
+        the given name unless a matching export is in progress or finished. The 'options' are passed on to
+        'export.export_image' by the backend and must be JSON serializable, with the 'region' given as GeoJSON.
+        """
+        key = generate_exportkey(payload, bucket, options)
+
+        # The manifest is only changed with conditional replaces, so no lock is held across calls to the backend
+        while True:
+            # Join or skip the matching export if it is in progress or finished
+            previous = self.manifest.get(key)
+            if previous is not None:
+                previous = self._refresh(previous)
+                if previous.state in ACTIVESTATES:
+                    self._count("joined")
+                    return ExportOutcome(key, previous.path, previous.taskid, previous.state, "JOINED")
+                if previous.state == "COMPLETED" and self._exists(previous):
+                    self._count("skipped")
+                    return ExportOutcome(key, previous.path, previous.taskid, previous.state, "SKIPPED")
+
+            # Claim the export, retrying if another thread or process claimed it first
+            now = self.clock()
+            claim = ManifestEntry(key, bucket, name, f"gs://{bucket}/{name}.tif", None, "PENDING", now, now)
+            if self.manifest.replace(claim, previous):
+                break
+
+        try:
+            # Start the task with the export key as its description
+            options = {**(options or {}), "description": f"terrarium-{key}"}
+            job = scheduler.ExportJob(0, name, bucket, payload, options=json.dumps(options))
+            taskid = self.backend.start(job)
+
+        except Exception as e:
+            # Release the claim so the export can be attempted again
+            self.manifest.remove(claim)
+            raise RuntimeError(f"could not start export. error: {e}")
+
+        entry = claim._replace(taskid=taskid, state="RUNNING", updated=self.clock())
+        self.manifest.replace(entry, claim)
+        self._count("started")
+        return ExportOutcome(key, entry.path, taskid, entry.state, "STARTED")
+
+    def submit_image(self, image: ee.Image, bucket: str, name: str, options: dict = None) -> ExportOutcome:
+        """ A method that exports an Earth Engine Image unless a matching export is in progress or finished. Refer to 'submit'. """
+        try:
+            payload = image.serialize(for_cloud_api=True)
+        except Exception as e:
+            raise RuntimeError(f"could not serialize image. {e}.")
+
+        return self.submit(payload, bucket, name, options)
+
+    def get_export(self, key: str) -> typing.Optional[ManifestEntry]:
+        """ A method that returns the entry of an export key with the state of its task refreshed, or None if it is not in the manifest. """
+        entry = self.manifest.get(key)
+        return self._refresh(entry) if entry is not None else None
+
+    @instrumentation.instrumented
+    def refresh(self) -> typing.List[ManifestEntry]:
+        """
+        A method that refreshes the states of every export in progress with a single status request to the backend
+        and returns their entries. Exports whose tasks are missing from the response are left as they are.
+        """
+        entries = self.manifest.entries(ACTIVESTATES)
+        taskids = [entry.taskid for entry in entries if entry.taskid is not None]
+
+        try:
+            states = self.backend.statuses(taskids) if taskids else {}
+        except Exception as e:
+            raise RuntimeError(f"could not refresh exports. error: {e}")
+
+        refreshed = []
+        for entry in entries:
+            state = states.get(entry.taskid, entry.state) if entry.taskid is not None else entry.state
+            if entry.taskid is None and self.clock() - entry.updated > self.staletimeout:
+                state = "FAILED"
+
+            if state != entry.state:
+                updated = entry._replace(state=state, updated=self.clock())
+                entry = updated if self.manifest.replace(updated, entry) else (self.manifest.get(entry.key) or updated)
+            refreshed.append(entry)
+
+        return refreshed
+
+    def metrics(self) -> dict:
+        """ A method that returns a mapping of the counters of started, joined and skipped exports and the number of exports in the manifest. """
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "exports": len(self.manifest)}
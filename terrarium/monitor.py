@@ -0,0 +1,192 @@
+"""
+Terrarium Package
+
+The monitor module contains the task monitor that polls the statuses
+of many export tasks in bulk and reports their state transitions.
+"""
+import time
+import typing
+import asyncio
+import threading
+
+from . import export
+
+# The normalized task states that will not change anymore
+TERMINALSTATES = ("COMPLETED", "FAILED", "CANCELLED")
+
+class StatusBackend:
+    """
+    A class that defines the interface for task status backends. Backends must implement
+    'fetch' which returns a mapping of the given operation IDs to their operation statuses.
+    """
+    def fetch(self, operationids: typing.Sequence[str]) -> typing.Dict[str, dict]:
+        raise NotImplementedError
+
+
+class EarthEngineStatusBackend(StatusBackend):
+    """ A class that retrieves operation statuses from Earth Engine with a bounded listing per project. """
+    def fetch(self, operationids: typing.Sequence[str]) -> typing.Dict[str, dict]:
+        return export.get_taskstatuses(operationids=list(operationids))
+
+
+class LocalStatusBackend(StatusBackend):
+    """
+    A class that replays scripted operation states. Intended to stand in for Earth Engine during tests.
+
+    'timelines' maps each operation ID to the list of states it reports on successive fetches, the last
+    state is repeated once the timeline is exhausted. The number of fetches is tracked in 'calls'.
+    """
+    def __init__(self, timelines: typing.Dict[str, typing.List[str]]):
+        self.timelines = timelines
+        self.calls = 0
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, operationids: typing.Sequence[str]) -> typing.Dict[str, dict]:
+        with self._lock:
+            self.calls += 1
+            statuses = {}
+            for operationid in operationids:
+                step = self._steps.get(operationid, 0)
+                timeline = self.timelines[operationid]
+                state = timeline[min(step, len(timeline) - 1)]
+                self._steps[operationid] = step + 1
+
+                statuses[operationid] = {
+                    "name": operationid,
+                    "metadata": {"state": state},
+                    "done": state in ("SUCCEEDED", "FAILED", "CANCELLED"),
+                }
+
+            return statuses
+
+
+class TaskMonitor:
+    """
+    A class that monitors the statuses of export tasks.
+
+    Statuses are fetched in bulk from the backend and cached for 'ttl' seconds so that several
+    consumers of the same monitor do not poll the same operation. Each task is polled at an
+    interval that grows with its age, from 'mininterval' to 'maxinterval' seconds, and pending
+    tasks are polled half as often as running ones.
+
+    Finished tasks are forgotten once their status has been returned, and tasks that have not been
+    polled for twice the maximum interval are considered abandoned and forgotten as well, so the
+    monitor only holds the tasks that are still being watched.
+    """
+    def __init__(self, backend: StatusBackend = None, ttl: float = 5.0, mininterval: float = 5.0, maxinterval: float = 120.0,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        self.backend = backend or EarthEngineStatusBackend()
+        self.ttl = ttl
+        self.mininterval = mininterval
+        self.maxinterval = maxinterval
+        self.clock = clock
+
+        self._cache = {}
+        self._firstseen = {}
+        self._lastseen = {}
+        self._pruned = clock()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        """ A method that forgets the expired statuses and the tasks that have not been polled for twice the maximum interval. """
+        if now - self._pruned < self.maxinterval:
+            return
+        self._pruned = now
+
+        for operationid, (cachedat, _) in list(self._cache.items()):
+            if now - cachedat >= self.ttl:
+                del self._cache[operationid]
+        for operationid, lastseen in list(self._lastseen.items()):
+            if now - lastseen > 2 * self.maxinterval:
+                self._forget(operationid)
+
+    def _forget(self, operationid: str):
+        """ A method that removes every entry of a task. """
+        self._cache.pop(operationid, None)
+        self._firstseen.pop(operationid, None)
+        self._lastseen.pop(operationid, None)
+
+    def get_statuses(self, operationids: typing.Sequence[str]) -> typing.Dict[str, dict]:
+        """ A method that returns a mapping of operation IDs to statuses. Only the statuses not in the cache are fetched. """
+        now = self.clock()
+        statuses, missing = {}, []
+
+        with self._lock:
+            self._prune(now)
+            for operationid in operationids:
+                self._firstseen.setdefault(operationid, now)
+                self._lastseen[operationid] = now
+                cached = self._cache.get(operationid)
+                if cached is not None and now - cached[0] < self.ttl:
+                    statuses[operationid] = cached[1]
+                else:
+                    missing.append(operationid)
+
+        if missing:
+            try:
+                # Fetch the missing statuses in a single call
+                fetched = self.backend.fetch(missing)
+            except RuntimeError:
+                raise
+            except Exception as e:
+                raise RuntimeError(f"could not check task statuses. {e}.")
+
+            with self._lock:
+                for operationid, status in fetched.items():
+                    # Forget finished operations, their status is returned but will not change anymore
+                    if status.get("done"):
+                        self._forget(operationid)
+                    else:
+                        self._cache[operationid] = (now, status)
+
+            statuses.update(fetched)
+
+        return statuses
+
+    def get_interval(self, operationid: str, state: str) -> float:
+        """ A method that returns the number of seconds to wait before polling a task again given its current state. """
+        age = self.clock() - self._firstseen.get(operationid, self.clock())
+        # Poll young tasks frequently and back off as they age
+        interval = age / 10
+        if state == "PENDING":
+            interval *= 2
+
+        return min(self.maxinterval, max(self.mininterval, interval))
+
+    async def watch(self, operationids: typing.Sequence[str], sleep: typing.Callable[[float], typing.Awaitable] = asyncio.sleep
+                    ) -> typing.AsyncIterator[typing.Tuple[str, str, dict]]:
+        """
+        A method that yields a tuple of the operation ID, the normalized state and the status
+        every time the state of one of the tasks changes, until every task has finished.
+        The blocking status fetches are run in the default executor of the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        states = {operationid: None for operationid in operationids}
+        nextpoll = {operationid: 0.0 for operationid in operationids}
+
+        while nextpoll:
+            # Fetch the statuses of the tasks that are due
+            now = self.clock()
+            due = [operationid for operationid, when in nextpoll.items() if when <= now]
+            if due:
+                statuses = await loop.run_in_executor(None, self.get_statuses, due)
+
+                for operationid in due:
+                    status = statuses[operationid]
+                    state = export.generate_taskstate(status)
+
+                    # Report the transition if the state changed
+                    if state != states[operationid]:
+                        states[operationid] = state
+                        yield operationid, state, status
+
+                    # Stop polling finished tasks and schedule the rest
+                    if state in TERMINALSTATES:
+                        del nextpoll[operationid]
+                    else:
+                        nextpoll[operationid] = self.clock() + self.get_interval(operationid, state)
+
+            # Wait until the next task is due
+            if nextpoll:
+                await sleep(max(0.0, min(nextpoll.values()) - self.clock()))
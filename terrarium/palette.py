@@ -30,3 +30,23 @@ NDVIFOCAL = {
     'max': 10.0, 
     'palette': ndvipalette
 }
+
+# NDWI color palette
+ndwipalette = [
+    '8C510A', 'BF812D', 'DFC27D', 'F6E8C3', 'F5F5F5', 
+    'C7EAE5', '80CDC1', '35978F', '01665E', '003C30'
+]
+
+# NDWI Regular Visualization Parameters
+NDWIRAW = {
+    'min': -1.0, 
+    'max': 1.0, 
+    'palette': ndwipalette
+}
+
+# EVI Regular Visualization Parameters
+EVIRAW = {
+    'min': 0.0, 
+    'max': 1.0, 
+    'palette': ndvipalette
+}
@@ -0,0 +1,168 @@
+"""
+Terrarium Package
+
+The postprocess module contains the local postprocessing stage for native resolution
+exports. It reproduces the server side upsampling and focalization of the spectral
+indices on downloaded GeoTIFFs in streaming windows with bounded memory.
+
+The module requires the 'rasterio' package which is installed with the 'raster' extra.
+"""
+from __future__ import annotations
+
+import os
+import math
+import typing
+import collections
+import concurrent.futures
+
+from . import lazyload
+from . import raster
+from . import spectral
+from . import instrumentation
+
+numpy = lazyload.lazy_import("numpy")
+
+# The local equivalents of the server side postprocessing algorithms
+LOCALSTEPS = {
+    spectral.upsample_algorithm: "upsample",
+    spectral.focalize_algorithm: "focalize",
+}
+
+# The datasets opened by the current process keyed by their path
+_datasets = {}
+
+def _import_rasterio():
+    """ A function that imports the rasterio package on first use. """
+    try:
+        import rasterio
+        import rasterio.windows
+        return rasterio
+
+    except ImportError:
+        raise RuntimeError("could not postprocess geotiff. the 'rasterio' package is required, install terrarium with the 'raster' extra.")
+
+def generate_local_steps(index: str) -> typing.List[str]:
+    """ A function that returns the names of the local postprocessing steps that reproduce the postprocessing of a registered spectral index. """
+    steps = []
+    for algorithm in spectral.get_spectral_index(index).postprocess:
+        if algorithm not in LOCALSTEPS:
+            raise RuntimeError(f"could not postprocess index {index}. {algorithm.__name__} has no local equivalent.")
+
+        steps.append(LOCALSTEPS[algorithm])
+
+    return steps
+
+def _generate_halo(steps: typing.List[str], factor: int, radius: int) -> int:
+    """ A function that returns the halo in input pixels needed by a sequence of local postprocessing steps. """
+    halo, scale = 0, 1
+    for step in steps:
+        if step == "upsample":
+            halo += raster.BICUBIC_HALO
+            scale = factor
+        elif step == "focalize":
+            halo += math.ceil(radius / scale)
+
+    return halo
+
+def _postprocess_window(source: str, steps: typing.List[str], window: tuple, halo: int, factor: int, radius: int, dtype: str) -> tuple:
+    """ A function that reads a window of a GeoTIFF with its halo, applies the postprocessing steps and returns the cropped result. """
+    rasterio = _import_rasterio()
+    if source not in _datasets:
+        _datasets[source] = rasterio.open(source)
+    dataset = _datasets[source]
+
+    # Read the window with the halo clamped to the raster
+    wtop, wbottom, wleft, wright = raster.expand_window(window, halo, dataset.height, dataset.width)
+    data = dataset.read(window=rasterio.windows.Window(wleft, wtop, wright - wleft, wbottom - wtop)).astype(numpy.float32)
+    if dataset.nodata is not None:
+        data[data == dataset.nodata] = numpy.nan
+
+    # Apply the postprocessing steps to every band
+    scale = 1
+    for step in steps:
+        if step == "upsample":
+            data = numpy.stack([raster.upsample_bicubic(band, factor) for band in data])
+            scale = factor
+        elif step == "focalize":
+            data = numpy.stack([raster.focalize_array(band, radius) for band in data])
+
+    # Crop the halo and cast the result to the output type
+    result = raster.crop_halo(data, window, (wtop, wleft), scale)
+    if numpy.dtype(dtype) == numpy.uint8:
+        result = numpy.clip(numpy.rint(result), 0, 255)
+
+    return window, result.astype(dtype)
+
+@instrumentation.instrumented
+def postprocess_geotiff(source: str, output: str, index: str, factor: int = 10, radius: int = 5, blocksize: int = 256, workers: int = None):
+    """
+    A function that postprocesses a native resolution GeoTIFF of a spectral index and writes the result to 'output'.
+
+    The GeoTIFF is expected to be an export of 'spectral.generate_native_spectral_image'. The postprocessing
+    algorithms of the index are reproduced locally, upsampling by 'factor' with bicubic interpolation in the
+    native CRS of the raster and focalizing with a median kernel of 'radius' pixels. The raster is processed in
+    windows of 'blocksize' input pixels with enough halo for the kernels, so memory is bounded by the window size.
+    Windows are processed by 'workers' processes (one per CPU by default) and written as they complete.
+
+    The result matches the unvisualized server side image within the differences of the bicubic kernels
+    used by Earth Engine and the raster module, which are largest at the edges of the raster.
+    """
+    rasterio = _import_rasterio()
+    steps = generate_local_steps(index)
+    scale = factor if "upsample" in steps else 1
+    halo = _generate_halo(steps, factor, radius)
+
+    try:
+        with rasterio.open(source) as dataset:
+            height, width = dataset.height, dataset.width
+            dtype = "uint8" if dataset.dtypes[0] == "uint8" else "float32"
+
+            # Scale the raster profile and the pixel size of the geotransform by the upsampling factor
+            transform = dataset.transform
+            profile = dataset.profile.copy()
+            profile.update(
+                driver="GTiff", width=width * scale, height=height * scale, dtype=dtype,
+                transform=rasterio.Affine(transform.a / scale, transform.b / scale, transform.c, transform.d / scale, transform.e / scale, transform.f),
+                nodata=None if dtype == "uint8" else numpy.nan,
+                tiled=True, blockxsize=256, blockysize=256, compress="deflate", BIGTIFF="IF_SAFER",
+            )
+
+    except rasterio.errors.RasterioIOError as e:
+        raise RuntimeError(f"could not open geotiff. {e}")
+
+    windows = raster.generate_windows(height, width, blocksize)
+    workers = workers or os.cpu_count() or 1
+
+    def write(destination, window: tuple, result: numpy.ndarray):
+        top, bottom, left, right = window
+        destination.write(result, window=rasterio.windows.Window(left * scale, top * scale, (right - left) * scale, (bottom - top) * scale))
+
+    try:
+        with rasterio.open(output, "w", **profile) as destination:
+            if workers == 1:
+                # Process the windows in this process
+                for window in windows:
+                    write(destination, *_postprocess_window(source, steps, window, halo, factor, radius, dtype))
+                return
+
+            # Process the windows in the process pool with at most two windows in flight per worker
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = collections.deque()
+                for window in windows:
+                    pending.append(executor.submit(_postprocess_window, source, steps, window, halo, factor, radius, dtype))
+                    if len(pending) >= 2 * workers:
+                        write(destination, *pending.popleft().result())
+
+                while pending:
+                    write(destination, *pending.popleft().result())
+
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"could not postprocess geotiff. error: {e}")
+
+    finally:
+        # Close the dataset opened by this process for serial processing
+        opened = _datasets.pop(source, None)
+        if opened is not None:
+            opened.close()
@@ -0,0 +1,291 @@
+"""
+Terrarium Package
+
+The raster module contains a local NumPy engine that reproduces the spectral
+algorithms of the spectral module on arrays of Sentinel-2 bands. Large rasters
+are processed in tiles with halo overlap that are spread across a process pool.
+"""
+from __future__ import annotations
+
+import os
+import math
+import typing
+import tempfile
+import concurrent.futures
+
+from . import lazyload
+from . import instrumentation
+
+numpy = lazyload.lazy_import("numpy")
+
+# The number of input pixels needed on each side of a pixel by bicubic interpolation
+BICUBIC_HALO = 2
+
+def _generate_cubicweights(size: int, factor: int) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    A function that returns the source indices and weights of the 4 taps of cubic convolution for
+    every output pixel when upsampling an axis of the given size by an integer factor. Output pixel
+    centers are aligned with input pixel centers and indices beyond the edges are clamped.
+    """
+    # Calculate the position of every output pixel center in input pixel coordinates
+    positions = (numpy.arange(size * factor) + 0.5) / factor - 0.5
+    base = numpy.floor(positions)
+    t = (positions - base)[:, None]
+
+    # Calculate the distance from every output pixel to its 4 taps
+    distance = numpy.abs(t - numpy.array([-1.0, 0.0, 1.0, 2.0]))
+    # Calculate the Keys cubic convolution weights with a = -0.5
+    weights = numpy.where(
+        distance <= 1,
+        1.5 * distance ** 3 - 2.5 * distance ** 2 + 1,
+        -0.5 * distance ** 3 + 2.5 * distance ** 2 - 4 * distance + 2,
+    )
+
+    indices = numpy.clip(base[:, None].astype(numpy.int64) + numpy.array([-1, 0, 1, 2]), 0, size - 1)
+    return indices, weights
+
+@instrumentation.instrumented
+def upsample_bicubic(array: numpy.ndarray, factor: int) -> numpy.ndarray:
+    """
+    A function that upsamples a 2D array by an integer factor with bicubic interpolation.
+    The interpolation is separable and is applied to the rows and then the columns. Returns a float32 array.
+    """
+    array = numpy.asarray(array, dtype=numpy.float32)
+    rows, columns = array.shape
+
+    # Interpolate along the rows
+    indices, weights = _generate_cubicweights(rows, factor)
+    interpolated = sum(weights[:, tap, None].astype(numpy.float32) * array[indices[:, tap], :] for tap in range(4))
+
+    # Interpolate along the columns
+    indices, weights = _generate_cubicweights(columns, factor)
+    return sum(weights[None, :, tap].astype(numpy.float32) * interpolated[:, indices[:, tap]] for tap in range(4))
+
+def _generate_boxsums(array: numpy.ndarray, radius: int) -> numpy.ndarray:
+    """ A function that returns the sum of every square window of the given radius in a 2D array. Values beyond the edges are zero. """
+    size = 2 * radius + 1
+    # Build the zero padded integral image
+    padded = numpy.zeros((array.shape[0] + size, array.shape[1] + size), dtype=numpy.int32)
+    padded[radius + 1:radius + 1 + array.shape[0], radius + 1:radius + 1 + array.shape[1]] = array
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    # Difference the corners of every window
+    return integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+
+@instrumentation.instrumented
+def focal_median(array: numpy.ndarray, radius: int, minimum: int, maximum: int) -> numpy.ndarray:
+    """
+    A function that returns the median of every square window of the given radius in a 2D array of
+    integer values between 'minimum' and 'maximum'. NaN values are masked and windows are truncated at
+    the edges. Windows with an even number of values use the lower median and fully masked windows are NaN.
+
+    The median is found from the cumulative histogram of every window instead of sorting the window.
+    The count of values at or below each level is a box sum of an integral image, so the cost grows with
+    the number of levels rather than with the size of the window.
+    """
+    array = numpy.asarray(array, dtype=numpy.float32)
+    valid = numpy.isfinite(array)
+
+    # Calculate the rank of the lower median of every window
+    counts = _generate_boxsums(valid, radius)
+    target = (counts + 1) // 2
+
+    result = numpy.full(array.shape, numpy.nan, dtype=numpy.float32)
+    pending = counts > 0
+
+    for level in range(minimum, maximum + 1):
+        # The median is the first level whose cumulative count reaches the target rank
+        cumulative = _generate_boxsums(valid & (array <= level), radius)
+        reached = pending & (cumulative >= target)
+        result[reached] = level
+        pending &= ~reached
+
+        if not pending.any():
+            break
+
+    return result
+
+@instrumentation.instrumented
+def ndvi_array(nir: numpy.ndarray, red: numpy.ndarray, factor: int = 10, radius: int = 5) -> numpy.ndarray:
+    """
+    A function that reproduces 'spectral.ndvi_algorithm' on arrays of the NIR (B8) and RED (B4) bands.
+
+    The NDVI is composed with (NIR-RED)/(NIR+RED), returning 0 where the denominator is 0 like the Earth Engine
+    division, upsampled by 'factor' with bicubic interpolation (10 for 10m bands at 1m), scaled by one order of
+    magnitude and truncated to integers and then focalized with a square median kernel of 'radius' pixels.
+    Returns a float32 array. NaN values in the bands are treated as masked pixels.
+    """
+    nir = numpy.asarray(nir, dtype=numpy.float32)
+    red = numpy.asarray(red, dtype=numpy.float32)
+
+    # Compose the NDVI with bandmath
+    denominator = nir + red
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ndvi = numpy.where(denominator == 0, 0.0, (nir - red) / denominator).astype(numpy.float32)
+
+    # Upsample the NDVI with bicubic interpolation and focalize it
+    return focalize_array(upsample_bicubic(ndvi, factor), radius)
+
+@instrumentation.instrumented
+def focalize_array(array: numpy.ndarray, radius: int = 5) -> numpy.ndarray:
+    """
+    A function that reproduces 'spectral.focalize_algorithm' on a 2D array. Each value is scaled by one
+    order of magnitude and truncated to an integer before the array is passed through a square median 
+    kernel of 'radius' pixels. Returns a float32 array.
+    """
+    # Scale each pixel value by one order of magnitude and truncate it
+    quantized = numpy.trunc(numpy.asarray(array, dtype=numpy.float32) * 10)
+    if not numpy.isfinite(quantized).any():
+        return quantized
+
+    # Focalize the image with a square median kernel over the range of quantized values
+    return focal_median(quantized, radius, int(numpy.nanmin(quantized)), int(numpy.nanmax(quantized)))
+
+@instrumentation.instrumented
+def truecolor_array(red: numpy.ndarray, green: numpy.ndarray, blue: numpy.ndarray, factor: int = 10) -> numpy.ndarray:
+    """
+    A function that reproduces 'spectral.truecolor_algorithm' on arrays of the TCI_R, TCI_G and TCI_B bands.
+    The bands are upsampled by 'factor' with bicubic interpolation and returned as a (3, rows, columns) uint8 array.
+    """
+    bands = [upsample_bicubic(band, factor) for band in (red, green, blue)]
+    return numpy.clip(numpy.rint(numpy.stack(bands)), 0, 255).astype(numpy.uint8)
+
+
+def _ndvi_kernel(windows: list, factor: int, radius: int) -> numpy.ndarray:
+    return ndvi_array(windows[0], windows[1], factor, radius)[None]
+
+def _truecolor_kernel(windows: list, factor: int, radius: int) -> numpy.ndarray:
+    return truecolor_array(*windows, factor)
+
+# The tile kernels for every index with their output dtype and number of output bands
+KERNELS = {
+    "NDVI": (_ndvi_kernel, "float32", 1),
+    "TCI": (_truecolor_kernel, "uint8", 3),
+}
+
+def _describe_array(source: typing.Union[str, numpy.ndarray]) -> typing.Any:
+    """
+    A function that returns a picklable descriptor of a file backed array that workers can open without copying it.
+    Returns None for arrays that are only in memory.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return ("npy", os.fspath(source))
+
+    if isinstance(source, numpy.memmap) and source.filename and source.flags.c_contiguous:
+        return ("memmap", source.filename, source.dtype.str, source.shape, source.offset)
+
+    return None
+
+def _open_array(descriptor: typing.Any, writable: bool = False) -> numpy.ndarray:
+    """ A function that opens a file backed array from its descriptor as a memory map. """
+    if descriptor[0] == "npy":
+        return numpy.load(descriptor[1], mmap_mode="r+" if writable else "r")
+
+    _, filename, dtype, shape, offset = descriptor
+    return numpy.memmap(filename, dtype=dtype, mode="r+" if writable else "r", shape=shape, offset=offset)
+
+def generate_windows(rows: int, columns: int, tilesize: int) -> typing.List[typing.Tuple[int, int, int, int]]:
+    """ A function that returns the (top, bottom, left, right) windows that split a raster into tiles of 'tilesize' pixels. """
+    return [
+        (top, min(rows, top + tilesize), left, min(columns, left + tilesize))
+        for top in range(0, rows, tilesize) for left in range(0, columns, tilesize)
+    ]
+
+def expand_window(window: typing.Tuple[int, int, int, int], halo: int, rows: int, columns: int) -> typing.Tuple[int, int, int, int]:
+    """ A function that returns a (top, bottom, left, right) window grown by 'halo' pixels on each side and clamped to the raster. """
+    top, bottom, left, right = window
+    return max(0, top - halo), min(rows, bottom + halo), max(0, left - halo), min(columns, right + halo)
+
+def crop_halo(result: numpy.ndarray, window: typing.Tuple[int, int, int, int], origin: typing.Tuple[int, int], factor: int) -> numpy.ndarray:
+    """
+    A function that crops the upsampled result of an expanded window down to the core window.
+    'origin' is the top left input pixel of the expanded window that the result was computed from.
+    """
+    top, bottom, left, right = window
+    offsettop, offsetleft = (top - origin[0]) * factor, (left - origin[1]) * factor
+    return result[..., offsettop:offsettop + (bottom - top) * factor, offsetleft:offsetleft + (right - left) * factor]
+
+def _process_tile(index: str, sources: list, output: typing.Any, window: tuple, factor: int, radius: int, halo: int):
+    """ A function that processes a single tile and writes its core into the output. """
+    kernel = KERNELS[index][0]
+    inputs = [_open_array(source) if isinstance(source, tuple) else source for source in sources]
+    target = _open_array(output, writable=True) if isinstance(output, tuple) else output
+
+    # Read the input window with the halo clamped to the raster
+    top, bottom, left, right = window
+    wtop, wbottom, wleft, wright = expand_window(window, halo, *inputs[0].shape)
+    windows = [numpy.asarray(source[wtop:wbottom, wleft:wright]) for source in inputs]
+
+    # Run the kernel and crop the halo from the result
+    result = kernel(windows, factor, radius)
+    target[:, top * factor:bottom * factor, left * factor:right * factor] = crop_halo(result, window, (wtop, wleft), factor)
+
+    if isinstance(target, numpy.memmap):
+        target.flush()
+
+@instrumentation.instrumented
+def generate_spectral_array(index: str, bands: typing.Sequence[typing.Union[str, numpy.ndarray]], output: str = None,
+                            factor: int = 10, radius: int = 5, tilesize: int = 256, workers: int = None) -> numpy.ndarray:
+    """
+    A function that generates a spectral array for the given index from arrays of Sentinel-2 bands in tiles.
+
+    Valid values for the 'index' argument are:
+    - 'TCI' - True Color Index, from the TCI_R, TCI_G and TCI_B bands
+    - 'NDVI' - Normalized Difference Vegetation Index, from the B8 and B4 bands
+
+    Bands can be arrays, memory-mapped arrays or paths to '.npy' files. The raster is split into tiles of
+    'tilesize' input pixels that are read with enough halo for the bicubic and focal kernels, so the result
+    matches processing the whole raster at once. When every band is file backed the tiles are spread over a
+    pool of 'workers' processes (one per CPU by default) that open the bands as memory maps. The result is
+    a (bands, rows * factor, columns * factor) array that is written to the '.npy' file at 'output' if given.
+    """
+    if index not in KERNELS:
+        raise RuntimeError(f"unsupported index: {index}")
+
+    kernel, dtype, count = KERNELS[index]
+    descriptors = [_describe_array(band) for band in bands]
+    arrays = [_open_array(descriptor) if descriptor else numpy.asarray(band) for band, descriptor in zip(bands, descriptors)]
+
+    rows, columns = arrays[0].shape
+    if any(array.shape != (rows, columns) for array in arrays):
+        raise RuntimeError("could not generate spectral array. bands must have the same shape")
+
+    # Calculate the halo needed by the kernels in input pixels
+    halo = BICUBIC_HALO + (math.ceil(radius / factor) if index == "NDVI" else 0)
+    windows = generate_windows(rows, columns, tilesize)
+
+    shape = (count, rows * factor, columns * factor)
+    parallel = all(descriptors) and (workers is None or workers > 1) and len(windows) > 1
+    temporary = None
+
+    try:
+        if not parallel:
+            # Process the tiles in this process
+            result = numpy.lib.format.open_memmap(output, mode="w+", dtype=dtype, shape=shape) if output else numpy.empty(shape, dtype=dtype)
+            for window in windows:
+                _process_tile(index, arrays, result, window, factor, radius, halo)
+            return result
+
+        # Create the output file that is shared by the workers
+        if output is None:
+            handle, temporary = tempfile.mkstemp(suffix=".npy")
+            os.close(handle)
+        target = output or temporary
+        numpy.lib.format.open_memmap(target, mode="w+", dtype=dtype, shape=shape).flush()
+
+        # Process the tiles in the process pool
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_process_tile, index, descriptors, ("npy", target), window, factor, radius, halo) for window in windows]
+            for future in futures:
+                future.result()
+
+        result = numpy.load(target, mmap_mode="r+")
+        return numpy.array(result) if temporary else result
+
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"could not generate spectral array. error: {e}")
+
+    finally:
+        if temporary:
+            os.remove(temporary)
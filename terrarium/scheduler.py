@@ -0,0 +1,377 @@
+"""
+Terrarium Package
+
+The scheduler module contains the export scheduler that queues, starts,
+throttles and retries export tasks on a pluggable task backend.
+"""
+from __future__ import annotations
+
+import json
+import time
+import heapq
+import typing
+import sqlite3
+import threading
+import dataclasses
+
+from . import lazyload
+from . import export
+from . import caching
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+# The states of a job that will not change anymore
+TERMINALSTATES = ("COMPLETED", "FAILED", "CANCELLED")
+
+@dataclasses.dataclass
+class ExportJob:
+    """
+    A queued export. The 'payload' is the Cloud API serialized Earth Engine graph of the image,
+    such as 'spectral.SpectralGraph.serialized', and is only interpreted by the backend. 'state' is one of 'QUEUED', 'RUNNING',
+    'COMPLETED', 'FAILED' or 'CANCELLED'. 'options' is a JSON mapping of additional keyword arguments for 'export.export_image'
+    and jobs that share a 'group' make up one logical export, such as the chunks of a tiled export.
+    """
+    jobid: int
+    name: str
+    bucket: str
+    payload: str
+    priority: int = 0
+    state: str = "QUEUED"
+    attempts: int = 0
+    taskid: typing.Optional[str] = None
+    nextattempt: float = 0.0
+    error: typing.Optional[str] = None
+    options: typing.Optional[str] = None
+    group: typing.Optional[str] = None
+
+
+class ExportBackend:
+    """
+    A class that defines the interface for export task backends. Backends must implement
+    'start' which starts a task for a job and returns its task ID and 'status' which returns the
+    normalized state of a task. 'statuses' can be overridden to retrieve many states at once.
+    """
+    def start(self, job: ExportJob) -> str:
+        raise NotImplementedError
+
+    def status(self, taskid: str) -> str:
+        raise NotImplementedError
+
+    def statuses(self, taskids: typing.Sequence[str]) -> typing.Dict[str, str]:
+        return {taskid: self.status(taskid) for taskid in taskids}
+
+
+class EarthEngineBackend(ExportBackend):
+    """ A class that starts image exports to Cloud Storage as Earth Engine tasks in the given project. """
+    def __init__(self, project: str):
+        self.project = project
+
+    def start(self, job: ExportJob) -> str:
+        # Reconstruct the image from its serialized graph
+        expression = json.loads(job.payload)
+        image = ee.Image(ee.deserializer.decodeCloudApi(expression))
+        # Reconstruct the export options, the region is stored as GeoJSON in the CRS of the export
+        options = json.loads(job.options) if job.options else {}
+        if "region" in options:
+            options["region"] = ee.Geometry(options["region"], options.get("crs"), False)
+        # Create the export task with the serialized graph and start it
+        task = export.export_image(image, job.bucket, job.name, expression=expression, **options)
+        with instrumentation.roundtrip("earthengine", "startExport"):
+            task.start()
+        return task.id
+
+    def status(self, taskid: str) -> str:
+        return export.generate_taskstate(export.get_taskstatus(taskid=taskid, project=self.project))
+
+    def statuses(self, taskids: typing.Sequence[str]) -> typing.Dict[str, str]:
+        # Retrieve the statuses of every task with a single operation listing
+        statuses = export.get_taskstatuses(taskids=taskids, project=self.project)
+        return {operationid.rsplit("/", 1)[-1]: export.generate_taskstate(status) for operationid, status in statuses.items()}
+
+
+class LocalBackend(ExportBackend):
+    """
+    A class that runs export tasks in process. Intended to stand in for Earth Engine during tests.
+
+    Every task reports 'RUNNING' for 'polls' status checks and then finishes with the state returned
+    by 'resolver', which is called with the job and defaults to 'COMPLETED'. The resolver can also
+    raise to simulate a transient failure. Started jobs are recorded in 'started'.
+    """
+    def __init__(self, resolver: typing.Callable[[ExportJob], str] = None, polls: int = 1):
+        self.resolver = resolver or (lambda job: "COMPLETED")
+        self.polls = polls
+        self.started = []
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def start(self, job: ExportJob) -> str:
+        with self._lock:
+            taskid = f"local-{len(self.started)}"
+            self.started.append(job.name)
+            self._tasks[taskid] = [job, 0]
+            return taskid
+
+    def status(self, taskid: str) -> str:
+        with self._lock:
+            task = self._tasks[taskid]
+            task[1] += 1
+            if task[1] <= self.polls:
+                return "RUNNING"
+
+        return self.resolver(task[0])
+
+
+class ExportScheduler:
+    """
+    A class that schedules export jobs on a backend.
+
+    Jobs are started in order of descending priority and then submission while at most 'concurrency'
+    tasks are running. Jobs that fail or whose backend calls raise are retried up to 'retries' times
+    with exponential backoff starting at 'backoff' seconds and capped at 'maxbackoff' seconds.
+
+    The queue is persisted to an SQLite database at 'path', which defaults to 'exports.sqlite' in the
+    Terrarium cache directory. Unfinished jobs are restored when a scheduler is created with the same
+    path and running tasks are resumed without being started again.
+    """
+    def __init__(self, backend: ExportBackend, path: str = None, concurrency: int = 8, retries: int = 3,
+                 backoff: float = 30.0, maxbackoff: float = 900.0, clock: typing.Callable[[], float] = time.time):
+        self.backend = backend
+        self.path = path or caching.generate_cachepath("exports.sqlite")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.clock = clock
+
+        self.jobs = {}
+        self.counters = {"submitted": 0, "started": 0, "completed": 0, "failed": 0, "retried": 0, "statuserrors": 0}
+        self.statuserror = None
+        self._queue = []
+        self._began = None
+        self._lock = threading.RLock()
+        self._steplock = threading.Lock()
+
+        try:
+            # Open the database and create the jobs table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (jobid INTEGER PRIMARY KEY, name TEXT, bucket TEXT, payload TEXT, "
+                "priority INTEGER, state TEXT, attempts INTEGER, taskid TEXT, nextattempt REAL, error TEXT, options TEXT, "
+                "groupname TEXT)"
+            )
+            # Add the columns of the export options and groups to queues created before they existed
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")]
+            for column in ("options", "groupname"):
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            self._connection.commit()
+
+            # Restore the unfinished jobs
+            rows = self._connection.execute(
+                "SELECT * FROM jobs WHERE state NOT IN (?, ?, ?) ORDER BY jobid", TERMINALSTATES
+            ).fetchall()
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open export queue. error: {e}")
+
+        for row in rows:
+            job = ExportJob(*row)
+            self.jobs[job.jobid] = job
+            if job.state == "QUEUED":
+                self._enqueue(job)
+
+    def _enqueue(self, job: ExportJob):
+        """ A method that pushes a job onto the priority queue. """
+        heapq.heappush(self._queue, (-job.priority, job.jobid))
+
+    def _persist(self, job: ExportJob):
+        """ A method that writes the state of a job to the database. """
+        self._connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", dataclasses.astuple(job))
+        self._connection.commit()
+
+    def get_job(self, jobid: int) -> typing.Optional[ExportJob]:
+        """ A method that returns the job with the given ID, including finished jobs, or None if it does not exist. """
+        with self._lock:
+            if jobid in self.jobs:
+                return self.jobs[jobid]
+
+            row = self._connection.execute("SELECT * FROM jobs WHERE jobid = ?", (jobid,)).fetchone()
+            return ExportJob(*row) if row else None
+
+    def get_group(self, group: str) -> typing.List[ExportJob]:
+        """ A method that returns the jobs of a group in order of submission, including finished jobs. """
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM jobs WHERE groupname = ? ORDER BY jobid", (group,)).fetchall()
+            return [self.jobs.get(row[0]) or ExportJob(*row) for row in rows]
+
+    def get_groupstate(self, group: str) -> str:
+        """
+        A method that returns the state of a group of jobs as a whole. The group is 'FAILED' or 'CANCELLED' once any of
+        its jobs is, 'COMPLETED' once all of its jobs are, 'RUNNING' while any of its jobs is running and 'QUEUED' otherwise.
+        """
+        states = {job.state for job in self.get_group(group)}
+        if not states:
+            raise RuntimeError(f"could not get group state. group {group} does not exist.")
+
+        for state in ("FAILED", "CANCELLED"):
+            if state in states:
+                return state
+        if states == {"COMPLETED"}:
+            return "COMPLETED"
+        return "RUNNING" if "RUNNING" in states or "COMPLETED" in states else "QUEUED"
+
+    @instrumentation.instrumented
+    def submit(self, payload: str, bucket: str, name: str, priority: int = 0, options: dict = None, group: str = None) -> int:
+        """
+        A method that queues an export of a serialized image graph and returns its job ID.
+        The 'options' are passed on to 'export.export_image' by the backend and must be JSON serializable.
+        """
+        options = json.dumps(options) if options else None
+        with self._lock:
+            try:
+                cursor = self._connection.execute(
+                    "INSERT INTO jobs (name, bucket, payload, priority, state, attempts, nextattempt, options, groupname) "
+                    "VALUES (?, ?, ?, ?, 'QUEUED', 0, 0, ?, ?)",
+                    (name, bucket, payload, priority, options, group)
+                )
+                self._connection.commit()
+
+            except sqlite3.Error as e:
+                raise RuntimeError(f"could not queue export. error: {e}")
+
+            job = ExportJob(cursor.lastrowid, name, bucket, payload, priority, options=options, group=group)
+            self.jobs[job.jobid] = job
+            self._enqueue(job)
+            self.counters["submitted"] += 1
+            return job.jobid
+
+    def submit_image(self, image: ee.Image, bucket: str, name: str, priority: int = 0, options: dict = None, group: str = None) -> int:
+        """ A method that queues an export of an Earth Engine Image and returns its job ID. """
+        try:
+            payload = image.serialize(for_cloud_api=True)
+        except Exception as e:
+            raise RuntimeError(f"could not serialize image. {e}.")
+
+        return self.submit(payload, bucket, name, priority, options, group)
+
+    def _retry(self, job: ExportJob, error: str, now: float):
+        """ A method that requeues a failed job with backoff or marks it failed if it has no retries left. """
+        job.error = error
+        job.taskid = None
+
+        if job.attempts > self.retries:
+            job.state = "FAILED"
+            self.counters["failed"] += 1
+        else:
+            job.state = "QUEUED"
+            job.nextattempt = now + min(self.backoff * 2 ** (job.attempts - 1), self.maxbackoff)
+            self.counters["retried"] += 1
+            self._enqueue(job)
+
+        self._persist(job)
+
+    @instrumentation.instrumented
+    def step(self) -> int:
+        """
+        A method that runs a single scheduling cycle. The states of running jobs are refreshed,
+        finished jobs are completed or retried and queued jobs are started up to the concurrency limit.
+        Returns the number of jobs that are not finished yet.
+
+        The backend is called without holding the lock of the scheduler, so jobs can be submitted and
+        looked up while a cycle waits on the backend. Cycles themselves run one at a time. A failure to
+        refresh the states is counted in the 'statuserrors' counter and kept in 'statuserror', and the
+        running jobs are left as they are until the next cycle.
+        """
+        with self._steplock:
+            with self._lock:
+                now = self.clock()
+                running = [job for job in self.jobs.values() if job.state == "RUNNING"]
+
+            # Refresh the states of the running jobs
+            states = {}
+            if running:
+                try:
+                    states = self.backend.statuses([job.taskid for job in running])
+                    self.statuserror = None
+                except Exception as e:
+                    with self._lock:
+                        self.counters["statuserrors"] += 1
+                        self.statuserror = f"could not check task statuses. {e}"
+
+            with self._lock:
+                for job in running:
+                    state = states.get(job.taskid, "RUNNING")
+                    if state == "COMPLETED":
+                        job.state = "COMPLETED"
+                        self.counters["completed"] += 1
+                        self._persist(job)
+                    elif state == "CANCELLED":
+                        job.state = "CANCELLED"
+                        self._persist(job)
+                    elif state == "FAILED":
+                        self._retry(job, "task failed", now)
+
+                # Take the queued jobs that are due while there is capacity
+                active = sum(1 for job in self.jobs.values() if job.state == "RUNNING")
+                deferred, starting = [], []
+                while self._queue and active + len(starting) < self.concurrency:
+                    _, jobid = heapq.heappop(self._queue)
+                    job = self.jobs.get(jobid)
+                    if job is None or job.state != "QUEUED":
+                        continue
+                    if job.nextattempt > now:
+                        deferred.append(job)
+                        continue
+
+                    job.attempts += 1
+                    starting.append(job)
+
+                for job in deferred:
+                    self._enqueue(job)
+
+            # Start the tasks of the taken jobs
+            results = []
+            for job in starting:
+                try:
+                    results.append((job, self.backend.start(job), None))
+                except Exception as e:
+                    results.append((job, None, e))
+
+            with self._lock:
+                for job, taskid, error in results:
+                    if error is not None:
+                        self._retry(job, f"could not start task. {error}", now)
+                        continue
+
+                    job.taskid = taskid
+                    job.state = "RUNNING"
+                    self.counters["started"] += 1
+                    self._began = self._began or now
+                    self._persist(job)
+
+                # Drop the finished jobs from memory, they remain in the database
+                for jobid in [jobid for jobid, job in self.jobs.items() if job.state in TERMINALSTATES]:
+                    del self.jobs[jobid]
+
+                return len(self.jobs)
+
+    def run(self, interval: float = 10.0, sleep: typing.Callable[[float], None] = time.sleep):
+        """ A method that runs scheduling cycles every 'interval' seconds until every job is finished. """
+        while self.step():
+            sleep(interval)
+
+    def metrics(self) -> dict:
+        """
+        A method that returns a mapping of the scheduler metrics. Includes the counters of submitted, started,
+        completed, failed and retried jobs and of failed status refreshes, the queue depth, the number of running jobs
+        and the throughput of completed jobs per second since the first job was started.
+        """
+        with self._lock:
+            elapsed = self.clock() - self._began if self._began is not None else 0.0
+            return {
+                **self.counters,
+                "queued": sum(1 for job in self.jobs.values() if job.state == "QUEUED"),
+                "running": sum(1 for job in self.jobs.values() if job.state == "RUNNING"),
+                "throughput": self.counters["completed"] / elapsed if elapsed > 0 else 0.0,
+            }
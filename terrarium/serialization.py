@@ -0,0 +1,548 @@
+"""
+Terrarium Package
+
+The serialization module contains the encoders and decoders for moving collections
+of geometries between workers. Geometries are flattened into contiguous columnar
+coordinate buffers from which GeoJSON and WKB are written directly and which are
+encoded into a compact binary format that decodes into NumPy views of the encoded
+buffer without copying its coordinates.
+"""
+from __future__ import annotations
+
+import json
+import struct
+import typing
+
+from . import lazyload
+from . import instrumentation
+
+numpy = lazyload.lazy_import("numpy")
+shapes = lazyload.lazy_import("shapely.geometry")
+shapewkb = lazyload.lazy_import("shapely.wkb")
+
+# The WKB type codes of the supported geometry types
+POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON = 1, 2, 3, 4, 5, 6
+
+# The GeoJSON type names of the geometry type codes
+GEOMETRYTYPES = {
+    POINT: "Point", LINESTRING: "LineString", POLYGON: "Polygon",
+    MULTIPOINT: "MultiPoint", MULTILINESTRING: "MultiLineString", MULTIPOLYGON: "MultiPolygon",
+}
+
+# The geometry type codes of the GeoJSON type names
+GEOMETRYCODES = {name: code for code, name in GEOMETRYTYPES.items()}
+
+# The magic bytes, version and header layout of the binary columnar encoding
+COLUMNARMAGIC = b"TRGC"
+COLUMNARVERSION = 1
+COLUMNARHEADER = struct.Struct("<4sBBHQQQQQ")
+
+# The magic bytes and header layout of the WKB collection encoding
+WKBMAGIC = b"TRGW"
+WKBHEADER = struct.Struct("<4sQ")
+
+
+class GeometryColumns(typing.NamedTuple):
+    """
+    A class that represents a collection of geometries as contiguous columnar buffers.
+
+    Every geometry has the WKB type code in 'types' and is made of parts, every part is made of rings and every ring
+    is a run of coordinates. The parts of geometry i are 'geometryoffsets[i]:geometryoffsets[i + 1]', the rings of
+    part j are 'partoffsets[j]:partoffsets[j + 1]' and the coordinates of ring k are 'ringoffsets[k]:ringoffsets[k + 1]'
+    in the (N, 2) float64 'coordinates'. The parts of a multipart geometry are its members and the part of a single
+    geometry is itself. The rings of a polygon are its exterior followed by its interiors and every other part has a
+    single ring. The 'properties' of every geometry are optional.
+    """
+    types: numpy.ndarray
+    geometryoffsets: numpy.ndarray
+    partoffsets: numpy.ndarray
+    ringoffsets: numpy.ndarray
+    coordinates: numpy.ndarray
+    properties: typing.Optional[typing.List[dict]] = None
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def rings(self, index: int) -> typing.List[typing.List[numpy.ndarray]]:
+        """ A method that returns the coordinates of every ring of every part of a geometry as views of the coordinate buffer. """
+        rings = []
+        for part in range(self.geometryoffsets[index], self.geometryoffsets[index + 1]):
+            rings.append([
+                self.coordinates[self.ringoffsets[ring]:self.ringoffsets[ring + 1]]
+                for ring in range(self.partoffsets[part], self.partoffsets[part + 1])
+            ])
+
+        return rings
+
+
+def _generate_parts(shape: shapes.base.BaseGeometry) -> typing.Tuple[int, list]:
+    """ A function that returns the type code of a Shapely Geometry and the rings of each of its parts as Shapely coordinate sequences. """
+    code = GEOMETRYCODES.get(shape.geom_type)
+    if code is None:
+        raise RuntimeError(f"could not serialize geometry. unsupported geometry type {shape.geom_type}.")
+    if shape.is_empty:
+        return code, []
+
+    members = list(shape.geoms) if code in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON) else [shape]
+    if code in (POLYGON, MULTIPOLYGON):
+        return code, [[member.exterior.coords, *(interior.coords for interior in member.interiors)] for member in members]
+    return code, [[member.coords] for member in members]
+
+@instrumentation.instrumented
+def generate_geometrycolumns(shapelist: typing.Sequence[shapes.base.BaseGeometry], properties: typing.Sequence[dict] = None) -> GeometryColumns:
+    """
+    A function that flattens a sequence of Shapely Geometries into contiguous columnar buffers. Points, LineStrings,
+    Polygons and their multipart variants are supported and only their x and y coordinates are kept.
+    """
+    types, partsizes, ringsizes, coordinates = [], [], [], []
+
+    for shape in shapelist:
+        code, parts = _generate_parts(shape)
+        types.append(code)
+        partsizes.append(len(parts))
+
+        # Accumulate the coordinates of every ring of every part
+        for rings in parts:
+            ringsizes.append(len(rings))
+            for ring in rings:
+                coordinates.append(numpy.asarray(ring, dtype=numpy.float64)[:, :2])
+
+    try:
+        # Concatenate the coordinates and accumulate the sizes into offsets
+        ringlengths = [len(ring) for ring in coordinates]
+        coordinates = numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2), dtype=numpy.float64)
+        return GeometryColumns(
+            numpy.asarray(types, dtype=numpy.uint8),
+            numpy.concatenate([[0], numpy.cumsum(partsizes, dtype=numpy.int64)]),
+            numpy.concatenate([[0], numpy.cumsum(ringsizes, dtype=numpy.int64)]),
+            numpy.concatenate([[0], numpy.cumsum(ringlengths, dtype=numpy.int64)]),
+            coordinates,
+            list(properties) if properties is not None else None,
+        )
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate geometry columns. error: {e}")
+
+@instrumentation.instrumented
+def generate_shapes_fromcolumns(columns: GeometryColumns) -> typing.List[shapes.base.BaseGeometry]:
+    """ A function that returns the Shapely Geometries of a collection of geometry columns. """
+    shapelist = []
+    try:
+        for index, code in enumerate(columns.types.tolist()):
+            parts = columns.rings(index)
+            if not parts:
+                shapelist.append(getattr(shapes, GEOMETRYTYPES[code])())
+            elif code == POINT:
+                shapelist.append(shapes.Point(parts[0][0][0]))
+            elif code == LINESTRING:
+                shapelist.append(shapes.LineString(parts[0][0]))
+            elif code == POLYGON:
+                shapelist.append(shapes.Polygon(parts[0][0], parts[0][1:]))
+            elif code == MULTIPOINT:
+                shapelist.append(shapes.MultiPoint([rings[0][0] for rings in parts]))
+            elif code == MULTILINESTRING:
+                shapelist.append(shapes.MultiLineString([rings[0] for rings in parts]))
+            else:
+                shapelist.append(shapes.MultiPolygon([shapes.Polygon(rings[0], rings[1:]) for rings in parts]))
+
+    except Exception as e:
+        raise RuntimeError(f"could not construct shapely geometries. error: {e}")
+
+    return shapelist
+
+def _generate_geometrymappings(columns: GeometryColumns) -> typing.List[dict]:
+    """ A function that returns the GeoJSON geometry mappings of every geometry from the coordinate buffers. """
+    # Slice the coordinates of every ring and the rings of every part out of a single list conversion
+    coordinates = columns.coordinates.tolist()
+    ringoffsets, partoffsets, geometryoffsets = columns.ringoffsets.tolist(), columns.partoffsets.tolist(), columns.geometryoffsets.tolist()
+    rings = [coordinates[start:end] for start, end in zip(ringoffsets, ringoffsets[1:])]
+    parts = [rings[start:end] for start, end in zip(partoffsets, partoffsets[1:])]
+
+    mappings = []
+    for code, start, end in zip(columns.types.tolist(), geometryoffsets, geometryoffsets[1:]):
+        members = parts[start:end]
+        if code == POINT:
+            geometry = members[0][0][0] if members else []
+        elif code in (LINESTRING, POLYGON):
+            geometry = (members[0][0] if code == LINESTRING else members[0]) if members else []
+        elif code == MULTIPOINT:
+            geometry = [member[0][0] for member in members]
+        elif code == MULTILINESTRING:
+            geometry = [member[0] for member in members]
+        else:
+            geometry = members
+
+        mappings.append({"type": GEOMETRYTYPES[code], "coordinates": geometry})
+
+    return mappings
+
+def _check_fixedpoint(values: numpy.ndarray, precision: int) -> bool:
+    """
+    A function that returns whether every number of an array can be formatted by '_format_numbers', which scales them
+    by 10 to the power of 'precision' into 64 bit integers. Numbers that would overflow them and non-finite numbers cannot.
+    """
+    if not values.size:
+        return True
+
+    with numpy.errstate(invalid="ignore", over="ignore"):
+        return bool(numpy.abs(values).max() * 10.0 ** precision < 2.0 ** 63)
+
+def _format_numbers(values: numpy.ndarray, precision: int) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    A function that formats an array of numbers as fixed point text with at most 'precision' decimals. Returns a matrix
+    of the ASCII characters of every number and a mask of the characters that make up its shortest text, without the
+    leading zeros, the trailing zeros of the decimals and the sign and decimal point where they are not needed.
+    The numbers must pass '_check_fixedpoint'.
+    """
+    scaled = numpy.rint(values * 10.0 ** precision).astype(numpy.int64)
+    integers, fractions = numpy.divmod(numpy.abs(scaled), 10 ** precision)
+    width = len(str(int(integers.max()))) if len(integers) else 1
+
+    chars = numpy.empty((len(values), width + precision + 2), dtype=numpy.uint8)
+    mask = numpy.empty(chars.shape, dtype=bool)
+    chars[:, 0], mask[:, 0] = ord("-"), scaled < 0
+
+    # Write the integer digits from the right and keep them from the most significant digit on
+    remainder = integers
+    for column in range(width, 0, -1):
+        remainder, digit = numpy.divmod(remainder, 10)
+        chars[:, column] = digit + ord("0")
+        mask[:, column] = integers >= 10 ** (width - column) if column < width else True
+
+    chars[:, width + 1], mask[:, width + 1] = ord("."), fractions != 0
+
+    # Write the decimals from the right and keep them up to the last non-zero decimal
+    remainder, significant = fractions, numpy.zeros(len(values), dtype=bool)
+    for column in range(width + precision + 1, width + 1, -1):
+        remainder, digit = numpy.divmod(remainder, 10)
+        significant |= digit != 0
+        chars[:, column], mask[:, column] = digit + ord("0"), significant
+
+    return chars, mask
+
+def _generate_ringtexts(columns: GeometryColumns, precision: int) -> typing.List[str]:
+    """
+    A function that returns the GeoJSON text of the coordinates of every ring, without the enclosing brackets, written
+    from the coordinate buffers as fixed point numbers with at most 'precision' decimals.
+    """
+    coordinates = numpy.asarray(columns.coordinates, dtype=numpy.float64)
+    xchars, xmask = _format_numbers(coordinates[:, 0], precision)
+    ychars, ymask = _format_numbers(coordinates[:, 1], precision)
+
+    # Lay out every coordinate as '[x,y],' and drop the separator after the last coordinate of every ring
+    count = len(coordinates)
+    punctuation = [numpy.full((count, 1), ord(char), dtype=numpy.uint8) for char in "[,],"]
+    chars = numpy.hstack([punctuation[0], xchars, punctuation[1], ychars, punctuation[2], punctuation[3]])
+    separators = numpy.ones((count, 1), dtype=bool)
+    ringends = numpy.asarray(columns.ringoffsets[1:], dtype=numpy.int64) - 1
+    separators[ringends[ringends >= numpy.asarray(columns.ringoffsets[:-1], dtype=numpy.int64)], 0] = False
+    mask = numpy.hstack([numpy.ones((count, 1), dtype=bool), xmask, numpy.ones((count, 1), dtype=bool), ymask, numpy.ones((count, 1), dtype=bool), separators])
+
+    # Compact the characters into a single text and slice the rings out of it by the offsets of their coordinates
+    text = chars[mask].tobytes().decode("ascii")
+    offsets = numpy.concatenate([[0], numpy.cumsum(mask.sum(axis=1))])[numpy.asarray(columns.ringoffsets, dtype=numpy.int64)].tolist()
+    return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+def _generate_geojson_fromtexts(columns: GeometryColumns, precision: int) -> str:
+    """ A function that assembles the GeoJSON FeatureCollection of geometry columns from the fixed point texts of their rings. """
+    rings = _generate_ringtexts(columns, precision)
+    partoffsets, geometryoffsets = columns.partoffsets.tolist(), columns.geometryoffsets.tolist()
+    properties = columns.properties if columns.properties is not None else [{}] * len(columns)
+
+    features = []
+    for code, start, end, featureproperties in zip(columns.types.tolist(), geometryoffsets, geometryoffsets[1:], properties):
+        # Enclose the rings of every part in the brackets of the geometry type
+        parts = [rings[partoffsets[part]:partoffsets[part + 1]] for part in range(start, end)]
+        if code in (POINT, MULTIPOINT):
+            members = [part[0] for part in parts]
+        elif code in (LINESTRING, MULTILINESTRING):
+            members = ["[" + part[0] + "]" for part in parts]
+        else:
+            members = ["[" + ",".join("[" + ring + "]" for ring in part) + "]" for part in parts]
+
+        if code in (POINT, LINESTRING, POLYGON):
+            geometry = members[0] if members else "[]"
+        else:
+            geometry = "[" + ",".join(members) + "]"
+
+        features.append(
+            '{"type":"Feature","properties":' + json.dumps(featureproperties, separators=(",", ":")) +
+            ',"geometry":{"type":"' + GEOMETRYTYPES[code] + '","coordinates":' + geometry + '}}'
+        )
+
+    return '{"type":"FeatureCollection","features":[' + ",".join(features) + ']}'
+
+@instrumentation.instrumented
+def generate_geojson_fromcolumns(columns: GeometryColumns, precision: int = None) -> str:
+    """
+    A function that returns a GeoJSON FeatureCollection string with a Feature for every geometry of a collection of
+    geometry columns.
+
+    By default the coordinates are written with the shortest text that reads back to the same value and the output
+    for a single Polygon, Point or LineString is identical to 'spatial.generate_geojson_fromshape'. If 'precision' is
+    given, the coordinates are formatted as fixed point numbers with at most that many decimals in bulk from the
+    coordinate buffers, without creating a Python float for any of them, and the output has no whitespace.
+    Coordinates too large to be scaled to that many decimals in 64 bit integers, such as projected coordinates at a
+    high precision, are instead rounded to the precision and written with the shortest text of the rounded values.
+    The precision for an error bound in meters is returned by 'spatial.generate_quantizationprecision'.
+    """
+    if precision is not None and not 0 <= precision <= 15:
+        raise RuntimeError("could not generate geojson. precision must be between 0 and 15 decimals.")
+
+    try:
+        separators = None
+        if precision is not None:
+            coordinates = numpy.asarray(columns.coordinates, dtype=numpy.float64)
+            if _check_fixedpoint(coordinates, precision):
+                return _generate_geojson_fromtexts(columns, precision)
+
+            # Round the coordinates that cannot be written as fixed point text and write them without whitespace
+            columns = GeometryColumns(*columns[:4], numpy.round(coordinates, precision), columns.properties)
+            separators = (",", ":")
+
+        properties = columns.properties if columns.properties is not None else [{}] * len(columns)
+        features = [
+            {"type": "Feature", "properties": featureproperties, "geometry": geometry}
+            for featureproperties, geometry in zip(properties, _generate_geometrymappings(columns))
+        ]
+
+        return json.dumps({"type": "FeatureCollection", "features": features}, separators=separators)
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate geojson. error: {e}")
+
+@instrumentation.instrumented
+def generate_geojson_fromshapes(shapelist: typing.Sequence[shapes.base.BaseGeometry], properties: typing.Sequence[dict] = None, precision: int = None) -> str:
+    """
+    A function that returns a GeoJSON FeatureCollection string with a Feature for every given Shapely Geometry.
+    Refer to 'generate_geojson_fromcolumns' for details on the 'precision'.
+    """
+    return generate_geojson_fromcolumns(generate_geometrycolumns(shapelist, properties), precision)
+
+@instrumentation.instrumented
+def generate_columns_fromgeojson(geojson: typing.Union[str, bytes]) -> GeometryColumns:
+    """
+    A function that parses a GeoJSON FeatureCollection, Feature or Geometry string into geometry columns without
+    constructing any Shapely Geometries. The properties of the features are kept.
+    """
+    try:
+        geodata = json.loads(geojson)
+        if geodata["type"] == "FeatureCollection":
+            features = geodata["features"]
+        elif geodata["type"] == "Feature":
+            features = [geodata]
+        else:
+            features = [{"properties": None, "geometry": geodata}]
+
+    except (KeyError, TypeError) as e:
+        raise RuntimeError(f"corrupt geojson. missing key: {e}.")
+    except json.JSONDecodeError as e:
+        raise RuntimeError(f"could not parse geojson. {e}.")
+
+    types, partsizes, ringsizes, rings, properties = [], [], [], [], []
+    try:
+        for feature in features:
+            geometry = feature["geometry"]
+            code = GEOMETRYCODES[geometry["type"]]
+            types.append(code)
+            properties.append(feature.get("properties"))
+
+            # Normalize the coordinates into a list of parts made of a list of rings
+            members = geometry["coordinates"]
+            if code == POINT:
+                parts = [[[members]]] if members else []
+            elif code == LINESTRING:
+                parts = [[members]] if members else []
+            elif code == POLYGON:
+                parts = [members] if members else []
+            elif code == MULTIPOINT:
+                parts = [[[member]] for member in members]
+            elif code == MULTILINESTRING:
+                parts = [[member] for member in members]
+            else:
+                parts = members
+
+            partsizes.append(len(parts))
+            for part in parts:
+                ringsizes.append(len(part))
+                rings.extend(part)
+
+        # Convert every ring into an array at once and keep the x and y coordinates
+        coordinates = [numpy.asarray(ring, dtype=numpy.float64).reshape(len(ring), -1)[:, :2] for ring in rings]
+        return GeometryColumns(
+            numpy.asarray(types, dtype=numpy.uint8),
+            numpy.concatenate([[0], numpy.cumsum(partsizes, dtype=numpy.int64)]),
+            numpy.concatenate([[0], numpy.cumsum(ringsizes, dtype=numpy.int64)]),
+            numpy.concatenate([[0], numpy.cumsum([len(ring) for ring in rings], dtype=numpy.int64)]),
+            numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2), dtype=numpy.float64),
+            properties,
+        )
+
+    except KeyError as e:
+        raise RuntimeError(f"corrupt geojson. unsupported or missing geometry {e}.")
+    except Exception as e:
+        raise RuntimeError(f"could not generate geometry columns. error: {e}")
+
+@instrumentation.instrumented
+def generate_shapes_fromgeojson(geojson: typing.Union[str, bytes]) -> typing.List[shapes.base.BaseGeometry]:
+    """ A function that returns the Shapely Geometries of every feature of a GeoJSON FeatureCollection, Feature or Geometry string. """
+    return generate_shapes_fromcolumns(generate_columns_fromgeojson(geojson))
+
+def _generate_padding(size: int) -> bytes:
+    """ A function that returns the zero bytes that pad a section of the given size to a multiple of 8 bytes. """
+    return b"\0" * (-size % 8)
+
+@instrumentation.instrumented
+def encode_columns(columns: GeometryColumns) -> bytes:
+    """
+    A function that encodes geometry columns into the compact binary columnar format.
+
+    The format is a fixed header followed by the types, the three offset arrays and the coordinates as little endian
+    arrays that are each padded to 8 bytes, and the properties as a trailing JSON document. The offsets are stored as
+    32 bit integers when they fit. Every array can be read in place, refer to 'decode_columns'.
+    """
+    try:
+        # Store the offsets in the narrowest of 32 and 64 bit integers
+        width = 4 if len(columns.coordinates) < 2 ** 31 else 8
+        offsetstype = numpy.dtype("<i4") if width == 4 else numpy.dtype("<i8")
+        properties = json.dumps(columns.properties).encode() if columns.properties is not None else b""
+
+        sections = [COLUMNARHEADER.pack(
+            COLUMNARMAGIC, COLUMNARVERSION, width, 0, len(columns.types), len(columns.partoffsets) - 1,
+            len(columns.ringoffsets) - 1, len(columns.coordinates), len(properties)
+        )]
+        for array in (
+            numpy.ascontiguousarray(columns.types, dtype=numpy.uint8),
+            numpy.ascontiguousarray(columns.geometryoffsets, dtype=offsetstype),
+            numpy.ascontiguousarray(columns.partoffsets, dtype=offsetstype),
+            numpy.ascontiguousarray(columns.ringoffsets, dtype=offsetstype),
+            numpy.ascontiguousarray(columns.coordinates, dtype="<f8"),
+        ):
+            sections.append(array.tobytes())
+            sections.append(_generate_padding(array.nbytes))
+
+        sections.append(properties)
+        return b"".join(sections)
+
+    except Exception as e:
+        raise RuntimeError(f"could not encode geometry columns. error: {e}")
+
+@instrumentation.instrumented
+def decode_columns(buffer: typing.Union[bytes, bytearray, memoryview]) -> GeometryColumns:
+    """
+    A function that decodes geometry columns from the compact binary columnar format. The arrays of the returned
+    columns are read-only NumPy views of the given buffer, so no coordinates are copied and the buffer, which may
+    also be a memory map or a shared memory block, must outlive them.
+    """
+    try:
+        magic, version, width, _, geometries, parts, rings, points, propertybytes = COLUMNARHEADER.unpack_from(buffer, 0)
+    except struct.error as e:
+        raise RuntimeError(f"could not decode geometry columns. corrupt header. {e}")
+
+    if magic != COLUMNARMAGIC or version != COLUMNARVERSION:
+        raise RuntimeError(f"could not decode geometry columns. unsupported format {magic!r} version {version}.")
+
+    try:
+        # View every array in place and skip the padding after it
+        offset, arrays = COLUMNARHEADER.size, []
+        offsetstype = numpy.dtype("<i4") if width == 4 else numpy.dtype("<i8")
+        for dtype, count in ((numpy.dtype(numpy.uint8), geometries), (offsetstype, geometries + 1), (offsetstype, parts + 1),
+                             (offsetstype, rings + 1), (numpy.dtype("<f8"), points * 2)):
+            arrays.append(numpy.frombuffer(buffer, dtype=dtype, count=count, offset=offset))
+            offset += count * dtype.itemsize
+            offset += -offset % 8
+
+        properties = None
+        if propertybytes:
+            properties = json.loads(bytes(memoryview(buffer)[offset:offset + propertybytes]))
+
+        types, geometryoffsets, partoffsets, ringoffsets, coordinates = arrays
+        return GeometryColumns(types, geometryoffsets, partoffsets, ringoffsets, coordinates.reshape(-1, 2), properties)
+
+    except Exception as e:
+        raise RuntimeError(f"could not decode geometry columns. error: {e}")
+
+@instrumentation.instrumented
+def generate_wkb_fromcolumns(columns: GeometryColumns) -> typing.List[bytes]:
+    """
+    A function that returns the little endian WKB of every geometry of a collection of geometry columns.
+    The WKB is written directly from the coordinate buffers and is identical to the WKB written by Shapely.
+    """
+    header = struct.Struct("<BI")
+    count = struct.Struct("<I")
+    coordinates = numpy.ascontiguousarray(columns.coordinates, dtype="<f8")
+    ringoffsets, partoffsets, geometryoffsets = columns.ringoffsets.tolist(), columns.partoffsets.tolist(), columns.geometryoffsets.tolist()
+
+    def ring(index: int) -> bytes:
+        return coordinates[ringoffsets[index]:ringoffsets[index + 1]].tobytes()
+
+    def part(code: int, index: int) -> bytes:
+        # Write the points without and the rings of linestrings and polygons with their number of points
+        start, end = partoffsets[index], partoffsets[index + 1]
+        if code == POINT:
+            return header.pack(1, POINT) + ring(start)
+        if code == LINESTRING:
+            return header.pack(1, LINESTRING) + count.pack(ringoffsets[start + 1] - ringoffsets[start]) + ring(start)
+        return header.pack(1, POLYGON) + count.pack(end - start) + b"".join(
+            count.pack(ringoffsets[member + 1] - ringoffsets[member]) + ring(member) for member in range(start, end)
+        )
+
+    blobs = []
+    try:
+        for code, start, end in zip(columns.types.tolist(), geometryoffsets, geometryoffsets[1:]):
+            if code in (POINT, LINESTRING, POLYGON):
+                if start == end:
+                    # Empty points are written with NaN coordinates as by GEOS
+                    blobs.append(header.pack(1, code) + (struct.pack("<2d", numpy.nan, numpy.nan) if code == POINT else count.pack(0)))
+                else:
+                    blobs.append(part(code, start))
+            else:
+                blobs.append(header.pack(1, code) + count.pack(end - start) + b"".join(part(code - 3, index) for index in range(start, end)))
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate wkb. error: {e}")
+
+    return blobs
+
+@instrumentation.instrumented
+def encode_wkbcollection(shapelist: typing.Union[typing.Sequence[shapes.base.BaseGeometry], GeometryColumns]) -> bytes:
+    """
+    A function that encodes a collection of geometries into a single buffer of WKB geometries for bulk transfer.
+    The buffer holds a header with the number of geometries, the 64 bit end offset of every geometry and their WKB.
+    Geometry columns are written directly from their buffers with 'generate_wkb_fromcolumns'.
+    """
+    try:
+        blobs = generate_wkb_fromcolumns(shapelist) if isinstance(shapelist, GeometryColumns) else [shape.wkb for shape in shapelist]
+        offsets = numpy.cumsum([len(blob) for blob in blobs], dtype="<u8")
+        return WKBHEADER.pack(WKBMAGIC, len(blobs)) + offsets.tobytes() + b"".join(blobs)
+
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"could not encode wkb collection. error: {e}")
+
+def decode_wkbcollection(buffer: typing.Union[bytes, bytearray, memoryview]) -> typing.List[memoryview]:
+    """ A function that returns the WKB of every geometry of a WKB collection buffer as views of the buffer, without copying them. """
+    try:
+        magic, count = WKBHEADER.unpack_from(buffer, 0)
+    except struct.error as e:
+        raise RuntimeError(f"could not decode wkb collection. corrupt header. {e}")
+
+    if magic != WKBMAGIC:
+        raise RuntimeError(f"could not decode wkb collection. unsupported format {magic!r}.")
+
+    # Resolve the start and end of every geometry after the header and the offsets
+    start = WKBHEADER.size + count * 8
+    ends = numpy.frombuffer(buffer, dtype="<u8", count=count, offset=WKBHEADER.size).tolist()
+    view = memoryview(buffer)
+    return [view[start + begin:start + end] for begin, end in zip([0] + ends, ends)]
+
+@instrumentation.instrumented
+def generate_shapes_fromwkbcollection(buffer: typing.Union[bytes, bytearray, memoryview]) -> typing.List[shapes.base.BaseGeometry]:
+    """ A function that returns the Shapely Geometries of a WKB collection buffer. """
+    try:
+        return [shapewkb.loads(bytes(blob)) for blob in decode_wkbcollection(buffer)]
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"could not construct shapely geometries. error: {e}")
@@ -0,0 +1,396 @@
+"""
+Terrarium Package
+
+The session module contains the session manager that initializes Earth Engine
+once per process, caches the parsed Service Account credentials and routes calls
+across named sessions bound to different projects. Requests are sent on a pooled
+HTTP transport and the cost of every phase is reported to timing hooks.
+"""
+from __future__ import annotations
+
+import os
+import time
+import queue
+import socket
+import typing
+import threading
+import functools
+import contextlib
+import contextvars
+
+from . import lazyload
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+httplib2 = lazyload.lazy_import("httplib2")
+
+# The header that sets the project that is charged for the quota of a request
+USERPROJECT_HEADER = "x-goog-user-project"
+
+
+class Timing(typing.NamedTuple):
+    """
+    A class that represents the cost in seconds of a phase of a session. The phase is one of 'credentials',
+    'initialize', 'wait' for a pooled connection, 'connect' for opening a connection or 'request' for the full
+    request. The session is None for phases that are not done while a session is acquired.
+    """
+    session: typing.Optional[str]
+    phase: str
+    seconds: float
+
+
+class Session:
+    """
+    A class of a named session bound to an Earth Engine project. Calls made while the session is
+    acquired from its manager are sent to its project. 'inflight' is the number of calls in progress
+    and 'weight' scales the share of the calls that the session is routed when it is the least loaded.
+    """
+    def __init__(self, name: str, project: str, weight: float = 1.0):
+        self.name = name
+        self.project = project
+        self.weight = weight
+        self.inflight = 0
+        self.calls = 0
+
+    @property
+    def load(self) -> float:
+        """ A property that returns the number of calls in progress scaled by the weight of the session. """
+        return self.inflight / self.weight
+
+# The session acquired in the current context
+_currentsession = contextvars.ContextVar("terrarium_session", default=None)
+
+# The parsed credentials keyed by the path and modification time of their key file
+_credentials = {}
+_credentialslock = threading.Lock()
+
+def load_credentials(keyfile: str = None) -> ee.ServiceAccountCredentials:
+    """
+    A function that returns the Service Account credentials parsed from a key file. The key file defaults to the
+    'GOOGLE_APPLICATION_CREDENTIALS' environment variable. Credentials are cached by the path and modification time
+    of the key file, so the file is only read again when it changes.
+    """
+    try:
+        # Retrieve the location of the credentials file and its modification time
+        keyfile = keyfile or os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+        path, modified = os.path.realpath(keyfile), os.stat(keyfile).st_mtime_ns
+
+    except KeyError:
+        raise RuntimeError(f"could not load credentials. cannot find credentials")
+    except OSError as e:
+        raise RuntimeError(f"could not load credentials. error: {e}")
+
+    with _credentialslock:
+        credentials = _credentials.get((path, modified))
+        if credentials is None:
+            try:
+                # Construct the Service Account Credentials from the credentials file
+                credentials = ee.ServiceAccountCredentials(email=None, key_file=path)
+            except Exception as e:
+                raise RuntimeError(f"could not load credentials. error: {e}")
+
+            # Replace the credentials of earlier versions of the key file
+            for key in [key for key in _credentials if key[0] == path]:
+                del _credentials[key]
+            _credentials[(path, modified)] = credentials
+
+        return credentials
+
+# The time spent opening connections by the requests of the current thread
+_connecting = threading.local()
+
+@functools.lru_cache(maxsize=None)
+def _generate_connectiontypes() -> typing.Dict[str, type]:
+    """
+    A function that returns the httplib2 connection classes by scheme that record the time spent opening connections.
+    Nagle's algorithm is disabled on the connections, as requests are written as separate header and body segments
+    that would otherwise wait for the delayed acknowledgement of the server on reused connections.
+    """
+    def timed(connectiontype: type) -> type:
+        class TimedConnection(connectiontype):
+            def connect(self):
+                started = time.perf_counter()
+                try:
+                    super().connect()
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                finally:
+                    _connecting.seconds = getattr(_connecting, "seconds", 0.0) + time.perf_counter() - started
+
+        return TimedConnection
+
+    return {"http": timed(httplib2.HTTPConnectionWithTimeout), "https": timed(httplib2.HTTPSConnectionWithTimeout)}
+
+
+class PooledTransport:
+    """
+    A class of the thread-safe HTTP transport used by the Earth Engine client.
+
+    Requests are sent on a pool of at most 'poolsize' httplib2 clients that keep their connections alive,
+    so concurrent requests never share a client and connections are reused by later requests. Idle clients
+    are reused most recent first to keep the number of open connections low. Requests made while a session
+    is acquired are charged to its project. The time spent waiting for a client, opening connections and
+    completing every request is reported to 'timer' with the phase and the seconds.
+    """
+    def __init__(self, poolsize: int = 8, timeout: float = 60.0, timer: typing.Callable[[str, float], None] = None):
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.timer = timer
+        self.clients = 0
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(poolsize)
+        self._lock = threading.Lock()
+
+    def _checkout(self) -> httplib2.Http:
+        """ A method that waits for a free slot of the pool and returns an idle client or a new one. """
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.clients += 1
+            return httplib2.Http(timeout=self.timeout)
+
+    def _checkin(self, client: httplib2.Http):
+        """ A method that returns a client to the pool. """
+        self._idle.put(client)
+        self._slots.release()
+
+    def request(self, uri: str, method: str = "GET", body: typing.Any = None, headers: dict = None,
+                redirections: int = 5, connection_type: type = None, **kwargs) -> typing.Tuple[typing.Any, bytes]:
+        """ A method that sends a request on a pooled client with the interface of 'httplib2.Http.request'. """
+        # Charge the request to the project of the acquired session
+        session = _currentsession.get()
+        if session is not None:
+            headers = {key: value for key, value in (headers or {}).items() if key.lower() != USERPROJECT_HEADER}
+            headers[USERPROJECT_HEADER] = session.project
+
+        started = time.perf_counter()
+        client = self._checkout()
+        waited = time.perf_counter() - started
+        _connecting.seconds = 0.0
+
+        try:
+            # Send the request with the connection class that records the time spent connecting
+            connection_type = connection_type or _generate_connectiontypes().get(uri.split(":", 1)[0].lower())
+            return client.request(uri, method, body, headers, redirections, connection_type, **kwargs)
+
+        finally:
+            elapsed = time.perf_counter() - started
+            self._checkin(client)
+
+            if self.timer is not None:
+                self.timer("wait", waited)
+                if _connecting.seconds:
+                    self.timer("connect", _connecting.seconds)
+                self.timer("request", elapsed)
+
+    def close(self):
+        """ A method that closes the connections of every idle client. """
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                return
+
+            for connection in client.connections.values():
+                connection.close()
+            client.connections.clear()
+            with self._lock:
+                self.clients -= 1
+
+# Whether the Earth Engine client builds its project paths from the acquired session
+_resolverinstalled = False
+_resolverlock = threading.Lock()
+
+def _install_projectresolver():
+    """
+    A function that makes the Earth Engine client build the project path of its calls, such as computations and
+    exports, from the session acquired in the current context and from its initialized project otherwise.
+
+    The client takes the project of most calls from its process-wide state and offers no way to pass it per call,
+    so the private function that builds the project path is replaced. Installing the resolver fails with an error
+    if the client no longer has that function or if it does not resolve to the replacement, rather than sending
+    every call to the initialized project unnoticed.
+    """
+    global _resolverinstalled
+    with _resolverlock:
+        if _resolverinstalled:
+            return
+
+        original = getattr(ee.data, "_get_projects_path", None)
+        if not callable(original):
+            raise RuntimeError("could not install project resolver. earth engine client does not build project paths "
+                               f"with '_get_projects_path' (earthengine-api {getattr(ee, '__version__', 'unknown')})")
+
+        def resolve() -> str:
+            session = _currentsession.get()
+            return f"projects/{session.project}" if session is not None else original()
+
+        ee.data._get_projects_path = resolve
+
+        # Check that the project path is now built from the acquired session
+        token = _currentsession.set(Session("probe", "terrarium-probe"))
+        try:
+            resolved = ee.data._get_projects_path()
+        finally:
+            _currentsession.reset(token)
+
+        if resolved != "projects/terrarium-probe":
+            ee.data._get_projects_path = original
+            raise RuntimeError(f"could not install project resolver. project path resolved to '{resolved}'")
+
+        _resolverinstalled = True
+
+class SessionManager:
+    """
+    A class that manages the Earth Engine sessions of a process.
+
+    Earth Engine is initialized once on first use with the credentials from 'keyfile' and the project of the first
+    session, and safely so when many threads race to use it. The Earth Engine client holds a single set of credentials
+    per process, so sessions share them and differ by the project their calls are sent to, and a single manager
+    should be used per process, such as the one returned by 'get_manager'.
+
+    Calls are bound to a session with 'acquire', either by name or by routing them to the least loaded session.
+    The binding follows the context of the caller and is not inherited by threads started inside it.
+    Every finished phase is passed to the hooks added with 'add_timinghook' as a 'Timing'.
+    """
+    def __init__(self, keyfile: str = None, poolsize: int = 8, timeout: float = 60.0):
+        self.keyfile = keyfile
+        self.sessions = {}
+        self.transport = PooledTransport(poolsize, timeout, self._record)
+        self.timinghooks = []
+
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._routelock = threading.Lock()
+
+    def add_session(self, name: str, project: str, weight: float = 1.0) -> Session:
+        """ A method that adds a session with the given name that is bound to a project and returns it. """
+        with self._routelock:
+            if name in self.sessions:
+                raise RuntimeError(f"could not add session. session '{name}' already exists.")
+
+            session = self.sessions[name] = Session(name, project, weight)
+            return session
+
+    def get_session(self, name: str) -> Session:
+        """ A method that returns the session with the given name. """
+        try:
+            return self.sessions[name]
+        except KeyError:
+            raise RuntimeError(f"could not get session. session '{name}' does not exist.")
+
+    def add_timinghook(self, hook: typing.Callable[[Timing], None]):
+        """ A method that adds a callable that is called with the 'Timing' of every finished phase. """
+        self.timinghooks.append(hook)
+
+    def _record(self, phase: str, seconds: float):
+        """ A method that passes the timing of a phase of the acquired session to the timing hooks. """
+        session = _currentsession.get()
+        timing = Timing(session.name if session is not None else None, phase, seconds)
+        for hook in self.timinghooks:
+            hook(timing)
+
+    @property
+    def initialized(self) -> bool:
+        """ A property that returns whether Earth Engine has been initialized by the manager. """
+        return self._initialized
+
+    def initialize(self):
+        """ A method that initializes Earth Engine with the project of the first session if it is not already initialized. """
+        # Check without the lock first, so that initialized managers do not contend on it
+        if self._initialized:
+            return
+
+        with self._lock:
+            if self._initialized:
+                return
+
+            if not self.sessions:
+                raise RuntimeError("could not initialize earth engine. no sessions have been added.")
+            project = next(iter(self.sessions.values())).project
+
+            try:
+                # Retrieve the Service Account Credentials
+                started = time.perf_counter()
+                credentials = load_credentials(self.keyfile)
+                self._record("credentials", time.perf_counter() - started)
+
+                # Route the project of every call through the acquired session before any call is made
+                _install_projectresolver()
+
+                # Authenticate with Earth Engine and initialize the session on the pooled transport
+                started = time.perf_counter()
+                with instrumentation.roundtrip("earthengine", "initialize"):
+                    ee.Initialize(credentials=credentials, project=project, http_transport=self.transport)
+                self._record("initialize", time.perf_counter() - started)
+
+            except RuntimeError as e:
+                raise RuntimeError(f"could not initialize earth engine. {e}")
+            except Exception as e:
+                raise RuntimeError(f"could not initialize earth engine. error: {e}")
+
+            self._initialized = True
+
+    def _leastloaded(self) -> Session:
+        """ A method that returns the least loaded session, preferring the session with the fewest calls on ties. """
+        if not self.sessions:
+            raise RuntimeError("could not route call. no sessions have been added.")
+        return min(self.sessions.values(), key=lambda session: (session.load, session.calls))
+
+    def route(self) -> Session:
+        """ A method that returns the session that the next call without a session name would be routed to. """
+        with self._routelock:
+            return self._leastloaded()
+
+    @contextlib.contextmanager
+    def acquire(self, name: str = None) -> typing.Iterator[Session]:
+        """
+        A method that returns a context manager that binds the Earth Engine calls made inside it to a session.
+        The session with the given name is used or the least loaded session if no name is given.
+        Earth Engine is initialized on the first call.
+        """
+        self.initialize()
+
+        with self._routelock:
+            session = self.get_session(name) if name is not None else self._leastloaded()
+            session.inflight += 1
+            session.calls += 1
+
+        token = _currentsession.set(session)
+        try:
+            yield session
+
+        finally:
+            _currentsession.reset(token)
+            with self._routelock:
+                session.inflight -= 1
+
+    def call(self, function: typing.Callable, *args, **kwargs) -> typing.Any:
+        """ A method that calls a function with its Earth Engine calls bound to the least loaded session. """
+        with self.acquire():
+            return function(*args, **kwargs)
+
+def current_session() -> typing.Optional[Session]:
+    """ A function that returns the session acquired in the current context or None. """
+    return _currentsession.get()
+
+# The default session manager of the process
+_manager = None
+_managerlock = threading.Lock()
+
+def get_manager() -> SessionManager:
+    """ A function that returns the default SessionManager. It is created on first use unless one was set with 'set_manager'. """
+    global _manager
+    with _managerlock:
+        if _manager is None:
+            _manager = SessionManager()
+
+        return _manager
+
+def set_manager(manager: typing.Optional[SessionManager]):
+    """ A function that replaces the default SessionManager. Passing None resets it to be recreated on next use. """
+    global _manager
+    with _managerlock:
+        _manager = manager
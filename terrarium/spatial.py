@@ -4,22 +4,42 @@ Terrarium Package
 The spatial module contains function required 
 for geometric and spatial manipulations.
 """
-import os
+from __future__ import annotations
+
 import json
 import math
 import typing
+import hashlib
 import functools
 
-import ee
-import area
-import pyproj
-import googlemaps
+from . import lazyload
+from . import caching
+from . import geocoding
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+area = lazyload.lazy_import("area")
+numpy = lazyload.lazy_import("numpy")
+pyproj = lazyload.lazy_import("pyproj")
+shapeops = lazyload.lazy_import("shapely.ops")
+shapes = lazyload.lazy_import("shapely.geometry")
+
+# The approximate length of a degree of latitude or of longitude at the equator in meters
+DEGREE_METERS = 111320.0
+
+# The share of the error bound of a geometry preparation that is spent on simplification, the rest is spent on quantization
+SIMPLIFYSHARE = 0.75
 
-import shapely.ops as shapeops
-import shapely.geometry as shapes
+# The prepared geometries keyed by the hash of the geometry and the error bound
+geometrycache = caching.LRUCache(capacity=1024)
 
-def generate_earthenginegeometry_fromgeojson(geojson: str) -> ee.Geometry:
-    """ A function that returns an Earth Engine Geometry for a given GeoJSON string. """
+@instrumentation.instrumented
+def generate_earthenginegeometry_fromgeojson(geojson: str, tolerance: float = None) -> ee.Geometry:
+    """
+    A function that returns an Earth Engine Geometry for a given GeoJSON string.
+    If a 'tolerance' in meters is given, the polygon is prepared with 'prepare_geometry' before it is
+    constructed so that its outline deviates by at most the tolerance from the given one.
+    """
     try:
         geodata = json.loads(geojson)
         coordinates = geodata['features'][0]['geometry']['coordinates'][0]
@@ -31,6 +51,11 @@ def generate_earthenginegeometry_fromgeojson(geojson: str) -> ee.Geometry:
     except json.JSONDecodeError as e:
         raise RuntimeError(f"could not parse geojson. {e}.")
 
+    if tolerance is not None:
+        # Simplify and quantize the outline of the polygon within the tolerance
+        prepared = prepare_geometry(shapes.Polygon(coordinates), tolerance)
+        coordinates = [list(coordinate) for coordinate in prepared.shape.exterior.coords]
+
     try:
         geometry = ee.Geometry.Polygon(coordinates)
         return geometry
@@ -38,6 +63,31 @@ def generate_earthenginegeometry_fromgeojson(geojson: str) -> ee.Geometry:
     except Exception as e:
         raise RuntimeError(f"could not construct ee.Geometry. {e}")
 
+@instrumentation.instrumented
+def generate_geometryhash(geometry: typing.Union[ee.Geometry, shapes.base.BaseGeometry]) -> str:
+    """ 
+    A function that returns a canonical SHA-256 hash of an Earth Engine or Shapely Geometry.
+    Geometries with the same GeoJSON representation have the same hash. Computed Earth Engine 
+    Geometries that have no client side GeoJSON are hashed by their serialized graph.
+    """
+    try:
+        if isinstance(geometry, shapes.base.BaseGeometry):
+            # Use the GeoJSON mapping of the Shapely Geometry
+            canonical = json.dumps(shapes.mapping(geometry), sort_keys=True)
+        else:
+            try:
+                # Use the client side GeoJSON of the Earth Engine Geometry
+                canonical = json.dumps(geometry.toGeoJSON(), sort_keys=True)
+            except ee.EEException:
+                # Fall back on the serialized graph of computed geometries
+                canonical = geometry.serialize()
+
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate geometry hash. error: {e}")
+
+@instrumentation.instrumented
 def generate_earthenginegeometry_frombounds(west: float, south: float, east: float, north: float) -> ee.Geometry:
     """ A function that returns an Earth Engine Geometry for a given 4 bounding points. """
     try:
@@ -47,6 +97,7 @@ def generate_earthenginegeometry_frombounds(west: float, south: float, east: flo
     except Exception as e:
         raise RuntimeError(f"could not construct ee.Geometry. {e}")
 
+@instrumentation.instrumented
 def generate_shape_fromgeojson(geojson: str) -> typing.Union[shapes.Point, shapes.Polygon, shapes.LineString]:
     """ A function that returns a Shapely Geometry for a given GeoJSON string. """
     try:
@@ -67,6 +118,7 @@ def generate_shape_fromgeojson(geojson: str) -> typing.Union[shapes.Point, shape
     except Exception as e:
         raise RuntimeError(f"could not construct shapely geometry. {e}")
 
+@instrumentation.instrumented
 def generate_geojson_fromshape(shape: shapes.shape) -> str:
     """ A function that returns a GeoJSON string for a given Shapely Geometry. """
     if not isinstance(shape, (shapes.Point, shapes.Polygon, shapes.LineString)):
@@ -90,6 +142,7 @@ def generate_geojson_fromshape(shape: shapes.shape) -> str:
     except Exception as e:
         raise RuntimeError(f"could not generate geojson. error: {e}")
 
+@instrumentation.instrumented
 def generate_area(shape: shapes.Polygon) -> dict:
     """ A function that returns a mapping of area units to the area for a given Shapely Geometry. """
     if not isinstance(shape, shapes.Polygon):
@@ -112,6 +165,7 @@ def generate_area(shape: shapes.Polygon) -> dict:
     except Exception as e:
         raise RuntimeError(f"could not calculate area conversions. error: {e}")
 
+@instrumentation.instrumented
 def generate_centroid(shape: shapes.Polygon) -> dict:
     """ A function that returns the centroid coordinates for a given Shapely Geometry as a mapping. """
     if not isinstance(shape, shapes.Polygon):
@@ -129,28 +183,326 @@ def generate_centroid(shape: shapes.Polygon) -> dict:
     except Exception as e:
         raise RuntimeError(f"could not generate centroid. error: {e}")
 
-def generate_location(longitude: float, latitude: float) -> dict:
-    """ A function that returns the location address for a given set of coordinates as longitude and latitude values. """
+def generate_coordinatebuffers(shapelist: typing.Sequence[shapes.Polygon]) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ 
+    A function that flattens a sequence of Shapely Polygons into contiguous coordinate buffers.
+
+    Returns a tuple of a (N, 2) float64 array of longitude and latitude values, an array of ring offsets
+    into the coordinates and an array of polygon offsets into the rings. The first ring of every polygon
+    is its exterior and any following rings are its interiors.
+    """
+    coordinates, ringsizes, polygonsizes = [], [], []
+
+    for shape in shapelist:
+        if not isinstance(shape, shapes.Polygon):
+            raise RuntimeError("could not generate coordinate buffers. not a shapely polygon")
+
+        # Accumulate the exterior and interior rings of the polygon
+        rings = [shape.exterior, *shape.interiors]
+        for ring in rings:
+            ringcoords = numpy.asarray(ring.coords, dtype=numpy.float64)[:, :2]
+            coordinates.append(ringcoords)
+            ringsizes.append(len(ringcoords))
+
+        polygonsizes.append(len(rings))
+
     try:
-        # Retrieve the Google Maps Geocoding API Key
-        geocodingapikey = os.environ['MAPS_APIKEY']
-        # Create the Google Maps Client
-        gmaps = googlemaps.Client(key=geocodingapikey)
+        # Concatenate the coordinates and accumulate the sizes into offsets
+        coordinates = numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2), dtype=numpy.float64)
+        ringoffsets = numpy.concatenate([[0], numpy.cumsum(ringsizes, dtype=numpy.int64)])
+        polygonoffsets = numpy.concatenate([[0], numpy.cumsum(polygonsizes, dtype=numpy.int64)])
+        return coordinates, ringoffsets, polygonoffsets
 
-    except KeyError:
-        raise RuntimeError(f"could not setup maps client. geocoding API key is not set in environment variables.")
     except Exception as e:
-        raise RuntimeError(f"could not setup maps client. error: {e}")
+        raise RuntimeError(f"could not generate coordinate buffers. error: {e}")
+
+def _generate_ringindices(ringoffsets: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ A function that returns the ring index, previous vertex index and next vertex index for every vertex in the coordinate buffers. """
+    starts, sizes = ringoffsets[:-1], numpy.diff(ringoffsets)
+    # Assign every vertex to its ring and calculate its position within the ring
+    ringindex = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    position = numpy.arange(ringoffsets[-1]) - starts[ringindex]
+    # Calculate the cyclic neighbours of every vertex within its ring
+    previous = starts[ringindex] + (position - 1) % sizes[ringindex]
+    following = starts[ringindex] + (position + 1) % sizes[ringindex]
+    return ringindex, previous, following
+
+@instrumentation.instrumented
+def generate_areas_fromarrays(coordinates: numpy.ndarray, ringoffsets: numpy.ndarray, polygonoffsets: numpy.ndarray) -> typing.Dict[str, numpy.ndarray]:
+    """ 
+    A function that returns a mapping of area units to an array of areas for polygons stored in coordinate buffers.
+    The buffers follow the layout returned by 'generate_coordinatebuffers'. The areas are calculated in a single 
+    vectorized pass with the same spherical approximation used by the 'area' package in 'generate_area'.
+    """
+    try:
+        coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+        ringoffsets = numpy.asarray(ringoffsets, dtype=numpy.int64)
+        polygonoffsets = numpy.asarray(polygonoffsets, dtype=numpy.int64)
+
+        # Calculate the signed area contribution of every vertex
+        ringindex, previous, following = _generate_ringindices(ringoffsets)
+        radians = numpy.radians(coordinates)
+        terms = (radians[following, 0] - radians[previous, 0]) * numpy.sin(radians[:, 1])
+
+        # Accumulate the contributions into the area of every ring
+        ringcount = len(ringoffsets) - 1
+        ringareas = numpy.abs(numpy.bincount(ringindex, weights=terms, minlength=ringcount)) * area.WGS84_RADIUS ** 2 / 2
+        # Rings with fewer than 3 vertices have no area
+        ringareas[numpy.diff(ringoffsets) <= 2] = 0
+
+        # Subtract the interior rings from the exterior ring of every polygon
+        polygonsizes = numpy.diff(polygonoffsets)
+        polygonindex = numpy.repeat(numpy.arange(len(polygonsizes)), polygonsizes)
+        signs = numpy.where(numpy.arange(ringcount) == polygonoffsets[polygonindex], 1.0, -1.0)
+        geoarea = numpy.bincount(polygonindex, weights=ringareas * signs, minlength=len(polygonsizes))
+
+    except Exception as e:
+        raise RuntimeError(f"could not calculate areas. error: {e}")
 
     try:
-        # Perform a reverse geocode lookup for the coordinates
-        result = gmaps.reverse_geocode((latitude, longitude), language="English", location_type="APPROXIMATE", result_type=f"administrative_area_level_2")
-        # Retrieve the formatted address from the result and return it
-        return result[0]["formatted_address"] if result else "limbo"
+        conversion = {"SQM": 1, "SQKM": 0.000001, "ACRE": 0.000247, "HA": 0.0001}
+        # Create a dictionary with units as key and the corresponding area array as the value
+        return {key: numpy.round(value * geoarea, 3) for key, value in conversion.items()}
 
+    except Exception as e:
+        raise RuntimeError(f"could not calculate area conversions. error: {e}")
+
+@instrumentation.instrumented
+def generate_areas(shapelist: typing.Sequence[shapes.Polygon]) -> typing.Dict[str, numpy.ndarray]:
+    """ A function that returns a mapping of area units to an array of areas for a sequence of Shapely Polygons. """
+    return generate_areas_fromarrays(*generate_coordinatebuffers(shapelist))
+
+@instrumentation.instrumented
+def generate_centroids_fromarrays(coordinates: numpy.ndarray, ringoffsets: numpy.ndarray, polygonoffsets: numpy.ndarray) -> typing.Dict[str, numpy.ndarray]:
+    """ 
+    A function that returns the centroid coordinates for polygons stored in coordinate buffers as a mapping of arrays.
+    The buffers follow the layout returned by 'generate_coordinatebuffers'. The centroids are planar centroids in 
+    longitude and latitude, the same as the Shapely centroid used by 'generate_centroid'.
+    """
+    try:
+        coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+        ringoffsets = numpy.asarray(ringoffsets, dtype=numpy.int64)
+        polygonoffsets = numpy.asarray(polygonoffsets, dtype=numpy.int64)
+
+        # Assign every ring and vertex to its polygon
+        polygonsizes = numpy.diff(polygonoffsets)
+        ringpolygon = numpy.repeat(numpy.arange(len(polygonsizes)), polygonsizes)
+        ringindex, _, following = _generate_ringindices(ringoffsets)
+        vertexpolygon = ringpolygon[ringindex]
+
+        # Shift every polygon to its first vertex for numerical stability
+        origins = coordinates[ringoffsets[polygonoffsets[:-1]]]
+        shifted = coordinates - origins[vertexpolygon]
+        x, y = shifted[:, 0], shifted[:, 1]
+        nx, ny = shifted[following, 0], shifted[following, 1]
+
+        # Calculate the shoelace cross product and moments of every edge
+        cross = x * ny - nx * y
+        ringcount = len(ringoffsets) - 1
+        ringarea = numpy.bincount(ringindex, weights=cross, minlength=ringcount) / 2
+        ringmomentx = numpy.bincount(ringindex, weights=(x + nx) * cross, minlength=ringcount) / 6
+        ringmomenty = numpy.bincount(ringindex, weights=(y + ny) * cross, minlength=ringcount) / 6
+
+        # Orient the exterior rings positively and the interior rings negatively
+        exterior = numpy.arange(ringcount) == polygonoffsets[ringpolygon]
+        orientation = numpy.sign(ringarea) * numpy.where(exterior, 1.0, -1.0)
+
+        # Accumulate the oriented ring moments into the centroid of every polygon
+        polygonarea = numpy.bincount(ringpolygon, weights=ringarea * orientation, minlength=len(polygonsizes))
+        centroidx = numpy.bincount(ringpolygon, weights=ringmomentx * orientation, minlength=len(polygonsizes)) / polygonarea
+        centroidy = numpy.bincount(ringpolygon, weights=ringmomenty * orientation, minlength=len(polygonsizes)) / polygonarea
+
+        # Generate the mapping and return it
+        return {
+            "longitude": centroidx + origins[:, 0],
+            "latitude": centroidy + origins[:, 1]
+        }
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate centroids. error: {e}")
+
+@instrumentation.instrumented
+def generate_centroids(shapelist: typing.Sequence[shapes.Polygon]) -> typing.Dict[str, numpy.ndarray]:
+    """ A function that returns the centroid coordinates for a sequence of Shapely Polygons as a mapping of arrays. """
+    return generate_centroids_fromarrays(*generate_coordinatebuffers(shapelist))
+
+@instrumentation.instrumented
+def generate_location(longitude: float, latitude: float) -> str:
+    """ 
+    A function that returns the location address for a given set of coordinates as longitude and latitude values.
+    Lookups are served by the default Geocoder which reuses its Maps client and caches addresses by geohash cell.
+    """
+    try:
+        # Retrieve the default geocoder
+        geocoder = geocoding.get_geocoder()
+        # Resolve the location address for the coordinates and return it
+        return geocoder.locate(longitude, latitude)
+
+    except RuntimeError:
+        raise
     except Exception as e:
         raise RuntimeError(f"could not generate geocoded address. error: {e}")
 
+@instrumentation.instrumented
+def generate_locations(points: typing.Sequence[typing.Tuple[float, float]]) -> typing.List[str]:
+    """ 
+    A function that returns the location addresses for a sequence of (longitude, latitude) points.
+    Only the points that are not already cached are sent to the geocoding backend.
+    """
+    try:
+        # Retrieve the default geocoder
+        geocoder = geocoding.get_geocoder()
+        # Resolve the location addresses for all the points and return them
+        return geocoder.locate_many(points)
+
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"could not generate geocoded addresses. error: {e}")
+
+# The PROJ string for WGS84 longitude and latitude coordinates
+WGS84_PROJ = "+proj=longlat +datum=WGS84"
+
+@functools.lru_cache(maxsize=256)
+def get_transformer(source: str, target: str) -> pyproj.Transformer:
+    """ 
+    A function that returns a cached pyproj Transformer between two CRS definitions.
+    Coordinates are always in (x, y) or (longitude, latitude) order.
+    """
+    return pyproj.Transformer.from_crs(pyproj.CRS.from_user_input(source), pyproj.CRS.from_user_input(target), always_xy=True)
+
+def generate_utmcrs(longitude: float, latitude: float) -> str:
+    """ A function that returns the EPSG code of the WGS84 UTM zone that contains the given coordinates. """
+    zone = min(int((longitude + 180) // 6) + 1, 60)
+    return f"EPSG:{32600 + zone if latitude >= 0 else 32700 + zone}"
+
+@functools.lru_cache(maxsize=16)
+def get_geod(ellps: str = "WGS84") -> pyproj.Geod:
+    """ A function that returns a cached pyproj Geod for the given ellipsoid. """
+    return pyproj.Geod(ellps=ellps)
+
+class PreparedGeometry(typing.NamedTuple):
+    """
+    A class that represents a geometry prepared by 'prepare_geometry'. The 'shape' deviates by at most 'tolerance' meters
+    from the original geometry and its coordinates are rounded to 'precision' decimals. The 'vertices' and the 'payload'
+    bytes of the GeoJSON coordinates are the (original, prepared) counts and report the savings of the preparation.
+    """
+    shape: shapes.base.BaseGeometry
+    tolerance: float
+    precision: int
+    vertices: typing.Tuple[int, int]
+    payload: typing.Tuple[int, int]
+
+    @property
+    def savings(self) -> dict:
+        """ A mapping of the number of vertices and payload bytes saved by the preparation and their share of the original. """
+        return {
+            "vertices": self.vertices[0] - self.vertices[1],
+            "bytes": self.payload[0] - self.payload[1],
+            "vertexratio": 1 - self.vertices[1] / self.vertices[0],
+            "byteratio": 1 - self.payload[1] / self.payload[0],
+        }
+
+def _generate_coordinatestats(shape: shapes.base.BaseGeometry) -> typing.Tuple[int, int]:
+    """ A function that returns the number of vertices of a Shapely Geometry and the size in bytes of its GeoJSON coordinates. """
+    coordinates = shapes.mapping(shape)["coordinates"]
+
+    def count(coordinates) -> int:
+        return 1 if isinstance(coordinates[0], (int, float)) else sum(count(part) for part in coordinates)
+
+    return count(coordinates), len(json.dumps(coordinates))
+
+def _simplify_shape(shape: shapes.base.BaseGeometry, tolerance: float) -> shapes.base.BaseGeometry:
+    """
+    A function that simplifies a Shapely Geometry with the topology preserving simplifier. The rings of polygons are
+    simplified together as closed lines, which keep their endpoints and cannot cross each other, so that no vertex
+    deviates by more than the tolerance. Rings that would collapse below four vertices are kept whole.
+    """
+    if shape.geom_type not in ("Polygon", "MultiPolygon"):
+        return shape.simplify(tolerance, preserve_topology=True)
+
+    polygons = [shape] if shape.geom_type == "Polygon" else list(shape.geoms)
+    rings = [[polygon.exterior, *polygon.interiors] for polygon in polygons]
+    lines = shapes.MultiLineString([ring.coords for polygon in rings for ring in polygon]).simplify(tolerance, preserve_topology=True)
+
+    # Rebuild the polygons from their simplified rings
+    simplified, lines = [], iter(lines.geoms if lines.geom_type == "MultiLineString" else [lines])
+    for polygon in rings:
+        coordinates = [line.coords if len(line.coords) >= 4 else ring.coords for ring, line in zip(polygon, lines)]
+        simplified.append(shapes.Polygon(coordinates[0], coordinates[1:]))
+
+    return simplified[0] if shape.geom_type == "Polygon" else shapes.MultiPolygon(simplified)
+
+def _quantize_shape(shape: shapes.base.BaseGeometry, precision: int) -> shapes.base.BaseGeometry:
+    """ A function that rounds the coordinates of a Shapely Geometry to 'precision' decimals and drops the repeated vertices. """
+    quantized = shapeops.transform(lambda x, y, z=None: (numpy.round(x, precision), numpy.round(y, precision)), shape)
+    return quantized.simplify(0, preserve_topology=True)
+
+def generate_quantizationprecision(tolerance: float) -> int:
+    """ A function that returns the fewest decimals that WGS84 coordinates can be rounded to while moving by at most 'tolerance' meters. """
+    # Rounding moves a coordinate by at most half a step along both axes
+    return max(0, math.ceil(math.log10(math.sqrt(2) / 2 * DEGREE_METERS / tolerance)))
+
+@instrumentation.instrumented
+def prepare_geometry(shape: shapes.base.BaseGeometry, tolerance: float = 1.0) -> PreparedGeometry:
+    """
+    A function that prepares a Shapely Geometry in WGS84 coordinates for Earth Engine by reducing its vertices and the
+    precision of its coordinates while its outline deviates by at most 'tolerance' meters from the given one.
+
+    Three quarters of the tolerance are spent on a topology preserving simplification in the UTM zone of the geometry
+    and the rest on rounding the coordinates to the fewest decimals within it. Decimals are added while rounding would
+    invalidate the geometry. Prepared geometries are memoized in the 'geometrycache' LRU cache keyed on the SHA-256 hash
+    of the WKB encoding of the geometry and the tolerance.
+    """
+    if tolerance <= 0:
+        raise RuntimeError("could not prepare geometry. tolerance must be positive.")
+    if not isinstance(shape, shapes.base.BaseGeometry) or shape.is_empty or shape.geom_type == "GeometryCollection":
+        raise RuntimeError("could not prepare geometry. not a non-empty shapely geometry with coordinates.")
+
+    # Return the memoized preparation of the geometry if there is one, keyed on the hash of its binary encoding
+    key = (hashlib.sha256(shape.wkb).hexdigest(), tolerance)
+    prepared = geometrycache.get(key)
+    if prepared is not None:
+        return prepared
+
+    try:
+        # Simplify the geometry in meters in its UTM zone
+        centroid = shape.centroid
+        crs = generate_utmcrs(centroid.x, centroid.y)
+        projected = shapeops.transform(get_transformer("EPSG:4326", crs).transform, shape)
+        simplified = _simplify_shape(projected, tolerance * SIMPLIFYSHARE)
+        simplified = shapeops.transform(get_transformer(crs, "EPSG:4326").transform, simplified)
+
+        # Round the coordinates within the rest of the tolerance and add decimals while the rounding invalidates the geometry
+        precision = generate_quantizationprecision(tolerance * (1 - SIMPLIFYSHARE))
+        quantized = _quantize_shape(simplified, precision)
+        while simplified.is_valid and not quantized.is_valid and precision < 15:
+            precision += 1
+            quantized = _quantize_shape(simplified, precision)
+
+    except Exception as e:
+        raise RuntimeError(f"could not prepare geometry. error: {e}")
+
+    # Count the vertices and payload bytes of the original and the prepared geometry
+    original, prepared = _generate_coordinatestats(shape), _generate_coordinatestats(quantized)
+    prepared = PreparedGeometry(quantized, tolerance, precision, (original[0], prepared[0]), (original[1], prepared[1]))
+    geometrycache.put(key, prepared)
+    return prepared
+
+def generate_savingsreport(prepared: typing.Sequence[PreparedGeometry]) -> dict:
+    """ A function that returns a mapping of the total vertices and payload bytes before and after the given preparations and the totals saved. """
+    report = {
+        "geometries": len(prepared),
+        "vertices": sum(geometry.vertices[0] for geometry in prepared),
+        "preparedvertices": sum(geometry.vertices[1] for geometry in prepared),
+        "bytes": sum(geometry.payload[0] for geometry in prepared),
+        "preparedbytes": sum(geometry.payload[1] for geometry in prepared),
+    }
+    report["savedvertices"] = report["vertices"] - report["preparedvertices"]
+    report["savedbytes"] = report["bytes"] - report["preparedbytes"]
+    return report
+
+@instrumentation.instrumented
 def reshape_point(shape: shapes.Point, buffer: int = 2.5) -> shapes.Polygon:
     """ 
     A function that reshapes a Shapely Point into it's Square Bounding Box Polygon. 
@@ -169,27 +521,24 @@ def reshape_point(shape: shapes.Point, buffer: int = 2.5) -> shapes.Polygon:
         raise RuntimeError(f"could not reshape point. could not calculate point metrics. error: {e}.")
 
     try:
-        # Construct the projection partial
-        projection = functools.partial(
-            pyproj.transform, 
-            pyproj.Proj(aeqd_proj), 
-            pyproj.Proj('+proj=longlat +datum=WGS84')
-        )
+        # Retrieve the cached transformer from the projection to WGS84
+        transformer = get_transformer(aeqd_proj, WGS84_PROJ)
 
     except Exception as e:
-        raise RuntimeError(f"could not reshape point. could not construct projecttion partial. error: {e}.")
+        raise RuntimeError(f"could not reshape point. could not construct projection transformer. error: {e}.")
 
     try: 
         # Create an arbitrary point and buffer it as a square
         buffered = shapes.Point(0, 0).buffer(buffer * 1000, cap_style=3)
-        # Transform the arbitrary point with the projection partial
-        buffered = shapeops.transform(projection, buffered)
+        # Transform the arbitrary point with the projection transformer
+        buffered = shapeops.transform(transformer.transform, buffered)
         # Return the reshaped point as polygon
         return buffered
 
     except Exception as e:
         raise RuntimeError(f"could not reshape point. error: {e}.")
 
+@instrumentation.instrumented
 def reshape_polygon(shape: shapes.Polygon) -> shapes.Polygon:
     """ A function that reshapes a Shapely Polygon into it's Square Bounding Box Polygon. """
     if not isinstance(shape, shapes.Polygon):
@@ -210,8 +559,8 @@ def reshape_polygon(shape: shapes.Polygon) -> shapes.Polygon:
         # Create the diagonal shape of the polygon
         diagonal = shapes.LineString([(minx, miny), (maxx,maxy)])
 
-        # Create the projection geod class with the WGS84 ellipsoid
-        wgs84geod = pyproj.Geod(ellps="WGS84")
+        # Retrieve the cached projection geod class with the WGS84 ellipsoid
+        wgs84geod = get_geod("WGS84")
         # Calculate the lenght of the diagonal in meters
         length = wgs84geod.geometry_length(diagonal)
         
@@ -229,6 +578,7 @@ def reshape_polygon(shape: shapes.Polygon) -> shapes.Polygon:
     except Exception as e:
         raise RuntimeError(f"could not reshape polygon. error: {e}")
 
+@instrumentation.instrumented
 def reshape_linestring(shape: shapes.LineString) -> shapes.Polygon:
     """ A function that reshapes a Shapely Polygon into it's Square Bounding Box Polygon. """
     if not isinstance(shape, shapes.LineString):
@@ -242,3 +592,78 @@ def reshape_linestring(shape: shapes.LineString) -> shapes.Polygon:
 
     except Exception as e:
         raise RuntimeError(f"could not reshape linestring. error: {e}.")
+
+
+# The azimuths of the square corners from the center in the order of a Shapely square buffer
+SQUARE_AZIMUTHS = (45.0, 135.0, -135.0, -45.0, 45.0)
+# The tolerance in degrees within which the bulk reshape functions match the single shape functions
+RESHAPE_TOLERANCE = 1e-9
+
+@instrumentation.instrumented
+def reshape_points(longitudes: numpy.ndarray, latitudes: numpy.ndarray, buffers: typing.Union[float, numpy.ndarray] = 2.5) -> numpy.ndarray:
+    """ 
+    A function that reshapes arrays of point coordinates into their Square Bounding Box Polygons in a single vectorized pass.
+    Creates a buffer around each point (2.5 kms by default) which can be a scalar or an array of buffers in kms.
+
+    Returns a (N, 5, 2) array with the closed exterior ring of each square that can be passed to shapes.Polygon.
+    The corners are solved with the direct geodesic problem on the WGS84 ellipsoid, which is how the Azimuthal 
+    Equidistant projection used by 'reshape_point' is defined, and match it within 'RESHAPE_TOLERANCE' degrees.
+    """
+    try:
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64).ravel()
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64).ravel()
+        buffers = numpy.broadcast_to(numpy.asarray(buffers, dtype=numpy.float64), longitudes.shape)
+
+        # Calculate the distance from each center to the square corners in meters
+        distances = numpy.repeat(buffers * 1000 * math.sqrt(2), 5)
+        azimuths = numpy.tile(SQUARE_AZIMUTHS, len(longitudes))
+
+        # Solve the corner coordinates for every point in one call
+        cornerlons, cornerlats, _ = get_geod("WGS84").fwd(numpy.repeat(longitudes, 5), numpy.repeat(latitudes, 5), azimuths, distances)
+        # Return the corner coordinates as closed rings
+        return numpy.stack([cornerlons, cornerlats], axis=-1).reshape(-1, 5, 2)
+
+    except Exception as e:
+        raise RuntimeError(f"could not reshape points. error: {e}.")
+
+@instrumentation.instrumented
+def reshape_bounds(west: numpy.ndarray, south: numpy.ndarray, east: numpy.ndarray, north: numpy.ndarray) -> numpy.ndarray:
+    """ 
+    A function that reshapes arrays of bounding coordinates into their Square Bounding Box Polygons in a single vectorized pass.
+    Each square is centered on its bounds with a buffer of half the geodesic length of the bounds diagonal, as in 'reshape_polygon',
+    and matches it within 'RESHAPE_TOLERANCE' degrees. Returns a (N, 5, 2) array with the closed exterior ring of each square.
+    """
+    try:
+        west, south = numpy.asarray(west, dtype=numpy.float64), numpy.asarray(south, dtype=numpy.float64)
+        east, north = numpy.asarray(east, dtype=numpy.float64), numpy.asarray(north, dtype=numpy.float64)
+
+        # Calculate the length of the diagonals in meters
+        _, _, lengths = get_geod("WGS84").inv(west, south, east, north)
+
+    except Exception as e:
+        raise RuntimeError(f"could not reshape bounds. could not calculate diagonal distances. error: {e}")
+
+    # Reshape the centers with half the diagonal length in kms
+    return reshape_points((west + east) / 2, (south + north) / 2, (lengths / 2) / 1000)
+
+def _generate_bounds(shapelist: typing.Sequence[shapes.base.BaseGeometry]) -> typing.Tuple[numpy.ndarray, ...]:
+    """ A function that returns the arrays of west, south, east and north bounds for a sequence of Shapely Geometries. """
+    bounds = numpy.array([shape.bounds for shape in shapelist], dtype=numpy.float64).reshape(-1, 4)
+    return bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]
+
+@instrumentation.instrumented
+def reshape_polygons(shapelist: typing.Sequence[shapes.Polygon]) -> numpy.ndarray:
+    """ A function that reshapes a sequence of Shapely Polygons into their Square Bounding Box Polygons as a (N, 5, 2) array. """
+    if not all(isinstance(shape, shapes.Polygon) for shape in shapelist):
+        raise RuntimeError("could not reshape polygons. not a shapely polygon")
+
+    return reshape_bounds(*_generate_bounds(shapelist))
+
+@instrumentation.instrumented
+def reshape_linestrings(shapelist: typing.Sequence[shapes.LineString]) -> numpy.ndarray:
+    """ A function that reshapes a sequence of Shapely LineStrings into their Square Bounding Box Polygons as a (N, 5, 2) array. """
+    if not all(isinstance(shape, shapes.LineString) for shape in shapelist):
+        raise RuntimeError("could not reshape linestrings. not a shapely linestring")
+
+    # The envelope of a linestring shares its bounds
+    return reshape_bounds(*_generate_bounds(shapelist))
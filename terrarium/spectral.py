@@ -4,12 +4,44 @@ Terrarium Package
 The spectral module contains functions for generating
 various spectral manipulation on acquisition images.
 """
-import ee
+from __future__ import annotations
+
+import json
+import typing
 import datetime
+import functools
 
+from . import lazyload
 from . import palette
+from . import spatial
+from . import caching
 from . import temporal
+from . import cloudcover
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+
+class SpectralGraph:
+    """
+    A class that holds a constructed spectral image along with its serialized Earth Engine graph.
+    The graph is serialized in the Cloud API format once, on first access, and the encoded 
+    'expression' can be passed to 'export.export_image' to avoid serializing the image again.
+    """
+    def __init__(self, image: ee.Image):
+        self.image = image
 
+    @functools.cached_property
+    def serialized(self) -> str:
+        return self.image.serialize(for_cloud_api=True)
+
+    @functools.cached_property
+    def expression(self) -> dict:
+        return json.loads(self.serialized)
+
+# The LRU cache of spectral graphs keyed by date, geometry hash and index
+graphcache = caching.LRUCache(capacity=256)
+
+@instrumentation.instrumented
 def truecolor_algorithm(image: ee.Image) -> ee.Image:
     """ 
     An algorithm that takes in an ee.Image and outputs an ee.Image. 
@@ -28,25 +60,9 @@ def truecolor_algorithm(image: ee.Image) -> ee.Image:
     The images are upsampled using bicubic interpolation at a 
     1m spatial resolution and then reprojected to the EPSG:4326 CRS.
     """
-    try:
-        # Isolate the True Color band components of the Image
-        tcbase = image.select('TCI_R', 'TCI_G', 'TCI_B')
-
-    except ee.EEException as e:
-        raise ee.EEException(f"true color composition failed. {e}")
-
-    try:
-        # Upsample the true color image with bicubic interpolation
-        upsampled = tcbase.resample('bicubic')
-        # Reproject the upsampled image to it's native CRS at a 1m scale.
-        tc = upsampled.reproject(tcbase.projection(), scale=1)
-
-    except ee.EEException as e:
-        raise ee.EEException(f"true color upsampling failed. {e}")
-
-    # Return the final true color image
-    return tc
+    return generate_index_algorithm("TCI")(image)
 
+@instrumentation.instrumented
 def ndvi_algorithm(image: ee.Image) -> ee.Image:
     """
     An algorithm that takes in an ee.Image and outputs an ee.Image. 
@@ -74,37 +90,184 @@ def ndvi_algorithm(image: ee.Image) -> ee.Image:
     and rounding them down to the nearest whole number. The resultant image is then
     passed through a morphological reducer that uses a square kernel.
     """
-    try:
-        # Isolate the NIR and RED band components and add them to a dictionary
-        values = {"NIR": image.select('B8'), "RED": image.select('B4')}
-        # Generate the NDVI image and rename the resultant band
-        ndvibase = image.expression("(NIR-RED)/(NIR+RED)", values).rename('NDVI')
-        
-    except ee.EEException as e:
-        raise ee.EEException(f"ndvi composition failed. {e}")
+    return generate_index_algorithm("NDVI")(image)
 
+def upsample_algorithm(image: ee.Image) -> ee.Image:
+    """
+    An algorithm that upsamples an ee.Image with bicubic interpolation
+    and reprojects it to its native CRS at a 1m spatial resolution.
+    """
     try:
-        # Upsample the NDVI image with bicubic interpolation
-        upsampled = ndvibase.resample('bicubic')
+        # Upsample the image with bicubic interpolation
+        upsampled = image.resample('bicubic')
         # Reproject the upsampled image to it's native CRS at a 1m scale.
-        upsampled = upsampled.reproject(ndvibase.projection(), scale=1)
-    
+        return upsampled.reproject(image.projection(), scale=1)
+
     except ee.EEException as e:
-        raise ee.EEException(f"ndvi upsampling failed. {e}")
+        raise ee.EEException(f"upsampling failed. {e}")
 
+def focalize_algorithm(image: ee.Image) -> ee.Image:
+    """
+    An algorithm that focalizes an ee.Image by scaling each pixel value by one order of magnitude
+    and rounding them down to the nearest whole number before passing the image through a 
+    morphological median reducer that uses a square kernel with a radius of 5 pixels.
+    """
     try:
         # Scale each pixel value in the image by one order of magnitude
-        ndvi = ee.Image(upsampled).toFloat().multiply(10).toInt().toFloat()
+        focalized = ee.Image(image).toFloat().multiply(10).toInt().toFloat()
         # Focalize the image with a morpohological reducer
-        ndvi = ndvi.focal_median(kernelType="square", radius=5)
+        return focalized.focal_median(kernelType="square", radius=5)
+
+    except ee.EEException as e:
+        raise ee.EEException(f"focalization failed. {e}")
+
+class SpectralIndex(typing.NamedTuple):
+    """
+    A spectral index that can be generated from the Sentinel-2 MSI L2A Collection.
+
+    The index is composed with the bandmath 'expression' where each variable is mapped to a Sentinel-2 band
+    by 'variables'. If there is no expression the mapped bands are selected as they are. The composed bands are
+    renamed to 'bands' and passed through each of the 'postprocess' algorithms in order. 'palette' contains the
+    visualization parameters of the index from the palette module.
+    """
+    name: str
+    bands: typing.Tuple[str, ...]
+    expression: typing.Optional[str]
+    variables: typing.Dict[str, str]
+    postprocess: typing.Tuple[typing.Callable[[ee.Image], ee.Image], ...]
+    palette: dict
+
+# The registry of spectral indices keyed by their name
+SPECTRALINDICES = {}
+
+def register_spectral_index(index: SpectralIndex):
+    """ A function that adds a spectral index to the registry, replacing any index with the same name. """
+    SPECTRALINDICES[index.name] = index
+
+def get_spectral_index(name: str) -> SpectralIndex:
+    """ A function that returns the registered spectral index with the given name. """
+    try:
+        return SPECTRALINDICES[name]
+    except KeyError:
+        raise RuntimeError(f"unsupported index: {name}")
+
+def generate_index_algorithm(name: str, postprocess: bool = True) -> typing.Callable[[ee.Image], ee.Image]:
+    """ 
+    A function that returns the algorithm of a registered spectral index. The algorithm takes 
+    in an ee.Image and outputs an ee.Image and is suitable for use with ee.ImageCollection.map(algorithm).
+    The postprocessing algorithms of the index are skipped if 'postprocess' is False.
+    """
+    index = get_spectral_index(name)
+
+    def algorithm(image: ee.Image) -> ee.Image:
+        try:
+            # Compose the index with its bandmath or select its bands
+            if index.expression:
+                values = {variable: image.select(band) for variable, band in index.variables.items()}
+                composed = image.expression(index.expression, values).rename(list(index.bands))
+            else:
+                composed = image.select(list(index.variables.values())).rename(list(index.bands))
+
+        except ee.EEException as e:
+            raise ee.EEException(f"{index.name.lower()} composition failed. {e}")
+
+        try:
+            # Apply the postprocessing algorithms in order
+            for algorithm in (index.postprocess if postprocess else ()):
+                composed = algorithm(composed)
+
+        except ee.EEException as e:
+            raise ee.EEException(f"{index.name.lower()} {e}")
+
+        return composed
+
+    return algorithm
+
+def generate_fused_algorithm(names: typing.Sequence[str]) -> typing.Callable[[ee.Image], ee.Image]:
+    """ 
+    A function that returns an algorithm that generates several registered spectral indices from 
+    each ee.Image and concatenates their bands into a single multi-band ee.Image.
+    """
+    algorithms = [generate_index_algorithm(name) for name in names]
+    return lambda image: ee.Image.cat([algorithm(image) for algorithm in algorithms])
+
+register_spectral_index(SpectralIndex(
+    "TCI", ("TCI_R", "TCI_G", "TCI_B"), None,
+    {"TCI_R": "TCI_R", "TCI_G": "TCI_G", "TCI_B": "TCI_B"},
+    (upsample_algorithm,), palette.S2TRUECOLOR
+))
+register_spectral_index(SpectralIndex(
+    "NDVI", ("NDVI",), "(NIR-RED)/(NIR+RED)",
+    {"NIR": "B8", "RED": "B4"},
+    (upsample_algorithm, focalize_algorithm), palette.NDVIFOCAL
+))
+register_spectral_index(SpectralIndex(
+    "NDWI", ("NDWI",), "(GREEN-NIR)/(GREEN+NIR)",
+    {"GREEN": "B3", "NIR": "B8"},
+    (upsample_algorithm,), palette.NDWIRAW
+))
+register_spectral_index(SpectralIndex(
+    "EVI", ("EVI",), "2.5*((NIR-RED)/(NIR+6*RED-7.5*BLUE+10000))",
+    {"NIR": "B8", "RED": "B4", "BLUE": "B2"},
+    (upsample_algorithm,), palette.EVIRAW
+))
+
+@instrumentation.instrumented
+def visualize_spectral_index(image: ee.Image, name: str) -> ee.Image:
+    """ 
+    A function that visualizes the bands of a registered spectral index in an ee.Image with its palette.
+    Suitable for the multi-band images generated by 'generate_fused_spectral_image'.
+    """
+    index = get_spectral_index(name)
+
+    try:
+        # Apply the visualisation palette to the bands of the index
+        return image.visualize(**{**index.palette, "bands": list(index.bands)})
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not visualize spectral index. {e}")
+
+@instrumentation.instrumented
+def select_spectral_index(image: ee.Image, name: str) -> ee.Image:
+    """ A function that selects the bands of a registered spectral index from an ee.Image, such as for exporting it. """
+    try:
+        return image.select(list(get_spectral_index(name).bands))
 
     except ee.EEException as e:
-        raise ee.EEException(f"ndvi focalization failed. {e}")
+        raise RuntimeError(f"could not select spectral index. {e}")
+
+def _memoize_graph(key: tuple, constructor: typing.Callable[[], ee.Image]) -> SpectralGraph:
+    """ A function that returns the cached SpectralGraph for a key or constructs and caches it. """
+    # Check the cache for the graph
+    graph = graphcache.get(key)
+    if graph is None:
+        # Construct the image and cache its graph in a span with the date, AOI and index
+        index = key[2] if isinstance(key[2], str) else ",".join(key[2])
+        with instrumentation.span("spectral.construct_graph", date=key[0], aoi=key[1], index=index):
+            graph = SpectralGraph(constructor())
+        graphcache.put(key, graph)
+
+    return graph
+
+@instrumentation.instrumented
+def generate_spectral_graph(date: datetime.datetime, geometry: ee.Geometry, index: str, maxcloud: float = None) -> SpectralGraph:
+    """ 
+    A function that returns the SpectralGraph of the spectral Image for the given date, geometry and index.
+    
+    Graphs are memoized in the 'graphcache' LRU cache keyed on the date, the canonical hash of the 
+    geometry and the index. Repeated requests reuse the constructed image and its serialized graph.
+    Refer to 'generate_spectral_image' for details on how the image is generated.
+    """
+    # Screen the date with the default cloud screen before building the graph
+    if maxcloud is not None:
+        cloudcover.get_cloudscreen().check(geometry, date, maxcloud)
 
-    # Return the final NDVI image
-    return ndvi
+    # Construct the memoization key
+    key = (date.isoformat(), spatial.generate_geometryhash(geometry), index)
+    return _memoize_graph(key, lambda: _construct_spectral_image(date, geometry, index))
 
-def generate_spectral_image(date: datetime.datetime, geometry: ee.Geometry, index: str) -> ee.Image:
+@instrumentation.instrumented
+def generate_spectral_image(date: datetime.datetime, geometry: ee.Geometry, index: str, maxcloud: float = None) -> ee.Image:
     """ 
     A function that generates a spectral Image given the date as a datetime object, geometry
     as an ee.Geometry and a valid spectral index as a string to generate.
@@ -114,46 +277,59 @@ def generate_spectral_image(date: datetime.datetime, geometry: ee.Geometry, inde
     the filtered ImageCollection. The transformed collection is then mosaic-ed into a single Image, 
     visualized with corresponding palette and clipped to the given geometry before being returned.
 
-    Valid values for the 'index' argument are:
+    Valid values for the 'index' argument are the registered spectral indices:
     - 'TCI' - True Color Index
     - 'NDVI' - Normalized Difference Vegetation Index
+    - 'NDWI' - Normalized Difference Water Index
+    - 'EVI' - Enhanced Vegetation Index
     
-    (other values will be supported in the future)
+    (other indices can be added with 'register_spectral_index')
 
     Refer to the spectral generation algorithm for each Index for details on how they are generated.
-    """
-    # Assign null values for algo and vis
-    algo = None
-    vis = None
+    Constructed images are memoized, refer to 'generate_spectral_graph' for details.
 
-    # Check the value of the index and set 
-    # the algorithm and palett accordingly
-    if index == "NDVI":               
-        algo = ndvi_algorithm
-        vis = palette.NDVIFOCAL
-
-    elif index == "TCI":
-        algo = truecolor_algorithm
-        vis = palette.S2TRUECOLOR
-
-    else:
-        # Raise an exception if the index is not valid
-        raise RuntimeError(f"unsupported index: {index}")    
+    If 'maxcloud' is given, the cloud fraction of the geometry on the date is looked up with the default
+    'cloudcover.CloudScreen' before any graph is built and a RuntimeError is raised if it exceeds 'maxcloud'
+    or if there are no acquisitions on the date.
+    """
+    return generate_spectral_graph(date, geometry, index, maxcloud).image
 
+def _generate_filtered_collection(date: datetime.datetime, geometry: ee.Geometry) -> ee.ImageCollection:
+    """ A function that returns the Sentinel-2 MSI L2A Collection filtered for the geometry and a buffer around the date. """
     try:   
         # Create a temporal buffer around the given date
-        buffer = daterange = temporal.generate_daterange(date, 0.5, buffer=True)
+        buffer = temporal.generate_daterange(date, 0.5, buffer=True)
 
         # Define the Sentinel-2 MSI L2A Collection
         s2collection = ee.ImageCollection("COPERNICUS/S2_SR")
         # Filter the collection for the geometry and the temporal buffer
-        collection = s2collection.filterBounds(geometry).filterDate(*buffer)
+        return s2collection.filterBounds(geometry).filterDate(*buffer)
     
     except RuntimeError as e:
         raise RuntimeError(f"could not create temporal buffer. {e}")
     except ee.EEException as e:
         raise RuntimeError(f"could not create filtered collection. {e}")
 
+def _reproject_spectral_image(image: ee.Image, transformed_collection: ee.ImageCollection) -> ee.Image:
+    """ A function that reprojects a spectral Image to the native CRS of the first Image of the transformed collection. """
+    try:
+        # Retrieve the projection of the Sentinel-2 Image    
+        projection = transformed_collection.first().projection()
+        # Reproject the clipped image to its native CRS.
+        return image.reproject(projection)
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not reproject spectral image. {e}")
+
+def _construct_spectral_image(date: datetime.datetime, geometry: ee.Geometry, index: str) -> ee.Image:
+    """ A function that constructs the spectral Image graph for 'generate_spectral_image'. """
+    # Retrieve the algorithm and palette of the index
+    algo = generate_index_algorithm(index)
+    vis = get_spectral_index(index).palette
+
+    # Filter the collection for the geometry and date
+    collection = _generate_filtered_collection(date, geometry)
+
     try:
         # Transform the collection by mapping the algorithm over it
         transformed_collection = collection.map(algo)
@@ -168,14 +344,214 @@ def generate_spectral_image(date: datetime.datetime, geometry: ee.Geometry, inde
     except ee.EEException as e:
         raise RuntimeError(f"could not create spectral image. {e}")
 
+    # Reproject and return the image
+    return _reproject_spectral_image(image, transformed_collection)
+
+def _construct_fused_spectral_image(date: datetime.datetime, geometry: ee.Geometry, indices: typing.Tuple[str, ...]) -> ee.Image:
+    """ A function that constructs the multi-band spectral Image graph for 'generate_fused_spectral_image'. """
+    # Retrieve the fused algorithm of the indices
+    algo = generate_fused_algorithm(indices)
+
+    # Filter the collection for the geometry and date
+    collection = _generate_filtered_collection(date, geometry)
+
     try:
-        # Retrieve the projection of the Sentinel-2 Image    
-        projection = transformed_collection.first().projection()
-        # Reproject the clipped image to its native CRS.
-        image = image.reproject(projection)
+        # Transform the collection by mapping the fused algorithm over it
+        transformed_collection = collection.map(algo)
+        # Mosaic the transformed collection into a single image and clip it to the geometry.
+        image = transformed_collection.mosaic().clip(geometry)
 
     except ee.EEException as e:
-        raise RuntimeError(f"could not reproject spectral image. {e}")
+        raise RuntimeError(f"could not create spectral image. {e}")
+
+    # Reproject and return the image
+    return _reproject_spectral_image(image, transformed_collection)
+
+@instrumentation.instrumented
+def generate_fused_spectral_graph(date: datetime.datetime, geometry: ee.Geometry, indices: typing.Sequence[str]) -> SpectralGraph:
+    """ 
+    A function that returns the SpectralGraph of the fused multi-band spectral Image for the given date, 
+    geometry and indices. Graphs are memoized in the 'graphcache' alongside those of 'generate_spectral_graph'.
+    """
+    indices = tuple(indices)
+    # Construct the memoization key
+    key = (date.isoformat(), spatial.generate_geometryhash(geometry), indices)
+    return _memoize_graph(key, lambda: _construct_fused_spectral_image(date, geometry, indices))
+
+@instrumentation.instrumented
+def generate_fused_spectral_image(date: datetime.datetime, geometry: ee.Geometry, indices: typing.Sequence[str]) -> ee.Image:
+    """ 
+    A function that generates several spectral indices as a single multi-band Image given the date as a datetime
+    object, geometry as an ee.Geometry and a sequence of registered spectral indices to generate.
+
+    All the indices are computed from a single filtered collection with one map and one mosaic, instead of
+    one per index. The Image is not visualized, its bands are named by the 'bands' of each index and can be 
+    visualized with 'visualize_spectral_index' or isolated for export with 'select_spectral_index'.
+    """
+    return generate_fused_spectral_graph(date, geometry, indices).image
+
+def _construct_native_spectral_image(date: datetime.datetime, geometry: ee.Geometry, index: str) -> ee.Image:
+    """ A function that constructs the native resolution spectral Image graph for 'generate_native_spectral_image'. """
+    # Retrieve the algorithm of the index without postprocessing
+    algo = generate_index_algorithm(index, postprocess=False)
+
+    # Filter the collection for the geometry and date
+    collection = _generate_filtered_collection(date, geometry)
+
+    try:
+        # Transform the collection by mapping the composition algorithm over it
+        transformed_collection = collection.map(algo)
+        # Mosaic the transformed collection into a single image and clip it to the geometry.
+        image = transformed_collection.mosaic().clip(geometry)
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create spectral image. {e}")
+
+    # Reproject and return the image
+    return _reproject_spectral_image(image, transformed_collection)
+
+@instrumentation.instrumented
+def generate_native_spectral_graph(date: datetime.datetime, geometry: ee.Geometry, index: str) -> SpectralGraph:
+    """ 
+    A function that returns the SpectralGraph of the native resolution spectral Image for the given date,
+    geometry and index. Graphs are memoized in the 'graphcache' alongside those of 'generate_spectral_graph'.
+    """
+    # Construct the memoization key
+    key = (date.isoformat(), spatial.generate_geometryhash(geometry), index, "NATIVE")
+    return _memoize_graph(key, lambda: _construct_native_spectral_image(date, geometry, index))
+
+@instrumentation.instrumented
+def generate_native_spectral_image(date: datetime.datetime, geometry: ee.Geometry, index: str) -> ee.Image:
+    """ 
+    A function that generates a spectral Image at the native resolution of its Sentinel-2 bands given the date 
+    as a datetime object, geometry as an ee.Geometry and a registered spectral index as a string to generate.
+
+    The Image is composed the same as 'generate_spectral_image' but is not upsampled, focalized or visualized. 
+    It is intended to be exported with 'export.export_native_image' and postprocessed locally with the 
+    'postprocess.postprocess_geotiff' function which reproduces the skipped steps on the downloaded raster.
+    """
+    return generate_native_spectral_graph(date, geometry, index).image
 
-    # Return the image
-    return image
+def _generate_series_collection(dates: typing.Sequence[datetime.datetime], geometry: ee.Geometry) -> typing.Tuple[ee.ImageCollection, ee.List]:
+    """
+    A function that returns the Sentinel-2 MSI L2A Collection filtered for the geometry and the merged buffers of
+    every date, along with the server side list of the [start, end, date] POSIX timestamps of the buffer of every date.
+    """
+    try:
+        # Define the Sentinel-2 MSI L2A Collection and filter it for the geometry
+        s2collection = ee.ImageCollection("COPERNICUS/S2_SR").filterBounds(geometry)
+        # Filter the collection for the temporal buffers of every date
+        return temporal.generate_earthenginecollection_series(s2collection, dates, 0.5)
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create filtered collection. {e}")
+
+def _construct_spectral_timeseries(dates: typing.Tuple[datetime.datetime, ...], geometry: ee.Geometry, index: str, visualize: bool) -> ee.ImageCollection:
+    """ A function that constructs the spectral ImageCollection graph for 'generate_spectral_timeseries'. """
+    # Retrieve the algorithm and palette of the index
+    algo = generate_index_algorithm(index)
+    vis = get_spectral_index(index).palette
+
+    # Filter the collection once for the geometry and every date
+    collection, buffers = _generate_series_collection(dates, geometry)
+
+    try:
+        def mosaic(buffer: ee.List) -> ee.Image:
+            # Filter the collection for the buffer of the date before the algorithm is mapped over it, as the
+            # composed images of the algorithm do not carry the 'system:time_start' of their acquisitions
+            buffer = ee.List(buffer)
+            window = collection.filterDate(buffer.get(0), buffer.get(1))
+            # Transform the window by mapping the algorithm over it and mosaic it into a single image
+            transformed_collection = window.map(algo)
+            image = transformed_collection.mosaic()
+            # Apply the visualisation palette and clip the image to the geometry
+            image = image.visualize(**vis).clip(geometry) if visualize else image.clip(geometry)
+            # Reproject the image to its native CRS only if there are acquisitions for the date
+            image = ee.Image(ee.Algorithms.If(window.size().gt(0), image.reproject(transformed_collection.first().projection()), image))
+            return image.set({"system:time_start": buffer.get(2), "images": window.size()})
+
+        # Map the mosaic over the dates on the server and drop the dates without acquisitions
+        series = ee.ImageCollection.fromImages(buffers.map(mosaic))
+        return series.filter(ee.Filter.gt("images", 0))
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create spectral timeseries. {e}")
+
+@instrumentation.instrumented
+def generate_spectral_timeseries_graph(dates: typing.Sequence[datetime.datetime], geometry: ee.Geometry, index: str, visualize: bool = False, maxcloud: float = None) -> SpectralGraph:
+    """ 
+    A function that returns the SpectralGraph of the spectral ImageCollection for the given dates, geometry and index.
+    Graphs are memoized in the 'graphcache' alongside those of 'generate_spectral_graph'.
+    """
+    # Drop the dates that are too cloudy or have no acquisitions with the default cloud screen
+    if maxcloud is not None:
+        dates = cloudcover.get_cloudscreen().screen(geometry, dates, maxcloud)
+
+    dates = tuple(dates)
+    if not dates:
+        raise RuntimeError("could not create spectral timeseries. no dates were given or left after screening.")
+
+    # Construct the memoization key
+    key = (",".join(date.isoformat() for date in dates), spatial.generate_geometryhash(geometry), index, "SERIES", visualize)
+    return _memoize_graph(key, lambda: _construct_spectral_timeseries(dates, geometry, index, visualize))
+
+@instrumentation.instrumented
+def generate_spectral_timeseries(dates: typing.Sequence[datetime.datetime], geometry: ee.Geometry, index: str, visualize: bool = False, maxcloud: float = None) -> ee.ImageCollection:
+    """ 
+    A function that generates a spectral ImageCollection with an Image for every date with acquisitions, given 
+    a sequence of dates as datetime objects, geometry as an ee.Geometry and a registered spectral index.
+
+    The Images are the same as those of 'generate_spectral_image' for each date, but are built in a single graph.
+    The Sentinel-2 collection is filtered once for the merged buffers of every date, after which a function that
+    filters the buffer of a date, maps the spectral algorithm over it and mosaics it is mapped over the list of
+    dates on the server. The size of the graph does not grow with the number of dates beyond their timestamps,
+    so the collection can be reduced or exported as a stack with 'generate_spectral_stack' in a single task.
+
+    The Images hold the bands of the index and are only visualized with its palette if 'visualize' is set.
+    Every Image has the 'system:time_start' of its date and the number of mosaiced acquisitions as 'images'.
+    If 'maxcloud' is given, the dates with a cloud fraction above it are dropped before the graph is built.
+    """
+    return generate_spectral_timeseries_graph(dates, geometry, index, visualize, maxcloud).image
+
+def _construct_spectral_stack(dates: typing.Tuple[datetime.datetime, ...], geometry: ee.Geometry, index: str, visualize: bool) -> ee.Image:
+    """ A function that constructs the multi-band spectral Image graph for 'generate_spectral_stack'. """
+    series = generate_spectral_timeseries(dates, geometry, index, visualize)
+
+    try:
+        # Suffix the bands of every Image with its date
+        def suffix(image: ee.Image) -> ee.Image:
+            date = ee.Date(image.get("system:time_start")).format("YYYYMMdd")
+            return image.rename(image.bandNames().map(lambda band: ee.String(band).cat("_").cat(date)))
+
+        # Stack the bands of every Image into a single image and drop the position prefixes
+        return series.map(suffix).toBands().regexpRename("^[^_]*_", "")
+
+    except ee.EEException as e:
+        raise RuntimeError(f"could not create spectral stack. {e}")
+
+@instrumentation.instrumented
+def generate_spectral_stack_graph(dates: typing.Sequence[datetime.datetime], geometry: ee.Geometry, index: str, visualize: bool = False, maxcloud: float = None) -> SpectralGraph:
+    """ 
+    A function that returns the SpectralGraph of the multi-band spectral Image for the given dates, geometry and index.
+    Graphs are memoized in the 'graphcache' alongside those of 'generate_spectral_graph'.
+    """
+    # Drop the dates that are too cloudy or have no acquisitions with the default cloud screen
+    if maxcloud is not None:
+        dates = cloudcover.get_cloudscreen().screen(geometry, dates, maxcloud)
+
+    dates = tuple(dates)
+    if not dates:
+        raise RuntimeError("could not create spectral stack. no dates were given or left after screening.")
+
+    # Construct the memoization key
+    key = (",".join(date.isoformat() for date in dates), spatial.generate_geometryhash(geometry), index, "STACK", visualize)
+    return _memoize_graph(key, lambda: _construct_spectral_stack(dates, geometry, index, visualize))
+
+@instrumentation.instrumented
+def generate_spectral_stack(dates: typing.Sequence[datetime.datetime], geometry: ee.Geometry, index: str, visualize: bool = False, maxcloud: float = None) -> ee.Image:
+    """ 
+    A function that generates the spectral Images of 'generate_spectral_timeseries' as a single multi-band Image.
+    The bands of every date are suffixed with the date, such as 'NDVI_20210601', and the Image can be exported with
+    'export.export_image' as a single task instead of one task per date.
+    """
+    return generate_spectral_stack_graph(dates, geometry, index, visualize, maxcloud).image
@@ -3,36 +3,108 @@ Terrarium Package
 
 The temporal package contains functions for temporal manipulations
 """
-import ee
+from __future__ import annotations
+
 import typing
 import datetime
-from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from . import lazyload
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+numpy = lazyload.lazy_import("numpy")
+datetime_helpers = lazyload.lazy_import("google.api_core.datetime_helpers")
+
+# The NumPy datetime type of date arrays, which has the microsecond resolution of datetime objects
+DATETIME64 = "datetime64[us]"
+# The number of microseconds in a day
+DAY_MICROSECONDS = 86400 * 10**6
+# The epoch and the resolution of datetime64 values as datetime objects
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+def __getattr__(name: str):
+    # Keep 'DatetimeWithNanoseconds' available from the module now that it is imported lazily
+    if name == "DatetimeWithNanoseconds":
+        return datetime_helpers.DatetimeWithNanoseconds
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 """ A set of conversion functions between different temporal data structures """
 
+@instrumentation.instrumented
 def datetime_fromtimestamp(posixstamp: int) -> datetime.datetime:
     """ A function that returns a datetime object for a given POSIX timestamp. """
     return datetime.datetime.utcfromtimestamp(int(posixstamp/1000))
 
-def datetime_fromgoogledate(date: DatetimeWithNanoseconds) -> datetime.datetime:
+@instrumentation.instrumented
+def datetime_fromgoogledate(date: datetime_helpers.DatetimeWithNanoseconds) -> datetime.datetime:
     """ A function that returns a datetime object for a given DatetimeWithNanoseconds object. """
     return datetime.datetime.fromisoformat(date.isoformat()).replace(tzinfo=None)
 
-def googledate_fromdatetime(date: datetime.datetime) -> DatetimeWithNanoseconds:
+@instrumentation.instrumented
+def googledate_fromdatetime(date: datetime.datetime) -> datetime_helpers.DatetimeWithNanoseconds:
     """ A function that returns a DatetimeWithNanoseconds object for a given datetime object. """
-    return DatetimeWithNanoseconds.fromisoformat(date.isoformat())
+    return datetime_helpers.DatetimeWithNanoseconds.fromisoformat(date.isoformat())
 
-def googledate_fromtimestamp(posixstamp: int) -> DatetimeWithNanoseconds:
+@instrumentation.instrumented
+def googledate_fromtimestamp(posixstamp: int) -> datetime_helpers.DatetimeWithNanoseconds:
     """ A function that returns a DatetimeWithNanoseconds object for a given POSIX timestamp. """
-    return DatetimeWithNanoseconds.utcfromtimestamp(int(posixstamp/1000))
+    return datetime_helpers.DatetimeWithNanoseconds.utcfromtimestamp(int(posixstamp/1000))
+
+
+""" A set of conversion functions between arrays of temporal data structures """
+
+@instrumentation.instrumented
+def datetimes_fromtimestamps(posixstamps: typing.Sequence[int]) -> numpy.ndarray:
+    """
+    A function that returns an array of datetime64 values for a sequence of POSIX timestamps in milliseconds.
+    The timestamps are truncated to the second, the same as 'datetime_fromtimestamp'.
+    """
+    # Truncate the timestamps to seconds with the same float division as the single timestamp conversion
+    seconds = numpy.trunc(numpy.asarray(posixstamps, dtype=numpy.float64) / 1000).astype(numpy.int64)
+    # Convert the seconds into datetime values
+    return seconds.astype("datetime64[s]").astype(DATETIME64)
+
+@instrumentation.instrumented
+def datetimes_fromarray(dates: numpy.ndarray) -> typing.List[datetime.datetime]:
+    """ A function that returns a list of datetime objects for an array of datetime64 values. """
+    return numpy.asarray(dates).astype(DATETIME64).tolist()
+
+@instrumentation.instrumented
+def datetimes_toarray(dates: typing.Sequence[datetime.datetime]) -> numpy.ndarray:
+    """ A function that returns an array of datetime64 values for a sequence of datetime objects or datetime64 values. """
+    if isinstance(dates, numpy.ndarray):
+        return dates.astype(DATETIME64)
+
+    try:
+        # Convert the datetime objects into microseconds since the epoch, which is much faster than converting the objects
+        microseconds = [(date - EPOCH) // MICROSECOND for date in dates]
+        return numpy.array(microseconds, dtype=numpy.int64).view(DATETIME64)
+
+    except TypeError:
+        # Convert timezone aware datetime objects into naive datetime objects in UTC, which NumPy only does with a warning
+        dates = [date.astimezone(datetime.timezone.utc).replace(tzinfo=None) if isinstance(date, datetime.datetime) and date.tzinfo else date for date in dates]
+        # Convert sequences of other date values, such as datetime64 values, directly
+        return numpy.asarray(dates, dtype=DATETIME64)
+
+@instrumentation.instrumented
+def googledates_fromtimestamps(posixstamps: typing.Sequence[int]) -> typing.List[datetime_helpers.DatetimeWithNanoseconds]:
+    """ A function that returns a list of DatetimeWithNanoseconds objects for a sequence of POSIX timestamps in milliseconds. """
+    # Convert the timestamps into datetime objects in a single pass
+    dates = datetimes_fromarray(datetimes_fromtimestamps(posixstamps))
+    # Construct the DatetimeWithNanoseconds objects from the date components
+    constructor = datetime_helpers.DatetimeWithNanoseconds
+    return [constructor(date.year, date.month, date.day, date.hour, date.minute, date.second) for date in dates]
 
 
 """ A set of manipulation functions for temporal entities """
 
+@instrumentation.instrumented
 def shift_date(date: datetime.datetime, shift: int) -> datetime.datetime:
     """ A function that returns a datetime object for the next acquisition given another acquisition date. """
     return date + datetime.timedelta(days=shift)
 
+@instrumentation.instrumented
 def generate_daterange(date: datetime.datetime, width: int, buffer: bool = False) -> typing.Tuple[datetime.datetime]:
     """ 
     A function that returns a datetime tuple with two dates that represent the beginning and end of a temporal daterange. 
@@ -51,6 +123,122 @@ def generate_daterange(date: datetime.datetime, width: int, buffer: bool = False
     except Exception as e:
         raise RuntimeError(f"could not generate daterange. error: {e}")
 
+def _generate_timedeltas(days: typing.Union[float, typing.Sequence[float]]) -> numpy.ndarray:
+    """ A function that returns the timedelta64 values for a number or a sequence of numbers of days. """
+    microseconds = numpy.round(numpy.asarray(days, dtype=numpy.float64) * DAY_MICROSECONDS).astype(numpy.int64)
+    return microseconds.astype("timedelta64[us]")
+
+@instrumentation.instrumented
+def shift_dates(dates: typing.Sequence[datetime.datetime], shift: typing.Union[float, typing.Sequence[float]]) -> numpy.ndarray:
+    """
+    A function that returns an array of datetime64 values for a sequence of dates shifted by a number of days.
+    The shift can be a single number of days or a sequence with a number of days for every date.
+    """
+    return datetimes_toarray(dates) + _generate_timedeltas(shift)
+
+@instrumentation.instrumented
+def generate_dateranges(dates: typing.Sequence[datetime.datetime], width: float, buffer: bool = False) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    A function that returns two arrays of datetime64 values with the beginning and end of the daterange of every date.
+    The dateranges are the same as the ones generated by 'generate_daterange' for every date.
+    """
+    try:
+        dates = datetimes_toarray(dates)
+        # Generate the starts and the ends of the dateranges
+        starts = dates - _generate_timedeltas(width)
+        ends = dates + _generate_timedeltas(width) if buffer else dates
+
+        # Return the arrays of dates
+        return (starts, ends)
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate dateranges. error: {e}")
+
+
+class DaterangePlan(typing.NamedTuple):
+    """
+    A class that represents the merged dateranges for a sequence of dates. 'ranges' is the sorted list of (start, end)
+    datetime tuples and 'windows' is an array with the position in 'ranges' of the merged daterange of every date.
+    """
+    ranges: typing.List[typing.Tuple[datetime.datetime, datetime.datetime]]
+    windows: numpy.ndarray
+
+    def window(self, position: int) -> typing.Tuple[datetime.datetime, datetime.datetime]:
+        """ A method that returns the merged daterange that contains the daterange of the date at the given position. """
+        return self.ranges[self.windows[position]]
+
+@instrumentation.instrumented
+def plan_dateranges(dates: typing.Sequence[datetime.datetime], width: float, buffer: bool = False) -> DaterangePlan:
+    """
+    A function that merges the overlapping dateranges of a sequence of dates, as generated by 'generate_daterange',
+    into the minimum set of dateranges that covers them. Dateranges that touch are merged as the end of a filter
+    daterange is exclusive. Every date is mapped to the merged daterange that contains its own daterange, so a
+    collection can be filtered once per merged daterange instead of once per date.
+    """
+    starts, ends = generate_dateranges(dates, width, buffer)
+    if not len(starts):
+        return DaterangePlan([], numpy.zeros(0, dtype=numpy.int64))
+
+    # Sort the dateranges by their start
+    order = numpy.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+
+    # Start a new merged daterange wherever a daterange begins after the furthest end of the dateranges before it
+    reach = numpy.maximum.accumulate(ends)
+    boundaries = numpy.empty(len(starts), dtype=bool)
+    boundaries[0] = True
+    boundaries[1:] = starts[1:] > reach[:-1]
+
+    # Number the merged dateranges and find their bounds
+    groups = numpy.cumsum(boundaries) - 1
+    firsts = numpy.flatnonzero(boundaries)
+    lasts = numpy.append(firsts[1:], len(starts)) - 1
+    ranges = list(zip(datetimes_fromarray(starts[firsts]), datetimes_fromarray(reach[lasts])))
+
+    # Map the merged daterange of every date back to its original position
+    windows = numpy.empty(len(starts), dtype=numpy.int64)
+    windows[order] = groups
+    return DaterangePlan(ranges, windows)
+
+@instrumentation.instrumented
+def generate_earthenginecollection_windows(collection: ee.ImageCollection, plan: DaterangePlan) -> typing.List[ee.ImageCollection]:
+    """
+    A function that returns the given Earth Engine ImageCollection filtered to every merged daterange of a plan.
+    The filtered collection of the date at a given position is at the position 'plan.windows[position]'.
+    """
+    if not isinstance(collection, ee.ImageCollection):
+        raise RuntimeError("could not generate windows. collection must be a ee.ImageCollection.")
+
+    return [collection.filterDate(start, end) for start, end in plan.ranges]
+
+@instrumentation.instrumented
+def generate_earthenginecollection_series(collection: ee.ImageCollection, dates: typing.Sequence[datetime.datetime], width: float) -> typing.Tuple[ee.ImageCollection, ee.List]:
+    """
+    A function that returns the given Earth Engine ImageCollection filtered to the buffers of 'width' days around every
+    date, along with a server side list with the [start, end, date] POSIX timestamps in milliseconds of the buffer of 
+    every date. The buffers are merged with 'plan_dateranges' and the collection is filtered with a single filter, so a
+    function can be mapped over the list on the server to filter the collection for every date in a single graph.
+    """
+    if not isinstance(collection, ee.ImageCollection):
+        raise RuntimeError("could not generate series. collection must be a ee.ImageCollection.")
+
+    try:
+        # Create the temporal buffers around the dates and merge the overlapping buffers into the filter dateranges
+        starts, ends = generate_dateranges(dates, width, buffer=True)
+        plan = plan_dateranges(dates, width, buffer=True)
+
+        # Filter the collection for the merged dateranges in a single filter
+        filters = [ee.Filter.date(start, end) for start, end in plan.ranges]
+        collection = collection.filter(ee.Filter.Or(*filters) if len(filters) > 1 else filters[0])
+
+        # Encode the buffers of every date as POSIX timestamps in milliseconds
+        stamps = numpy.stack([starts, ends, datetimes_toarray(dates)], axis=1).astype("datetime64[ms]").astype(numpy.int64)
+        return collection, ee.List(stamps.tolist())
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate series. error: {e}")
+
+@instrumentation.instrumented
 def generate_earthenginecollection_datelist(collection: ee.ImageCollection) -> typing.List[datetime.datetime]:
     """
     A function that returns a list of datetime object representing the unique dates in a 
@@ -61,7 +249,8 @@ def generate_earthenginecollection_datelist(collection: ee.ImageCollection) -> t
 
     try:
         # Aggregate the timestamps of every Image in the ImageCollection as a list of POSIX timestamps
-        timestamps = collection.aggregate_array("system:time_start").getInfo()
+        with instrumentation.roundtrip("earthengine", "getInfo"):
+            timestamps = collection.aggregate_array("system:time_start").getInfo()
         # Accumulate the timestamps into a list of datetime objects
         datelist = [datetime_fromtimestamp(posix_stamp) for posix_stamp in timestamps]
         # Sort the datetime objects in the list
@@ -72,3 +261,28 @@ def generate_earthenginecollection_datelist(collection: ee.ImageCollection) -> t
 
     # Return the datelist
     return datelist
+
+@instrumentation.instrumented
+def generate_earthenginecollection_daylist(collection: ee.ImageCollection) -> typing.List[datetime.datetime]:
+    """
+    A function that returns a list of datetime objects representing the unique acquisition days in a
+    given Earth Engine ImageCollection. Images from the same day are deduplicated on the server so
+    overlapping tiles only return a single date. The returned daylist is sorted chronologically.
+    """
+    if not isinstance(collection, ee.ImageCollection):
+        raise RuntimeError("could not generate daylist. collection must be a ee.ImageCollection.")
+
+    try:
+        # Aggregate the timestamps of every Image and format them as unique day strings on the server
+        timestamps = collection.aggregate_array("system:time_start")
+        days = timestamps.map(lambda timestamp: ee.Date(timestamp).format("YYYY-MM-dd")).distinct().sort()
+        # Retrieve the days and accumulate them into a list of datetime objects
+        with instrumentation.roundtrip("earthengine", "getInfo"):
+            days = days.getInfo()
+        daylist = [datetime.datetime.strptime(day, "%Y-%m-%d") for day in days]
+
+    except Exception as e:
+        raise RuntimeError(f"could not generate daylist. error: {e}")
+
+    # Return the daylist
+    return daylist
@@ -0,0 +1,415 @@
+"""
+Terrarium Package
+
+The tiledexport module contains the tiled export mode for regions that are too large
+for a single export task. The region is split into a grid of pixel aligned chunks
+within a pixel budget, every chunk is exported as a separate task of one logical job
+on the export scheduler and the downloaded tiles are stitched locally into a single
+GeoTIFF or a virtual mosaic with windowed, streaming writes.
+
+Stitching requires the 'rasterio' package which is installed with the 'raster' extra
+and downloading from Cloud Storage requires the 'google-cloud-storage' package which
+is installed with the 'storage' extra.
+"""
+from __future__ import annotations
+
+import os
+import math
+import shutil
+import typing
+import concurrent.futures
+
+from . import lazyload
+from . import spatial
+from . import scheduler
+from . import instrumentation
+
+ee = lazyload.lazy_import("ee")
+shapeops = lazyload.lazy_import("shapely.ops")
+shapes = lazyload.lazy_import("shapely.geometry")
+ElementTree = lazyload.lazy_import("xml.etree.ElementTree")
+
+# The GDAL data type names of the numpy data types of the tiles
+GDALTYPES = {
+    "uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16", "uint32": "UInt32",
+    "int32": "Int32", "float32": "Float32", "float64": "Float64",
+}
+
+def _import_rasterio():
+    """ A function that imports the rasterio package on first use. """
+    try:
+        import rasterio
+        import rasterio.windows
+        return rasterio
+
+    except ImportError:
+        raise RuntimeError("could not stitch tiles. the 'rasterio' package is required, install terrarium with the 'raster' extra.")
+
+
+class ExportChunk(typing.NamedTuple):
+    """
+    A class that represents a chunk of an export grid. The 'window' is the (row offset, column offset, height, width)
+    of the chunk in pixels of the grid and the 'transform' is the affine transform of the chunk in the order of the
+    'crsTransform' of Earth Engine exports, so the pixels of every chunk are aligned to the same grid.
+    """
+    row: int
+    column: int
+    window: typing.Tuple[int, int, int, int]
+    transform: typing.Tuple[float, float, float, float, float, float]
+
+    @property
+    def bounds(self) -> typing.Tuple[float, float, float, float]:
+        """ The (xmin, ymin, xmax, ymax) bounds of the chunk in the CRS of the grid. """
+        scale, _, left, _, _, top = self.transform
+        return (left, top - self.window[2] * scale, left + self.window[3] * scale, top)
+
+
+class ExportGrid(typing.NamedTuple):
+    """
+    A class that represents the grid of chunks of a tiled export. The 'origin' is the top left corner of the grid in
+    the CRS of the grid, the 'shape' is its (height, width) in pixels and the 'chunks' are the chunks of the grid that
+    intersect the region of the export. Every chunk has at most 'maxpixels' pixels.
+    """
+    crs: str
+    scale: float
+    origin: typing.Tuple[float, float]
+    shape: typing.Tuple[int, int]
+    maxpixels: float
+    chunks: typing.List[ExportChunk]
+
+    @property
+    def transform(self) -> typing.Tuple[float, float, float, float, float, float]:
+        """ The affine transform of the whole grid in the order of the 'crsTransform' of Earth Engine exports. """
+        return (self.scale, 0.0, self.origin[0], 0.0, -self.scale, self.origin[1])
+
+
+@instrumentation.instrumented
+def generate_exportgrid(shape: shapes.base.BaseGeometry, scale: float = 1, maxpixels: float = 1e8, crs: str = None, blocksize: int = 256) -> ExportGrid:
+    """
+    A function that splits the region of a shapely geometry in WGS84 coordinates into a grid of square chunks of at most
+    'maxpixels' pixels at a resolution of 'scale' meters. The grid is aligned to multiples of the scale in the given CRS,
+    which defaults to the UTM zone of the centroid of the geometry, and the side of a chunk is rounded down to a multiple
+    of 'blocksize' pixels so the chunks line up with the internal blocks of the stitched GeoTIFF.
+    Chunks that do not intersect the geometry are left out of the grid.
+    """
+    try:
+        # Project the geometry into the CRS of the grid
+        if crs is None:
+            centroid = shape.centroid
+            crs = spatial.generate_utmcrs(centroid.x, centroid.y)
+
+        transformer = spatial.get_transformer("EPSG:4326", crs)
+        projected = shapeops.transform(transformer.transform, shape)
+
+    except Exception as e:
+        raise RuntimeError(f"could not project export region. error: {e}")
+
+    # Align the bounds of the geometry to the pixels of the grid
+    xmin, ymin, xmax, ymax = projected.bounds
+    left, top = math.floor(xmin / scale) * scale, math.ceil(ymax / scale) * scale
+    height, width = max(math.ceil((top - ymin) / scale), 1), max(math.ceil((xmax - left) / scale), 1)
+
+    # Determine the side of the chunks from the pixel budget
+    side = math.floor(math.sqrt(maxpixels))
+    if side >= blocksize:
+        side -= side % blocksize
+    if side < 1:
+        raise RuntimeError(f"could not generate export grid. pixel budget of {maxpixels} is too small.")
+
+    chunks = []
+    for row in range(math.ceil(height / side)):
+        for column in range(math.ceil(width / side)):
+            # Clip the chunks at the bottom and the right edge of the grid
+            rowoff, coloff = row * side, column * side
+            window = (rowoff, coloff, min(side, height - rowoff), min(side, width - coloff))
+            transform = (scale, 0.0, left + coloff * scale, 0.0, -scale, top - rowoff * scale)
+            chunk = ExportChunk(row, column, window, transform)
+
+            # Skip the chunks that do not intersect the geometry
+            if projected.intersects(shapes.box(*chunk.bounds)):
+                chunks.append(chunk)
+
+    return ExportGrid(crs, scale, (left, top), (height, width), maxpixels, chunks)
+
+
+class TiledExport(typing.NamedTuple):
+    """
+    A class that represents a tiled export as one logical job. The chunk exports are the jobs of 'group' on the export
+    scheduler and are written to the bucket with the names in 'names', in the order of the chunks of the grid.
+    """
+    group: str
+    bucket: str
+    name: str
+    grid: ExportGrid
+    names: typing.List[str]
+
+    def jobs(self, exportscheduler: scheduler.ExportScheduler) -> typing.List[scheduler.ExportJob]:
+        """ A method that returns the jobs of the chunk exports on the export scheduler. """
+        return exportscheduler.get_group(self.group)
+
+    def state(self, exportscheduler: scheduler.ExportScheduler) -> str:
+        """ A method that returns the state of the tiled export as a whole with 'scheduler.ExportScheduler.get_groupstate'. """
+        return exportscheduler.get_groupstate(self.group)
+
+
+@instrumentation.instrumented
+def submit_tiled_image(exportscheduler: scheduler.ExportScheduler, image: ee.Image, bucket: str, name: str, grid: ExportGrid, priority: int = 0) -> TiledExport:
+    """
+    A function that queues the export of an Earth Engine Image as one export job for every chunk of the grid on the
+    export scheduler, which runs them in parallel up to its concurrency limit. Every chunk is exported with the region,
+    CRS and pixel grid of the chunk to a GeoTIFF named after the export with the row and column of the chunk appended.
+    The image is serialized once and shared by every chunk.
+    """
+    try:
+        payload = image.serialize(for_cloud_api=True)
+    except Exception as e:
+        raise RuntimeError(f"could not serialize image. {e}.")
+
+    group = f"{name}-{os.urandom(6).hex()}"
+    digits = len(str(max([max(chunk.row, chunk.column) for chunk in grid.chunks], default=0)))
+
+    names = []
+    for chunk in grid.chunks:
+        # Queue the export of the chunk with its region in the CRS of the grid
+        chunkname = f"{name}-{chunk.row:0{digits}d}-{chunk.column:0{digits}d}"
+        options = {
+            "region": shapes.mapping(shapes.box(*chunk.bounds)),
+            "crs": grid.crs,
+            "crstransform": list(chunk.transform),
+            "maxpixels": grid.maxpixels,
+        }
+
+        exportscheduler.submit(payload, bucket, chunkname, priority, options, group)
+        names.append(chunkname)
+
+    return TiledExport(group, bucket, name, grid, names)
+
+
+class StorageBackend:
+    """
+    A class that defines the interface for the storage backends that tiled exports are downloaded from.
+    Backends must implement 'list' which returns the names of the objects in a bucket with a prefix and
+    'download' which copies an object to a local path.
+    """
+    def list(self, bucket: str, prefix: str) -> typing.List[str]:
+        raise NotImplementedError
+
+    def download(self, bucket: str, name: str, path: str):
+        raise NotImplementedError
+
+
+class CloudStorage(StorageBackend):
+    """ A class that downloads objects from Google Cloud Storage with the default credentials of the environment. """
+    def __init__(self, project: str = None):
+        try:
+            from google.cloud import storage
+        except ImportError:
+            raise RuntimeError("could not open cloud storage. the 'google-cloud-storage' package is required, install terrarium with the 'storage' extra.")
+
+        self.client = storage.Client(project=project)
+
+    def list(self, bucket: str, prefix: str) -> typing.List[str]:
+        return [blob.name for blob in self.client.list_blobs(bucket, prefix=prefix)]
+
+    def download(self, bucket: str, name: str, path: str):
+        self.client.bucket(bucket).blob(name).download_to_filename(path)
+
+
+class LocalStorage(StorageBackend):
+    """
+    A class that stores objects as files in a local directory with a subdirectory for every bucket.
+    Intended to stand in for Cloud Storage during tests, objects are added with 'upload'.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, bucket: str, name: str) -> str:
+        """ A method that returns the local path of an object. """
+        return os.path.join(self.root, bucket, name)
+
+    def upload(self, bucket: str, name: str, source: str):
+        """ A method that copies a local file into the storage as an object. """
+        os.makedirs(os.path.dirname(self.path(bucket, name)), exist_ok=True)
+        shutil.copyfile(source, self.path(bucket, name))
+
+    def list(self, bucket: str, prefix: str) -> typing.List[str]:
+        directory = os.path.join(self.root, bucket)
+        if not os.path.isdir(directory):
+            return []
+
+        names = []
+        for root, _, files in os.walk(directory):
+            names.extend(os.path.relpath(os.path.join(root, file), directory).replace(os.sep, "/") for file in files)
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def download(self, bucket: str, name: str, path: str):
+        shutil.copyfile(self.path(bucket, name), path)
+
+
+def get_exportfiles(storage: StorageBackend, bucket: str, name: str) -> typing.List[str]:
+    """
+    A function that returns the names of the GeoTIFFs of an image export in a bucket. Matches the single file of
+    the export and the files of an export that Earth Engine split into several files, which share its name as prefix.
+    """
+    names = []
+    for objectname in storage.list(bucket, name):
+        rest = objectname[len(name):]
+        if rest == ".tif" or (rest.startswith("-") and rest.endswith(".tif") and rest[1:-4].replace("-", "").isdigit()):
+            names.append(objectname)
+
+    return names
+
+@instrumentation.instrumented
+def download_tiles(storage: StorageBackend, tiledexport: TiledExport, directory: str, workers: int = 8) -> typing.List[str]:
+    """
+    A function that downloads the GeoTIFFs of every chunk of a tiled export into a local directory with 'workers'
+    parallel downloads and returns their paths. Chunks that Earth Engine split into several files are downloaded
+    whole and chunks without a file, such as the empty chunks skipped by the export, are left out.
+    """
+    names = []
+    for chunkname in tiledexport.names:
+        # Match the single file of the chunk and the files of a chunk split by Earth Engine
+        names.extend(get_exportfiles(storage, tiledexport.bucket, chunkname))
+
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, os.path.basename(name)) for name in names]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda item: storage.download(tiledexport.bucket, *item), zip(names, paths)))
+
+    except Exception as e:
+        raise RuntimeError(f"could not download tiles. error: {e}")
+
+    return paths
+
+
+class MosaicLayout(typing.NamedTuple):
+    """
+    A class that represents the layout of tiles in a mosaic. The 'transform' is the affine transform of the mosaic in
+    the order of the 'crsTransform' of Earth Engine exports and the 'offsets' are the (row, column) pixel offsets of
+    every tile in the mosaic.
+    """
+    crs: str
+    transform: typing.Tuple[float, float, float, float, float, float]
+    shape: typing.Tuple[int, int]
+    count: int
+    dtype: str
+    nodata: typing.Optional[float]
+    offsets: typing.List[typing.Tuple[int, int]]
+
+
+def generate_mosaiclayout(paths: typing.Sequence[str]) -> MosaicLayout:
+    """
+    A function that returns the layout of the mosaic of the given GeoTIFFs from their metadata. The tiles must share the
+    CRS, resolution, band count and data type and be aligned to the same pixel grid, as the tiles of a tiled export are.
+    """
+    if not paths:
+        raise RuntimeError("could not generate mosaic layout. no tiles were given.")
+
+    rasterio = _import_rasterio()
+    tiles = []
+    try:
+        for path in paths:
+            with rasterio.open(path) as dataset:
+                tiles.append((dataset.crs, dataset.transform, dataset.height, dataset.width, dataset.count, dataset.dtypes[0], dataset.nodata))
+
+    except Exception as e:
+        raise RuntimeError(f"could not read tile metadata. error: {e}")
+
+    crs, transform, _, _, count, dtype, nodata = tiles[0]
+    xres, yres = transform.a, transform.e
+    for tilecrs, tiletransform, _, _, tilecount, tiledtype, _ in tiles[1:]:
+        if tilecrs != crs or (tiletransform.a, tiletransform.e) != (xres, yres) or tilecount != count or tiledtype != dtype:
+            raise RuntimeError("could not generate mosaic layout. the tiles do not share a crs, resolution, band count and data type.")
+
+    # Determine the extent of the mosaic from the extents of the tiles
+    left = min(tile[1].c for tile in tiles)
+    top = max(tile[1].f for tile in tiles)
+    right = max(tile[1].c + tile[3] * xres for tile in tiles)
+    bottom = min(tile[1].f + tile[2] * yres for tile in tiles)
+
+    offsets = [(round((tile[1].f - top) / yres), round((tile[1].c - left) / xres)) for tile in tiles]
+    shape = (round((bottom - top) / yres), round((right - left) / xres))
+    return MosaicLayout(crs.to_string(), (xres, 0.0, left, 0.0, yres, top), shape, count, dtype, nodata, offsets)
+
+
+@instrumentation.instrumented
+def stitch_geotiffs(paths: typing.Sequence[str], output: str, blocksize: int = 512) -> str:
+    """
+    A function that stitches the tiles of a tiled export into a single tiled and compressed GeoTIFF at 'output' and
+    returns its path. Every tile is copied in windows of 'blocksize' pixels, so memory use is bounded by a single window
+    regardless of the size of the tiles and the mosaic. Pixels that are not covered by a tile are left as nodata.
+    """
+    rasterio = _import_rasterio()
+    layout = generate_mosaiclayout(paths)
+    profile = {
+        "driver": "GTiff", "height": layout.shape[0], "width": layout.shape[1], "count": layout.count, "dtype": layout.dtype,
+        "crs": layout.crs, "transform": rasterio.Affine(*layout.transform), "nodata": layout.nodata,
+        "tiled": True, "blockxsize": blocksize, "blockysize": blocksize, "compress": "deflate", "BIGTIFF": "IF_SAFER",
+    }
+
+    try:
+        with rasterio.open(output, "w", **profile) as destination:
+            for path, (rowoff, coloff) in zip(paths, layout.offsets):
+                with rasterio.open(path) as source:
+                    # Copy the tile into its place in the mosaic one window at a time
+                    for row in range(0, source.height, blocksize):
+                        for column in range(0, source.width, blocksize):
+                            window = rasterio.windows.Window(column, row, min(blocksize, source.width - column), min(blocksize, source.height - row))
+                            target = rasterio.windows.Window(coloff + column, rowoff + row, window.width, window.height)
+                            destination.write(source.read(window=window), window=target)
+
+    except Exception as e:
+        raise RuntimeError(f"could not stitch geotiffs. error: {e}")
+
+    return output
+
+@instrumentation.instrumented
+def stitch_virtualmosaic(paths: typing.Sequence[str], output: str) -> str:
+    """
+    A function that writes a GDAL virtual mosaic of the tiles of a tiled export to 'output' and returns its path.
+    The mosaic references the tiles relative to its own location when possible and reads their pixels on demand,
+    so no pixels are copied. It can be opened by rasterio or GDAL like any other raster.
+    """
+    rasterio = _import_rasterio()
+    layout = generate_mosaiclayout(paths)
+
+    # Describe the extent, the CRS and the pixel grid of the mosaic
+    a, b, c, d, e, f = layout.transform
+    dataset = ElementTree.Element("VRTDataset", rasterXSize=str(layout.shape[1]), rasterYSize=str(layout.shape[0]))
+    ElementTree.SubElement(dataset, "SRS").text = rasterio.crs.CRS.from_string(layout.crs).to_wkt()
+    ElementTree.SubElement(dataset, "GeoTransform").text = ", ".join(repr(float(value)) for value in (c, a, b, f, d, e))
+
+    sizes = []
+    try:
+        for path in paths:
+            with rasterio.open(path) as source:
+                sizes.append((source.height, source.width))
+
+    except Exception as e:
+        raise RuntimeError(f"could not read tile metadata. error: {e}")
+
+    directory = os.path.dirname(os.path.abspath(output))
+    for band in range(1, layout.count + 1):
+        element = ElementTree.SubElement(dataset, "VRTRasterBand", dataType=GDALTYPES[layout.dtype], band=str(band))
+        if layout.nodata is not None:
+            ElementTree.SubElement(element, "NoDataValue").text = repr(layout.nodata)
+
+        # Place every tile at its offset in the mosaic
+        for path, (height, width), (rowoff, coloff) in zip(paths, sizes, layout.offsets):
+            source = ElementTree.SubElement(element, "SimpleSource")
+            relative = os.path.relpath(os.path.abspath(path), directory)
+            relativetovrt = not relative.startswith("..")
+            filename = ElementTree.SubElement(source, "SourceFilename", relativeToVRT="1" if relativetovrt else "0")
+            filename.text = relative if relativetovrt else os.path.abspath(path)
+            ElementTree.SubElement(source, "SourceBand").text = str(band)
+            ElementTree.SubElement(source, "SrcRect", xOff="0", yOff="0", xSize=str(width), ySize=str(height))
+            ElementTree.SubElement(source, "DstRect", xOff=str(coloff), yOff=str(rowoff), xSize=str(width), ySize=str(height))
+
+    try:
+        ElementTree.ElementTree(dataset).write(output, encoding="utf-8")
+    except OSError as e:
+        raise RuntimeError(f"could not write virtual mosaic. error: {e}")
+
+    return output
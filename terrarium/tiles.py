@@ -0,0 +1,503 @@
+"""
+Terrarium Package
+
+The tiles module contains a local renderer of XYZ map tiles for exported rasters.
+Visualization parameters from the palette module are compiled into lookup tables,
+tiles are cut from windowed reads of the raster in the WebMercator tiling scheme,
+encoded as PNG and kept in a size bounded memory and disk cache.
+"""
+from __future__ import annotations
+
+import os
+import json
+import math
+import time
+import zlib
+import struct
+import typing
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+
+from . import lazyload
+from . import caching
+from . import spatial
+from . import instrumentation
+
+numpy = lazyload.lazy_import("numpy")
+shapes = lazyload.lazy_import("shapely.geometry")
+prepared = lazyload.lazy_import("shapely.prepared")
+
+# The number of levels in a compiled lookup table
+LUTLEVELS = 1024
+# The half extent of the WebMercator projection in meters
+ORIGINSHIFT = math.pi * 6378137.0
+# The latitude limit of the WebMercator projection
+MAXLATITUDE = 85.0511287798066
+# The CRS of the WebMercator projection
+WEBMERCATOR_PROJ = "EPSG:3857"
+
+class ColorMap(typing.NamedTuple):
+    """
+    A class that represents compiled visualization parameters.
+
+    'lut' is a (levels, 4) RGBA table for single band palettes or a (levels,) gray table that is applied
+    to every band for multiband stretches. Values between 'minimum' and 'maximum' of every band are
+    quantized into the levels of the table.
+    """
+    lut: numpy.ndarray
+    minimum: numpy.ndarray
+    maximum: numpy.ndarray
+    bands: int
+    palette: bool
+
+# The compiled colormaps keyed by their visualization parameters
+_colormaps = caching.LRUCache(64)
+
+def compile_colormap(visparams: dict, levels: int = LUTLEVELS) -> ColorMap:
+    """
+    A function that compiles Earth Engine visualization parameters such as 'palette.NDVIFOCAL' into a uint8 lookup table.
+    Palette colors are linearly interpolated between evenly spaced stops from 'min' to 'max' like 'ee.Image.visualize'.
+    """
+    key = (json.dumps(visparams, sort_keys=True), levels)
+    colormap = _colormaps.get(key)
+    if colormap is not None:
+        return colormap
+
+    try:
+        palette = visparams.get("palette")
+        count = 1 if palette else len(visparams.get("bands", [None] * 3))
+
+        # Broadcast the value range to every band
+        minimum = numpy.broadcast_to(numpy.asarray(visparams.get("min", 0), dtype=numpy.float64), (count,)).copy()
+        maximum = numpy.broadcast_to(numpy.asarray(visparams.get("max", 1), dtype=numpy.float64), (count,)).copy()
+        positions = numpy.linspace(0, 1, levels)
+
+        if palette:
+            # Interpolate every channel of the palette colors over the levels
+            colors = numpy.array([[int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)] for color in palette], dtype=numpy.float64)
+            stops = numpy.linspace(0, 1, len(colors)) if len(colors) > 1 else numpy.zeros(1)
+            channels = [numpy.interp(positions, stops, colors[:, channel]) for channel in range(3)]
+            lut = numpy.stack(channels + [numpy.full(levels, 255.0)], axis=1)
+        else:
+            # Stretch the values of every band linearly over the levels
+            lut = positions * 255
+
+    except Exception as e:
+        raise RuntimeError(f"could not compile visualization parameters. error: {e}")
+
+    colormap = ColorMap(numpy.rint(lut).astype(numpy.uint8), minimum, maximum, count, bool(palette))
+    _colormaps.put(key, colormap)
+    return colormap
+
+def colormap_array(array: numpy.ndarray, colormap: ColorMap) -> numpy.ndarray:
+    """
+    A function that applies a compiled colormap to a 2D array or a (bands, rows, columns) array and
+    returns a (rows, columns, 4) RGBA uint8 array. Pixels that are NaN in any band are transparent.
+    """
+    array = numpy.asarray(array, dtype=numpy.float32)
+    if array.ndim == 2:
+        array = array[None]
+
+    if array.shape[0] != colormap.bands:
+        raise RuntimeError(f"could not colormap array. expected {colormap.bands} bands, got {array.shape[0]}")
+
+    levels = len(colormap.lut)
+    valid = numpy.isfinite(array).all(axis=0)
+
+    # Quantize the values of every band into the levels of the lookup table
+    scale = (levels - 1) / numpy.where(colormap.maximum == colormap.minimum, 1, colormap.maximum - colormap.minimum)
+    with numpy.errstate(invalid="ignore"):
+        positions = (array - colormap.minimum[:, None, None].astype(numpy.float32)) * scale[:, None, None].astype(numpy.float32) + 0.5
+    indices = numpy.clip(numpy.nan_to_num(positions), 0, levels - 1).astype(numpy.intp)
+
+    # Look up the colors of every pixel
+    if colormap.palette:
+        rgba = colormap.lut[indices[0]]
+    else:
+        rgba = numpy.empty(array.shape[1:] + (4,), dtype=numpy.uint8)
+        rgba[..., :3] = numpy.moveaxis(colormap.lut[indices], 0, -1)
+        rgba[..., 3] = 255
+
+    rgba[~valid] = 0
+    return rgba
+
+def encode_png(rgba: numpy.ndarray, level: int = 6) -> bytes:
+    """ A function that encodes a (rows, columns, 4) RGBA uint8 array as a PNG image with the 'Sub' filter on every scanline. """
+    rows, columns = rgba.shape[:2]
+    pixels = numpy.ascontiguousarray(rgba, dtype=numpy.uint8).reshape(rows, columns * 4)
+
+    # Filter every scanline with the difference to the pixel on its left
+    scanlines = numpy.empty((rows, columns * 4 + 1), dtype=numpy.uint8)
+    scanlines[:, 0] = 1
+    scanlines[:, 1:5] = pixels[:, :4]
+    numpy.subtract(pixels[:, 4:], pixels[:, :-4], out=scanlines[:, 5:])
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", columns, rows, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(scanlines.tobytes(), level)) + chunk(b"IEND", b"")
+
+def generate_tilebounds(zoom: int, x: int, y: int) -> typing.Tuple[float, float, float, float]:
+    """ A function that returns the (west, south, east, north) bounds of an XYZ tile in WebMercator meters. """
+    size = 2 * ORIGINSHIFT / 2 ** zoom
+    west, north = -ORIGINSHIFT + x * size, ORIGINSHIFT - y * size
+    return west, north - size, west + size, north
+
+def generate_tilelonlat(zoom: int, x: int, y: int) -> typing.Tuple[float, float, float, float]:
+    """ A function that returns the (west, south, east, north) bounds of an XYZ tile in degrees. """
+    count = 2 ** zoom
+    latitude = lambda row: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / count))))
+    return x / count * 360 - 180, latitude(y + 1), (x + 1) / count * 360 - 180, latitude(y)
+
+def generate_tilerange(bounds: typing.Tuple[float, float, float, float], zoom: int) -> typing.Tuple[int, int, int, int]:
+    """ A function that returns the inclusive (xmin, ymin, xmax, ymax) range of XYZ tiles that cover (west, south, east, north) bounds in degrees. """
+    west, south, east, north = bounds
+    count = 2 ** zoom
+
+    def column(longitude: float) -> int:
+        return min(count - 1, max(0, int(math.floor((longitude + 180) / 360 * count))))
+
+    def row(latitude: float) -> int:
+        latitude = math.radians(min(MAXLATITUDE, max(-MAXLATITUDE, latitude)))
+        return min(count - 1, max(0, int(math.floor((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * count))))
+
+    return column(west), row(north), column(east), row(south)
+
+def generate_pyramid(aoi: typing.Union[tuple, shapes.base.BaseGeometry], minzoom: int, maxzoom: int) -> typing.List[typing.Tuple[int, int, int]]:
+    """
+    A function that returns the (zoom, x, y) tiles of every zoom level from 'minzoom' to 'maxzoom' that cover an AOI.
+    The AOI can be (west, south, east, north) bounds or a Shapely geometry in degrees. For geometries, tiles that
+    are within the bounds but do not intersect the geometry are skipped.
+    """
+    geometry = None if isinstance(aoi, tuple) else prepared.prep(aoi)
+    bounds = aoi if isinstance(aoi, tuple) else aoi.bounds
+
+    tiles = []
+    for zoom in range(minzoom, maxzoom + 1):
+        xmin, ymin, xmax, ymax = generate_tilerange(bounds, zoom)
+        for x in range(xmin, xmax + 1):
+            for y in range(ymin, ymax + 1):
+                if geometry is None or geometry.intersects(shapes.box(*generate_tilelonlat(zoom, x, y))):
+                    tiles.append((zoom, x, y))
+
+    return tiles
+
+
+class RasterSource:
+    """
+    A class that defines the interface for rasters that tiles are cut from. Sources have a 'crs', a 'transform'
+    with the (a, b, c, d, e, f) coefficients of their geotransform, a (bands, rows, columns) 'shape' and a 'key'
+    that identifies their content. Sources must implement 'read' which returns a float32 window of the raster
+    with NaN for nodata values, sampled every 'step' pixels.
+    """
+    crs: str
+    transform: typing.Tuple[float, float, float, float, float, float]
+    shape: typing.Tuple[int, int, int]
+    key: str
+
+    def read(self, window: typing.Tuple[int, int, int, int], step: int = 1) -> numpy.ndarray:
+        raise NotImplementedError
+
+    @property
+    def bounds(self) -> typing.Tuple[float, float, float, float]:
+        """ A property that returns the (west, south, east, north) bounds of the raster in degrees. """
+        a, b, c, d, e, f = self.transform
+        _, rows, columns = self.shape
+        xs = [c, c + a * columns + b * rows, c + a * columns, c + b * rows]
+        ys = [f, f + d * columns + e * rows, f + d * columns, f + e * rows]
+
+        transformer = spatial.get_transformer(self.crs, spatial.WGS84_PROJ)
+        return transformer.transform_bounds(min(xs), min(ys), max(xs), max(ys), densify_pts=21)
+
+
+# The number of bytes of an array that are hashed at once
+HASHBLOCKSIZE = 2 ** 24
+
+def generate_arraykey(array: numpy.ndarray, transform: typing.Sequence[float], crs: str) -> str:
+    """
+    A function that returns a content key for a georeferenced array as a SHA-256 digest of its values, shape,
+    dtype, transform and CRS. The array is hashed in blocks of rows, so memory-mapped arrays are not loaded whole.
+    """
+    digest = hashlib.sha256(f"{array.shape}|{array.dtype.str}|{tuple(transform)}|{crs}".encode("utf-8"))
+    rows = array.reshape(-1, array.shape[-1]) if array.ndim > 1 else array[None]
+    step = max(1, HASHBLOCKSIZE // max(1, rows.shape[1] * rows.itemsize))
+    for start in range(0, rows.shape[0], step):
+        digest.update(numpy.ascontiguousarray(rows[start:start + step]).data)
+
+    return digest.hexdigest()
+
+
+class ArraySource(RasterSource):
+    """
+    A class that serves tiles from an in-memory or memory-mapped array of shape (rows, columns) or (bands, rows, columns).
+    The 'key' that identifies the tiles of the source in the tile cache defaults to a hash of the array contents and its
+    georeferencing, which reads the whole array once. A stable key can be given instead, it must change with the contents.
+    """
+    def __init__(self, array: numpy.ndarray, transform: typing.Sequence[float], crs: str, key: str = None):
+        self.array = array if array.ndim == 3 else array[None]
+        self.transform = tuple(transform)[:6]
+        self.crs = crs
+        self.shape = self.array.shape
+        self.key = key or f"array:{generate_arraykey(self.array, self.transform, crs)}"
+
+    def read(self, window: typing.Tuple[int, int, int, int], step: int = 1) -> numpy.ndarray:
+        top, bottom, left, right = window
+        return numpy.asarray(self.array[:, top:bottom:step, left:right:step], dtype=numpy.float32)
+
+
+class GeoTIFFSource(RasterSource):
+    """
+    A class that serves tiles from a GeoTIFF with windowed reads. Decimated reads use the overviews of the
+    GeoTIFF when it has them. Requires the 'rasterio' package which is installed with the 'raster' extra.
+    """
+    def __init__(self, path: str):
+        try:
+            import rasterio
+            import rasterio.windows
+            self._rasterio = rasterio
+
+        except ImportError:
+            raise RuntimeError("could not open geotiff. the 'rasterio' package is required, install terrarium with the 'raster' extra.")
+
+        try:
+            self.dataset = rasterio.open(path)
+        except rasterio.errors.RasterioIOError as e:
+            raise RuntimeError(f"could not open geotiff. {e}")
+
+        self.crs = self.dataset.crs.to_string()
+        self.transform = tuple(self.dataset.transform)[:6]
+        self.shape = (self.dataset.count, self.dataset.height, self.dataset.width)
+        self.key = f"geotiff:{os.path.abspath(path)}:{os.path.getmtime(path)}"
+        self._lock = threading.Lock()
+
+    def read(self, window: typing.Tuple[int, int, int, int], step: int = 1) -> numpy.ndarray:
+        top, bottom, left, right = window
+        shape = (self.shape[0], math.ceil((bottom - top) / step), math.ceil((right - left) / step))
+
+        # Datasets are not safe to read from several threads at once
+        with self._lock:
+            data = self.dataset.read(window=self._rasterio.windows.Window(left, top, right - left, bottom - top), out_shape=shape)
+
+        data = data.astype(numpy.float32)
+        if self.dataset.nodata is not None:
+            data[data == self.dataset.nodata] = numpy.nan
+        return data
+
+    def close(self):
+        """ A method that closes the GeoTIFF. """
+        self.dataset.close()
+
+
+class TileCache:
+    """
+    A class that caches encoded tiles in memory and in an SQLite database on disk.
+
+    The least recently used tiles are evicted from memory beyond 'memorysize' bytes and from the disk beyond
+    'disksize' bytes. Tiles found on disk are promoted to memory. The disk cache can be disabled with 'disk'
+    and the path defaults to 'tiles.sqlite' in the Terrarium cache directory.
+    """
+    def __init__(self, path: str = None, memorysize: int = 64 * 2 ** 20, disksize: int = 2 ** 30, disk: bool = True):
+        self.memory = caching.LRUCache(capacity=2 ** 31, maxweight=memorysize)
+        self.disksize = disksize
+        self.diskhits = 0
+        self.path = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+        if not disk:
+            return
+
+        self.path = path or caching.generate_cachepath("tiles.sqlite")
+        try:
+            # Open the database and create the cache table if required
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, data BLOB, size INTEGER, accessed REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)")
+            self._connection.commit()
+            self._used = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+
+        except sqlite3.Error as e:
+            raise RuntimeError(f"could not open tile cache. error: {e}")
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        """ A method that returns the cached tile for a key or None if it is not cached. """
+        data = self.memory.get(key)
+        if data is not None or self._connection is None:
+            return data
+
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM tiles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            # Refresh the access time of the tile
+            self._connection.execute("UPDATE tiles SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self.diskhits += 1
+
+        self.memory.put(key, row[0])
+        return row[0]
+
+    def put(self, key: str, data: bytes):
+        """ A method that caches a tile and evicts the least recently used tiles. """
+        self.memory.put(key, data)
+        if self._connection is None:
+            return
+
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM tiles WHERE key = ?", (key,)).fetchone()
+            self._used += len(data) - (previous[0] if previous else 0)
+            self._connection.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+
+            # Evict the least recently used tiles beyond the disk size
+            if self._used > self.disksize:
+                evicted, freed = [], 0
+                for oldkey, size in self._connection.execute("SELECT key, size FROM tiles ORDER BY accessed ASC"):
+                    if self._used - freed <= self.disksize:
+                        break
+                    evicted.append((oldkey,))
+                    freed += size
+
+                self._connection.executemany("DELETE FROM tiles WHERE key = ?", evicted)
+                self._used -= freed
+
+            self._connection.commit()
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.memory:
+            return True
+        if self._connection is None:
+            return False
+
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM tiles WHERE key = ?", (key,)).fetchone() is not None
+
+    def stats(self) -> dict:
+        """ A method that returns a mapping of the memory and disk hits, the misses and the bytes used in memory and on disk. """
+        memory = self.memory.stats()
+        return {
+            "memoryhits": memory["hits"], "diskhits": self.diskhits, "misses": memory["misses"] - self.diskhits,
+            "memorybytes": memory["weight"], "diskbytes": self._used if self._connection is not None else 0,
+        }
+
+
+class TileRenderer:
+    """
+    A class that renders XYZ tiles of a raster source with visualization parameters such as 'palette.NDVIFOCAL'.
+
+    Tile pixels are mapped to the raster by projecting a coarse grid of every 'step' pixels and interpolating it,
+    which is how GDAL approximates warps, and sampled with nearest neighbour from a single windowed read. At zoom
+    levels coarser than the raster the read is decimated so the cost of a tile does not grow with the raster size.
+    """
+    def __init__(self, source: RasterSource, visparams: dict, cache: TileCache = None, tilesize: int = 256, step: int = 16):
+        self.source = source
+        self.colormap = compile_colormap(visparams)
+        self.cache = cache
+        self.tilesize = tilesize
+        self.step = step
+
+        # The layer key identifies the rendered content in the cache
+        layer = f"{source.key}|{json.dumps(visparams, sort_keys=True)}|{tilesize}"
+        self.layer = hashlib.sha256(layer.encode()).hexdigest()[:16]
+
+        self._transformer = spatial.get_transformer(WEBMERCATOR_PROJ, source.crs)
+        a, b, c, d, e, f = source.transform
+        determinant = a * e - b * d
+        # The inverse geotransform from raster coordinates to fractional (column, row) pixels
+        self._inverse = (e / determinant, -b / determinant, -d / determinant, a / determinant, c, f)
+        self._empty = None
+
+    def _generate_pixels(self, zoom: int, x: int, y: int) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        """ A method that returns the fractional raster rows and columns of the center of every pixel of a tile. """
+        west, _, east, north = generate_tilebounds(zoom, x, y)
+        resolution = (east - west) / self.tilesize
+
+        # Project a coarse grid of pixel centers into the raster CRS
+        grid = numpy.unique(numpy.append(numpy.arange(0, self.tilesize, self.step), self.tilesize - 1)) + 0.5
+        xs, ys = numpy.meshgrid(west + grid * resolution, north - grid * resolution)
+        xs, ys = self._transformer.transform(xs, ys)
+
+        ia, ib, id, ie, c, f = self._inverse
+        columns, rows = ia * (xs - c) + ib * (ys - f), id * (xs - c) + ie * (ys - f)
+
+        # Interpolate the coarse grid bilinearly to every pixel
+        positions = numpy.interp(numpy.arange(self.tilesize) + 0.5, grid, numpy.arange(len(grid)))
+        lower = numpy.minimum(positions.astype(numpy.intp), len(grid) - 2)
+        t = positions - lower
+
+        def interpolate(values: numpy.ndarray) -> numpy.ndarray:
+            values = values[lower] * (1 - t)[:, None] + values[lower + 1] * t[:, None]
+            return values[:, lower] * (1 - t)[None, :] + values[:, lower + 1] * t[None, :]
+
+        return interpolate(rows), interpolate(columns)
+
+    def render_array(self, zoom: int, x: int, y: int) -> typing.Optional[numpy.ndarray]:
+        """ A method that returns the (bands, tilesize, tilesize) float32 values of a tile or None if the tile does not overlap the raster. """
+        rows, columns = self._generate_pixels(zoom, x, y)
+        _, height, width = self.source.shape
+
+        rows, columns = numpy.floor(rows).astype(numpy.int64), numpy.floor(columns).astype(numpy.int64)
+        inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+        if not inside.any():
+            return None
+
+        # Decimate the read when a tile pixel spans several raster pixels
+        span = max(abs(columns[0, -1] - columns[0, 0]), abs(rows[-1, 0] - rows[0, 0])) / self.tilesize
+        step = max(1, int(span))
+
+        # Read the window of the raster under the tile
+        rows, columns = rows[inside], columns[inside]
+        top, left = rows.min(), columns.min()
+        data = self.source.read((top, rows.max() + 1, left, columns.max() + 1), step)
+
+        values = numpy.full((data.shape[0], self.tilesize, self.tilesize), numpy.nan, dtype=numpy.float32)
+        values[:, inside] = data[:, (rows - top) // step, (columns - left) // step]
+        return values
+
+    @instrumentation.instrumented
+    def render_tile(self, zoom: int, x: int, y: int) -> bytes:
+        """ A method that returns a tile as PNG bytes. Tiles that do not overlap the raster are transparent. """
+        key = f"{self.layer}/{zoom}/{x}/{y}"
+        if self.cache is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+
+        try:
+            values = self.render_array(zoom, x, y)
+            if values is None:
+                if self._empty is None:
+                    self._empty = encode_png(numpy.zeros((self.tilesize, self.tilesize, 4), dtype=numpy.uint8))
+                data = self._empty
+            else:
+                data = encode_png(colormap_array(values, self.colormap))
+
+        except RuntimeError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"could not render tile {zoom}/{x}/{y}. error: {e}")
+
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
+    @instrumentation.instrumented
+    def prewarm(self, aoi: typing.Union[tuple, shapes.base.BaseGeometry] = None, minzoom: int = 10, maxzoom: int = 16, workers: int = 4) -> int:
+        """
+        A method that renders every tile of the zoom pyramid of an AOI into the cache on 'workers' threads.
+        The AOI defaults to the bounds of the raster. Returns the number of tiles that were rendered.
+        """
+        if self.cache is None:
+            raise RuntimeError("could not prewarm tiles. the renderer has no cache")
+
+        tiles = generate_pyramid(aoi or tuple(self.source.bounds), minzoom, maxzoom)
+        missing = [tile for tile in tiles if f"{self.layer}/{tile[0]}/{tile[1]}/{tile[2]}" not in self.cache]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(self.render_tile, *tile) for tile in missing]:
+                future.result()
+
+        return len(missing)
@@ -0,0 +1,28 @@
+"""
+Terrarium Tests
+
+Shared fixtures of the test suite. Every test runs with its own Terrarium cache
+directory and tests that build Earth Engine graphs use the offline stand-in for
+Earth Engine from the benchmarks, so the suite runs without credentials or network.
+"""
+import os
+import sys
+
+import pytest
+
+# Make the offline Earth Engine stand-in of the benchmarks importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+@pytest.fixture(autouse=True)
+def cachedir(tmp_path, monkeypatch):
+    """ A fixture that points the Terrarium cache directory at a temporary directory. """
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("TERRARIUM_CACHE_DIR", str(directory))
+    return directory
+
+@pytest.fixture
+def fakeearthengine():
+    """ A fixture that installs the offline Earth Engine stand-in for the duration of a test. """
+    fakeee = pytest.importorskip("fakeee")
+    with fakeee.FakeEarthEngine() as fake:
+        yield fake
@@ -0,0 +1,235 @@
+"""
+Terrarium Tests
+
+Tests for the backend pools of the aio module with stub blocking functions that are held and released
+by the tests, so the order of the calls, the quota backoff and the timeouts are checked without a network.
+"""
+import time
+import asyncio
+import threading
+
+import pytest
+
+from terrarium import aio
+
+class Gate:
+    """ A stub blocking function that records the calls that started and holds every call until it is released. """
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self._released = threading.Semaphore(0)
+
+    def __call__(self, value):
+        self.started.append(value)
+        self._released.acquire(timeout=5)
+        self.finished.append(value)
+        return value
+
+    def release(self, count: int = 1):
+        for _ in range(count):
+            self._released.release()
+
+class Quota:
+    """ A stub blocking function that fails with a quota error for its first 'failures' calls. """
+    def __init__(self, failures: int, error: Exception = None):
+        self.failures = failures
+        self.error = error or RuntimeError("429 Too Many Requests")
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.calls += 1
+            failed = self.calls <= self.failures
+        if failed:
+            raise self.error
+        return value
+
+async def wait_until(condition, timeout: float = 5):
+    """ A function that polls a condition on the event loop until it holds. """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition was not met"
+        await asyncio.sleep(0.005)
+
+@pytest.fixture
+def pools():
+    created = []
+
+    def create(*args, **kwargs) -> aio.BackendPool:
+        created.append(aio.BackendPool(*args, **kwargs))
+        return created[-1]
+
+    yield create
+    for pool in created:
+        pool.close()
+
+def test_is_quotaerror():
+    assert aio.is_quotaerror(RuntimeError("HttpError 429 when requesting"))
+    assert aio.is_quotaerror(Exception("Earth Engine memory capacity exceeded: RESOURCE_EXHAUSTED"))
+    assert not aio.is_quotaerror(ValueError("invalid geometry"))
+
+    # Errors raised from a quota error are quota errors
+    try:
+        try:
+            raise ConnectionError("over_query_limit")
+        except ConnectionError as e:
+            raise RuntimeError("could not generate location.") from e
+    except RuntimeError as e:
+        assert aio.is_quotaerror(e)
+
+def test_callers_beyond_the_limit_wait_in_order(pools):
+    pool, gate = pools("test", concurrency=2), Gate()
+
+    async def main():
+        tasks = []
+        for index in range(6):
+            tasks.append(asyncio.ensure_future(pool.run(gate, index)))
+            await asyncio.sleep(0)
+
+        # The first two calls run and the others wait for a slot without being submitted to the threads
+        await wait_until(lambda: len(gate.started) == 2)
+        await asyncio.sleep(0.05)
+        assert sorted(gate.started) == [0, 1]
+        assert pool.metrics()["inflight"] == 2 and pool.metrics()["waiting"] == 4
+
+        # Every finished call frees its slot for the caller that waited longest
+        for count in range(3, 7):
+            gate.release()
+            await wait_until(lambda: len(gate.started) == count)
+            assert pool.inflight == 2
+
+        gate.release(2)
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == list(range(6))
+    assert gate.started[2:] == [2, 3, 4, 5]
+    assert pool.metrics() == {**pool.counters, "calls": 6, "completed": 6, "limit": 2, "inflight": 0, "waiting": 0}
+
+def test_rate_spaces_the_starts(pools):
+    pool, starts = pools("test", concurrency=8, rate=50.0), []
+    asyncio.run(pool.gather(lambda index: starts.append(time.monotonic()), [(index,) for index in range(6)]))
+
+    # The six starts span at least five intervals of the rate
+    assert max(starts) - min(starts) >= 5 / 50.0 * 0.9
+
+def test_quota_errors_throttle_and_recover(pools):
+    pool, quota = pools("test", concurrency=4, cooldown=0.1), Quota(1)
+
+    async def main():
+        start = time.monotonic()
+        assert await pool.run(quota, "first") == "first"
+        # The call is retried after the cooldown with the limit halved
+        assert time.monotonic() - start >= 0.1
+        assert pool.limit == 2 and pool.counters["throttled"] == 1 and pool.counters["retried"] == 1
+
+        # The limit grows by a slot once as many calls as the limit have succeeded
+        await pool.run(quota, "second")
+        assert pool.limit == 3
+        for _ in range(3):
+            await pool.run(quota, "next")
+        assert pool.limit == 4
+
+        # The limit does not grow beyond the concurrency
+        await pool.gather(quota, [("more",)] * 10)
+        assert pool.limit == 4
+
+    asyncio.run(main())
+    assert quota.calls == 16 and pool.counters["completed"] == 15 and pool.counters["failed"] == 0
+
+def test_concurrent_quota_errors_throttle_once(pools):
+    pool, barrier = pools("test", concurrency=4, cooldown=0.05), threading.Barrier(4, timeout=5)
+    quota = Quota(4)
+
+    def call(value):
+        # The four calls fail together after they have all started
+        if quota.calls < 4:
+            barrier.wait()
+        return quota(value)
+
+    assert asyncio.run(pool.gather(call, [(index,) for index in range(4)])) == [0, 1, 2, 3]
+    # The limit is halved once and grows back by a slot after the first two retries succeed
+    assert pool.counters["throttled"] == 1 and pool.counters["retried"] == 4 and pool.limit == 3
+
+def test_quota_retries_are_bounded(pools):
+    pool = pools("test", concurrency=2, retries=2, cooldown=0.01, maxcooldown=0.02)
+    quota = Quota(10)
+    with pytest.raises(RuntimeError, match="429"):
+        asyncio.run(pool.run(quota, None))
+    # The last attempt is not retried, so it does not throttle the pool again
+    assert quota.calls == 3 and pool.counters["failed"] == 1 and pool.counters["throttled"] == 2 and pool.limit == 1
+
+    # Other errors are raised without a retry
+    other = Quota(1, ValueError("invalid geometry"))
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run(other, None))
+    assert other.calls == 1 and pool.counters["retried"] == 2
+
+def test_timeouts(pools):
+    pool, gate, slow = pools("test", concurrency=1, timeout=0.05), Gate(), Gate()
+
+    async def main():
+        running = asyncio.ensure_future(pool.run(gate, "running", timeout=5))
+        await wait_until(lambda: gate.started)
+
+        # A call waiting for a slot times out without being started
+        with pytest.raises(RuntimeError, match="timed out after 0.05s"):
+            await pool.run(gate, "queued")
+        assert pool.metrics()["waiting"] == 0
+        gate.release()
+        assert await running == "running"
+
+        # A running call times out but keeps its slot until its thread returns
+        with pytest.raises(RuntimeError, match="timed out"):
+            await pool.run(slow, "slow")
+        assert pool.inflight == 1
+        slow.release()
+        await wait_until(lambda: pool.inflight == 0)
+        assert await pool.run(gate.finished.copy) == ["running"]
+
+    asyncio.run(main())
+    assert gate.started == ["running"] and slow.finished == ["slow"]
+    assert pool.counters["timeouts"] == 2 and pool.counters["completed"] == 2
+
+def test_cancelled_callers_pass_on_their_slot(pools):
+    pool, gate = pools("test", concurrency=1), Gate()
+
+    async def main():
+        tasks = []
+        for value in ("running", "cancelled", "queued"):
+            tasks.append(asyncio.ensure_future(pool.run(gate, value)))
+            await asyncio.sleep(0)
+        await wait_until(lambda: gate.started)
+
+        # The cancelled caller gives up its place in line, so the slot freed by the running call goes to the next caller
+        tasks[1].cancel()
+        gate.release()
+        assert await tasks[0] == "running"
+        with pytest.raises(asyncio.CancelledError):
+            await tasks[1]
+        await wait_until(lambda: len(gate.started) == 2)
+        gate.release()
+        assert await asyncio.wait_for(tasks[2], 5) == "queued"
+
+    asyncio.run(main())
+    assert gate.started == ["running", "queued"]
+    assert pool.metrics() == {**pool.counters, "calls": 3, "completed": 2, "cancelled": 1, "limit": 1, "inflight": 0, "waiting": 0}
+
+def test_gather_cancels_the_calls_that_have_not_started(pools):
+    pool, gate = pools("test", concurrency=1), Gate()
+
+    def call(value):
+        if value == "failed":
+            raise ValueError("invalid geometry")
+        return gate(value)
+
+    async def main():
+        with pytest.raises(ValueError):
+            await pool.gather(call, [("failed",)] + [("queued",)] * 4)
+        gate.release(4)
+        await wait_until(lambda: pool.inflight == 0)
+
+    asyncio.run(main())
+    # The slot freed by the failed call may be taken by the next caller before the batch is cancelled
+    assert len(gate.started) <= 1 and gate.finished == gate.started
+    assert pool.counters["cancelled"] == 4 and pool.metrics()["waiting"] == 0
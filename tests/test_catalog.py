@@ -0,0 +1,96 @@
+"""
+Terrarium Tests
+
+Tests for the catalog module that compare the queries of the packed spatial index against
+brute force checks of every geometry with Shapely.
+"""
+import numpy
+import pytest
+import shapely.geometry
+
+from terrarium import catalog
+
+def generate_shapes(count: int, seed: int = 0) -> list:
+    """ A function that returns a random mix of points, linestrings and polygons with and without holes. """
+    rng = numpy.random.default_rng(seed)
+    shapelist = []
+    for index in range(count):
+        x, y = rng.uniform(-10, 10), rng.uniform(-10, 10)
+        size = rng.uniform(0.01, 1.5)
+        kind = index % 4
+        if kind == 0:
+            shapelist.append(shapely.geometry.Point(x, y))
+        elif kind == 1:
+            shapelist.append(shapely.geometry.LineString([(x, y), (x + size, y - size / 2), (x + size / 3, y + size)]))
+        elif kind == 2:
+            shapelist.append(shapely.geometry.box(x, y, x + size, y + size / 2))
+        else:
+            hole = [(x + size / 4, y + size / 4), (x + size / 2, y + size / 4), (x + size / 2, y + size / 2), (x + size / 4, y + size / 2)]
+            shapelist.append(shapely.geometry.Polygon([(x, y), (x + size, y), (x + size, y + size), (x, y + size)], [hole]))
+
+    return shapelist
+
+QUERIES = [
+    shapely.geometry.box(-2, -2, 2, 2),
+    shapely.geometry.box(-11, -11, 11, 11),
+    shapely.geometry.box(20, 20, 21, 21),
+    shapely.geometry.Point(0.5, 0.5).buffer(3),
+    shapely.geometry.LineString([(-10, -10), (10, 10)]),
+]
+
+@pytest.fixture(scope="module")
+def shapelist():
+    return generate_shapes(1000)
+
+@pytest.mark.parametrize("nodesize", [2, 4, catalog.NODESIZE])
+def test_queries_match_brute_force(shapelist, nodesize):
+    aois = catalog.AOICatalog.from_shapes(shapelist)
+    aois = catalog.AOICatalog(aois.coordinates, aois.ringoffsets, aois.partoffsets, aois.types, nodesize=nodesize)
+    assert len(aois) == len(shapelist)
+
+    for query in QUERIES:
+        expected = [index for index, shape in enumerate(shapelist) if shapely.geometry.box(*shape.bounds).intersects(shapely.geometry.box(*query.bounds))]
+        assert aois.query_bounds(*query.bounds).tolist() == expected
+
+        expected = [index for index, shape in enumerate(shapelist) if shape.intersects(query)]
+        assert aois.query_intersects(query).tolist() == expected
+
+def test_shapes_are_stored_exactly(shapelist):
+    aois = catalog.AOICatalog.from_shapes(shapelist)
+    for index in (0, 1, 2, 3, 998, 999):
+        assert aois.get_shape(index).equals_exact(shapelist[index], 0)
+    assert numpy.array_equal(aois.bounds, [shape.bounds for shape in shapelist])
+
+def test_rings_catalog():
+    rings = numpy.array([[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]], [[5, 5], [6, 5], [6, 6], [5, 6], [5, 5]]], dtype=float)
+    aois = catalog.AOICatalog.from_rings(rings)
+
+    assert aois.get_shape(1).equals(shapely.geometry.box(5, 5, 6, 6))
+    assert aois.query_intersects(shapely.geometry.Point(0.5, 0.5)).tolist() == [0]
+    with pytest.raises(RuntimeError):
+        catalog.AOICatalog.from_rings(rings[0])
+
+def test_empty_catalog():
+    aois = catalog.AOICatalog.from_shapes([])
+    assert len(aois) == 0
+    assert aois.query_bounds(-180, -90, 180, 90).tolist() == []
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, shapelist, mmap):
+    aois = catalog.AOICatalog.from_shapes(shapelist)
+    aois.save(str(tmp_path / "catalog"))
+    loaded = catalog.AOICatalog.load(str(tmp_path / "catalog"), mmap=mmap)
+
+    assert len(loaded) == len(aois) and loaded.nodesize == aois.nodesize
+    assert isinstance(loaded.coordinates, numpy.memmap) == mmap
+    for name in ("coordinates", "ringoffsets", "partoffsets", "types", "bounds", "order"):
+        assert numpy.array_equal(getattr(loaded, name), getattr(aois, name))
+    assert all(numpy.array_equal(level, original) for level, original in zip(loaded.levels, aois.levels, strict=True))
+
+    for query in QUERIES:
+        assert loaded.query_bounds(*query.bounds).tolist() == aois.query_bounds(*query.bounds).tolist()
+        assert loaded.query_intersects(query).tolist() == aois.query_intersects(query).tolist()
+
+def test_load_missing_catalog(tmp_path):
+    with pytest.raises(RuntimeError):
+        catalog.AOICatalog.load(str(tmp_path / "missing"))
@@ -0,0 +1,73 @@
+"""
+Terrarium Tests
+
+Tests for the cloudcover module with a stub fetcher and the offline stand-in for Earth Engine.
+"""
+import datetime
+
+import ee
+import pytest
+
+from terrarium import cloudcover
+
+def count_dates(expression) -> int:
+    """ A function that returns the number of date buffers in the series of a Cloud API encoded cloud fraction reduction. """
+    stack = [expression]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            constant = value.get("constantValue")
+            if isinstance(constant, list) and constant and all(isinstance(item, list) and len(item) == 3 for item in constant):
+                return len(constant)
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+    raise AssertionError("expression has no date buffers")
+
+class Fetcher:
+    """ A stub fetcher that returns a fixed fraction for every date and records the dates it was called with. """
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.calls = []
+
+    def __call__(self, geometry, dates, probability, scale):
+        self.calls.append(list(dates))
+        return [self.fraction] * len(dates)
+
+@pytest.fixture
+def geometry(fakeearthengine):
+    return ee.Geometry.Polygon([[[-121.9, 37.3], [-121.8, 37.3], [-121.8, 37.4], [-121.9, 37.4]]])
+
+def test_old_fractions_are_stored(tmp_path, geometry):
+    fetcher = Fetcher(0.25)
+    path = str(tmp_path / "clouds.sqlite")
+    dates = [datetime.datetime(2021, 1, day) for day in range(1, 6)]
+
+    assert cloudcover.CloudScreen(path, fetcher=fetcher).fractions(geometry, dates) == dict.fromkeys(dates, 0.25)
+    assert cloudcover.CloudScreen(path, fetcher=fetcher).fractions(geometry, dates) == dict.fromkeys(dates, 0.25)
+    assert fetcher.calls == [dates]
+
+def test_recent_fractions_are_fetched_until_they_settle(tmp_path, geometry):
+    path = str(tmp_path / "clouds.sqlite")
+    recent = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=1)
+    old = datetime.datetime(2021, 1, 1)
+
+    # A recent date with acquisitions may still gain images, so its fraction is not stored either
+    for fraction in (0.75, None):
+        fetcher = Fetcher(fraction)
+        screen = cloudcover.CloudScreen(path, settle=5, fetcher=fetcher)
+        screen.fractions(geometry, [recent, old])
+        assert screen.fractions(geometry, [recent, old]) == {recent: fraction, old: 0.75}
+        assert fetcher.calls[-1] == [recent]
+
+def test_fetch_cloudfractions_is_chunked(fakeearthengine, geometry):
+    fakeearthengine.responder = lambda expression: [0.5] * (count_dates(expression) - 1) + [-1]
+    dates = [datetime.datetime(2021, 1, 1) + datetime.timedelta(days=index) for index in range(7)]
+
+    fractions = cloudcover.fetch_cloudfractions(geometry, dates, chunksize=3)
+    assert fakeearthengine.calls["computeValue"] == 3
+    assert fractions == [0.5, 0.5, None, 0.5, 0.5, None, None]
+
+    with pytest.raises(RuntimeError):
+        cloudcover.fetch_cloudfractions(geometry, dates, chunksize=0)
@@ -0,0 +1,97 @@
+"""
+Terrarium Tests
+
+Tests for the acquisition index of the dateindex module against the offline stand-in for Earth Engine,
+which answers the day lists and counts the round trips.
+"""
+import json
+import datetime
+
+import ee
+import pytest
+import shapely.geometry
+
+from terrarium import dateindex
+
+class Responder:
+    """ A responder for the offline Earth Engine that returns the scripted days and records every expression. """
+    def __init__(self):
+        self.days = []
+        self.expressions = []
+
+    def __call__(self, expression: dict) -> list:
+        self.expressions.append(json.dumps(expression))
+        return self.days
+
+def generate_millis(day: datetime.datetime) -> int:
+    return int(day.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+@pytest.fixture
+def responder(fakeearthengine):
+    fakeearthengine.responder = Responder()
+    return fakeearthengine.responder
+
+@pytest.fixture
+def index(tmp_path):
+    return dateindex.AcquisitionIndex(str(tmp_path / "acquisitions.sqlite"), lookback=2)
+
+def generate_geometry() -> ee.Geometry:
+    return ee.Geometry.Polygon([[[-121.9, 37.3], [-121.8, 37.3], [-121.8, 37.4], [-121.9, 37.4]]])
+
+def test_refresh_fetches_after_the_last_known_day(fakeearthengine, responder, index):
+    geometry = generate_geometry()
+    responder.days = ["2021-01-01", "2021-01-06", "2021-01-11"]
+    assert index.refresh(geometry) == [datetime.datetime(2021, 1, day) for day in (1, 6, 11)]
+    # The first refresh has no start day, which is filtered with 'ee.Filter.gte', encoded as the negation of 'Filter.lessThan'
+    assert "Filter.lessThan" not in responder.expressions[0]
+
+    # The next refresh starts from the last known day with the lookback and only returns the new days
+    responder.days = ["2021-01-10", "2021-01-11", "2021-01-16"]
+    assert index.refresh(geometry) == [datetime.datetime(2021, 1, 10), datetime.datetime(2021, 1, 16)]
+    assert "Filter.lessThan" in responder.expressions[1]
+    assert str(generate_millis(datetime.datetime(2021, 1, 9))) in responder.expressions[1]
+    assert index.get_lastdate(geometry) == datetime.datetime(2021, 1, 16)
+    assert fakeearthengine.calls["computeValue"] == 2
+
+def test_query_is_answered_locally(fakeearthengine, responder, index):
+    geometry = generate_geometry()
+    responder.days = ["2021-01-01", "2021-01-06", "2021-01-11", "2021-02-05"]
+    index.refresh(geometry)
+    fakeearthengine.reset()
+
+    assert index.query(geometry) == [datetime.datetime(2021, 1, day) for day in (1, 6, 11)] + [datetime.datetime(2021, 2, 5)]
+    # Both ends of the range are inclusive and the time of day is ignored
+    assert index.query(geometry, datetime.datetime(2021, 1, 6, 12), datetime.datetime(2021, 1, 11, 8)) == [datetime.datetime(2021, 1, 6), datetime.datetime(2021, 1, 11)]
+    assert index.query(geometry, start=datetime.datetime(2021, 2, 1)) == [datetime.datetime(2021, 2, 5)]
+    assert fakeearthengine.calls["computeValue"] == 0
+
+def test_aois_are_keyed_by_their_geometry(fakeearthengine, responder, index, tmp_path):
+    responder.days = ["2021-01-01", "2021-01-06"]
+    index.refresh(generate_geometry())
+
+    # The same geometry constructed again shares the known days, even across index instances
+    reopened = dateindex.AcquisitionIndex(index.path)
+    assert reopened.query(generate_geometry()) == [datetime.datetime(2021, 1, 1), datetime.datetime(2021, 1, 6)]
+    assert reopened.get_lastdate(generate_geometry()) == datetime.datetime(2021, 1, 6)
+
+    # Another geometry has no known days and is fetched from the start
+    other = ee.Geometry.Point([77.59, 12.97])
+    assert index.query(other) == [] and index.get_lastdate(other) is None
+    responder.days = ["2021-03-01"]
+    assert index.refresh(other) == [datetime.datetime(2021, 3, 1)]
+    assert "Filter.lessThan" not in responder.expressions[-1]
+    assert len(index.query(generate_geometry())) == 2
+    assert fakeearthengine.calls["computeValue"] == 2
+
+def test_fetcher_is_called_with_the_first_day_to_fetch(tmp_path):
+    calls = []
+
+    def fetcher(geometry, since):
+        calls.append(since)
+        return [datetime.datetime(2021, 5, 20)]
+
+    index = dateindex.AcquisitionIndex(str(tmp_path / "acquisitions.sqlite"), lookback=3, fetcher=fetcher)
+    # Shapely geometries are keyed by the same canonical hash
+    index.refresh(shapely.geometry.Point(0, 0))
+    index.refresh(shapely.geometry.Point(0, 0))
+    assert calls == [None, datetime.datetime(2021, 5, 17)]
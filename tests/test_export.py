@@ -0,0 +1,115 @@
+"""
+Terrarium Tests
+
+Tests for the export module with the Earth Engine operations API replaced by local fakes.
+"""
+import types
+
+import ee
+import pytest
+
+from terrarium import export
+
+PROJECT = "projects/terrarium-tests"
+
+class PagedOperations:
+    """ A fake of the paged operations resource of the Earth Engine client that records the pages it serves. """
+    def __init__(self, count: int):
+        self.operations = [{"name": f"{PROJECT}/operations/OP{index}", "metadata": {"state": "RUNNING"}} for index in range(count)]
+        self.pages = []
+
+    def list(self, pageSize: int, name: str) -> dict:
+        assert name == PROJECT
+        return {"offset": 0, "size": pageSize}
+
+    def list_next(self, request: dict, response: dict):
+        if "nextPageToken" not in response:
+            return None
+        return {"offset": request["offset"] + request["size"], "size": request["size"]}
+
+    def execute(self, request: dict) -> dict:
+        self.pages.append(request["offset"])
+        response = {"operations": self.operations[request["offset"]:request["offset"] + request["size"]]}
+        if request["offset"] + request["size"] < len(self.operations):
+            response["nextPageToken"] = "next"
+        return response
+
+@pytest.fixture
+def operations(monkeypatch):
+    resource = PagedOperations(1000)
+    lookups = []
+
+    def get_operation(name):
+        lookups.append(name)
+        return {"name": name, "metadata": {"state": "SUCCEEDED"}, "done": True}
+
+    monkeypatch.setattr(ee.data, "_get_cloud_projects", lambda: types.SimpleNamespace(operations=lambda: resource), raising=False)
+    monkeypatch.setattr(ee.data, "_execute_cloud_call", resource.execute, raising=False)
+    monkeypatch.setattr(ee.data, "getOperation", get_operation)
+    resource.lookups = lookups
+    return resource
+
+def operationids(*indices):
+    return [f"{PROJECT}/operations/OP{index}" for index in indices]
+
+def test_listing_stops_once_every_operation_is_found(operations):
+    wanted = operationids(3, 50, 120, 150, 199)
+    statuses = export.get_taskstatuses(operationids=wanted)
+
+    assert set(statuses) == set(wanted)
+    assert all(status["metadata"]["state"] == "RUNNING" for status in statuses.values())
+    # Only the first two pages are read
+    assert operations.pages == [0, export.LISTPAGESIZE]
+    assert operations.lookups == []
+
+def test_listing_is_bounded_and_missing_operations_are_looked_up(operations):
+    wanted = operationids(1, 2, 3, 4, 900, "MISSING")
+    statuses = export.get_taskstatuses(operationids=wanted)
+
+    assert len(operations.pages) == export.MAXLISTPAGES
+    assert operations.lookups == operationids(900, "MISSING")
+    assert export.generate_taskstate(statuses[wanted[4]]) == "COMPLETED"
+    assert export.generate_taskstate(statuses[wanted[0]]) == "RUNNING"
+
+def test_few_operations_are_looked_up_individually(operations):
+    wanted = operationids(*range(export.MAXLOOKUPS))
+    statuses = export.get_taskstatuses(operationids=wanted)
+
+    assert operations.pages == []
+    assert operations.lookups == wanted
+    assert set(statuses) == set(wanted)
+
+def test_statuses_from_task_ids(operations):
+    statuses = export.get_taskstatuses(taskids=[f"OP{index}" for index in range(10)], project="terrarium-tests")
+    assert set(statuses) == set(operationids(*range(10)))
+
+    with pytest.raises(RuntimeError):
+        export.get_taskstatuses(taskids=["OP1"])
+
+def test_listing_falls_back_without_the_paged_resource(monkeypatch):
+    def unavailable():
+        raise ee.EEException("not initialized")
+
+    listed = [{"name": name, "metadata": {"state": "PENDING"}} for name in operationids(*range(10))]
+    monkeypatch.setattr(ee.data, "_get_cloud_projects", unavailable, raising=False)
+    monkeypatch.setattr(ee.data, "listOperations", lambda project: listed)
+    monkeypatch.setattr(ee.data, "getOperation", lambda name: pytest.fail("unexpected lookup"))
+
+    statuses = export.get_taskstatuses(operationids=operationids(*range(10)))
+    assert {export.generate_taskstate(status) for status in statuses.values()} == {"PENDING"}
+
+@pytest.mark.parametrize("status, state", [
+    ({"metadata": {"state": "READY"}}, "PENDING"),
+    ({"metadata": {"state": "RUNNING"}}, "RUNNING"),
+    ({"metadata": {"state": "SUCCEEDED"}}, "COMPLETED"),
+    ({"metadata": {"state": "CANCELLED"}}, "CANCELLED"),
+    ({"done": True, "error": {"message": "boom"}}, "FAILED"),
+    ({"done": True}, "COMPLETED"),
+    ({}, "PENDING"),
+])
+def test_generate_taskstate(status, state):
+    assert export.generate_taskstate(status) == state
+
+def test_generate_taskstate_unknown_state():
+    with pytest.raises(RuntimeError):
+        export.generate_taskstate({"metadata": {"state": "EXPLODED"}})
@@ -0,0 +1,131 @@
+"""
+Terrarium Tests
+
+Tests for the geocoding module with the stub backend standing in for Google Maps.
+"""
+import time
+import threading
+
+import pytest
+
+from terrarium import geocoding
+
+def resolve(longitude: float, latitude: float) -> str:
+    return f"{longitude:.2f},{latitude:.2f}"
+
+@pytest.fixture
+def cache(tmp_path):
+    return geocoding.GeocodeCache(str(tmp_path / "geocoding.sqlite"))
+
+def test_geohash_known_cells():
+    assert geocoding.generate_geohash(-5.6, 42.6, 5) == "ezs42"
+    assert geocoding.generate_geohash(10.40744, 57.64911, 11) == "u4pruydqqvj"
+
+def test_locate_caches_by_geohash_cell(cache):
+    stub = geocoding.StubBackend(resolve)
+    geocoder = geocoding.Geocoder(stub, cache)
+
+    first = geocoder.locate(77.5946, 12.9716)
+    # A point in the same precision 5 cell is served from the cache
+    second = geocoder.locate(77.5950, 12.9720)
+    assert first == second == "77.59,12.97"
+    assert stub.calls == 1
+
+    # The cache persists across geocoders
+    geocoder = geocoding.Geocoder(stub, geocoding.GeocodeCache(cache.path))
+    assert geocoder.locate(77.5946, 12.9716) == first
+    assert stub.calls == 1
+
+def test_locate_unresolved_address_is_cached_as_limbo(cache):
+    stub = geocoding.StubBackend(lambda longitude, latitude: None)
+    geocoder = geocoding.Geocoder(stub, cache)
+
+    assert geocoder.locate(0.0, 0.0) == "limbo"
+    assert geocoder.locate(0.0, 0.0) == "limbo"
+    assert stub.calls == 1
+
+def test_cache_ttl_expiry(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(geocoding.time, "time", lambda: now[0])
+    cache = geocoding.GeocodeCache(str(tmp_path / "geocoding.sqlite"), ttl=60)
+
+    cache.put("ezs42", "address")
+    now[0] += 59
+    assert cache.get("ezs42") == (True, "address")
+
+    # The entry is dropped once it outlives the TTL
+    now[0] += 2
+    assert cache.get("ezs42") == (False, None)
+    assert len(cache) == 0
+
+def test_cache_lru_eviction(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(geocoding.time, "time", lambda: now[0])
+    cache = geocoding.GeocodeCache(str(tmp_path / "geocoding.sqlite"), capacity=2)
+
+    cache.put("a", "A")
+    now[0] += 1
+    cache.put("b", "B")
+    now[0] += 1
+    # Accessing 'a' makes 'b' the least recently used entry
+    assert cache.get("a") == (True, "A")
+    now[0] += 1
+    cache.put("c", "C")
+
+    assert len(cache) == 2
+    assert cache.get("a") == (True, "A")
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, "C")
+
+def test_concurrent_lookups_share_a_backend_call(cache):
+    release = threading.Event()
+    stub = geocoding.StubBackend(lambda longitude, latitude: (release.wait(5), "shared")[1])
+    geocoder = geocoding.Geocoder(stub, cache)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(geocoder.locate(77.5946, 12.9716))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+
+    # Let every thread join the in-flight lookup before it resolves
+    deadline = time.time() + 5
+    while stub.calls == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["shared"] * 8
+    assert stub.calls == 1
+
+def test_failed_lookup_is_not_cached(cache):
+    failures = [RuntimeError("backend down")]
+
+    def flaky(longitude, latitude):
+        if failures:
+            raise failures.pop()
+        return "recovered"
+
+    geocoder = geocoding.Geocoder(geocoding.StubBackend(flaky), cache)
+    with pytest.raises(RuntimeError):
+        geocoder.locate(1.0, 1.0)
+    assert geocoder.locate(1.0, 1.0) == "recovered"
+
+def test_locate_many_sends_only_misses(cache):
+    stub = geocoding.StubBackend(resolve)
+    geocoder = geocoding.Geocoder(stub, cache)
+    geocoder.locate(77.5946, 12.9716)
+    assert stub.calls == 1
+
+    points = [
+        (77.5946, 12.9716), (77.5950, 12.9720),  # cached cell
+        (2.3522, 48.8566), (2.3525, 48.8568),    # one uncached cell
+        (-74.0060, 40.7128),                     # another uncached cell
+    ]
+    addresses = geocoder.locate_many(points)
+
+    assert stub.calls == 3
+    assert addresses[0] == addresses[1] == "77.59,12.97"
+    assert addresses[2] == addresses[3] == "2.35,48.86"
+    assert addresses[4] == "-74.01,40.71"
@@ -0,0 +1,32 @@
+"""
+Terrarium Tests
+
+Tests for the cold start of the package that import every module in a fresh interpreter
+and check that none of the heavy dependencies are loaded before their first use.
+"""
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+import bench_imports
+
+# The root of the repository, which makes the package importable in the fresh interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def probe(module: str) -> dict:
+    """ A function that imports a module in a fresh interpreter and returns the import time and the heavy dependencies loaded. """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", bench_imports.PROBE.format(module=module, heavy=bench_imports.HEAVY)],
+                            capture_output=True, text=True, env=env, cwd=ROOT, timeout=60)
+    assert output.returncode == 0, output.stderr
+    return json.loads(output.stdout)
+
+def test_package_import_is_lazy():
+    assert probe("terrarium")["heavy"] == []
+
+@pytest.mark.parametrize("module", [module for module in bench_imports.MODULES if module != "terrarium"])
+def test_module_import_is_lazy(module):
+    assert probe(module)["heavy"] == []
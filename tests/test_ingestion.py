@@ -0,0 +1,92 @@
+"""
+Terrarium Tests
+
+Tests for the ingestion module that stream GeoJSON FeatureCollections in chunks of every size, so that
+values, tokens and multi-byte characters are split across the reads of the stream.
+"""
+import io
+import json
+
+import pytest
+
+from terrarium import ingestion
+
+FEATURES = [
+    {"type": "Feature", "properties": {"name": "café", "city": "東京"}, "geometry": {"type": "Point", "coordinates": [139.6917, 35.6895]}},
+    {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1.25, 0], [1.25, 1e-3], [0, 0]]]}},
+    {"type": "Feature", "properties": {"id": 12345678901234567890}, "geometry": {"type": "LineString", "coordinates": [[-1.5, 2.5], [3, -4]]}},
+]
+
+# A collection with a scalar top level key before the features and insignificant whitespace
+COLLECTION = ('{ "count" : 1234567 ,\n "type": "FeatureCollection",\n "features" : [\n  '
+              + ',\n  '.join(json.dumps(feature, ensure_ascii=False) for feature in FEATURES) + '\n ] }\n').encode("utf-8")
+
+@pytest.mark.parametrize("chunksize", [1, 2, 3, 5, 7, 13, 64, 1 << 16])
+def test_features_are_decoded_in_chunks_of_any_size(chunksize):
+    features = list(ingestion.iterate_geojson_features(COLLECTION, chunksize))
+    assert features == list(enumerate(FEATURES))
+
+def test_tokens_split_across_reads():
+    # Every split point of the collection falls between two reads of the stream exactly once
+    for split in range(1, len(COLLECTION)):
+        class SplitStream(io.BytesIO):
+            def read(self, size=-1):
+                position = self.tell()
+                if position < split:
+                    return super().read(min(size, split - position))
+                return super().read(size)
+
+        features = [feature for _, feature in ingestion.iterate_geojson_features(SplitStream(COLLECTION), 1 << 16)]
+        assert features == FEATURES, split
+
+def test_sources(tmp_path):
+    path = tmp_path / "collection.geojson"
+    path.write_bytes(COLLECTION)
+
+    for source in (str(path), path, io.BytesIO(COLLECTION), io.StringIO(COLLECTION.decode("utf-8"))):
+        assert [feature for _, feature in ingestion.iterate_geojson_features(source, 4)] == FEATURES
+
+    with pytest.raises(RuntimeError):
+        list(ingestion.iterate_geojson_features(str(tmp_path / "missing.geojson")))
+    with pytest.raises(RuntimeError):
+        list(ingestion.iterate_geojson_features(42))
+
+def test_empty_and_missing_features():
+    assert list(ingestion.iterate_geojson_features(b'{"type": "FeatureCollection", "features": []}')) == []
+
+    for collection in (b'{}', b'{"type": "FeatureCollection"}'):
+        with pytest.raises(RuntimeError, match="missing key: 'features'"):
+            list(ingestion.iterate_geojson_features(collection))
+
+def test_malformed_json_raises_after_the_preceding_features():
+    collection = b'{"features": [' + json.dumps(FEATURES[0]).encode() + b', {"type": "Feature", "geometry": {]}'
+    features = ingestion.iterate_geojson_features(collection, 8)
+
+    assert next(features) == (0, FEATURES[0])
+    with pytest.raises(RuntimeError, match="could not parse geojson"):
+        next(features)
+
+def test_batches_report_corrupt_features():
+    features = [
+        FEATURES[0],
+        {"type": "Feature", "properties": {}},
+        FEATURES[1],
+        ["not", "a", "feature"],
+        {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": "nowhere"}},
+        FEATURES[2],
+    ]
+    collection = json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+    batches = list(ingestion.stream_shapes_fromgeojson(collection, batchsize=4, chunksize=16))
+    assert [len(batch.geometries) + len(batch.errors) for batch in batches] == [4, 2]
+
+    indices = [index for batch in batches for index in batch.indices]
+    errors = [error for batch in batches for error in batch.errors]
+    assert indices == [0, 2, 5]
+    assert [geometry.geom_type for batch in batches for geometry in batch.geometries] == ["Point", "Polygon", "LineString"]
+
+    # The corrupt features are reported by their position without aborting the batch
+    assert [index for index, _ in errors] == [1, 3, 4]
+    assert "missing key: 'geometry'" in errors[0][1]
+    assert "not a mapping" in errors[1][1]
+    assert errors[2][1].startswith("could not construct geometry.")
@@ -0,0 +1,187 @@
+"""
+Terrarium Tests
+
+Tests for the instrumentation module that swap instrumented functions in and out of their modules,
+record latency histograms and nested spans and export the metrics in the Prometheus text format.
+"""
+import re
+import asyncio
+import threading
+
+import pytest
+import shapely.geometry
+
+from terrarium import spatial
+from terrarium import instrumentation
+
+@pytest.fixture(autouse=True)
+def isolated():
+    """ A fixture that runs every test with instrumentation disabled and empty metrics and restores the state afterwards. """
+    enabled, tracing = instrumentation._enabled, instrumentation._tracing
+    instrumentation.disable()
+    instrumentation.reset()
+    yield
+    if enabled:
+        instrumentation.enable(tracing)
+    else:
+        instrumentation.disable()
+    instrumentation.reset()
+
+@instrumentation.instrumented
+def double(value: int) -> int:
+    return value * 2
+
+@instrumentation.instrumented(name="tests.fail")
+def fail():
+    raise ValueError("failed")
+
+class Squarer:
+    @instrumentation.instrumented
+    def square(self, value: int) -> int:
+        return value * value
+
+def test_enable_and_disable_swap_module_attributes():
+    original = spatial.reshape_point
+    assert not hasattr(original, "__wrapped__")
+
+    instrumentation.enable()
+    assert spatial.reshape_point.__wrapped__ is original and Squarer.square.__wrapped__ is not None
+    spatial.reshape_point(shapely.geometry.Point(77.59, 12.97))
+    double(2)
+    assert Squarer().square(3) == 9
+
+    instrumentation.disable()
+    assert spatial.reshape_point is original and double.__name__ == "double" and not hasattr(double, "__wrapped__")
+    spatial.reshape_point(shapely.geometry.Point(77.59, 12.97))
+
+    # Calls are only recorded while enabled and recorded metrics are kept when disabled
+    calls = instrumentation.snapshot()["calls"]
+    assert calls["spatial.reshape_point"]["count"] == 1
+    assert calls["test_instrumentation.double"]["count"] == 1
+    assert calls["test_instrumentation.Squarer.square"]["count"] == 1
+
+def test_errors_are_counted_and_raised():
+    instrumentation.enable()
+    with pytest.raises(ValueError):
+        fail()
+    double(1)
+
+    calls = instrumentation.snapshot()["calls"]
+    assert calls["tests.fail"]["errors"] == 1 and calls["tests.fail"]["count"] == 1
+    assert calls["test_instrumentation.double"]["errors"] == 0
+
+def test_histogram_buckets():
+    histogram = instrumentation.Histogram()
+    # The bounds are inclusive, so a value on a bound is counted in its bucket
+    for value in (0.0001, 0.0005, 0.0006, 0.05, 0.05001, 100.0):
+        histogram.observe(value)
+
+    cumulative = dict(histogram.cumulative())
+    assert histogram.count == 6 and histogram.sum == pytest.approx(100.10121)
+    assert cumulative[0.0005] == 2 and cumulative[0.001] == 3
+    assert cumulative[0.05] == 4 and cumulative[0.1] == 5
+    assert cumulative[60.0] == 5 and cumulative[float("inf")] == 6
+    counts = [count for _, count in histogram.cumulative()]
+    assert counts == sorted(counts)
+
+def test_roundtrips_are_recorded_while_enabled():
+    with instrumentation.roundtrip("earthengine", "getInfo"):
+        pass
+    assert instrumentation.snapshot()["roundtrips"] == {}
+
+    instrumentation.enable()
+    with instrumentation.roundtrip("earthengine", "getInfo"):
+        pass
+    with pytest.raises(RuntimeError):
+        with instrumentation.roundtrip("earthengine", "getInfo"):
+            raise RuntimeError("timeout")
+
+    roundtrip = instrumentation.snapshot()["roundtrips"]["earthengine.getInfo"]
+    assert roundtrip["count"] == 2 and roundtrip["errors"] == 1 and roundtrip["backend"] == "earthengine"
+
+def test_nested_spans():
+    instrumentation.enable(tracing=True)
+    with instrumentation.span("outer", aoi="berlin") as outer:
+        double(1)
+        with instrumentation.span("inner") as inner:
+            inner.set("index", "NDVI")
+            with instrumentation.roundtrip("earthengine", "getInfo"):
+                pass
+
+    spans = {span["name"]: span for span in instrumentation.snapshot()["spans"]}
+    assert spans["outer"]["parentid"] is None and spans["outer"]["attributes"] == {"aoi": "berlin"}
+    assert spans["test_instrumentation.double"]["parentid"] == outer.spanid
+    assert spans["inner"]["parentid"] == outer.spanid and spans["inner"]["attributes"] == {"index": "NDVI"}
+    assert spans["earthengine.getInfo"]["parentid"] == inner.spanid
+    assert spans["earthengine.getInfo"]["duration"] <= spans["inner"]["duration"] <= spans["outer"]["duration"]
+
+def test_spans_of_concurrent_tasks_and_threads():
+    instrumentation.enable(tracing=True)
+
+    async def task(name: str):
+        with instrumentation.span(name):
+            await asyncio.sleep(0.01)
+            with instrumentation.span(f"{name}.child"):
+                await asyncio.sleep(0)
+
+    async def main():
+        with instrumentation.span("root") as root:
+            await asyncio.gather(task("a"), task("b"))
+        return root
+
+    root = asyncio.run(main())
+    spans = {span["name"]: span for span in instrumentation.snapshot()["spans"]}
+    # The interleaved tasks do not become the parents of each other
+    assert spans["a"]["parentid"] == spans["b"]["parentid"] == root.spanid
+    assert spans["a.child"]["parentid"] == spans["a"]["spanid"] and spans["b.child"]["parentid"] == spans["b"]["spanid"]
+
+    def run():
+        with instrumentation.span("thread"):
+            pass
+
+    # Threads start without an active span
+    with instrumentation.span("caller"):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    spans = {span["name"]: span for span in instrumentation.snapshot()["spans"]}
+    assert spans["thread"]["parentid"] is None
+
+def test_spans_are_only_recorded_while_tracing():
+    instrumentation.enable()
+    with instrumentation.span("untraced") as active:
+        active.set("key", "value")
+    double(1)
+    assert instrumentation.snapshot()["spans"] == []
+
+def test_prometheus_export():
+    instrumentation.enable()
+    double(1)
+    double(2)
+    with pytest.raises(ValueError):
+        fail()
+    with instrumentation.roundtrip("maps", 'reverse "geocode"'):
+        pass
+
+    text = instrumentation.export_prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+
+    # Every family is declared with its help and type before its samples
+    for name, kind in (("calls_total", "counter"), ("call_errors_total", "counter"), ("call_duration_seconds", "histogram"),
+                       ("roundtrips_total", "counter"), ("roundtrip_errors_total", "counter"), ("roundtrip_duration_seconds", "histogram")):
+        assert lines.index(f"# TYPE terrarium_{name} {kind}") == lines.index(next(line for line in lines if line.startswith(f"# HELP terrarium_{name} "))) + 1
+
+    sample = re.compile(r'^terrarium_[a-z_]+\{([a-z]+="(?:[^"\\]|\\.)*",?)+\} [0-9.e+-]+$')
+    assert all(sample.match(line) for line in lines if not line.startswith("#")), text
+
+    assert 'terrarium_calls_total{function="test_instrumentation.double"} 2' in lines
+    assert 'terrarium_call_errors_total{function="tests.fail"} 1' in lines
+    assert 'terrarium_call_duration_seconds_count{function="test_instrumentation.double"} 2' in lines
+    assert 'terrarium_call_duration_seconds_bucket{function="test_instrumentation.double",le="+Inf"} 2' in lines
+    # Label values are escaped
+    assert 'terrarium_roundtrips_total{backend="maps",operation="reverse \\"geocode\\""} 1' in lines
+
+    # The buckets of every histogram are cumulative
+    buckets = [int(line.rsplit(" ", 1)[1]) for line in lines if line.startswith('terrarium_call_duration_seconds_bucket{function="test_instrumentation.double"')]
+    assert len(buckets) == len(instrumentation.BUCKETS) and buckets == sorted(buckets)
@@ -0,0 +1,167 @@
+"""
+Terrarium Tests
+
+Tests for the export deduplicator of the manifest module with the in-process task backend
+standing in for Earth Engine and local storage standing in for Cloud Storage.
+"""
+import json
+import threading
+
+import pytest
+
+from terrarium import manifest
+from terrarium import scheduler
+from terrarium import tiledexport
+
+PAYLOAD = json.dumps({"result": "0", "values": {"0": {"constantValue": 1}}})
+
+class Clock:
+    """ A manually advanced clock for the stale claims of the deduplicator. """
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def manifestpath(tmp_path):
+    return str(tmp_path / "manifest.sqlite")
+
+@pytest.fixture
+def storage(tmp_path):
+    return tiledexport.LocalStorage(str(tmp_path / "storage"))
+
+def write_export(tmp_path, storage: tiledexport.LocalStorage, bucket: str, name: str):
+    """ A function that writes the file of a finished export into storage. """
+    path = tmp_path / "export.tif"
+    path.write_bytes(b"tif")
+    storage.upload(bucket, f"{name}.tif", str(path))
+
+def test_matching_export_in_progress_is_joined(manifestpath):
+    backend = scheduler.LocalBackend(polls=10)
+    deduplicator = manifest.ExportDeduplicator(backend, manifest.ExportManifest(manifestpath))
+
+    started = deduplicator.submit(PAYLOAD, "bucket", "a", {"scale": 10})
+    joined = deduplicator.submit(PAYLOAD, "bucket", "b", {"scale": 10})
+    other = deduplicator.submit(PAYLOAD, "bucket", "c", {"scale": 20})
+
+    assert (started.action, joined.action, other.action) == ("STARTED", "JOINED", "STARTED")
+    assert joined.key == started.key and joined.path == "gs://bucket/a.tif" and joined.taskid == started.taskid
+    assert backend.started == ["a", "c"]
+    assert deduplicator.metrics() == {"started": 2, "joined": 1, "skipped": 0, "exports": 2}
+
+def test_completed_export_with_files_is_skipped(tmp_path, manifestpath, storage):
+    backend = scheduler.LocalBackend(polls=0)
+    deduplicator = manifest.ExportDeduplicator(backend, manifest.ExportManifest(manifestpath), storage)
+    deduplicator.submit(PAYLOAD, "bucket", "a")
+    write_export(tmp_path, storage, "bucket", "a")
+
+    outcome = deduplicator.submit(PAYLOAD, "bucket", "b")
+    assert outcome.action == "SKIPPED" and outcome.state == "COMPLETED" and outcome.path == "gs://bucket/a.tif"
+    assert backend.started == ["a"]
+
+def test_completed_export_without_files_is_started_again(tmp_path, manifestpath, storage):
+    backend = scheduler.LocalBackend(polls=0)
+    deduplicator = manifest.ExportDeduplicator(backend, manifest.ExportManifest(manifestpath), storage)
+    first = deduplicator.submit(PAYLOAD, "bucket", "a")
+    write_export(tmp_path, storage, "bucket", "a")
+    assert deduplicator.submit(PAYLOAD, "bucket", "a").action == "SKIPPED"
+
+    # The files of the export were deleted from storage
+    (tmp_path / "storage" / "bucket" / "a.tif").unlink()
+    outcome = deduplicator.submit(PAYLOAD, "bucket", "b")
+    assert outcome.action == "STARTED" and outcome.path == "gs://bucket/b.tif" and outcome.taskid != first.taskid
+    assert backend.started == ["a", "b"]
+
+def test_failed_export_is_started_again(manifestpath):
+    backend = scheduler.LocalBackend(lambda job: "FAILED" if job.name == "a" else "COMPLETED", polls=0)
+    deduplicator = manifest.ExportDeduplicator(backend, manifest.ExportManifest(manifestpath))
+    first = deduplicator.submit(PAYLOAD, "bucket", "a")
+    assert deduplicator.get_export(first.key).state == "FAILED"
+
+    outcome = deduplicator.submit(PAYLOAD, "bucket", "b")
+    assert outcome.action == "STARTED"
+    assert deduplicator.get_export(first.key).state == "COMPLETED"
+    assert backend.started == ["a", "b"]
+
+def test_stale_claim_is_started_again(manifestpath):
+    clock = Clock()
+    backend = scheduler.LocalBackend(polls=10)
+    exportmanifest = manifest.ExportManifest(manifestpath)
+    deduplicator = manifest.ExportDeduplicator(backend, exportmanifest, staletimeout=60, clock=clock)
+
+    # A claim of a process that stopped before it started the task
+    key = manifest.generate_exportkey(PAYLOAD, "bucket")
+    assert exportmanifest.replace(manifest.ManifestEntry(key, "bucket", "a", "gs://bucket/a.tif", None, "PENDING", 1000.0, 1000.0))
+
+    clock.now = 1060
+    outcome = deduplicator.submit(PAYLOAD, "bucket", "b")
+    assert outcome.action == "JOINED" and outcome.taskid is None
+
+    clock.now = 1061
+    outcome = deduplicator.submit(PAYLOAD, "bucket", "b")
+    assert outcome.action == "STARTED" and outcome.path == "gs://bucket/b.tif"
+    assert exportmanifest.get(key).taskid == outcome.taskid and backend.started == ["b"]
+
+def test_start_errors_release_the_claim(manifestpath):
+    class BrokenBackend(scheduler.LocalBackend):
+        def start(self, job):
+            raise RuntimeError("quota exceeded")
+
+    exportmanifest = manifest.ExportManifest(manifestpath)
+    with pytest.raises(RuntimeError, match="quota exceeded"):
+        manifest.ExportDeduplicator(BrokenBackend(), exportmanifest).submit(PAYLOAD, "bucket", "a")
+    assert len(exportmanifest) == 0
+
+    assert manifest.ExportDeduplicator(scheduler.LocalBackend(), exportmanifest).submit(PAYLOAD, "bucket", "a").action == "STARTED"
+
+def test_replace_only_applies_to_the_current_entry(manifestpath):
+    # Two processes that share the manifest read the same finished entry
+    first, second = manifest.ExportManifest(manifestpath), manifest.ExportManifest(manifestpath)
+    entry = manifest.ManifestEntry("key", "bucket", "a", "gs://bucket/a.tif", "local-0", "FAILED", 1000.0, 1000.0)
+    assert first.replace(entry)
+    assert not second.replace(entry)
+
+    previous = second.get("key")
+    claim = entry._replace(name="b", taskid=None, state="PENDING", created=1001.0, updated=1001.0)
+    assert first.replace(claim, previous)
+    # The other claim is based on an entry that is no longer current
+    assert not second.replace(entry._replace(name="c", taskid=None, state="PENDING", created=1002.0, updated=1002.0), previous)
+    assert second.get("key") == claim
+
+    assert not first.remove(entry)
+    assert second.remove(claim) and len(first) == 0
+
+def test_concurrent_deduplicators_start_one_task(manifestpath):
+    entered, release = threading.Event(), threading.Event()
+
+    class SlowBackend(scheduler.LocalBackend):
+        def start(self, job):
+            entered.set()
+            release.wait(5)
+            return super().start(job)
+
+    backend = SlowBackend(polls=10)
+    deduplicators = [manifest.ExportDeduplicator(backend, manifest.ExportManifest(manifestpath)) for _ in range(2)]
+
+    outcomes = []
+    starter = threading.Thread(target=lambda: outcomes.append(deduplicators[0].submit(PAYLOAD, "bucket", "a")))
+    starter.start()
+    assert entered.wait(5)
+
+    # While the task is being started, the claim is joined by both deduplicators and other exports are not held up
+    for index, deduplicator in enumerate(deduplicators):
+        submitter = threading.Thread(target=lambda deduplicator=deduplicator: outcomes.append(deduplicator.submit(PAYLOAD, "bucket", "b")))
+        submitter.start()
+        submitter.join(5)
+        assert not submitter.is_alive()
+
+    other = threading.Thread(target=lambda: outcomes.append(deduplicators[0].submit(PAYLOAD, "other", "c")))
+    other.start()
+    release.set()
+    other.join(5)
+    starter.join(5)
+
+    actions = sorted((outcome.path, outcome.action) for outcome in outcomes)
+    assert actions == [("gs://bucket/a.tif", "JOINED"), ("gs://bucket/a.tif", "JOINED"), ("gs://bucket/a.tif", "STARTED"), ("gs://other/c.tif", "STARTED")]
+    assert sorted(backend.started) == ["a", "c"]
@@ -0,0 +1,120 @@
+"""
+Terrarium Tests
+
+Tests for the task monitor with the local status backend replaying scripted task states.
+"""
+import asyncio
+
+import pytest
+
+from terrarium import monitor
+
+class Clock:
+    """ A clock that is advanced by the fake sleep of the monitor. """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+async def collect(taskmonitor: monitor.TaskMonitor, operationids: list, clock: Clock) -> list:
+    return [(operationid, state) async for operationid, state, _ in taskmonitor.watch(operationids, clock.sleep)]
+
+def test_watch_reports_transitions_until_finished():
+    timelines = {
+        "op/a": ["READY", "RUNNING", "RUNNING", "SUCCEEDED"],
+        "op/b": ["RUNNING", "FAILED"],
+        "op/c": ["CANCELLED"],
+    }
+    clock = Clock()
+    backend = monitor.LocalStatusBackend(timelines)
+    taskmonitor = monitor.TaskMonitor(backend, ttl=0, mininterval=5, maxinterval=60, clock=clock)
+
+    events = asyncio.run(collect(taskmonitor, list(timelines), clock))
+
+    assert [event for event in events if event[0] == "op/a"] == [("op/a", "PENDING"), ("op/a", "RUNNING"), ("op/a", "COMPLETED")]
+    assert [event for event in events if event[0] == "op/b"] == [("op/b", "RUNNING"), ("op/b", "FAILED")]
+    assert [event for event in events if event[0] == "op/c"] == [("op/c", "CANCELLED")]
+    # Every fetch polls the due tasks in bulk
+    assert backend.calls <= 4
+    assert all(seconds >= 0 for seconds in clock.sleeps)
+
+def test_statuses_are_cached_for_the_ttl():
+    clock = Clock()
+    backend = monitor.LocalStatusBackend({"op/a": ["RUNNING", "SUCCEEDED"], "op/b": ["RUNNING"]})
+    taskmonitor = monitor.TaskMonitor(backend, ttl=5, clock=clock)
+
+    taskmonitor.get_statuses(["op/a"])
+    clock.now = 4
+    # Only the uncached operation is fetched
+    statuses = taskmonitor.get_statuses(["op/a", "op/b"])
+    assert backend.calls == 2 and backend._steps == {"op/a": 1, "op/b": 1}
+    assert statuses["op/a"]["metadata"]["state"] == "RUNNING"
+
+    clock.now = 6
+    statuses = taskmonitor.get_statuses(["op/a", "op/b"])
+    assert statuses["op/a"]["metadata"]["state"] == "SUCCEEDED"
+
+def test_poll_interval_grows_with_age():
+    clock = Clock()
+    taskmonitor = monitor.TaskMonitor(monitor.LocalStatusBackend({"op/a": ["RUNNING"]}), mininterval=5, maxinterval=120, clock=clock)
+    taskmonitor.get_statuses(["op/a"])
+
+    assert taskmonitor.get_interval("op/a", "RUNNING") == 5
+    clock.now = 300
+    assert taskmonitor.get_interval("op/a", "RUNNING") == 30
+    # Pending tasks are polled half as often
+    assert taskmonitor.get_interval("op/a", "PENDING") == 60
+    clock.now = 10000
+    assert taskmonitor.get_interval("op/a", "RUNNING") == 120
+
+def test_backend_errors_are_raised_as_runtime_errors():
+    class BrokenBackend(monitor.StatusBackend):
+        def fetch(self, operationids):
+            raise ValueError("connection reset")
+
+    taskmonitor = monitor.TaskMonitor(BrokenBackend(), clock=Clock())
+    with pytest.raises(RuntimeError, match="connection reset"):
+        taskmonitor.get_statuses(["op/a"])
+
+def test_finished_tasks_are_forgotten():
+    clock = Clock()
+    backend = monitor.LocalStatusBackend({"op/a": ["RUNNING", "SUCCEEDED"], "op/b": ["RUNNING"]})
+    taskmonitor = monitor.TaskMonitor(backend, ttl=0, clock=clock)
+
+    taskmonitor.get_statuses(["op/a", "op/b"])
+    assert set(taskmonitor._firstseen) == set(taskmonitor._cache) == {"op/a", "op/b"}
+
+    # The final status is returned once and the task is no longer held
+    statuses = taskmonitor.get_statuses(["op/a", "op/b"])
+    assert statuses["op/a"]["metadata"]["state"] == "SUCCEEDED"
+    assert set(taskmonitor._firstseen) == set(taskmonitor._cache) == {"op/b"}
+
+def test_watched_tasks_are_forgotten_when_finished():
+    clock = Clock()
+    timelines = {f"op/{index}": ["RUNNING"] * (index % 3) + ["SUCCEEDED"] for index in range(20)}
+    taskmonitor = monitor.TaskMonitor(monitor.LocalStatusBackend(timelines), ttl=0, clock=clock)
+
+    events = asyncio.run(collect(taskmonitor, list(timelines), clock))
+    assert sum(state == "COMPLETED" for _, state in events) == 20
+    assert taskmonitor._firstseen == taskmonitor._lastseen == taskmonitor._cache == {}
+
+def test_abandoned_tasks_are_forgotten():
+    clock = Clock()
+    taskmonitor = monitor.TaskMonitor(monitor.LocalStatusBackend({"op/a": ["RUNNING"], "op/b": ["RUNNING"]}), ttl=5, maxinterval=60, clock=clock)
+    taskmonitor.get_statuses(["op/a", "op/b"])
+
+    # Only 'op/b' is still polled
+    clock.now = 100
+    taskmonitor.get_statuses(["op/b"])
+    assert set(taskmonitor._firstseen) == {"op/a", "op/b"}
+    assert set(taskmonitor._cache) == {"op/b"}
+
+    clock.now = 200
+    taskmonitor.get_statuses(["op/b"])
+    assert set(taskmonitor._firstseen) == set(taskmonitor._lastseen) == set(taskmonitor._cache) == {"op/b"}
@@ -0,0 +1,76 @@
+"""
+Terrarium Tests
+
+Tests for the postprocess module that compare the windowed postprocessing of native resolution
+GeoTIFFs against the raster module, which reproduces the server side algorithms on whole arrays.
+"""
+import numpy
+import pytest
+
+from terrarium import raster
+from terrarium import postprocess
+
+rasterio = pytest.importorskip("rasterio")
+
+# The tolerance of the comparison. The NDVI is quantized to integers by the focal step, so the windowed result
+# must be identical, and the upsampled true color bands may differ by at most one level from float rounding.
+NDVI_TOLERANCE = 0.0
+TCI_TOLERANCE = 1
+
+def generate_band(rows: int, columns: int, seed: int, low: float, high: float) -> numpy.ndarray:
+    """ A function that returns a smooth band with noise so the kernels see both gradients and edges. """
+    rng = numpy.random.default_rng(seed)
+    y, x = numpy.mgrid[0:rows, 0:columns]
+    smooth = numpy.sin(x / 7.0 + seed) * numpy.cos(y / 5.0) * 0.5 + 0.5
+    return (low + (high - low) * (0.7 * smooth + 0.3 * rng.random((rows, columns)))).astype(numpy.float32)
+
+def write_geotiff(path: str, bands: numpy.ndarray, dtype: str):
+    profile = dict(
+        driver="GTiff", width=bands.shape[2], height=bands.shape[1], count=bands.shape[0], dtype=dtype,
+        crs="EPSG:32643", transform=rasterio.Affine(10, 0, 500000, 0, -10, 1400000),
+    )
+    with rasterio.open(path, "w", **profile) as dataset:
+        dataset.write(bands.astype(dtype))
+
+def read_geotiff(path: str) -> numpy.ndarray:
+    with rasterio.open(path) as dataset:
+        return dataset.read(), dataset.transform
+
+@pytest.mark.parametrize("blocksize, workers", [(16, 1), (16, 2), (23, 2), (256, 1)])
+def test_ndvi_matches_spectral_array(tmp_path, blocksize, workers):
+    rows, columns = 37, 53
+    nir, red = generate_band(rows, columns, 1, 1000, 4000), generate_band(rows, columns, 2, 500, 2500)
+
+    # The native resolution NDVI as composed by the server
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ndvi = numpy.where(nir + red == 0, 0.0, (nir - red) / (nir + red)).astype(numpy.float32)
+    write_geotiff(str(tmp_path / "native.tif"), ndvi[None], "float32")
+
+    postprocess.postprocess_geotiff(str(tmp_path / "native.tif"), str(tmp_path / "output.tif"), "NDVI", blocksize=blocksize, workers=workers)
+    result, transform = read_geotiff(str(tmp_path / "output.tif"))
+
+    # Tiles of the raster module and windows of the postprocessing have seams at different places
+    expected = raster.generate_spectral_array("NDVI", [nir, red], tilesize=19, workers=1)
+    assert result.shape == expected.shape == (1, rows * 10, columns * 10)
+    numpy.testing.assert_allclose(result, expected, rtol=0, atol=NDVI_TOLERANCE)
+    numpy.testing.assert_allclose(result[0], raster.ndvi_array(nir, red), rtol=0, atol=NDVI_TOLERANCE)
+
+    # The geotransform is scaled to the upsampled pixel size
+    assert (transform.a, transform.e, transform.c, transform.f) == (1, -1, 500000, 1400000)
+
+@pytest.mark.parametrize("blocksize, workers", [(16, 2), (29, 1)])
+def test_truecolor_matches_spectral_array(tmp_path, blocksize, workers):
+    rows, columns = 31, 41
+    bands = [numpy.rint(generate_band(rows, columns, seed, 0, 255)) for seed in (3, 4, 5)]
+    write_geotiff(str(tmp_path / "native.tif"), numpy.stack(bands), "uint8")
+
+    postprocess.postprocess_geotiff(str(tmp_path / "native.tif"), str(tmp_path / "output.tif"), "TCI", blocksize=blocksize, workers=workers)
+    result, _ = read_geotiff(str(tmp_path / "output.tif"))
+
+    expected = raster.generate_spectral_array("TCI", bands, tilesize=64, workers=1)
+    assert result.dtype == numpy.uint8 and result.shape == expected.shape
+    assert numpy.abs(result.astype(int) - expected.astype(int)).max() <= TCI_TOLERANCE
+
+def test_indices_without_local_steps_are_rejected():
+    with pytest.raises(RuntimeError):
+        postprocess.generate_local_steps("UNKNOWN")
@@ -0,0 +1,203 @@
+"""
+Terrarium Tests
+
+Tests for the export scheduler with the in-process backend standing in for Earth Engine.
+"""
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from terrarium import scheduler
+
+class Clock:
+    """ A manually advanced clock for the backoff of the scheduler. """
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def queuepath(tmp_path):
+    return str(tmp_path / "exports.sqlite")
+
+def test_jobs_start_by_priority_then_submission(queuepath):
+    backend = scheduler.LocalBackend()
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath, concurrency=1)
+    for name, priority in (("low", 0), ("high", 5), ("low2", 0), ("mid", 2), ("high2", 5)):
+        exportscheduler.submit("{}", "bucket", name, priority)
+
+    exportscheduler.run(interval=0, sleep=lambda interval: None)
+    assert backend.started == ["high", "high2", "mid", "low", "low2"]
+
+def test_concurrency_cap(queuepath):
+    backend = scheduler.LocalBackend(polls=2)
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath, concurrency=3)
+    for index in range(10):
+        exportscheduler.submit("{}", "bucket", f"job-{index}")
+
+    peak = 0
+    while exportscheduler.step():
+        metrics = exportscheduler.metrics()
+        assert metrics["running"] <= 3
+        peak = max(peak, metrics["running"])
+
+    assert peak == 3
+    assert exportscheduler.metrics()["completed"] == 10
+
+def test_failed_jobs_are_retried_with_backoff(queuepath):
+    failures = {"flaky": 2}
+
+    def resolve(job):
+        if failures.get(job.name):
+            failures[job.name] -= 1
+            return "FAILED"
+        return "COMPLETED"
+
+    clock = Clock()
+    backend = scheduler.LocalBackend(resolve, polls=0)
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath, retries=3, backoff=10, maxbackoff=15, clock=clock)
+    jobid = exportscheduler.submit("{}", "bucket", "flaky")
+
+    exportscheduler.step()
+    exportscheduler.step()
+    job = exportscheduler.get_job(jobid)
+    assert job.state == "QUEUED" and job.attempts == 1 and job.nextattempt == 1010
+
+    # The job is not started again before its backoff has passed
+    clock.now = 1009
+    exportscheduler.step()
+    assert len(backend.started) == 1
+
+    clock.now = 1010
+    exportscheduler.step()
+    exportscheduler.step()
+    job = exportscheduler.get_job(jobid)
+    # The backoff doubles and is capped at the maximum
+    assert job.attempts == 2 and job.nextattempt == 1010 + 15
+
+    clock.now = 1025
+    exportscheduler.step()
+    exportscheduler.step()
+    job = exportscheduler.get_job(jobid)
+    assert job.state == "COMPLETED" and job.attempts == 3
+    assert exportscheduler.metrics()["retried"] == 2
+
+def test_jobs_fail_once_retries_are_exhausted(queuepath):
+    backend = scheduler.LocalBackend(lambda job: "FAILED", polls=0)
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath, retries=1, backoff=0)
+    jobid = exportscheduler.submit("{}", "bucket", "doomed")
+
+    exportscheduler.run(interval=0, sleep=lambda interval: None)
+    job = exportscheduler.get_job(jobid)
+    assert job.state == "FAILED" and job.attempts == 2 and job.error == "task failed"
+    assert exportscheduler.metrics()["failed"] == 1
+
+def test_start_errors_are_retried(queuepath):
+    class FlakyBackend(scheduler.LocalBackend):
+        def start(self, job):
+            if not self.started:
+                self.started.append(None)
+                raise RuntimeError("quota exceeded")
+            return super().start(job)
+
+    exportscheduler = scheduler.ExportScheduler(FlakyBackend(), queuepath, backoff=0)
+    jobid = exportscheduler.submit("{}", "bucket", "job")
+    exportscheduler.step()
+    assert "quota exceeded" in exportscheduler.get_job(jobid).error
+
+    exportscheduler.run(interval=0, sleep=lambda interval: None)
+    assert exportscheduler.get_job(jobid).state == "COMPLETED"
+
+def test_status_errors_are_counted(queuepath):
+    class BrokenBackend(scheduler.LocalBackend):
+        def statuses(self, taskids):
+            raise RuntimeError("listing failed")
+
+    exportscheduler = scheduler.ExportScheduler(BrokenBackend(), queuepath)
+    jobid = exportscheduler.submit("{}", "bucket", "job")
+    exportscheduler.step()
+    exportscheduler.step()
+
+    # The running job is kept and the failure is recorded
+    assert exportscheduler.get_job(jobid).state == "RUNNING"
+    assert exportscheduler.metrics()["statuserrors"] == 1
+    assert "listing failed" in exportscheduler.statuserror
+
+def test_backend_calls_do_not_hold_the_scheduler_lock(queuepath):
+    entered, release = threading.Event(), threading.Event()
+
+    class SlowBackend(scheduler.LocalBackend):
+        def start(self, job):
+            entered.set()
+            release.wait(5)
+            return super().start(job)
+
+    exportscheduler = scheduler.ExportScheduler(SlowBackend(), queuepath)
+    exportscheduler.submit("{}", "bucket", "slow")
+    stepper = threading.Thread(target=exportscheduler.step)
+    stepper.start()
+    assert entered.wait(5)
+
+    # Jobs can be submitted and looked up while the backend call is in progress
+    result = []
+    submitter = threading.Thread(target=lambda: result.append(exportscheduler.submit("{}", "bucket", "other")))
+    submitter.start()
+    submitter.join(1)
+    alive = submitter.is_alive()
+    release.set()
+    stepper.join()
+    submitter.join()
+
+    assert not alive
+    assert exportscheduler.get_job(result[0]).state == "QUEUED"
+
+def test_unfinished_jobs_are_restored(queuepath):
+    backend = scheduler.LocalBackend(polls=10)
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath, concurrency=1)
+    region = {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}
+    running = exportscheduler.submit("{}", "bucket", "running", 1, {"scale": 10, "region": region}, "group-a")
+    queued = exportscheduler.submit("{}", "bucket", "queued", 0, {"crs": "EPSG:32643"}, "group-a")
+    exportscheduler.step()
+
+    restored = scheduler.ExportScheduler(backend, queuepath, concurrency=1)
+    job = restored.get_job(running)
+    assert job.state == "RUNNING" and job.taskid == "local-0"
+    assert json.loads(job.options) == {"scale": 10, "region": region} and job.group == "group-a"
+    assert restored.get_job(queued).state == "QUEUED"
+    assert restored.get_groupstate("group-a") == "RUNNING"
+
+    # The running task is resumed without being started again
+    restored.run(interval=0, sleep=lambda interval: None)
+    assert backend.started == ["running", "queued"]
+    assert restored.get_groupstate("group-a") == "COMPLETED"
+    assert [job.name for job in restored.get_group("group-a")] == ["running", "queued"]
+
+def test_queues_without_options_and_groups_are_migrated(queuepath):
+    # A queue created before the options and group columns existed
+    connection = sqlite3.connect(queuepath)
+    connection.execute(
+        "CREATE TABLE jobs (jobid INTEGER PRIMARY KEY, name TEXT, bucket TEXT, payload TEXT, "
+        "priority INTEGER, state TEXT, attempts INTEGER, taskid TEXT, nextattempt REAL, error TEXT)"
+    )
+    connection.execute("INSERT INTO jobs VALUES (1, 'old', 'bucket', '{}', 0, 'QUEUED', 0, NULL, 0, NULL)")
+    connection.commit()
+    connection.close()
+
+    backend = scheduler.LocalBackend(polls=0)
+    exportscheduler = scheduler.ExportScheduler(backend, queuepath)
+    job = exportscheduler.get_job(1)
+    assert job.name == "old" and job.options is None and job.group is None
+
+    jobid = exportscheduler.submit("{}", "bucket", "new", options={"scale": 10}, group="g")
+    exportscheduler.run(interval=0, sleep=lambda interval: None)
+    assert backend.started == ["old", "new"]
+    assert exportscheduler.get_groupstate("g") == "COMPLETED"
+    assert json.loads(exportscheduler.get_job(jobid).options) == {"scale": 10}
+
+def test_groupstate_of_missing_group(queuepath):
+    exportscheduler = scheduler.ExportScheduler(scheduler.LocalBackend(), queuepath)
+    with pytest.raises(RuntimeError):
+        exportscheduler.get_groupstate("missing")
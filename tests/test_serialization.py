@@ -0,0 +1,131 @@
+"""
+Terrarium Tests
+
+Tests for the serialization module that write GeoJSON with fixed point coordinates and read it back, and round
+trip geometries through the binary columnar and WKB collection encodings.
+"""
+import json
+
+import numpy
+import pytest
+import shapely.wkb
+import shapely.geometry
+
+from terrarium import serialization
+
+def read_coordinates(geojson: str) -> list:
+    return [feature["geometry"]["coordinates"] for feature in json.loads(geojson)["features"]]
+
+def test_fixed_point_coordinates():
+    shapelist = [shapely.geometry.Point(77.59461234, -12.9716), shapely.geometry.LineString([(0, 0), (1.5, -2.25)])]
+    geojson = serialization.generate_geojson_fromshapes(shapelist, precision=3)
+
+    assert " " not in geojson
+    assert read_coordinates(geojson) == [[77.595, -12.972], [[0, 0], [1.5, -2.25]]]
+
+@pytest.mark.parametrize("point, precision", [((5e6, 1e7), 12), ((5e6 + 0.123456789, -1e7), 12), ((1e300, 0.0), 0)])
+def test_coordinates_beyond_64_bit_fixed_point(point, precision):
+    # Scaling these coordinates to 'precision' decimals overflows 64 bit integers
+    geojson = serialization.generate_geojson_fromshapes([shapely.geometry.Point(*point)], precision=precision)
+
+    assert " " not in geojson
+    assert read_coordinates(geojson) == [[round(value, precision) for value in point]]
+
+def test_largest_fixed_point_coordinates():
+    # The largest coordinates that still fit are written as fixed point text
+    geojson = serialization.generate_geojson_fromshapes([shapely.geometry.Point(9e6, -9e6)], precision=12)
+    assert read_coordinates(geojson) == [[9000000, -9000000]]
+    assert "9000000," in geojson
+
+SHAPES = [
+    shapely.geometry.Point(77.59461234, -12.9716),
+    shapely.geometry.LineString([(0, 0), (1.5, -2.25), (3, 1e-9)]),
+    shapely.geometry.Polygon([(0, 0), (4, 0), (4, 4), (0, 4)], [[(1, 1), (2, 1), (2, 2), (1, 2)], [(3, 3), (3.5, 3), (3.5, 3.5)]]),
+    shapely.geometry.MultiPoint([(1, 2), (-3, 4.25)]),
+    shapely.geometry.MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3), (4, 2)]]),
+    shapely.geometry.MultiPolygon([shapely.geometry.box(0, 0, 1, 1), shapely.geometry.Polygon([(5, 5), (9, 5), (9, 9), (5, 9)], [[(6, 6), (7, 6), (7, 7)]])]),
+    shapely.geometry.Point(),
+    shapely.geometry.LineString(),
+    shapely.geometry.Polygon(),
+    shapely.geometry.MultiPoint(),
+    shapely.geometry.MultiLineString(),
+    shapely.geometry.MultiPolygon(),
+]
+
+PROPERTIES = [{"index": index, "name": f"aoi {index}"} for index in range(len(SHAPES))]
+
+def check_shapes(shapelist: list, expected: list):
+    assert len(shapelist) == len(expected)
+    for shape, original in zip(shapelist, expected):
+        assert shape.geom_type == original.geom_type and shape.is_empty == original.is_empty
+        assert shape.is_empty or shape.equals_exact(original, 0)
+
+def test_columns_round_trip():
+    columns = serialization.generate_geometrycolumns(SHAPES, PROPERTIES)
+    assert len(columns) == len(SHAPES) and columns.types.tolist() == [1, 2, 3, 4, 5, 6] * 2
+    # The parts of the multipart geometries are their members and the rings of polygons are their exterior and interiors
+    assert [len(parts) for parts in map(columns.rings, range(6))] == [1, 1, 1, 2, 2, 2]
+    assert [len(rings) for rings in columns.rings(2)] == [3] and [len(rings) for rings in columns.rings(5)] == [1, 2]
+
+    check_shapes(serialization.generate_shapes_fromcolumns(columns), SHAPES)
+
+@pytest.mark.parametrize("properties", [PROPERTIES, None])
+def test_encoded_columns_are_decoded_in_place(properties):
+    columns = serialization.generate_geometrycolumns(SHAPES, properties)
+    buffer = serialization.encode_columns(columns)
+    decoded = serialization.decode_columns(buffer)
+
+    for name in ("types", "geometryoffsets", "partoffsets", "ringoffsets", "coordinates"):
+        array = getattr(decoded, name)
+        assert numpy.array_equal(array, getattr(columns, name))
+        # The arrays are views of the buffer without a copy
+        assert not array.flags.owndata and not array.flags.writeable
+        assert numpy.shares_memory(array, numpy.frombuffer(buffer, dtype=numpy.uint8))
+
+    assert decoded.coordinates.base.base is buffer
+    assert decoded.properties == properties
+    check_shapes(serialization.generate_shapes_fromcolumns(decoded), SHAPES)
+
+def test_decoded_columns_from_memoryviews_and_empty_collections():
+    columns = serialization.generate_geometrycolumns(SHAPES)
+    buffer = bytearray(serialization.encode_columns(columns))
+    decoded = serialization.decode_columns(memoryview(buffer))
+
+    # Changes of the buffer are seen by the decoded columns
+    buffer[-8:] = numpy.array([42.5]).tobytes()
+    assert decoded.coordinates[-1, 1] == 42.5
+
+    empty = serialization.decode_columns(serialization.encode_columns(serialization.generate_geometrycolumns([])))
+    assert len(empty) == 0 and empty.coordinates.shape == (0, 2) and empty.geometryoffsets.tolist() == [0]
+
+def test_corrupt_columns():
+    buffer = serialization.encode_columns(serialization.generate_geometrycolumns(SHAPES))
+    with pytest.raises(RuntimeError, match="corrupt header"):
+        serialization.decode_columns(buffer[:10])
+    with pytest.raises(RuntimeError, match="unsupported format"):
+        serialization.decode_columns(b"XXXX" + buffer[4:])
+    with pytest.raises(RuntimeError):
+        serialization.decode_columns(buffer[:len(buffer) // 2])
+
+def test_wkb_is_identical_to_shapely():
+    columns = serialization.generate_geometrycolumns(SHAPES)
+    for blob, shape in zip(serialization.generate_wkb_fromcolumns(columns), SHAPES, strict=True):
+        assert blob == shapely.wkb.dumps(shape, byte_order=1), shape.wkt
+
+    # The WKB is also identical when written from decoded columns
+    decoded = serialization.decode_columns(serialization.encode_columns(columns))
+    assert serialization.generate_wkb_fromcolumns(decoded) == [shapely.wkb.dumps(shape, byte_order=1) for shape in SHAPES]
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_wkb_collection_round_trip(columnar):
+    source = serialization.generate_geometrycolumns(SHAPES) if columnar else SHAPES
+    buffer = serialization.encode_wkbcollection(source)
+
+    blobs = serialization.decode_wkbcollection(buffer)
+    assert [bytes(blob) for blob in blobs] == [shapely.wkb.dumps(shape, byte_order=1) for shape in SHAPES]
+    assert all(blob.obj is buffer for blob in blobs)
+    check_shapes(serialization.generate_shapes_fromwkbcollection(buffer), SHAPES)
+
+    assert serialization.decode_wkbcollection(serialization.encode_wkbcollection([])) == []
+    with pytest.raises(RuntimeError, match="unsupported format"):
+        serialization.decode_wkbcollection(b"XXXX" + buffer[4:])
@@ -0,0 +1,113 @@
+"""
+Terrarium Tests
+
+Tests for the session module that send requests on the pooled transport to a local
+HTTP server, with the credentials and the initialization of Earth Engine stubbed out.
+"""
+import threading
+import http.server
+
+import ee
+import pytest
+
+import terrarium.session as session
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ A class of the request handler of the local server that records the project header of every request. """
+    protocol_version = "HTTP/1.1"
+    projects = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.projects.append(self.headers.get(session.USERPROJECT_HEADER))
+        body = b'{"result": 1}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.projects = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def manager(monkeypatch):
+    # Initialize without credentials or a round trip, and restore the project path of the client afterwards
+    monkeypatch.setattr(session, "load_credentials", lambda keyfile=None: None)
+    monkeypatch.setattr(ee, "Initialize", lambda *args, **kwargs: None)
+    monkeypatch.setattr(ee.data, "_get_projects_path", ee.data._get_projects_path)
+    monkeypatch.setattr(session, "_resolverinstalled", False)
+
+    manager = session.SessionManager(poolsize=2)
+    manager.add_session("a", "project-a")
+    manager.add_session("b", "project-b")
+    yield manager
+    manager.transport.close()
+
+def test_acquire_charges_requests_to_the_session_project(server, manager):
+    url = f"http://127.0.0.1:{server.server_port}/v1/projects/any/value:compute"
+
+    with manager.acquire("b") as acquired:
+        assert session.current_session() is acquired
+        response, content = manager.transport.request(url, "POST", b"{}", {session.USERPROJECT_HEADER: "other"})
+        assert response.status == 200 and content == b'{"result": 1}'
+
+    # Requests outside a session keep the header of the caller
+    manager.transport.request(url, "POST", b"{}", {session.USERPROJECT_HEADER: "other"})
+    manager.transport.request(url, "POST", b"{}")
+    assert Handler.projects == ["project-b", "other", None]
+    assert session.current_session() is None
+
+def test_acquire_routes_to_the_least_loaded_session(server, manager):
+    url = f"http://127.0.0.1:{server.server_port}/v1/projects/any/value:compute"
+
+    with manager.acquire() as first:
+        with manager.acquire() as second:
+            assert {first.name, second.name} == {"a", "b"}
+            manager.transport.request(url, "POST", b"{}")
+        manager.transport.request(url, "POST", b"{}")
+
+    assert Handler.projects == [second.project, first.project]
+    assert manager.get_session("a").inflight == manager.get_session("b").inflight == 0
+
+    # Equally loaded sessions are routed by the number of calls they have served
+    manager.get_session("a").calls += 1
+    assert manager.route().name == "b"
+
+def test_acquire_builds_project_paths_from_the_session(manager):
+    initialized = ee.data._get_projects_path()
+    with manager.acquire("a"):
+        assert ee.data._get_projects_path() == "projects/project-a"
+        with manager.acquire("b"):
+            assert ee.data._get_projects_path() == "projects/project-b"
+
+    assert ee.data._get_projects_path() == initialized
+
+def test_missing_project_path_function_is_an_error(manager, monkeypatch):
+    monkeypatch.delattr(ee.data, "_get_projects_path")
+    with pytest.raises(RuntimeError, match="_get_projects_path"):
+        manager.initialize()
+    assert not manager.initialized
+
+def test_project_path_that_ignores_the_resolver_is_an_error(manager, monkeypatch):
+    # A client that keeps building paths from its own state after the function is replaced
+    class Data:
+        def __setattr__(self, name, value):
+            pass
+
+        @staticmethod
+        def _get_projects_path():
+            return "projects/initialized"
+
+    monkeypatch.setattr(ee, "data", Data())
+    with pytest.raises(RuntimeError, match="projects/initialized"):
+        manager.initialize()
@@ -0,0 +1,175 @@
+"""
+Terrarium Tests
+
+Tests for the spatial module.
+"""
+import json
+
+import numpy
+import pytest
+import shapely
+import shapely.ops as shapeops
+import shapely.geometry as shapes
+
+from terrarium import spatial
+
+# The latitudes at which the bulk functions are compared, from the equator to the high latitudes of both hemispheres
+LATITUDES = (0.0, 12.5, 37.0, 51.5, 66.0, 78.0, -33.9, -62.0)
+
+def generate_boxes(latitude: float, count: int = 20, seed: int = 0) -> list:
+    """ A function that returns random boxes of up to a few tens of kilometers around the given latitude. """
+    rng = numpy.random.default_rng(seed)
+    boxes = []
+    for _ in range(count):
+        west, south = rng.uniform(-179, 179), latitude + rng.uniform(-0.5, 0.5)
+        width, height = rng.uniform(0.001, 0.4, 2)
+        boxes.append((west, south, west + width, south + height))
+    return boxes
+
+def ring(polygon: shapes.Polygon) -> numpy.ndarray:
+    return numpy.asarray(polygon.exterior.coords)
+
+@pytest.mark.parametrize("latitude", LATITUDES)
+def test_reshape_points_match_reshape_point(latitude):
+    rng = numpy.random.default_rng(1)
+    longitudes = rng.uniform(-179, 179, 20)
+    latitudes = latitude + rng.uniform(-0.5, 0.5, 20)
+    buffers = rng.uniform(0.1, 25, 20)
+
+    rings = spatial.reshape_points(longitudes, latitudes, buffers)
+    assert rings.shape == (20, 5, 2)
+    for index in range(20):
+        expected = ring(spatial.reshape_point(shapes.Point(longitudes[index], latitudes[index]), buffers[index]))
+        numpy.testing.assert_allclose(rings[index], expected, rtol=0, atol=spatial.RESHAPE_TOLERANCE)
+
+@pytest.mark.parametrize("latitude", LATITUDES)
+def test_reshape_points_default_buffer(latitude):
+    rings = spatial.reshape_points([10.0], [latitude])
+    expected = ring(spatial.reshape_point(shapes.Point(10.0, latitude)))
+    numpy.testing.assert_allclose(rings[0], expected, rtol=0, atol=spatial.RESHAPE_TOLERANCE)
+
+@pytest.mark.parametrize("latitude", LATITUDES)
+def test_reshape_polygons_and_bounds_match_reshape_polygon(latitude):
+    boxes = generate_boxes(latitude)
+    polygons = [shapes.box(*bounds) for bounds in boxes]
+    expected = numpy.stack([ring(spatial.reshape_polygon(polygon)) for polygon in polygons])
+
+    numpy.testing.assert_allclose(spatial.reshape_polygons(polygons), expected, rtol=0, atol=spatial.RESHAPE_TOLERANCE)
+    bounds = numpy.array(boxes)
+    numpy.testing.assert_allclose(spatial.reshape_bounds(*bounds.T), expected, rtol=0, atol=spatial.RESHAPE_TOLERANCE)
+
+@pytest.mark.parametrize("latitude", LATITUDES)
+def test_reshape_linestrings_match_reshape_linestring(latitude):
+    rng = numpy.random.default_rng(2)
+    lines = []
+    for west, south, east, north in generate_boxes(latitude, seed=3):
+        # Lines with a few vertices spread inside the box
+        xs, ys = rng.uniform(west, east, 4), rng.uniform(south, north, 4)
+        xs[:2], ys[:2] = (west, east), (south, north)
+        lines.append(shapes.LineString(numpy.column_stack([xs, ys])))
+
+    expected = numpy.stack([ring(spatial.reshape_linestring(line)) for line in lines])
+    numpy.testing.assert_allclose(spatial.reshape_linestrings(lines), expected, rtol=0, atol=spatial.RESHAPE_TOLERANCE)
+
+def test_reshape_polygons_rejects_other_shapes():
+    with pytest.raises(RuntimeError):
+        spatial.reshape_polygons([shapes.Point(0, 0)])
+    with pytest.raises(RuntimeError):
+        spatial.reshape_linestrings([shapes.box(0, 0, 1, 1)])
+
+def generate_blob(longitude: float, latitude: float, radius: float, count: int = 360, seed: int = 0, holes: bool = False) -> shapes.Polygon:
+    """ A function that returns a jagged polygon of about 'radius' meters around a point, with two holes if 'holes' is set. """
+    rng = numpy.random.default_rng(seed)
+    degrees = radius / spatial.DEGREE_METERS
+
+    def jagged(x: float, y: float, size: float) -> list:
+        angles = numpy.linspace(0, 2 * numpy.pi, count, endpoint=False)
+        radii = size * (1 + rng.uniform(-0.02, 0.02, count))
+        return list(zip(x + radii * numpy.cos(angles) / numpy.cos(numpy.radians(latitude)), y + radii * numpy.sin(angles)))
+
+    offset = degrees / 3 / numpy.cos(numpy.radians(latitude))
+    interiors = [jagged(longitude - offset, latitude, degrees / 5), jagged(longitude + offset, latitude, degrees / 5)] if holes else []
+    return shapes.Polygon(jagged(longitude, latitude, degrees), interiors)
+
+def project(shape, crs: str):
+    return shapeops.transform(spatial.get_transformer("EPSG:4326", crs).transform, shape)
+
+@pytest.fixture
+def geometrycache():
+    spatial.geometrycache.clear()
+    yield spatial.geometrycache
+    spatial.geometrycache.clear()
+
+@pytest.mark.parametrize("tolerance", [0.5, 1.0, 10.0, 50.0])
+@pytest.mark.parametrize("latitude", LATITUDES)
+def test_prepared_geometry_is_within_tolerance(geometrycache, latitude, tolerance):
+    shape = generate_blob(23.5, latitude, 2000, holes=True)
+    assert shape.is_valid
+    prepared = spatial.prepare_geometry(shape, tolerance)
+
+    # The outline of the prepared geometry deviates by at most the tolerance in the UTM zone of the geometry
+    crs = spatial.generate_utmcrs(shape.centroid.x, shape.centroid.y)
+    distance = shapely.hausdorff_distance(project(shape, crs).boundary, project(prepared.shape, crs).boundary, densify=0.25)
+    assert distance <= tolerance
+
+    assert prepared.shape.is_valid and len(prepared.shape.interiors) == 2
+    assert prepared.vertices[1] < prepared.vertices[0] and prepared.payload[1] < prepared.payload[0]
+    assert prepared.precision == spatial.generate_quantizationprecision(tolerance * (1 - spatial.SIMPLIFYSHARE))
+
+@pytest.mark.parametrize("tolerance", [0.01, 0.2, 1.0, 7.5, 100.0, 1e6])
+def test_quantization_precision_is_the_fewest_decimals(tolerance):
+    precision = spatial.generate_quantizationprecision(tolerance)
+
+    # Rounding moves a coordinate by at most half a step along both axes
+    def movement(decimals: int) -> float:
+        return numpy.hypot(0.5, 0.5) * 10.0 ** -decimals * spatial.DEGREE_METERS
+
+    assert movement(precision) <= tolerance
+    assert precision == 0 or movement(precision - 1) > tolerance
+
+def test_simplified_polygons_stay_valid():
+    # Holes close to the exterior and to each other and a hole within the tolerance of collapsing
+    exterior = [(0, 0), (100, 0), (100, 1), (100, 2), (100, 100), (50, 99), (0, 100)]
+    holes = [[(1, 1), (49, 1), (49, 2), (1, 2)], [(51, 1), (99, 1), (99, 2), (51, 2)], [(10, 50), (10.1, 50.05), (10.2, 50), (10.1, 50.2)]]
+    polygon = shapes.Polygon(exterior, holes)
+    multipolygon = shapes.MultiPolygon([polygon, shapes.box(200, 0, 300, 100)])
+
+    for shape in (polygon, multipolygon):
+        for tolerance in (0.5, 2, 10, 100):
+            simplified = spatial._simplify_shape(shape, tolerance)
+            assert simplified.is_valid and simplified.geom_type == shape.geom_type
+            assert shapely.hausdorff_distance(shape.boundary, simplified.boundary, densify=0.1) <= tolerance
+
+    simplified = spatial._simplify_shape(polygon, 2)
+    assert len(simplified.interiors) == 3 and all(len(interior.coords) >= 4 for interior in simplified.interiors)
+    assert len(simplified.exterior.coords) < len(polygon.exterior.coords)
+
+def test_prepared_geometries_are_memoized(geometrycache):
+    shape = generate_blob(77.59, 12.97, 500)
+    prepared = spatial.prepare_geometry(shape, 1.0)
+    assert geometrycache.stats()["misses"] == 1
+
+    # The same geometry constructed again is a hit and another tolerance is a new preparation
+    assert spatial.prepare_geometry(shapes.Polygon(shape.exterior.coords), 1.0) is prepared
+    assert geometrycache.stats()["hits"] == 1
+    assert spatial.prepare_geometry(shape, 5.0) is not prepared and len(geometrycache) == 2
+
+def test_prepare_geometry_rejects_invalid_input(geometrycache):
+    with pytest.raises(RuntimeError):
+        spatial.prepare_geometry(shapes.box(0, 0, 1, 1), 0)
+    for shape in (shapes.Polygon(), shapes.GeometryCollection([shapes.Point(0, 0)]), [(0, 0), (1, 1)]):
+        with pytest.raises(RuntimeError):
+            spatial.prepare_geometry(shape)
+
+def test_savings_report(geometrycache):
+    prepared = [spatial.prepare_geometry(generate_blob(10.0 * index, 45.0, 1000, seed=index), 2.0) for index in range(5)]
+    prepared.append(spatial.prepare_geometry(shapes.Point(2.35, 48.85), 2.0))
+    report = spatial.generate_savingsreport(prepared)
+
+    assert report["geometries"] == 6
+    assert report["vertices"] == 5 * 361 + 1
+    assert report["preparedvertices"] == sum(len(shapes.mapping(geometry.shape)["coordinates"][0]) for geometry in prepared[:5]) + 1
+    assert report["savedvertices"] == sum(geometry.savings["vertices"] for geometry in prepared)
+    assert report["bytes"] == sum(len(json.dumps(shapes.mapping(geometry)["coordinates"])) for geometry in (generate_blob(10.0 * index, 45.0, 1000, seed=index) for index in range(5))) + len(json.dumps([2.35, 48.85]))
+    assert report["savedbytes"] == report["bytes"] - report["preparedbytes"] > 0
+    assert spatial.generate_savingsreport([]) == {"geometries": 0, "vertices": 0, "preparedvertices": 0, "bytes": 0, "preparedbytes": 0, "savedvertices": 0, "savedbytes": 0}
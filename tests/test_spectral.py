@@ -0,0 +1,89 @@
+"""
+Terrarium Tests
+
+Tests for the graphs of the spectral module that are built with the offline stand-in for Earth Engine
+and inspected in their Cloud API encoding.
+"""
+import datetime
+
+import ee
+import pytest
+
+from terrarium import spectral
+
+DATES = [datetime.datetime(2021, 1, 1), datetime.datetime(2021, 1, 6), datetime.datetime(2021, 3, 1)]
+
+def iterate_invocations(expression: dict):
+    """ A function that yields every function invocation of a Cloud API encoded expression with its value references resolved. """
+    values = expression["values"]
+
+    def resolve(value):
+        # Follow the references to shared values and to the bodies of function definitions
+        while isinstance(value, dict) and ("valueReference" in value or "argumentNames" in value):
+            value = values[value["valueReference"] if "valueReference" in value else value["body"]]
+        return value
+
+    stack = [resolve(values[expression["result"]])]
+    while stack:
+        value = resolve(stack.pop())
+        if isinstance(value, dict):
+            if "functionInvocationValue" in value:
+                invocation = value["functionInvocationValue"]
+                yield invocation, resolve
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+def find_functions(value: dict, resolve) -> set:
+    """ A function that returns the names of every function invoked by a value of an encoded expression. """
+    names = set()
+    stack = [value]
+    while stack:
+        value = resolve(stack.pop())
+        if isinstance(value, dict):
+            if "functionName" in value:
+                names.add(value["functionName"])
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+    return names
+
+def find_datefilters(expression: dict) -> list:
+    """ A function that returns the collection arguments of every filter on the 'system:time_start' of a collection. """
+    collections = []
+    for invocation, resolve in iterate_invocations(expression):
+        if invocation.get("functionName") != "Collection.filter":
+            continue
+        filters = find_functions(invocation["arguments"]["filter"], resolve)
+        if filters & {"Filter.dateRangeContains", "Filter.lessThan"}:
+            collections.append((invocation["arguments"]["collection"], resolve))
+
+    return collections
+
+@pytest.fixture
+def geometry(fakeearthengine):
+    spectral.graphcache.clear()
+    yield ee.Geometry.Point([77.59, 12.97]).buffer(100)
+    spectral.graphcache.clear()
+
+@pytest.mark.parametrize("index", ["NDVI", "TCI"])
+@pytest.mark.parametrize("constructor", [spectral.generate_spectral_timeseries_graph, spectral.generate_spectral_stack_graph])
+def test_series_filter_dates_before_the_algorithm(geometry, constructor, index):
+    expression = constructor(DATES, geometry, index).expression
+
+    # The composed images of the index algorithm have no 'system:time_start', so the dates must be
+    # filtered on the acquisitions of the collection before the algorithm is mapped over them
+    datefilters = find_datefilters(expression)
+    assert datefilters
+    for collection, resolve in datefilters:
+        assert "Collection.map" not in find_functions(collection, resolve)
+
+    # The algorithm is mapped over the window of every date
+    mapped = [invocation for invocation, _ in iterate_invocations(expression) if invocation.get("functionName") == "Collection.map"]
+    assert mapped and all(find_functions(invocation["arguments"]["collection"], resolve) >= {"Collection.filter"} for invocation in mapped)
+
+def test_series_graph_size_does_not_grow_with_dates(geometry):
+    short = spectral.generate_spectral_timeseries_graph(DATES[:1], geometry, "NDVI").serialized
+    long = spectral.generate_spectral_timeseries_graph([DATES[0] + datetime.timedelta(days=day) for day in range(0, 300, 5)], geometry, "NDVI").serialized
+    assert long.count("Collection.map") == short.count("Collection.map")
@@ -0,0 +1,122 @@
+"""
+Terrarium Tests
+
+Tests for the temporal module that compare the merged dateranges of many dates against the
+dateranges of single dates and round trip dates through NumPy arrays.
+"""
+import json
+import datetime
+
+import ee
+import numpy
+import pytest
+
+from terrarium import temporal
+
+def generate_millis(date: datetime.datetime) -> int:
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+def check_plan(dates: list, width: float, buffer: bool, plan: temporal.DaterangePlan):
+    """ A function that checks a plan against the dateranges of the single dates generated by 'generate_daterange'. """
+    # The merged dateranges are sorted and neither overlap nor touch
+    for (_, end), (start, _) in zip(plan.ranges, plan.ranges[1:]):
+        assert end < start
+
+    # The merged daterange of every date contains its own daterange
+    assert len(plan.windows) == len(dates)
+    for position, date in enumerate(dates):
+        start, end = temporal.generate_daterange(date, width, buffer)
+        low, high = plan.window(position)
+        assert low <= start and end <= high
+
+    # Every merged daterange is bounded by the dateranges of its dates
+    for index, (low, high) in enumerate(plan.ranges):
+        members = [temporal.generate_daterange(date, width, buffer) for date, window in zip(dates, plan.windows) if window == index]
+        assert members and min(start for start, _ in members) == low and max(end for _, end in members) == high
+
+def test_plan_merges_overlapping_buffers():
+    dates = [datetime.datetime(2021, 1, day) for day in (1, 3, 5, 20, 24, 28)] + [datetime.datetime(2021, 3, 1)]
+    plan = temporal.plan_dateranges(dates, 2, buffer=True)
+
+    # The buffers of the 20th and the 24th touch and are merged as the end of a filter daterange is exclusive
+    assert plan.ranges == [
+        (datetime.datetime(2020, 12, 30), datetime.datetime(2021, 1, 7)),
+        (datetime.datetime(2021, 1, 18), datetime.datetime(2021, 1, 30)),
+        (datetime.datetime(2021, 2, 27), datetime.datetime(2021, 3, 3)),
+    ]
+    assert plan.windows.tolist() == [0, 0, 0, 1, 1, 1, 2]
+    check_plan(dates, 2, True, plan)
+
+def test_plan_without_buffer():
+    dates = [datetime.datetime(2021, 1, 10), datetime.datetime(2021, 1, 12), datetime.datetime(2021, 1, 20)]
+    plan = temporal.plan_dateranges(dates, 1.5, buffer=False)
+
+    assert plan.ranges == [
+        (datetime.datetime(2021, 1, 8, 12), datetime.datetime(2021, 1, 10)),
+        (datetime.datetime(2021, 1, 10, 12), datetime.datetime(2021, 1, 12)),
+        (datetime.datetime(2021, 1, 18, 12), datetime.datetime(2021, 1, 20)),
+    ]
+    check_plan(dates, 1.5, False, plan)
+
+def test_plan_of_unsorted_and_repeated_dates():
+    rng = numpy.random.default_rng(0)
+    base = datetime.datetime(2020, 1, 1)
+    dates = [base + datetime.timedelta(days=int(day), hours=int(hour)) for day, hour in zip(rng.integers(0, 365, 200), rng.integers(0, 24, 200))]
+    dates += dates[:10]
+
+    plan = temporal.plan_dateranges(dates, 3, buffer=True)
+    check_plan(dates, 3, True, plan)
+    # The plan is the same for the sorted dates with the windows in the order of the given dates
+    ordered = temporal.plan_dateranges(sorted(dates), 3, buffer=True)
+    assert ordered.ranges == plan.ranges
+    assert sorted(plan.windows.tolist()) == ordered.windows.tolist()
+
+def test_plan_of_timezone_aware_dates():
+    tz = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+    dates = [datetime.datetime(2021, 6, 1, 3, tzinfo=tz), datetime.datetime(2021, 6, 10, tzinfo=datetime.timezone.utc)]
+    plan = temporal.plan_dateranges(dates, 1, buffer=True)
+
+    # Timezone aware dates are planned in naive UTC
+    assert plan.ranges == [
+        (datetime.datetime(2021, 5, 30, 21, 30), datetime.datetime(2021, 6, 1, 21, 30)),
+        (datetime.datetime(2021, 6, 9), datetime.datetime(2021, 6, 11)),
+    ]
+    assert plan.windows.tolist() == [0, 1]
+
+def test_plan_of_no_dates():
+    plan = temporal.plan_dateranges([], 5, buffer=True)
+    assert plan.ranges == [] and plan.windows.tolist() == []
+
+def test_dates_round_trip_through_arrays():
+    dates = [datetime.datetime(1969, 12, 31, 23, 59, 59, 999999), datetime.datetime(2021, 2, 28, 13, 45, 7, 123456), datetime.datetime(2038, 1, 19, 3, 14, 8)]
+    array = temporal.datetimes_toarray(dates)
+
+    assert array.dtype == numpy.dtype(temporal.DATETIME64)
+    assert temporal.datetimes_fromarray(array) == dates
+    # Arrays and sequences of datetime64 values are converted to the microsecond resolution
+    assert temporal.datetimes_toarray(array.astype("datetime64[ms]")).tolist() == [date.replace(microsecond=date.microsecond // 1000 * 1000) for date in dates]
+    assert temporal.datetimes_fromarray(temporal.datetimes_toarray(list(array))) == dates
+    assert temporal.datetimes_toarray([]).tolist() == []
+
+def test_timezone_aware_dates_are_converted_to_utc(recwarn):
+    dates = [datetime.datetime(2021, 6, 1, 3, tzinfo=datetime.timezone(datetime.timedelta(hours=-4))), datetime.datetime(2021, 6, 1, 3)]
+    assert temporal.datetimes_fromarray(temporal.datetimes_toarray(dates)) == [datetime.datetime(2021, 6, 1, 7), datetime.datetime(2021, 6, 1, 3)]
+    assert not recwarn.list
+
+def test_timestamps_are_truncated_like_single_timestamps():
+    stamps = [0, 999, 1609459200123, -1500]
+    assert temporal.datetimes_fromarray(temporal.datetimes_fromtimestamps(stamps)) == [temporal.datetime_fromtimestamp(stamp) for stamp in stamps]
+
+def test_collection_windows(fakeearthengine):
+    dates = [datetime.datetime(2021, 1, 1), datetime.datetime(2021, 1, 2), datetime.datetime(2021, 2, 1)]
+    plan = temporal.plan_dateranges(dates, 1, buffer=True)
+    windows = temporal.generate_earthenginecollection_windows(ee.ImageCollection("COPERNICUS/S2_SR"), plan)
+
+    assert len(windows) == len(plan.ranges) == 2
+    for window, (start, end) in zip(windows, plan.ranges):
+        assert isinstance(window, ee.ImageCollection)
+        expression = json.dumps(ee.serializer.encode(window, for_cloud_api=True))
+        assert str(generate_millis(start)) in expression and str(generate_millis(end)) in expression
+
+    with pytest.raises(RuntimeError):
+        temporal.generate_earthenginecollection_windows(ee.Image(1), plan)
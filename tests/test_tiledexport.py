@@ -0,0 +1,151 @@
+"""
+Terrarium Tests
+
+Tests for the tiledexport module that run a tiled export on the export scheduler with the in-process
+backend, which writes the GeoTIFF of every chunk into local storage, and stitch the chunks back together.
+"""
+import json
+
+import numpy
+import pytest
+import shapely.geometry
+
+from terrarium import scheduler
+from terrarium import tiledexport
+
+rasterio = pytest.importorskip("rasterio")
+
+# A small AOI in Berlin that splits into a grid of 2 by 2 chunks at the pixel budget of the tests
+AOI = shapely.geometry.box(13.40, 52.50, 13.42, 52.515)
+SCALE = 5
+MAXPIXELS = 300 * 300
+BLOCKSIZE = 128
+NODATA = -1
+
+class Image:
+    """ A stand-in for an Earth Engine Image that is serialized into the payload of the chunk exports. """
+    def serialize(self, for_cloud_api: bool = True) -> str:
+        return "{}"
+
+def write_geotiff(path: str, array: numpy.ndarray, crs: str, transform: tuple):
+    profile = dict(
+        driver="GTiff", height=array.shape[0], width=array.shape[1], count=1, dtype=str(array.dtype),
+        crs=crs, transform=rasterio.Affine(*transform), nodata=NODATA,
+    )
+    with rasterio.open(path, "w", **profile) as dataset:
+        dataset.write(array, 1)
+
+def run_export(tmp_path, grid: tiledexport.ExportGrid, source: numpy.ndarray, split: tuple = (), missing: tuple = ()):
+    """
+    A function that runs a tiled export of the source array to completion and returns the export and the storage.
+    The chunks in 'split' are written as two files with the pixel offsets that Earth Engine appends to split exports
+    and the chunks in 'missing' are not written at all.
+    """
+    storage = tiledexport.LocalStorage(str(tmp_path / "storage"))
+    (tmp_path / "exports").mkdir()
+
+    def resolve(job: scheduler.ExportJob) -> str:
+        # Cut the chunk out of the source array with the region and pixel grid of its export
+        options = json.loads(job.options)
+        scale, _, left, _, _, top = options["crstransform"]
+        xmin, ymin, xmax, ymax = shapely.geometry.shape(options["region"]).bounds
+        rowoff, coloff = round((grid.origin[1] - top) / scale), round((left - grid.origin[0]) / scale)
+        height, width = round((ymax - ymin) / scale), round((xmax - xmin) / scale)
+        chunk = source[rowoff:rowoff + height, coloff:coloff + width]
+
+        if job.name in missing:
+            return "COMPLETED"
+
+        # Split the chunk into a left and a right file named after their pixel offsets
+        parts = [(job.name, 0, chunk)]
+        if job.name in split:
+            half = chunk.shape[1] // 2
+            parts = [(f"{job.name}-0000000000-0000000000", 0, chunk[:, :half]), (f"{job.name}-0000000000-{half:010d}", half, chunk[:, half:])]
+
+        for name, offset, part in parts:
+            path = str(tmp_path / "exports" / f"{name}.tif")
+            write_geotiff(path, part, options["crs"], (scale, 0.0, left + offset * scale, 0.0, -scale, top))
+            storage.upload(job.bucket, f"{name}.tif", path)
+
+        return "COMPLETED"
+
+    exportscheduler = scheduler.ExportScheduler(scheduler.LocalBackend(resolve), str(tmp_path / "exports.sqlite"), concurrency=4)
+    export = tiledexport.submit_tiled_image(exportscheduler, Image(), "bucket", "aoi", grid)
+    assert export.state(exportscheduler) == "QUEUED"
+
+    for _ in range(10):
+        if export.state(exportscheduler) == "COMPLETED":
+            break
+        exportscheduler.step()
+    assert export.state(exportscheduler) == "COMPLETED", exportscheduler.statuserror
+    assert [job.name for job in export.jobs(exportscheduler)] == export.names
+
+    return export, storage
+
+def read_mosaic(path: str):
+    with rasterio.open(path) as dataset:
+        transform = dataset.transform
+        return dataset.read(1), (transform.a, transform.b, transform.c, transform.d, transform.e, transform.f)
+
+@pytest.fixture
+def grid():
+    return tiledexport.generate_exportgrid(AOI, scale=SCALE, maxpixels=MAXPIXELS, blocksize=BLOCKSIZE)
+
+@pytest.fixture
+def source(grid):
+    return numpy.arange(grid.shape[0] * grid.shape[1], dtype=numpy.float32).reshape(grid.shape)
+
+def test_exportgrid_chunks_are_aligned(grid):
+    assert grid.crs == "EPSG:32633"
+    assert len(grid.chunks) == 4
+    for chunk in grid.chunks:
+        rowoff, coloff, height, width = chunk.window
+        assert height * width <= MAXPIXELS
+        assert rowoff % BLOCKSIZE == coloff % BLOCKSIZE == 0
+        assert chunk.transform[2] == grid.origin[0] + coloff * SCALE and chunk.transform[5] == grid.origin[1] - rowoff * SCALE
+
+    # The chunks cover the grid without overlap
+    covered = numpy.zeros(grid.shape, dtype=int)
+    for rowoff, coloff, height, width in (chunk.window for chunk in grid.chunks):
+        covered[rowoff:rowoff + height, coloff:coloff + width] += 1
+    assert (covered == 1).all()
+
+def test_exportgrid_pixel_budget_too_small():
+    with pytest.raises(RuntimeError):
+        tiledexport.generate_exportgrid(AOI, scale=SCALE, maxpixels=0.5)
+
+@pytest.mark.parametrize("split", [(), ("aoi-0-0", "aoi-1-1")])
+def test_stitched_chunks_reproduce_the_source(tmp_path, grid, source, split):
+    export, storage = run_export(tmp_path, grid, source, split=split)
+    paths = tiledexport.download_tiles(storage, export, str(tmp_path / "tiles"))
+    assert len(paths) == len(grid.chunks) + len(split)
+
+    mosaic, transform = read_mosaic(tiledexport.stitch_geotiffs(paths, str(tmp_path / "mosaic.tif"), blocksize=BLOCKSIZE))
+    assert numpy.array_equal(mosaic, source) and transform == grid.transform
+
+    mosaic, transform = read_mosaic(tiledexport.stitch_virtualmosaic(paths, str(tmp_path / "mosaic.vrt")))
+    assert numpy.array_equal(mosaic, source) and transform == grid.transform
+
+def test_missing_chunks_are_left_as_nodata(tmp_path, grid, source):
+    export, storage = run_export(tmp_path, grid, source, missing=("aoi-1-1",))
+    paths = tiledexport.download_tiles(storage, export, str(tmp_path / "tiles"))
+    assert len(paths) == len(grid.chunks) - 1
+
+    # The other chunks still span the grid, so only the window of the missing chunk is empty
+    rowoff, coloff, height, width = next(chunk.window for chunk in grid.chunks if (chunk.row, chunk.column) == (1, 1))
+    expected = source.copy()
+    expected[rowoff:rowoff + height, coloff:coloff + width] = NODATA
+
+    for output in (tiledexport.stitch_geotiffs(paths, str(tmp_path / "mosaic.tif")), tiledexport.stitch_virtualmosaic(paths, str(tmp_path / "mosaic.vrt"))):
+        mosaic, _ = read_mosaic(output)
+        assert numpy.array_equal(mosaic, expected)
+
+def test_exportfiles_match_only_the_files_of_the_export(tmp_path):
+    storage = tiledexport.LocalStorage(str(tmp_path))
+    source = tmp_path / "object"
+    source.write_bytes(b"")
+    for name in ("aoi-0-1.tif", "aoi-0-1-0000000000-0000000256.tif", "aoi-0-10.tif", "aoi-0-1.vrt", "aoi-0-1-preview.tif"):
+        storage.upload("bucket", name, str(source))
+
+    assert tiledexport.get_exportfiles(storage, "bucket", "aoi-0-1") == ["aoi-0-1-0000000000-0000000256.tif", "aoi-0-1.tif"]
+    assert tiledexport.get_exportfiles(storage, "bucket", "aoi-1-1") == []
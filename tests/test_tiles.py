@@ -0,0 +1,58 @@
+"""
+Terrarium Tests
+
+Tests for the tiles module.
+"""
+import numpy
+
+from terrarium import tiles
+from terrarium import palette
+
+TRANSFORM = (1.0, 0.0, 500000.0, 0.0, -1.0, 4500000.0)
+CRS = "EPSG:32633"
+
+def generate_raster(value: float, size: int = 512) -> numpy.ndarray:
+    return numpy.full((size, size), value, dtype=numpy.float32)
+
+def test_array_keys_follow_the_contents():
+    first = tiles.ArraySource(generate_raster(1.0), TRANSFORM, CRS)
+    same = tiles.ArraySource(generate_raster(1.0), TRANSFORM, CRS)
+    other = tiles.ArraySource(generate_raster(2.0), TRANSFORM, CRS)
+    moved = tiles.ArraySource(generate_raster(1.0), (1.0, 0.0, 600000.0, 0.0, -1.0, 4500000.0), CRS)
+
+    assert first.key == same.key
+    assert len({first.key, other.key, moved.key}) == 3
+    assert tiles.ArraySource(generate_raster(1.0), TRANSFORM, CRS, key="fixed").key == "fixed"
+
+def test_array_keys_of_memory_mapped_arrays(tmp_path, monkeypatch):
+    array = numpy.arange(300 * 200, dtype=numpy.float32).reshape(300, 200)
+    numpy.save(tmp_path / "raster.npy", array)
+    mapped = numpy.load(tmp_path / "raster.npy", mmap_mode="r")
+
+    # Hash in small blocks to cover the block boundaries
+    monkeypatch.setattr(tiles, "HASHBLOCKSIZE", 4096)
+    assert tiles.generate_arraykey(mapped, TRANSFORM, CRS) == tiles.generate_arraykey(array, TRANSFORM, CRS)
+
+def test_disk_cache_does_not_serve_tiles_of_another_array(tmp_path):
+    path = str(tmp_path / "tiles.sqlite")
+    # The tile at the center of the raster
+    west, south, east, north = tiles.ArraySource(generate_raster(0.0), TRANSFORM, CRS).bounds
+    zoom = 16
+    center = ((west + east) / 2, (south + north) / 2)
+    x, y, _, _ = tiles.generate_tilerange(center * 2, zoom)
+
+    rendered = []
+    for value in (0.0, 9.0):
+        # Every array is created and released in turn, as in separate processes reusing memory
+        source = tiles.ArraySource(generate_raster(value), TRANSFORM, CRS)
+        renderer = tiles.TileRenderer(source, palette.NDVIFOCAL, cache=tiles.TileCache(path))
+        rendered.append(renderer.render_tile(zoom, x, y))
+        del source, renderer
+
+    assert rendered[0] != rendered[1]
+
+    # The same contents are served from the disk cache
+    cache = tiles.TileCache(path)
+    renderer = tiles.TileRenderer(tiles.ArraySource(generate_raster(9.0), TRANSFORM, CRS), palette.NDVIFOCAL, cache=cache)
+    assert renderer.render_tile(zoom, x, y) == rendered[1]
+    assert cache.diskhits == 1